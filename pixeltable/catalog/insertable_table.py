@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Iterable, Literal, Optional, overload
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, Literal, Optional, Sized, Union, overload
 from uuid import UUID
 
 import sqlalchemy.orm as orm
@@ -80,7 +80,7 @@ class InsertableTable(Table):
     @overload
     def insert(
         self,
-        rows: Iterable[dict[str, Any]],
+        rows: Union[Iterable[dict[str, Any]], AsyncIterable[dict[str, Any]]],
         /,
         *,
         print_stats: bool = False,
@@ -98,31 +98,37 @@ class InsertableTable(Table):
 
     def insert(  # type: ignore[misc]
         self,
-        rows: Optional[Iterable[dict[str, Any]]] = None,
+        rows: Optional[Union[Iterable[dict[str, Any]], AsyncIterable[dict[str, Any]]]] = None,
         /,
         *,
         print_stats: bool = False,
         on_error: Literal['abort', 'ignore'] = 'abort',
         **kwargs: Any
     ) -> UpdateStatus:
-        if rows is None:
-            rows = [kwargs]
-        else:
-            rows = list(rows)
-            if len(kwargs) > 0:
-                raise excs.Error('`kwargs` cannot be specified unless `rows is None`.')
-
+        if rows is not None and len(kwargs) > 0:
+            raise excs.Error('`kwargs` cannot be specified unless `rows is None`.')
         fail_on_exception = on_error == 'abort'
 
-        if not isinstance(rows, list):
-            raise excs.Error('rows must be a list of dictionaries')
-        if len(rows) == 0:
-            raise excs.Error('rows must not be empty')
-        for row in rows:
-            if not isinstance(row, dict):
-                raise excs.Error('rows must be a list of dictionaries')
-        self._validate_input_rows(rows)
-        status = self._tbl_version.insert(rows, None, print_stats=print_stats, fail_on_exception=fail_on_exception)
+        input_rows: Union[list[dict[str, Any]], Iterator[dict[str, Any]], AsyncIterator[dict[str, Any]]]
+        if rows is None:
+            input_rows = [kwargs]
+        elif isinstance(rows, AsyncIterable):
+            input_rows = self._validate_input_row_aiter(rows)
+        elif isinstance(rows, Sized):
+            input_rows = list(rows)
+        else:
+            # a stream of rows (eg, a generator, or an iterable that is read lazily, such as a file): rows are
+            # validated as they are consumed by the insert plan
+            input_rows = self._validate_input_row_iter(iter(rows))
+        if isinstance(input_rows, list):
+            if len(input_rows) == 0:
+                raise excs.Error('rows must not be empty')
+            for row in input_rows:
+                if not isinstance(row, dict):
+                    raise excs.Error('rows must be a list of dictionaries')
+            self._validate_input_rows(input_rows)
+        status = self._tbl_version.insert(
+            input_rows, None, print_stats=print_stats, fail_on_exception=fail_on_exception)
 
         if status.num_excs == 0:
             cols_with_excs_str = ''
@@ -141,30 +147,57 @@ class InsertableTable(Table):
 
     def _validate_input_rows(self, rows: list[dict[str, Any]]) -> None:
         """Verify that the input rows match the table schema"""
+        col_names = self._input_col_names()
+        for row in rows:
+            self._validate_input_row(row, *col_names)
+
+    def _validate_input_row_iter(self, rows: Iterator[Any]) -> Iterator[dict[str, Any]]:
+        """Verify the rows of a stream as they are consumed"""
+        col_names = self._input_col_names()
+        for row in rows:
+            if not isinstance(row, dict):
+                raise excs.Error('rows must be a list of dictionaries')
+            self._validate_input_row(row, *col_names)
+            yield row
+
+    async def _validate_input_row_aiter(self, rows: AsyncIterable[Any]) -> AsyncIterator[dict[str, Any]]:
+        """Verify the rows of an async stream as they are consumed"""
+        col_names = self._input_col_names()
+        async for row in rows:
+            if not isinstance(row, dict):
+                raise excs.Error('rows must be a list of dictionaries')
+            self._validate_input_row(row, *col_names)
+            yield row
+
+    def _input_col_names(self) -> tuple[set[str], set[str], set[str]]:
+        """Returns the names of all, the required and the computed columns"""
         valid_col_names = set(self._schema.keys())
         reqd_col_names = set(self._tbl_version_path.tbl_version.get_required_col_names())
         computed_col_names = set(self._tbl_version_path.tbl_version.get_computed_col_names())
-        for row in rows:
-            assert isinstance(row, dict)
-            col_names = set(row.keys())
-            if len(reqd_col_names - col_names) > 0:
-                raise excs.Error(f'Missing required column(s) ({", ".join(reqd_col_names - col_names)}) in row {row}')
-
-            for col_name, val in row.items():
-                if col_name not in valid_col_names:
-                    raise excs.Error(f'Unknown column name {col_name} in row {row}')
-                if col_name in computed_col_names:
-                    raise excs.Error(f'Value for computed column {col_name} in row {row}')
-
-                # validate data
-                col = self._tbl_version_path.get_column(col_name)
-                try:
-                    # basic sanity checks here
-                    checked_val = col.col_type.create_literal(val)
-                    row[col_name] = checked_val
-                except TypeError as e:
-                    msg = str(e)
-                    raise excs.Error(f'Error in column {col.name}: {msg[0].lower() + msg[1:]}\nRow: {row}')
+        return valid_col_names, reqd_col_names, computed_col_names
+
+    def _validate_input_row(
+        self, row: dict[str, Any], valid_col_names: set[str], reqd_col_names: set[str], computed_col_names: set[str]
+    ) -> None:
+        col_names = set(row.keys())
+        if len(reqd_col_names - col_names) > 0:
+            raise excs.Error(f'Missing required column(s) ({", ".join(reqd_col_names - col_names)}) in row {row}')
+
+        for col_name, val in row.items():
+            if col_name not in valid_col_names:
+                raise excs.Error(f'Unknown column name {col_name} in row {row}')
+            if col_name in computed_col_names:
+                raise excs.Error(f'Value for computed column {col_name} in row {row}')
+
+            # validate data
+            col = self._tbl_version_path.get_column(col_name)
+            try:
+                # basic sanity checks here
+                checked_val = col.col_type.create_literal(val)
+                row[col_name] = checked_val
+            except TypeError as e:
+                msg = str(e)
+                raise excs.Error(f'Error in column {col.name}: {msg[0].lower() + msg[1:]}\nRow: {row}')
 
     def delete(self, where: Optional['pxt.exprs.Expr'] = None) -> UpdateStatus:
         """Delete rows in this table.
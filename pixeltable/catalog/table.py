@@ -6,7 +6,7 @@ import json
 import logging
 from pathlib import Path
 from typing import _GenericAlias  # type: ignore[attr-defined]
-from typing import TYPE_CHECKING, Any, Callable, Iterable, Literal, Optional, Sequence, Union, overload
+from typing import TYPE_CHECKING, Any, AsyncIterable, Callable, Iterable, Literal, Optional, Sequence, Union, overload
 from uuid import UUID
 
 import pandas as pd
@@ -199,6 +199,15 @@ class Table(SchemaObject):
     def limit(self, n: int) -> 'pxt.DataFrame':
         return self._df().limit(n)
 
+    def similarity_search(
+            self, column: 'exprs.Expr', items: list[Any], k: int, **kwargs: Any
+    ) -> list['pxt.dataframe.DataFrameResultSet']:
+        """Return the k rows that are most similar to each of the query items.
+
+        See [`DataFrame.similarity_search`][pixeltable.DataFrame.similarity_search] for more details.
+        """
+        return self._df().similarity_search(column, items, k, **kwargs)
+
     def collect(self) -> 'pxt.dataframe.DataFrameResultSet':
         """Return rows from this table."""
         return self._df().collect()
@@ -555,6 +564,7 @@ class Table(SchemaObject):
         print_stats: bool = False,
         on_error: Literal['abort', 'ignore'] = 'abort',
         if_exists: Literal['error', 'ignore', 'replace'] = 'error',
+        resumable: bool = False,
         **kwargs: exprs.Expr
     ) -> UpdateStatus:
         """
@@ -576,13 +586,19 @@ class Table(SchemaObject):
                 - `'error'`: an exception will be raised.
                 - `'ignore'`: do nothing and return.
                 - `'replace' or 'replace_force'`: drop the existing column and add the new column, iff it has no dependents.
+            resumable: If `True`, the column values are computed and committed in ranges of rows, rather than in a
+                single transaction. If the operation is interrupted, calling `add_computed_column()` again with the
+                same column name and expression (and `resumable=True`) skips the rows that were already computed,
+                provided that the table hasn't been modified in the meantime. The column becomes visible only after
+                all of its values have been computed. Only valid for stored columns.
 
         Returns:
             Information about the execution status of the operation.
 
         Raises:
             Error: If the column name is invalid or already exists and `if_exists='error'`,
-                or `if_exists='replace*'` but the column has dependents or is a basetable column.
+                or `if_exists='replace*'` but the column has dependents or is a basetable column,
+                or `resumable=True` for an unstored column.
 
         Examples:
             For a table with an image column `frame`, add an image column `rotated` that rotates the image by
@@ -593,6 +609,10 @@ class Table(SchemaObject):
             Do the same, but now the column is unstored:
 
             >>> tbl.add_computed_column(rotated=tbl.frame.rotate(90), stored=False)
+
+            Add an embedding column to a large table, such that an interrupted computation can be resumed:
+
+            >>> tbl.add_computed_column(emb=embed_fn(tbl.text), resumable=True)
         """
         self._check_is_dropped()
         if self.get_metadata()['is_snapshot']:
@@ -620,7 +640,12 @@ class Table(SchemaObject):
 
         new_col = self._create_columns({col_name: col_schema})[0]
         self._verify_column(new_col)
-        status = self._tbl_version.add_columns([new_col], print_stats=print_stats, on_error=on_error)
+        if resumable:
+            if not new_col.is_stored:
+                raise excs.Error(f'Column {col_name!r}: resumable=True requires a stored column')
+            status = self._tbl_version.add_column_resumable(new_col, print_stats=print_stats, on_error=on_error)
+        else:
+            status = self._tbl_version.add_columns([new_col], print_stats=print_stats, on_error=on_error)
         FileCache.get().emit_eviction_warnings()
         return status
 
@@ -850,6 +875,10 @@ class Table(SchemaObject):
             embedding: Optional[pxt.Function] = None,
             string_embed: Optional[pxt.Function] = None, image_embed: Optional[pxt.Function] = None,
             metric: str = 'cosine',
+            index_type: Literal['hnsw', 'ivfflat', 'ivfpq'] = 'hnsw',
+            index_params: Optional[dict[str, int]] = None,
+            precision: Literal['float32', 'float16', 'binary'] = 'float32',
+            concurrently: bool = False,
             if_exists: Literal['error', 'ignore', 'replace', 'replace_force'] = 'error'
     ) -> None:
         """
@@ -892,6 +921,35 @@ class Table(SchemaObject):
                 specifying different embedding functions for different data types.
             metric: Distance metric to use for the index; one of `'cosine'`, `'ip'`, or `'l2'`.
                 The default is `'cosine'`.
+            index_type: The type of the vector index; one of `'hnsw'` (the default), `'ivfflat'` or `'ivfpq'`.
+                IVFFlat indices are faster to build and smaller, but need to be created after the table has been
+                populated in order to give good recall. IVFPQ indices are not maintained by Postgres, but are searched
+                in-process, using a compressed copy of the embeddings that is stored in the Pixeltable home directory
+                and kept in sync with the table when it is queried; they are suited to tables that are rarely updated.
+                Queries with a limit of `k` retrieve `k * rerank_factor` candidates and re-rank them by their exact
+                distance. IVFPQ indices require `precision='float32'`.
+            index_params: Optional index build parameters and default search parameters:
+
+                - HNSW: `m` (default 16), `ef_construction` (default 64), `ef_search` (default 40)
+                - IVFFlat: `lists` (default 100), `probes` (default 1)
+                - IVFPQ: `lists` (default: the square root of the number of rows), `subvectors` (default: one per 8
+                    dimensions), `probes` (default 8), `rerank_factor` (default 10)
+                - with `precision='binary'`: `rerank_factor` (default 4)
+
+                The search parameters can also be set for individual queries, via the corresponding parameters
+                of `similarity()`.
+            precision: How embeddings are stored and indexed; one of:
+
+                - `'float32'` (the default): full-precision vectors
+                - `'float16'`: half-precision vectors, which halves the size of the embeddings and the index
+                - `'binary'`: half-precision vectors with an index over their binary quantization (1 bit per
+                    dimension); queries with a limit of `k` retrieve `k * rerank_factor` candidates via the index and
+                    re-rank them by their exact distance.
+            concurrently: If `True`, the index structure is built after the embeddings have been computed and
+                committed, without blocking inserts, updates and deletes; until the build has finished, similarity
+                queries rank rows by their exact distance. If the build fails, the index is dropped again.
+                The memory and the number of parallel workers of index builds are configured with the
+                `index_build_memory_mb` and `index_build_workers` options.
             if_exists: Directive for handling an existing index with the same name. Must be one of the following:
 
                 - `'error'`: raise an error if an index with the same name already exists.
@@ -923,6 +981,17 @@ class Table(SchemaObject):
             ...     metric='ip'
             ... )
 
+            Add an index that stores the embeddings in half precision and indexes their binary quantization, and
+            query it with a larger number of re-ranked candidates:
+
+            >>> tbl.add_embedding_index(tbl.img, embedding=embedding_fn, precision='binary')
+            ... sim = tbl.img.similarity('a picture of a train', rerank_factor=10)
+            ... tbl.select(tbl.img, sim).order_by(sim, asc=False).limit(5)
+
+            Add an index to a large table without blocking writes to it while the index structure is built:
+
+            >>> tbl.add_embedding_index(tbl.img, embedding=embedding_fn, concurrently=True)
+
             Add an index using separately specified string and image embeddings:
 
             >>> tbl.add_embedding_index(
@@ -954,14 +1023,165 @@ class Table(SchemaObject):
             assert _if_exists == IfExistsParam.REPLACE or _if_exists == IfExistsParam.REPLACE_FORCE
             self.drop_index(idx_name=idx_name)
             assert idx_name not in self._tbl_version.idxs_by_name
-        from pixeltable.index import EmbeddingIndex
+        from pixeltable.index import EmbeddingIndex, LocalEmbeddingIndex
 
         # create the EmbeddingIndex instance to verify args
-        idx = EmbeddingIndex(col, metric=metric, embed=embedding, string_embed=string_embed, image_embed=image_embed)
-        status = self._tbl_version.add_index(col, idx_name=idx_name, idx=idx)
+        idx_cls = LocalEmbeddingIndex if index_type == 'ivfpq' else EmbeddingIndex
+        idx = idx_cls(
+            col, metric=metric, embed=embedding, string_embed=string_embed, image_embed=image_embed,
+            index_type=index_type, index_params=index_params, precision=precision)
+        status = self._tbl_version.add_index(col, idx_name=idx_name, idx=idx, concurrently=concurrently)
         # TODO: how to deal with exceptions here? drop the index and raise?
         FileCache.get().emit_eviction_warnings()
 
+    def add_text_index(
+            self,
+            column: Union[str, ColumnRef],
+            *,
+            idx_name: Optional[str] = None,
+            language: str = 'english',
+            if_exists: Literal['error', 'ignore', 'replace', 'replace_force'] = 'error'
+    ) -> None:
+        """
+        Add a full-text index to the table. Once the index is created, it will be automatically kept up-to-date as new
+        rows are inserted into the table.
+
+        The index can be used to filter rows by keyword queries with `column.text_match()`, and to order them by
+        their relevance for the query. Relevance is computed by Postgres' `ts_rank_cd()`, normalized by the length of
+        the text. The query syntax is that of web search engines: `"quoted phrases"`, `or` and `-excluded` terms are
+        supported.
+
+        Together with an embedding index on the same column, the index also supports hybrid ranking with
+        `column.hybrid_rank()`, which fuses the keyword ranking and the ranking by similarity with Reciprocal Rank
+        Fusion.
+
+        Args:
+            column: The name of, or reference to, the column to index; must be a `String` column.
+            idx_name: The name of index. If not specified, a name such as `'idx0'` will be generated automatically.
+                If specified, the name must be unique for this table.
+            language: The Postgres text search configuration used for parsing and stemming the text, such as
+                `'english'` or `'simple'`.
+            if_exists: Directive for handling an existing index with the same name. Must be one of the following:
+
+                - `'error'`: raise an error if an index with the same name already exists.
+                - `'ignore'`: do nothing if an index with the same name already exists.
+                - `'replace'` or `'replace_force'`: replace the existing index with the new one.
+
+        Raises:
+            Error: If an index with the specified name already exists for the table and `if_exists='error'`, or if
+                the specified column does not exist or is not a `String` column.
+
+        Examples:
+            Add a full-text index to the `text` column of the table `my_table`:
+
+            >>> tbl = pxt.get_table('my_table')
+            ... tbl.add_text_index('text')
+
+            Find the 10 most relevant rows for a query:
+
+            >>> tbl.where(tbl.text.text_match('brown fox')).order_by(
+            ...     tbl.text.text_match('brown fox'), asc=False
+            ... ).limit(10).collect()
+
+            Combine keyword and embedding search on a column that also has an embedding index:
+
+            >>> rank = tbl.text.hybrid_rank('brown fox')
+            ... tbl.order_by(rank, asc=False).limit(10).select(tbl.text, rank=rank).collect()
+        """
+        if self._tbl_version_path.is_snapshot():
+            raise excs.Error('Cannot add an index to a snapshot')
+        col: Column
+        if isinstance(column, str):
+            self.__check_column_name_exists(column, include_bases=True)
+            col = self._tbl_version_path.get_column(column, include_bases=True)
+        else:
+            self.__check_column_ref_exists(column, include_bases=True)
+            col = column.col
+
+        if idx_name is not None and idx_name in self._tbl_version.idxs_by_name:
+            _if_exists = IfExistsParam.validated(if_exists, 'if_exists')
+            if _if_exists == IfExistsParam.ERROR:
+                raise excs.Error(f'Duplicate index name: {idx_name}')
+            if not isinstance(self._tbl_version.idxs_by_name[idx_name].idx, index.FullTextIndex):
+                raise excs.Error(f'Index `{idx_name}` is not a full-text index. Cannot {_if_exists.name.lower()} it.')
+            if _if_exists == IfExistsParam.IGNORE:
+                return
+            assert _if_exists == IfExistsParam.REPLACE or _if_exists == IfExistsParam.REPLACE_FORCE
+            self.drop_index(idx_name=idx_name)
+            assert idx_name not in self._tbl_version.idxs_by_name
+
+        # create the FullTextIndex instance to verify args
+        idx = index.FullTextIndex(col, language=language)
+        self._tbl_version.add_index(col, idx_name=idx_name, idx=idx)
+
+    def add_json_index(
+            self,
+            path: exprs.JsonPath,
+            *,
+            idx_name: Optional[str] = None,
+            index_type: Literal['btree', 'gin'] = 'btree',
+            if_exists: Literal['error', 'ignore', 'replace', 'replace_force'] = 'error'
+    ) -> None:
+        """
+        Add an index on a path of a JSON column to the table. Once the index is created, it will be automatically kept
+        up-to-date as new rows are inserted into the table.
+
+        The index is used for filters that compare the same path with a string or number, such as
+        `tbl.where(tbl.detections.label == 'car')`. The following index types are supported:
+
+        - `'btree'`: indexes string and numeric values at the path; the best choice for paths with scalar values.
+            Strings with a JSON encoding of 256 or more characters aren't indexed.
+        - `'gin'`: a GIN index (with `jsonb_path_ops`) that indexes values of any size and shape at the path.
+
+        Args:
+            path: The JSON path to index, such as `tbl.detections.label`; it must consist of keys and list indices of
+                a JSON column of the table.
+            idx_name: The name of index. If not specified, a name such as `'idx0'` will be generated automatically.
+                If specified, the name must be unique for this table.
+            index_type: The type of index, `'btree'` or `'gin'`.
+            if_exists: Directive for handling an existing index with the same name. Must be one of the following:
+
+                - `'error'`: raise an error if an index with the same name already exists.
+                - `'ignore'`: do nothing if an index with the same name already exists.
+                - `'replace'` or `'replace_force'`: replace the existing index with the new one.
+
+        Raises:
+            Error: If an index with the specified name already exists for the table and `if_exists='error'`, or if
+                the path is not a path of a JSON column of the table.
+
+        Examples:
+            Add a B-tree index on the path `label` of the JSON column `detections` of the table `my_table`:
+
+            >>> tbl = pxt.get_table('my_table')
+            ... tbl.add_json_index(tbl.detections.label)
+
+            Add a GIN index on the path `metadata.tags`:
+
+            >>> tbl.add_json_index(tbl.metadata.tags, index_type='gin')
+        """
+        if self._tbl_version_path.is_snapshot():
+            raise excs.Error('Cannot add an index to a snapshot')
+        if not isinstance(path, exprs.JsonPath) or not isinstance(path._anchor, ColumnRef):
+            raise excs.Error(f'add_json_index(): requires a path of a JSON column, not {path!r}')
+        self.__check_column_ref_exists(path._anchor, include_bases=True)
+        col = path._anchor.col
+
+        if idx_name is not None and idx_name in self._tbl_version.idxs_by_name:
+            _if_exists = IfExistsParam.validated(if_exists, 'if_exists')
+            if _if_exists == IfExistsParam.ERROR:
+                raise excs.Error(f'Duplicate index name: {idx_name}')
+            if not isinstance(self._tbl_version.idxs_by_name[idx_name].idx, index.JsonPathIndex):
+                raise excs.Error(f'Index `{idx_name}` is not a JSON index. Cannot {_if_exists.name.lower()} it.')
+            if _if_exists == IfExistsParam.IGNORE:
+                return
+            assert _if_exists == IfExistsParam.REPLACE or _if_exists == IfExistsParam.REPLACE_FORCE
+            self.drop_index(idx_name=idx_name)
+            assert idx_name not in self._tbl_version.idxs_by_name
+
+        # create the JsonPathIndex instance to verify args
+        idx = index.JsonPathIndex(col, path.path_elements, index_type=index_type)
+        self._tbl_version.add_index(col, idx_name=idx_name, idx=idx)
+
     def drop_embedding_index(
             self, *,
             column: Union[str, ColumnRef, None] = None,
@@ -1127,7 +1347,7 @@ class Table(SchemaObject):
     @overload
     def insert(
         self,
-        rows: Iterable[dict[str, Any]],
+        rows: Union[Iterable[dict[str, Any]], AsyncIterable[dict[str, Any]]],
         /,
         *,
         print_stats: bool = False,
@@ -1146,7 +1366,7 @@ class Table(SchemaObject):
     @abc.abstractmethod  # type: ignore[misc]
     def insert(
         self,
-        rows: Optional[Iterable[dict[str, Any]]] = None,
+        rows: Optional[Union[Iterable[dict[str, Any]], AsyncIterable[dict[str, Any]]]] = None,
         /,
         *,
         print_stats: bool = False,
@@ -1159,7 +1379,7 @@ class Table(SchemaObject):
 
         ```python
         insert(
-            rows: Iterable[dict[str, Any]],
+            rows: Iterable[dict[str, Any]] | AsyncIterable[dict[str, Any]],
             /,
             *,
             print_stats: bool = False,
@@ -1177,8 +1397,12 @@ class Table(SchemaObject):
         )```
 
         Args:
-            rows: (if inserting multiple rows) A list of rows to insert, each of which is a dictionary mapping column
-                names to values.
+            rows: (if inserting multiple rows) The rows to insert, each of which is a dictionary mapping column
+                names to values. This can be a list or any other iterable, or an async iterable. Iterables other than
+                collections (such as generators) and async iterables are streamed into the table in batches, with
+                computed columns evaluated and stored as the rows arrive; they are never materialized in their
+                entirety. Synchronous streams are read on the calling thread, and the evaluation of computed columns
+                pauses while they block; async iterables avoid that.
             kwargs: (if inserting a single row) Keyword-argument pairs representing column names and values.
             print_stats: If `True`, print statistics about the cost of computed columns.
             on_error: Determines the behavior if an error occurs while evaluating a computed column or detecting an
@@ -4,9 +4,12 @@ import dataclasses
 import importlib
 import inspect
 import logging
+import os
+import threading
 import time
 import uuid
-from typing import TYPE_CHECKING, Any, Iterable, Iterator, Literal, Optional
+from concurrent import futures
+from typing import TYPE_CHECKING, Any, AsyncIterable, Iterable, Iterator, Literal, Optional, Union
 from uuid import UUID
 
 import jsonschema.exceptions
@@ -24,6 +27,7 @@ from pixeltable.iterators import ComponentIterator
 from pixeltable.metadata import schema
 from pixeltable.utils.filecache import FileCache
 from pixeltable.utils.media_store import MediaStore
+from pixeltable.utils.result_set_cache import ResultSetCache
 
 from ..func.globals import resolve_symbol
 from .column import Column
@@ -81,10 +85,17 @@ class TableVersion:
     idx_md: dict[int, schema.IndexMd]
     # contains only actively maintained indices
     idxs_by_name: dict[str, TableVersion.IndexInfo]
+    # ids of indices whose structure is known to be usable by queries (see is_index_ready())
+    ready_idx_ids: set[int]
 
     external_stores: dict[str, pxt.io.ExternalStore]
     store_tbl: 'store.StoreBase'
 
+    # number of new base rows that are loaded into views sharing a scan before the next rows are read
+    __PROPAGATION_BATCH_SIZE = 10_000
+    # default max number of views that are loaded concurrently; configurable via view_maintenance_workers
+    __DEFAULT_VIEW_MAINTENANCE_WORKERS = 4
+
     @dataclasses.dataclass
     class IndexInfo:
         id: int
@@ -92,7 +103,8 @@ class TableVersion:
         idx: index.IndexBase
         col: Column
         val_col: Column
-        undo_col: Column
+        # only for indices created before index value columns were retained for deleted rows
+        undo_col: Optional[Column]
 
 
     def __init__(
@@ -164,6 +176,7 @@ class TableVersion:
         self.cols_by_id = {}
         self.idx_md = tbl_md.index_md
         self.idxs_by_name = {}
+        self.ready_idx_ids = set()
         self.external_stores = {}
 
         self._init_schema(tbl_md, schema_version_md)
@@ -278,6 +291,8 @@ class TableVersion:
             # delete this table and all associated data
             MediaStore.delete(self.id)
             FileCache.get().clear(tbl_id=self.id)
+            for idx_info in self.idxs_by_name.values():
+                idx_info.idx.drop_index(self._store_idx_name(idx_info.id), idx_info.val_col)
             self.delete_md(self.id, conn)
             self.store_tbl.drop(conn)
 
@@ -351,9 +366,11 @@ class TableVersion:
             val_col = self.cols_by_id[md.index_val_col_id]
             val_col.sa_col_type = idx.index_sa_type()
             val_col._records_errors = False
-            undo_col = self.cols_by_id[md.index_val_undo_col_id]
-            undo_col.sa_col_type = idx.index_sa_type()
-            undo_col._records_errors = False
+            undo_col: Optional[Column] = None
+            if md.index_val_undo_col_id is not None:
+                undo_col = self.cols_by_id[md.index_val_undo_col_id]
+                undo_col.sa_col_type = idx.index_sa_type()
+                undo_col._records_errors = False
             idx_info = self.IndexInfo(id=md.id, name=md.name, idx=idx, col=idx_col, val_col=val_col, undo_col=undo_col)
             self.idxs_by_name[md.name] = idx_info
 
@@ -406,16 +423,80 @@ class TableVersion:
         """Return name of index in the store, which needs to be globally unique"""
         return f'idx_{self.id.hex}_{idx_id}'
 
-    def add_index(self, col: Column, idx_name: Optional[str], idx: index.IndexBase) -> UpdateStatus:
+    def add_index(
+            self, col: Column, idx_name: Optional[str], idx: index.IndexBase, concurrently: bool = False
+    ) -> UpdateStatus:
+        """
+        Args:
+            concurrently: if True, the index structure is built after the index value column has been populated and
+                committed, without blocking writes to the table; until then, queries don't use it
+        """
         # we're creating a new schema version
         self.version += 1
         preceding_schema_version = self.schema_version
         self.schema_version = self.version
+        idx_id = self.next_idx_id
         with Env.get().engine.begin() as conn:
-            status = self._add_index(col, idx_name, idx, conn)
+            status = self._add_index(col, idx_name, idx, conn, create_structure=not concurrently)
             self._update_md(time.time(), conn, preceding_schema_version=preceding_schema_version)
             _logger.info(f'Added index {idx_name} on column {col.name} to table {self.name}')
-            return status
+        if concurrently:
+            self._create_index_concurrently(idx_id)
+        return status
+
+    def _create_index_concurrently(self, idx_id: int) -> None:
+        """Build the structure of the (committed) index outside of a transaction"""
+        idx_info = self.idxs_by_name[self.idx_md[idx_id].name]
+        store_idx_name = self._store_idx_name(idx_id)
+        settings = self._index_build_settings()
+        try:
+            with Env.get().engine.connect() as conn:
+                conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                for name, val in settings.items():
+                    conn.execute(sql.text('SELECT set_config(:name, :val, false)'), {'name': name, 'val': val})
+                try:
+                    idx_info.idx.create_index(store_idx_name, idx_info.val_col, conn, concurrently=True)
+                finally:
+                    for name in settings:
+                        conn.execute(sql.text(f'RESET {name}'))
+        except Exception as e:
+            # a failed concurrent build leaves an invalid index behind
+            with Env.get().engine.begin() as conn:
+                conn.execute(sql.text(f'DROP INDEX IF EXISTS {store_idx_name}'))
+            self.drop_index(idx_id)
+            raise excs.Error(f'Failed to build index {idx_info.name!r}: {e}') from e
+        self.ready_idx_ids.add(idx_id)
+        _logger.info(f'Built index {idx_info.name} on table {self.name}')
+
+    @classmethod
+    def _index_build_settings(cls) -> dict[str, str]:
+        """Returns the Postgres settings for index builds, as configured by index_build_memory_mb/index_build_workers"""
+        settings: dict[str, str] = {}
+        memory_mb = Env.get().config.get_int_value('index_build_memory_mb')
+        if memory_mb is not None:
+            settings['maintenance_work_mem'] = f'{memory_mb}MB'
+        num_workers = Env.get().config.get_int_value('index_build_workers')
+        if num_workers is not None:
+            settings['max_parallel_maintenance_workers'] = str(num_workers)
+        return settings
+
+    def is_index_ready(self, idx_id: int) -> bool:
+        """
+        True if queries can use the structure of the index: an index that is built concurrently isn't valid, and is
+        ignored by Postgres, until the build has finished (possibly in another process)
+        """
+        if idx_id in self.ready_idx_ids or idx_id not in self.idx_md:
+            return True
+        idx_info = self.idxs_by_name.get(self.idx_md[idx_id].name)
+        if idx_info is None or not idx_info.idx.has_store_index():
+            return True
+        with Env.get().engine.connect() as conn:
+            stmt = sql.text(
+                'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name')
+            is_valid = conn.execute(stmt, {'name': self._store_idx_name(idx_id)}).scalar()
+        if is_valid:
+            self.ready_idx_ids.add(idx_id)
+        return bool(is_valid)
 
     def _add_default_index(self, col: Column, conn: sql.engine.Connection) -> Optional[UpdateStatus]:
         """Add a B-tree index on this column if it has a compatible type"""
@@ -432,18 +513,24 @@ class TableVersion:
         return status
 
     def _add_index(
-            self, col: Column, idx_name: Optional[str], idx: index.IndexBase, conn: sql.engine.Connection
+            self, col: Column, idx_name: Optional[str], idx: index.IndexBase, conn: sql.engine.Connection,
+            create_structure: bool = True
     ) -> UpdateStatus:
         assert not self.is_snapshot
         idx_id = self.next_idx_id
         self.next_idx_id += 1
+        # (the id of a reverted index can get reused)
+        self.ready_idx_ids.discard(idx_id)
         if idx_name is None:
             idx_name = f'idx{idx_id}'
         else:
             assert is_valid_identifier(idx_name)
             assert idx_name not in [i.name for i in self.idx_md.values()]
 
-        # add the index value and undo columns (which need to be nullable)
+        # add the index value column (which needs to be nullable); it retains the values of deleted rows, which
+        # drop out of the index because it is a partial index on the live rows (see StoreBase.live_rows_clause()),
+        # so that deletes don't need to touch the index values
+        # (indices created before that have an undo column instead, to which deletes move the index values)
         val_col = Column(
             col_id=self.next_col_id, name=None, computed_with=idx.index_value_expr(),
             sa_col_type=idx.index_sa_type(), stored=True,
@@ -453,33 +540,29 @@ class TableVersion:
         val_col.col_type = val_col.col_type.copy(nullable=True)
         self.next_col_id += 1
 
-        undo_col = Column(
-            col_id=self.next_col_id, name=None, col_type=val_col.col_type,
-            sa_col_type=val_col.sa_col_type, stored=True,
-            schema_version_add=self.schema_version, schema_version_drop=None,
-            records_errors=False)
-        undo_col.tbl = self
-        undo_col.col_type = undo_col.col_type.copy(nullable=True)
-        self.next_col_id += 1
-
         # create and register the index metadata
         idx_cls = type(idx)
         idx_md = schema.IndexMd(
             id=idx_id, name=idx_name,
             indexed_col_id=col.id, indexed_col_tbl_id=str(col.tbl.id),
-            index_val_col_id=val_col.id, index_val_undo_col_id=undo_col.id,
+            index_val_col_id=val_col.id, index_val_undo_col_id=None,
             schema_version_add=self.schema_version, schema_version_drop=None,
             class_fqn=idx_cls.__module__ + '.' + idx_cls.__name__, init_args=idx.as_dict())
-        idx_info = self.IndexInfo(id=idx_id, name=idx_name, idx=idx, col=col, val_col=val_col, undo_col=undo_col)
+        idx_info = self.IndexInfo(id=idx_id, name=idx_name, idx=idx, col=col, val_col=val_col, undo_col=None)
         self.idx_md[idx_id] = idx_md
         self.idxs_by_name[idx_name] = idx_info
 
         # add the columns and update the metadata
         # TODO support on_error='abort' for indices; it's tricky because of the way metadata changes are entangled
         # with the database operations
-        status = self._add_columns([val_col, undo_col], conn, print_stats=False, on_error='ignore')
+        status = self._add_columns([val_col], conn, print_stats=False, on_error='ignore')
         # now create the index structure
-        idx.create_index(self._store_idx_name(idx_id), val_col, conn)
+        if create_structure:
+            # the settings only apply to the current transaction
+            for name, val in self._index_build_settings().items():
+                conn.execute(sql.text('SELECT set_config(:name, :val, true)'), {'name': name, 'val': val})
+            idx.create_index(self._store_idx_name(idx_id), val_col, conn)
+            self.ready_idx_ids.add(idx_id)
 
         return status
 
@@ -501,7 +584,8 @@ class TableVersion:
         del self.idx_md[idx_id]
 
         with Env.get().engine.begin() as conn:
-            self._drop_columns([idx_info.val_col, idx_info.undo_col])
+            self._drop_columns([c for c in (idx_info.val_col, idx_info.undo_col) if c is not None])
+            idx_info.idx.drop_index(self._store_idx_name(idx_id), idx_info.val_col)
             self._update_md(time.time(), conn, preceding_schema_version=preceding_schema_version)
             _logger.info(f'Dropped index {idx_md.name} on table {self.name}')
 
@@ -536,15 +620,135 @@ class TableVersion:
         _logger.info(f'Columns {[col.name for col in cols]}: {msg}')
         return status
 
+    def add_column_resumable(
+        self, col: Column, print_stats: bool, on_error: Literal['abort', 'ignore']
+    ) -> UpdateStatus:
+        """Adds a stored computed column, populating it in rowid ranges that are committed individually.
+
+        The progress is recorded in the store (see StoreBase.start_backfill()). If the population is interrupted,
+        calling this again for a column with the same name and value expr skips the ranges that were already loaded,
+        provided that the table hasn't changed in the meantime. The column becomes visible (in a new table version)
+        only after all ranges have been loaded, and only if the table is still at the version the population started
+        from.
+        """
+        assert not self.is_snapshot
+        assert is_valid_identifier(col.name)
+        assert col.name not in self.cols_by_name
+        assert col.is_computed and col.is_stored
+        col.tbl = self
+        col.id = self.next_col_id
+        self.next_col_id += 1
+        # the column becomes visible in the next version
+        col.schema_version_add = self.version + 1
+        start_version, start_schema_version = self.version, self.schema_version
+
+        from pixeltable.plan import Planner
+        try:
+            # register the column while it is being populated, so that the store and the plans can reference it
+            self._register_column(col)
+            with Env.get().engine.begin() as conn:
+                rowid_ranges, num_excs = self.store_tbl.start_backfill(col, conn)
+            profile: Optional[exprs.ExecProfile] = None
+            for rowid_range in rowid_ranges:
+                with Env.get().engine.begin() as conn:
+                    plan, value_expr_slot_idx = Planner.create_add_column_plan(self.path, col, rowid_range=rowid_range)
+                    try:
+                        plan.ctx.set_conn(conn)
+                        plan.open()
+                        try:
+                            range_num_excs = self.store_tbl.load_column(col, plan, value_expr_slot_idx, conn, on_error)
+                        except sql.exc.DBAPIError as exc:
+                            raise excs.Error(
+                                f'SQL error during execution of computed column `{col.name}`:\n{exc}') from exc
+                    finally:
+                        plan.close()
+                    self.store_tbl.record_backfill_range(col, *rowid_range, range_num_excs, conn)
+                num_excs += range_num_excs
+                if profile is None:
+                    profile = plan.ctx.profile
+                else:
+                    for i in range(len(profile.eval_time)):
+                        profile.eval_time[i] += plan.ctx.profile.eval_time[i]
+                        profile.eval_count[i] += plan.ctx.profile.eval_count[i]
+        except BaseException:
+            # the ranges that were loaded remain in the store
+            self.next_col_id = col.id
+            raise
+        finally:
+            # _add_columns() registers it again
+            self._unregister_columns([col])
+
+        with Env.get().engine.begin() as conn:
+            # the loaded values are those of the rows at start_version: the column can only be added if the table
+            # hasn't changed since, in this process or another one
+            tbl_md = conn.execute(
+                sql.select(schema.Table.md).where(schema.Table.id == self.id).with_for_update()).scalar_one()
+            if (
+                self.version != start_version or self.schema_version != start_schema_version
+                or tbl_md['current_version'] != start_version
+                or tbl_md['current_schema_version'] != start_schema_version
+            ):
+                self.next_col_id = col.id
+                raise excs.Error(
+                    f'Table {self.name!r} was modified while column {col.name!r} was being populated; the column was '
+                    f'not added (adding it again recomputes all values)')
+            # we're creating a new schema version
+            self.version += 1
+            preceding_schema_version = self.schema_version
+            self.schema_version = self.version
+            status = self._add_columns([col], conn, print_stats=False, on_error=on_error, backfill_num_excs=num_excs)
+            _ = self._add_default_index(col, conn)
+            self._update_md(time.time(), conn, preceding_schema_version=preceding_schema_version)
+        _logger.info(f'Added column {col.name} to table {self.name}, new version: {self.version}')
+
+        if print_stats and profile is not None:
+            profile.print(num_rows=status.num_rows)
+        msg = (
+            f'Added {status.num_rows} column value{"" if status.num_rows == 1 else "s"} '
+            f'with {status.num_excs} error{"" if status.num_excs == 1 else "s"}.'
+        )
+        Env.get().console_logger.info(msg)
+        _logger.info(f'Columns {[col.name]}: {msg}')
+        return status
+
+    def _register_column(self, col: Column) -> None:
+        """Add col to the lookup structures"""
+        self.cols.append(col)
+        if col.name is not None:
+            self.cols_by_name[col.name] = col
+        self.cols_by_id[col.id] = col
+        if col.value_expr is not None:
+            col.check_value_expr()
+            self._record_refd_columns(col)
+
+    def _unregister_columns(self, cols: list[Column]) -> None:
+        """Remove cols from the lookup structures and the sqlalchemy schema"""
+        col_ids = {col.id for col in cols}
+        self.cols[:] = [col for col in self.cols if col.id not in col_ids]
+        for col in cols:
+            if col.name is not None and self.cols_by_name.get(col.name) is col:
+                del self.cols_by_name[col.name]
+            self.cols_by_id.pop(col.id, None)
+        for refd_col in self.cols:
+            refd_col.dependent_cols.difference_update(cols)
+        # we need to re-initialize the sqlalchemy schema
+        self.store_tbl.create_sa_tbl()
+
     def _add_columns(
         self,
         cols: Iterable[Column],
         conn: sql.engine.Connection,
         print_stats: bool,
-        on_error: Literal['abort', 'ignore']
+        on_error: Literal['abort', 'ignore'],
+        backfill_num_excs: Optional[int] = None
     ) -> UpdateStatus:
-        """Add and populate columns within the current transaction"""
+        """Add and populate columns within the current transaction
+
+        If backfill_num_excs is not None, cols is a single column whose values add_column_resumable() has already
+        loaded into the store (with backfill_num_excs exceptions).
+        """
         cols = list(cols)
+        assert backfill_num_excs is None or len(cols) == 1
         row_count = self.store_tbl.count(conn=conn)
         for col in cols:
             if not col.col_type.nullable and not col.is_computed:
@@ -552,57 +756,59 @@ class TableVersion:
                     raise excs.Error(
                         f'Cannot add non-nullable column "{col.name}" to table {self.name} with existing rows')
 
-        num_excs = 0
-        cols_with_excs: list[Column] = []
-        for col in cols:
-            col.schema_version_add = self.schema_version
-            # add the column to the lookup structures now, rather than after the store changes executed successfully,
-            # because it might be referenced by the next column's value_expr
-            self.cols.append(col)
-            if col.name is not None:
-                self.cols_by_name[col.name] = col
-            self.cols_by_id[col.id] = col
-            if col.value_expr is not None:
-                col.check_value_expr()
-                self._record_refd_columns(col)
+        if backfill_num_excs is not None:
+            # the store column is complete; this needs to precede the creation of any index, which would otherwise
+            # discard it
+            self.store_tbl.finish_backfill(conn)
+        elif any(col.is_stored for col in cols):
+            # the store might still contain an unfinished resumable backfill (see add_column_resumable()); its store
+            # column uses an id that we're about to reassign
+            self.store_tbl.discard_backfill(conn)
+
+        num_excs = 0 if backfill_num_excs is None else backfill_num_excs
+        cols_with_excs: list[Column] = [] if num_excs == 0 else cols[:]
+        plan: Optional[exec.ExecNode] = None
+        try:
+            for col in cols:
+                col.schema_version_add = self.schema_version
+                # add the column to the lookup structures now, rather than after the store changes executed
+                # successfully, because it might be referenced by the next column's value_expr
+                self._register_column(col)
+                if backfill_num_excs is not None:
+                    self.store_tbl.create_sa_tbl()
+                    continue
 
-            if col.is_stored:
-                self.store_tbl.add_column(col, conn)
+                if col.is_stored:
+                    self.store_tbl.add_column(col, conn)
 
-            if not col.is_computed or not col.is_stored or row_count == 0:
-                continue
+                if not col.is_computed or not col.is_stored or row_count == 0:
+                    continue
 
-            # populate the column
-            from pixeltable.plan import Planner
-            plan, value_expr_slot_idx = Planner.create_add_column_plan(self.path, col)
-            plan.ctx.num_rows = row_count
+                # populate the column
+                from pixeltable.plan import Planner
+                plan, value_expr_slot_idx = Planner.create_add_column_plan(self.path, col)
+                plan.ctx.num_rows = row_count
 
-            try:
-                plan.ctx.set_conn(conn)
-                plan.open()
                 try:
-                    num_excs = self.store_tbl.load_column(col, plan, value_expr_slot_idx, conn, on_error)
-                except sql.exc.DBAPIError as exc:
-                    # Wrap the DBAPIError in an excs.Error to unify processing in the subsequent except block
-                    raise excs.Error(f'SQL error during execution of computed column `{col.name}`:\n{exc}') from exc
-                if num_excs > 0:
-                    cols_with_excs.append(col)
-            except excs.Error as exc:
-                self.cols.pop()
-                for col in cols:
-                    # remove columns that we already added
-                    if col.id not in self.cols_by_id:
-                        continue
-                    if col.name is not None:
-                        del self.cols_by_name[col.name]
-                    del self.cols_by_id[col.id]
-                # we need to re-initialize the sqlalchemy schema
-                self.store_tbl.create_sa_tbl()
-                raise exc
-            finally:
-                plan.close()
-
-        if print_stats:
+                    plan.ctx.set_conn(conn)
+                    plan.open()
+                    try:
+                        col_num_excs = self.store_tbl.load_column(col, plan, value_expr_slot_idx, conn, on_error)
+                    except sql.exc.DBAPIError as exc:
+                        # Wrap the DBAPIError in an excs.Error to unify processing in the subsequent except block
+                        raise excs.Error(
+                            f'SQL error during execution of computed column `{col.name}`:\n{exc}') from exc
+                    if col_num_excs > 0:
+                        num_excs += col_num_excs
+                        cols_with_excs.append(col)
+                finally:
+                    plan.close()
+        except excs.Error:
+            # remove the columns that we already added
+            self._unregister_columns(cols)
+            raise
+
+        if print_stats and plan is not None:
             plan.ctx.profile.print(num_rows=row_count)
         # TODO(mkornacker): what to do about system columns with exceptions?
         return UpdateStatus(
@@ -628,7 +834,7 @@ class TableVersion:
             for idx_info in self.idxs_by_name.values():
                 if idx_info.col != col:
                     continue
-                dropped_cols.extend([idx_info.val_col, idx_info.undo_col])
+                dropped_cols.extend(c for c in (idx_info.val_col, idx_info.undo_col) if c is not None)
                 idx_md = self.idx_md[idx_info.id]
                 idx_md.schema_version_drop = self.schema_version
                 assert idx_md.name in self.idxs_by_name
@@ -706,14 +912,16 @@ class TableVersion:
 
     def insert(
             self,
-            rows: Optional[list[dict[str, Any]]],
+            rows: Optional[Union[Iterable[dict[str, Any]], AsyncIterable[dict[str, Any]]]],
             df: Optional[pxt.DataFrame],
             conn: Optional[sql.engine.Connection] = None,
             print_stats: bool = False,
             fail_on_exception: bool = True
     ) -> UpdateStatus:
         """
-        Insert rows into this table, either from an explicit list of dicts or from a `DataFrame`.
+        Insert rows into this table, either from an (async) iterable of dicts or from a `DataFrame`.
+
+        Rows are consumed by the insert plan in batches, which means that a stream of rows is never materialized.
         """
         from pixeltable.plan import Planner
 
@@ -745,33 +953,170 @@ class TableVersion:
         rowids: Optional[Iterator[int]] = None, print_stats: bool = False, abort_on_exc: bool = False
     ) -> UpdateStatus:
         """Insert rows produced by exec_plan and propagate to views"""
-        # we're creating a new version
-        self.version += 1
-        result = UpdateStatus()
-        num_rows, num_excs, cols_with_excs = self.store_tbl.insert_rows(
-            exec_plan, conn, v_min=self.version, rowids=rowids, abort_on_exc=abort_on_exc)
-        result.num_rows = num_rows
-        result.num_excs = num_excs
-        result.num_computed_values += exec_plan.ctx.num_computed_exprs * num_rows
-        result.cols_with_excs = [f'{self.name}.{self.cols_by_id[cid].name}' for cid in cols_with_excs]
-        self._update_md(timestamp, conn)
-
-        # update views
-        for view in self.mutable_views:
-            from pixeltable.plan import Planner
-            plan, _ = Planner.create_view_load_plan(view.path, propagates_insert=True)
-            status = view._insert(plan, conn, timestamp, print_stats=print_stats)
-            result.num_rows += status.num_rows
-            result.num_excs += status.num_excs
-            result.num_computed_values += status.num_computed_values
-            result.cols_with_excs += status.cols_with_excs
+        # if the insert fails (eg, because a row of a stream turns out to be invalid), the transaction is rolled back,
+        # and so are the versions of this table and its views and the next rowid
+        prev_versions = [(tbl_version, tbl_version.version) for tbl_version in self._mutable_view_tree()]
+        prev_next_rowid = self.next_rowid
+        try:
+            # we're creating a new version
+            self.version += 1
+            result = UpdateStatus()
+            num_rows, num_excs, cols_with_excs = self.store_tbl.insert_rows(
+                exec_plan, conn, v_min=self.version, rowids=rowids, abort_on_exc=abort_on_exc)
+            result.num_rows = num_rows
+            result.num_excs = num_excs
+            result.num_computed_values += exec_plan.ctx.num_computed_exprs * num_rows
+            result.cols_with_excs = [f'{self.name}.{self.cols_by_id[cid].name}' for cid in cols_with_excs]
+            self._update_md(timestamp, conn)
+
+            # update views
+            result += self._propagate_insert(conn, timestamp, print_stats=print_stats)
+        except BaseException:
+            for tbl_version, version in prev_versions:
+                tbl_version.version = version
+            self.next_rowid = prev_next_rowid
+            raise
 
-        result.cols_with_excs = list(dict.fromkeys(result.cols_with_excs).keys())  # remove duplicates
         if print_stats:
-            plan.ctx.profile.print(num_rows=num_rows)
+            exec_plan.ctx.profile.print(num_rows=num_rows)
         _logger.info(f'TableVersion {self.name}: new version {self.version}')
         return result
 
+    def _mutable_view_tree(self) -> list[TableVersion]:
+        """Returns this table and all of its mutable views, transitively"""
+        result = [self]
+        for view in self.mutable_views:
+            result.extend(view._mutable_view_tree())
+        return result
+
+    def _propagate_insert(self, conn: sql.engine.Connection, timestamp: float, print_stats: bool) -> UpdateStatus:
+        """Propagate the rows inserted for the current version to the mutable views
+
+        Views that can share it are populated from a single scan of the new rows (see
+        Planner.create_shared_view_load_plan()), which is consumed in batches: each batch is loaded into all of those
+        views before the next one is read. The remaining views scan the new rows themselves. Views are loaded
+        concurrently (see _load_views()).
+        """
+        from pixeltable.plan import Planner
+
+        shared_plan, shared_view_paths = Planner.create_shared_view_load_plan(
+            [view.path for view in self.mutable_views], batch_size=self.__PROPAGATION_BATCH_SIZE)
+        shared_views = [path.tbl_version for path in shared_view_paths]
+        shared_view_ids = {view.id for view in shared_views}
+        num_rows = {view.id: 0 for view in self.mutable_views}
+        num_excs = {view.id: 0 for view in self.mutable_views}
+        num_computed_values = {view.id: 0 for view in self.mutable_views}
+        cols_with_excs: dict[UUID, set[int]] = {view.id: set() for view in self.mutable_views}
+
+        def record_loads(loads: list[tuple[TableVersion, exec.ExecNode]], show_progress: bool = True) -> None:
+            for (view, plan), (view_num_rows, view_num_excs, view_cols_with_excs) in zip(
+                loads, self._load_views(loads, conn, show_progress=show_progress)
+            ):
+                num_rows[view.id] += view_num_rows
+                num_excs[view.id] += view_num_excs
+                num_computed_values[view.id] += plan.ctx.num_computed_exprs * view_num_rows
+                cols_with_excs[view.id].update(view_cols_with_excs)
+                if print_stats:
+                    plan.ctx.profile.print(num_rows=view_num_rows)
+
+        for view in self.mutable_views:
+            # we're creating a new version
+            view.version += 1
+        record_loads([
+            (view, Planner.create_view_load_plan(view.path, propagates_insert=True)[0])
+            for view in self.mutable_views if view.id not in shared_view_ids
+        ])
+
+        if shared_plan is not None:
+            def load_shared_views(batches: list[exec.DataRowBatch]) -> None:
+                record_loads(
+                    [
+                        (view, Planner.create_view_load_plan(
+                            view.path, propagates_insert=True, shared_plan=shared_plan, shared_batches=batches)[0])
+                        for view in shared_views
+                    ],
+                    show_progress=False)
+
+            shared_plan.ctx.set_conn(conn)
+            shared_plan.open()
+            try:
+                batches: list[exec.DataRowBatch] = []
+                num_batch_rows = 0
+                for batch in shared_plan:
+                    batches.append(batch)
+                    num_batch_rows += len(batch)
+                    if num_batch_rows >= self.__PROPAGATION_BATCH_SIZE:
+                        load_shared_views(batches)
+                        batches, num_batch_rows = [], 0
+                if num_batch_rows > 0:
+                    load_shared_views(batches)
+            finally:
+                shared_plan.close()
+
+        result = UpdateStatus()
+        for view in self.mutable_views:
+            result.num_rows += num_rows[view.id]
+            result.num_excs += num_excs[view.id]
+            result.num_computed_values += num_computed_values[view.id]
+            result.cols_with_excs += [f'{view.name}.{view.cols_by_id[cid].name}' for cid in cols_with_excs[view.id]]
+            view._update_md(timestamp, conn)
+            result += view._propagate_insert(conn, timestamp, print_stats=print_stats)
+            _logger.info(f'TableVersion {view.name}: new version {view.version}')
+        return result
+
+    def _load_views(
+        self, loads: list[tuple[TableVersion, exec.ExecNode]], conn: sql.engine.Connection, show_progress: bool = True
+    ) -> list[tuple[int, int, set[int]]]:
+        """Inserts the rows produced by each plan into its view, at the view's current version
+
+        The views are independent of each other, and up to view_maintenance_workers of them are loaded concurrently,
+        in worker threads. The loads share conn, and with it the caller's transaction; they serialize their use of it
+        via ExecContext.conn_lock. Plans that call query functions, which use conn on their own, and plans that call
+        functions with a resource pool (eg, rate-limited API endpoints), whose schedulers each assume that they're the
+        only user of the pool's (shared) info, are run sequentially.
+
+        Returns:
+            the result of StoreBase.insert_rows() for each load
+        """
+        def runs_sequentially(plan: exec.ExecNode) -> bool:
+            return any(
+                isinstance(e, exprs.FunctionCall)
+                and (isinstance(e.fn, func.QueryTemplateFunction) or e.resource_pool is not None)
+                for e in plan.row_builder.unique_exprs)
+
+        num_workers = min(len(loads), self._view_maintenance_workers())
+        concurrent_idxs = (
+            [i for i, (_, plan) in enumerate(loads) if not runs_sequentially(plan)] if num_workers > 1 else []
+        )
+        if len(concurrent_idxs) < 2:
+            concurrent_idxs = []
+        results: dict[int, tuple[int, int, set[int]]] = {}
+        if len(concurrent_idxs) > 0:
+            lock = threading.Lock()
+            fs: dict[int, futures.Future] = {}
+            with futures.ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='pxt-view') as executor:
+                for i in concurrent_idxs:
+                    view, plan = loads[i]
+                    plan.ctx.conn_lock = lock
+                    # progress bars of concurrent loads would garble each other
+                    fs[i] = executor.submit(
+                        view.store_tbl.insert_rows, plan, conn, v_min=view.version, show_progress=False)
+            # all loads have finished at this point; the first failure aborts the transaction
+            for i, f in fs.items():
+                results[i] = f.result()
+        for i, (view, plan) in enumerate(loads):
+            if i not in results:
+                results[i] = view.store_tbl.insert_rows(plan, conn, v_min=view.version, show_progress=show_progress)
+        return [results[i] for i in range(len(loads))]
+
+    @classmethod
+    def _view_maintenance_workers(cls) -> int:
+        """Returns the max number of views that are loaded concurrently, as configured by view_maintenance_workers"""
+        num_workers = Env.get().config.get_int_value('view_maintenance_workers')
+        if num_workers is None:
+            num_workers = min(cls.__DEFAULT_VIEW_MAINTENANCE_WORKERS, os.cpu_count() or 1)
+        return max(num_workers, 1)
+
     def update(
         self, value_spec: dict[str, Any], where: Optional[exprs.Expr] = None, cascade: bool = True
     ) -> UpdateStatus:
@@ -887,31 +1232,46 @@ class TableVersion:
             recomputed_view_cols: list[Column], base_versions: list[Optional[int]], conn: sql.engine.Connection,
             timestamp: float, cascade: bool, show_progress: bool = True
     ) -> UpdateStatus:
-        result = UpdateStatus()
+        load_result: Optional[tuple[int, int, set[int]]] = None
         if plan is not None:
             # we're creating a new version
             self.version += 1
-            result.num_rows, result.num_excs, cols_with_excs = \
-                self.store_tbl.insert_rows(plan, conn, v_min=self.version, show_progress=show_progress)
+            load_result = self.store_tbl.insert_rows(plan, conn, v_min=self.version, show_progress=show_progress)
+        return self._complete_update(
+            load_result, where_clause, recomputed_view_cols, base_versions, conn, timestamp, cascade)
+
+    def _complete_update(
+            self, load_result: Optional[tuple[int, int, set[int]]], where_clause: Optional[sql.ColumnElement],
+            recomputed_view_cols: list[Column], base_versions: list[Optional[int]], conn: sql.engine.Connection,
+            timestamp: float, cascade: bool
+    ) -> UpdateStatus:
+        """Completes propagate_update() once the updated rows have been inserted, if any (load_result is the result of
+        StoreBase.insert_rows()), and propagates the update to the views, which are loaded concurrently"""
+        result = UpdateStatus()
+        if load_result is not None:
+            result.num_rows, result.num_excs, cols_with_excs = load_result
             result.cols_with_excs = [f'{self.name}.{self.cols_by_id[cid].name}' for cid in cols_with_excs]
             self.store_tbl.delete_rows(
                 self.version, base_versions=base_versions, match_on_vmin=True, where_clause=where_clause, conn=conn)
             self._update_md(timestamp, conn)
 
         if cascade:
-            base_versions = [None if plan is None else self.version] + base_versions  # don't update in place
+            base_versions = [None if load_result is None else self.version] + base_versions  # don't update in place
             # propagate to views
+            loads: list[tuple[TableVersion, exec.ExecNode]] = []
             for view in self.mutable_views:
                 recomputed_cols = [col for col in recomputed_view_cols if col.tbl is view]
-                plan = None
                 if len(recomputed_cols) > 0:
                     from pixeltable.plan import Planner
                     plan = Planner.create_view_update_plan(view.path, recompute_targets=recomputed_cols)
-                status = view.propagate_update(
-                    plan, None, recomputed_view_cols, base_versions=base_versions, conn=conn, timestamp=timestamp, cascade=True)
-                result.num_rows += status.num_rows
-                result.num_excs += status.num_excs
-                result.cols_with_excs += status.cols_with_excs
+                    # we're creating a new version
+                    view.version += 1
+                    loads.append((view, plan))
+            load_results = {view.id: res for (view, _), res in zip(loads, self._load_views(loads, conn))}
+            for view in self.mutable_views:
+                result += view._complete_update(
+                    load_results.get(view.id), None, recomputed_view_cols, base_versions=base_versions, conn=conn,
+                    timestamp=timestamp, cascade=True)
 
         result.cols_with_excs = list(dict.fromkeys(result.cols_with_excs).keys())  # remove duplicates
         return result
@@ -1010,6 +1370,8 @@ class TableVersion:
         # revert new deletions
         set_clause: dict[sql.Column, Any] = {self.store_tbl.sa_tbl.c.v_max: schema.Table.MAX_VERSION}
         for index_info in self.idxs_by_name.values():
+            if index_info.undo_col is None:
+                continue
             # copy the index value back from the undo column and reset the undo column to NULL
             set_clause[index_info.val_col.sa_col] = index_info.undo_col.sa_col
             set_clause[index_info.undo_col.sa_col] = None
@@ -1017,6 +1379,8 @@ class TableVersion:
             .values(set_clause) \
             .where(self.store_tbl.sa_tbl.c.v_max == self.version)
         conn.execute(stmt)
+        for index_info in self.idxs_by_name.values():
+            index_info.idx.revert_index(self._store_idx_name(index_info.id), index_info.val_col, self.version)
 
         # revert schema changes
         if self.version == self.schema_version:
@@ -1034,6 +1398,8 @@ class TableVersion:
             if len(added_idx_md) > 0:
                 next_idx_id = min(md.id for md in added_idx_md)
                 for md in added_idx_md:
+                    idx_info = self.idxs_by_name[md.name]
+                    idx_info.idx.drop_index(self._store_idx_name(md.id), idx_info.val_col)
                     del self.idx_md[md.id]
                     del self.idxs_by_name[md.name]
                 self.next_idx_id = next_idx_id
@@ -1081,6 +1447,8 @@ class TableVersion:
             sql.update(schema.Table.__table__)
                 .values({schema.Table.md: dataclasses.asdict(self._create_tbl_md())})
                 .where(schema.Table.id == self.id))
+        # the version number will get reused
+        ResultSetCache.get().invalidate(self.id)
 
         # propagate to views
         for view in self.mutable_views:
@@ -245,11 +245,14 @@ class DataFrame:
         vars = self._vars()
         return {name: var.col_type for name, var in vars.items()}
 
-    def _exec(self, conn: Optional[sql.engine.Connection] = None) -> Iterator[exprs.DataRow]:
-        """Run the query and return rows as a generator.
+    def _exec(
+        self, conn: Optional[sql.engine.Connection] = None, plan: Optional[exec.ExecNode] = None
+    ) -> Iterator[exprs.DataRow]:
+        """Run the query (or the given plan for it) and return rows as a generator.
         This function must not modify the state of the DataFrame, otherwise it breaks dataset caching.
         """
-        plan = self._create_query_plan()
+        if plan is None:
+            plan = self._create_query_plan()
 
         def exec_plan(conn: sql.engine.Connection) -> Iterator[exprs.DataRow]:
             plan.ctx.set_conn(conn)
@@ -359,6 +362,114 @@ class DataFrame:
         result._reverse()
         return result
 
+    def explain(self) -> str:
+        """Return a description of how the query is executed, without executing it.
+
+        The description lists the steps of the execution plan. For the steps that run in Postgres, it includes the
+        Postgres query plan and, for similarity searches, how the embedding index is used (eg, in combination with a
+        filter).
+
+        Returns:
+            A multi-line string.
+
+        Examples:
+            >>> sim = t.img.similarity('a red car')
+            ... print(t.where(t.year == 2024).order_by(sim, asc=False).limit(10).explain())
+        """
+        query_plan = self._create_query_plan()
+        lines: list[str] = []
+        node: Optional[exec.ExecNode] = query_plan
+        with Env.get().engine.begin() as conn:
+            while node is not None:
+                lines.append(type(node).__name__)
+                if isinstance(node, exec.SqlNode):
+                    lines.extend(f'  {line}' for line in node.explain(conn))
+                node = node.input
+        return '\n'.join(lines)
+
+    def similarity_search(
+        self, column: exprs.Expr, items: list[Any], k: int, *, idx: Optional[str] = None,
+        ef_search: Optional[int] = None, probes: Optional[int] = None, rerank_factor: Optional[int] = None
+    ) -> list[DataFrameResultSet]:
+        """Return the k rows that are most similar to each of the query items, according to an embedding index.
+
+        The result for each item is the same as that of
+        `df.select(..., similarity=sim).order_by(sim, asc=False).limit(k)`, with `sim = column.similarity(item, ...)`,
+        but all items are embedded with batched calls to the embedding function and, unless the DataFrame has a
+        filter that needs to be evaluated in Python, all queries are run with a single SQL statement.
+
+        similarity_search() is not supported for joins or in combination with group_by(), order_by() or limit().
+
+        Args:
+            column: The column with the embedding index.
+            items: The query items (strings or images).
+            k: The number of rows to return for each item.
+            idx: The name of the embedding index; only needed if the column has more than one.
+            ef_search: Search parameter for HNSW indices (see [`similarity`][pixeltable.exprs.ColumnRef.similarity]).
+            probes: Search parameter for IVFFlat and IVFPQ indices.
+            rerank_factor: Re-ranking factor for indices with binary precision and IVFPQ indices.
+
+        Returns:
+            A list with one DataFrameResultSet per item, in the order of the items. The result sets contain the
+            columns of the DataFrame's select list plus a column `similarity`, in descending order of similarity.
+
+        Raises:
+            Error: If the DataFrame is the result of a join or has a group_by, order_by or limit clause,
+                or if the column doesn't have a suitable embedding index.
+
+        Examples:
+            Find the 5 most similar images for each of a list of descriptions:
+
+            >>> results = t.select(t.img).similarity_search(t.img, ['a red car', 'a dog on a beach'], k=5)
+            ... results[1]['img']
+        """
+        if self.group_by_clause is not None or self.grouping_tbl is not None:
+            raise excs.Error(f'similarity_search() cannot be used with group_by()')
+        if self.order_by_clause is not None:
+            raise excs.Error(f'similarity_search() cannot be used with order_by()')
+        if self.limit_val is not None:
+            raise excs.Error(f'similarity_search() cannot be used with limit()')
+        if self._has_joins():
+            raise excs.Error(f'similarity_search() not supported for joins')
+        if not isinstance(column, exprs.ColumnRef):
+            raise excs.Error(f'similarity_search(): `column` must be a column reference, not {column}')
+        if not isinstance(k, int) or k <= 0:
+            raise excs.Error(f'similarity_search(): `k` must be a positive integer, not {k!r}')
+        if 'similarity' in self.schema:
+            raise excs.Error(f'similarity_search(): the select list already contains a column named `similarity`')
+        if len(items) == 0:
+            return []
+
+        sims = [
+            column.similarity(item, idx=idx, ef_search=ef_search, probes=probes, rerank_factor=rerank_factor)
+            for item in items
+        ]
+        select_list = list(zip(self._select_list_exprs, self.schema.keys()))
+
+        def query(sim: exprs.Expr) -> DataFrame:
+            return DataFrame(
+                from_clause=self._from_clause, select_list=[*select_list, (sim, 'similarity')],
+                where_clause=self.where_clause
+            ).order_by(sim, asc=False).limit(k)
+
+        assert isinstance(sims[0], exprs.SimilarityExpr)
+        embedding_idx = sims[0].idx_info.idx
+        # the items are embedded in batches in either case; the per-item queries find them in the embedding cache
+        embeddings = embedding_idx.embed_batch(items)
+        df = query(sims[0])
+        query_plan = df._create_query_plan()
+        sql_node = query_plan.get_node(exec.SqlScanNode)
+        if sql_node is None or not sql_node.supports_similarity_queries(k):
+            return [query(sim).collect() for sim in sims]
+
+        sql_node.set_similarity_queries(embeddings)
+        rows = list(df._output_row_iterator(plan=query_plan))
+        assert len(rows) == len(sql_node.query_idxs)
+        results: list[list[list]] = [[] for _ in items]
+        for query_idx, row in zip(sql_node.query_idxs, rows):
+            results[query_idx].append(row)
+        return [DataFrameResultSet(result, df.schema) for result in results]
+
     @property
     def schema(self) -> dict[str, ColumnType]:
         return self._schema
@@ -421,9 +532,11 @@ class DataFrame:
             msg += f'\nStack:\n{nl.join(stack_trace[-1:1:-1])}'
         raise excs.Error(msg)
 
-    def _output_row_iterator(self, conn: Optional[sql.engine.Connection] = None) -> Iterator[list]:
+    def _output_row_iterator(
+        self, conn: Optional[sql.engine.Connection] = None, plan: Optional[exec.ExecNode] = None
+    ) -> Iterator[list]:
         try:
-            for data_row in self._exec(conn):
+            for data_row in self._exec(conn, plan):
                 yield [data_row[e.slot_idx] for e in self._select_list_exprs]
         except excs.ExprEvalError as e:
             self._raise_expr_eval_err(e)
@@ -431,7 +544,24 @@ class DataFrame:
             raise excs.Error(f'Error during SQL execution:\n{e}')
 
     def collect(self) -> DataFrameResultSet:
-        return self._collect()
+        from pixeltable.utils.result_set_cache import ResultSetCache
+
+        cache = ResultSetCache.get()
+        if not cache.is_enabled:
+            return self._collect()
+        try:
+            cache_key = self._hash_result_set()
+        except Exception as e:
+            # the query can't be serialized (eg, it contains an image literal)
+            _logger.debug(f'not caching result set: {e}')
+            return self._collect()
+        result = cache.lookup(cache_key)
+        if result is None:
+            result = self._collect()
+            tbl_ids = frozenset(
+                tbl_version.id for tbl in self._from_clause.tbls for tbl_version in tbl.get_tbl_versions())
+            cache.add(cache_key, tbl_ids, result)
+        return result
 
     def _collect(self, conn: Optional[sql.engine.Connection] = None) -> DataFrameResultSet:
         return DataFrameResultSet(list(self._output_row_iterator(conn)), self.schema)
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 from abc import abstractmethod
+import atexit
+from concurrent import futures
 import datetime
 import glob
 import http.server
@@ -8,6 +10,7 @@ import importlib
 import importlib.util
 import inspect
 import logging
+import multiprocessing
 import os
 import platform
 import shutil
@@ -53,6 +56,8 @@ class Env:
     _media_dir: Optional[Path]
     _file_cache_dir: Optional[Path]  # cached media files with external URL
     _dataset_cache_dir: Optional[Path]  # cached datasets (eg, pytorch or COCO)
+    _udf_cache_dir: Optional[Path]  # cached results of UDFs with cache=True
+    _index_dir: Optional[Path]  # in-process embedding indices
     _log_dir: Optional[Path]  # log files
     _tmp_dir: Optional[Path]  # any tmp files
     _sa_engine: Optional[sql.engine.base.Engine]
@@ -80,6 +85,8 @@ class Env:
     _initialized: bool
 
     _resource_pool_info: dict[str, Any]
+    _udf_executors: dict[str, futures.Executor]  # executor kind ('thread' or 'process') -> pool
+    _udf_executors_lock: threading.Lock  # guards the creation and shutdown of _udf_executors
 
     @classmethod
     def get(cls) -> Env:
@@ -89,6 +96,8 @@ class Env:
 
     @classmethod
     def _init_env(cls, reinit_db: bool = False) -> None:
+        if cls._instance is not None:
+            cls._instance._shut_down_udf_executors()
         env = Env()
         env._set_up(reinit_db=reinit_db)
         env._upgrade_metadata()
@@ -99,6 +108,8 @@ class Env:
         self._media_dir = None  # computed media files
         self._file_cache_dir = None  # cached media files with external URL
         self._dataset_cache_dir = None  # cached datasets (eg, pytorch or COCO)
+        self._udf_cache_dir = None  # cached results of UDFs with cache=True
+        self._index_dir = None  # in-process embedding indices
         self._log_dir = None  # log files
         self._tmp_dir = None  # any tmp files
         self._sa_engine = None
@@ -133,6 +144,8 @@ class Env:
         self._initialized = False
 
         self._resource_pool_info = {}
+        self._udf_executors = {}
+        self._udf_executors_lock = threading.Lock()
 
     @property
     def config(self) -> Config:
@@ -252,6 +265,8 @@ class Env:
         self._media_dir = self._home / 'media'
         self._file_cache_dir = self._home / 'file_cache'
         self._dataset_cache_dir = self._home / 'dataset_cache'
+        self._udf_cache_dir = self._home / 'udf_cache'
+        self._index_dir = self._home / 'indices'
         self._log_dir = self._home / 'logs'
         self._tmp_dir = self._home / 'tmp'
 
@@ -273,6 +288,10 @@ class Env:
             self._file_cache_dir.mkdir()
         if not self._dataset_cache_dir.exists():
             self._dataset_cache_dir.mkdir()
+        if not self._udf_cache_dir.exists():
+            self._udf_cache_dir.mkdir()
+        if not self._index_dir.exists():
+            self._index_dir.mkdir()
         if not self._log_dir.exists():
             self._log_dir.mkdir()
         if not self._tmp_dir.exists():
@@ -644,6 +663,38 @@ class Env:
             self._resource_pool_info[pool_id] = info
         return info
 
+    def get_udf_executor(self, kind: str) -> futures.Executor:
+        """
+        Returns the pool that runs synchronous UDFs with the given executor kind ('thread' or 'process'), creating it
+        if necessary. The pool size is given by the udf_executor_workers config option (default: number of CPUs).
+        """
+        # plans can run concurrently in different threads (eg, when loading several views), and each pool must be
+        # created only once
+        with self._udf_executors_lock:
+            executor = self._udf_executors.get(kind)
+            if executor is None:
+                num_workers = self.config.get_int_value('udf_executor_workers') or os.cpu_count() or 1
+                if kind == 'thread':
+                    executor = futures.ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='pxt-udf')
+                else:
+                    assert kind == 'process'
+                    # worker processes don't inherit any state (eg, db connections) from this one
+                    executor = futures.ProcessPoolExecutor(
+                        max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'))
+                if len(self._udf_executors) == 0:
+                    atexit.register(self._shut_down_udf_executors)
+                self._udf_executors[kind] = executor
+            return executor
+
+    def _shut_down_udf_executors(self) -> None:
+        """Shuts down the UDF pools; pending calls are cancelled, running ones are waited for"""
+        with self._udf_executors_lock:
+            executors = list(self._udf_executors.values())
+            self._udf_executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+        atexit.unregister(self._shut_down_udf_executors)
+
     @property
     def home(self) -> Path:
         assert self._home is not None
@@ -664,6 +715,16 @@ class Env:
         assert self._dataset_cache_dir is not None
         return self._dataset_cache_dir
 
+    @property
+    def udf_cache_dir(self) -> Path:
+        assert self._udf_cache_dir is not None
+        return self._udf_cache_dir
+
+    @property
+    def index_dir(self) -> Path:
+        assert self._index_dir is not None
+        return self._index_dir
+
     @property
     def tmp_dir(self) -> Path:
         assert self._tmp_dir is not None
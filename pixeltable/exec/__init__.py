@@ -6,5 +6,6 @@ from .exec_context import ExecContext
 from .exec_node import ExecNode
 from .in_memory_data_node import InMemoryDataNode
 from .row_update_node import RowUpdateNode
-from .sql_node import SqlLookupNode, SqlScanNode, SqlAggregationNode, SqlNode, SqlJoinNode
+from .shared_rows_node import SharedRowsNode
+from .sql_node import SqlLookupNode, SqlScanNode, SqlAggregationNode, SqlNode, SqlJoinNode, FilteredSimilaritySearch
 from .expr_eval import ExprEvalNode
@@ -1,15 +1,15 @@
 from __future__ import annotations
 
+import asyncio
 import dataclasses
 import itertools
 import logging
-import threading
+import time
 import urllib.parse
 import urllib.request
 from collections import deque
-from concurrent import futures
 from pathlib import Path
-from typing import Optional, Any, Iterator, AsyncIterator
+from typing import Optional, Iterator, AsyncIterator
 from uuid import UUID
 
 import pixeltable.env as env
@@ -17,9 +17,11 @@ import pixeltable.exceptions as excs
 import pixeltable.exprs as exprs
 from pixeltable import catalog
 from pixeltable.utils.filecache import FileCache
+from pixeltable.utils.url_fetcher import UrlFetcher
 
 from .data_row_batch import DataRowBatch
 from .exec_node import ExecNode
+from .expr_eval.batch_sizer import AdaptiveBatchSizer
 
 _logger = logging.getLogger('pixeltable')
 
@@ -27,16 +29,19 @@ _logger = logging.getLogger('pixeltable')
 class CachePrefetchNode(ExecNode):
     """Brings files with external URLs into the cache
 
-    TODO:
-    - adapting the number of download threads at runtime to maximize throughput
+    Downloads are asyncio tasks that stream the files to disk (see UrlFetcher). Urls are downloaded in the order in
+    which they appear in the input, with at most concurrency.batch_size downloads in flight. The number of concurrent
+    downloads is adapted at runtime to maximize the throughput (in bytes/s): AdaptiveBatchSizer performs a hill climb
+    over the concurrency, based on the throughput of windows of as many completed downloads as there are concurrent
+    downloads.
     """
     BATCH_SIZE = 16
-    NUM_EXECUTOR_THREADS = 16
+    INITIAL_CONCURRENCY = 16
+    MIN_CONCURRENCY = 2
+    MAX_CONCURRENCY = 64
 
     retain_input_order: bool  # if True, return rows in the exact order they were received
     file_col_info: list[exprs.ColumnSlotIdx]
-    boto_client: Optional[Any]
-    boto_client_lock: threading.Lock
 
     # execution state
     batch_tbl_version: Optional[catalog.TableVersion]  # needed to construct output batches
@@ -47,11 +52,19 @@ class CachePrefetchNode(ExecNode):
     ready_rows: deque[Optional[exprs.DataRow]]
 
     in_flight_rows: dict[int, CachePrefetchNode.RowState]  # rows with in-flight urls; id(row) -> RowState
-    in_flight_requests: dict[futures.Future, str]  # in-flight requests for urls; future -> URL
+    pending_urls: deque[str]  # urls waiting for a download slot, in submission order
+    in_flight_requests: dict[asyncio.Task, str]  # in-flight requests for urls; task -> URL
     in_flight_urls: dict[str, list[tuple[exprs.DataRow, exprs.ColumnSlotIdx]]]  # URL -> [(row, info)]
     input_finished: bool
     row_idx: Iterator[Optional[int]]
 
+    fetcher: Optional[UrlFetcher]
+    concurrency: AdaptiveBatchSizer  # concurrency.batch_size: max number of in-flight requests
+    # current throughput measurement window
+    window_start: Optional[float]
+    window_bytes: int
+    window_downloads: int
+
     @dataclasses.dataclass
     class RowState:
         row: exprs.DataRow
@@ -66,34 +79,38 @@ class CachePrefetchNode(ExecNode):
         self.retain_input_order = retain_input_order
         self.file_col_info = file_col_info
 
-        # clients for specific services are constructed as needed, because it's time-consuming
-        self.boto_client = None
-        self.boto_client_lock = threading.Lock()
-
         self.batch_tbl_version = None
         self.num_returned_rows = 0
         self.ready_rows = deque()
         self.in_flight_rows = {}
+        self.pending_urls = deque()
         self.in_flight_requests = {}
         self.in_flight_urls = {}
         self.input_finished = False
         self.row_idx = itertools.count() if retain_input_order else itertools.repeat(None)
 
+        self.fetcher = None
+        self.concurrency = AdaptiveBatchSizer(self.INITIAL_CONCURRENCY, self.MIN_CONCURRENCY, self.MAX_CONCURRENCY)
+        self.window_start = None
+        self.window_bytes = 0
+        self.window_downloads = 0
+
     async def __aiter__(self) -> AsyncIterator[DataRowBatch]:
         input_iter = self.input.__aiter__()
-        with futures.ThreadPoolExecutor(max_workers=self.NUM_EXECUTOR_THREADS) as executor:
+        self.fetcher = UrlFetcher(max_connections=self.MAX_CONCURRENCY)
+        try:
             # we create enough in-flight requests to fill the first batch
             while not self.input_finished and self.__num_pending_rows() < self.BATCH_SIZE:
-                await self.__submit_input_batch(input_iter, executor)
+                await self.__submit_input_batch(input_iter)
 
             while True:
                 # try to assemble a full batch of output rows
                 if not self.__has_ready_batch() and len(self.in_flight_requests) > 0:
-                    self.__wait_for_requests()
+                    await self.__wait_for_requests()
 
                 # try to create enough in-flight requests to fill the next batch
                 while not self.input_finished and self.__num_pending_rows() < self.BATCH_SIZE:
-                    await self.__submit_input_batch(input_iter, executor)
+                    await self.__submit_input_batch(input_iter)
 
                 if len(self.ready_rows) > 0:
                     # create DataRowBatch from the first BATCH_SIZE ready rows
@@ -108,6 +125,11 @@ class CachePrefetchNode(ExecNode):
 
                 if self.input_finished and self.__num_pending_rows() == 0:
                     return
+        finally:
+            for task in self.in_flight_requests:
+                task.cancel()
+            await asyncio.gather(*self.in_flight_requests, return_exceptions=True)
+            await self.fetcher.aclose()
 
     def __num_pending_rows(self) -> int:
         return len(self.in_flight_rows) + len(self.ready_rows)
@@ -132,12 +154,12 @@ class CachePrefetchNode(ExecNode):
                 self.ready_rows.extend([None] * (idx - len(self.ready_rows) + 1))
             self.ready_rows[idx] = row
 
-    def __wait_for_requests(self) -> None:
+    async def __wait_for_requests(self) -> None:
         """Wait for in-flight requests to complete until we have a full batch of rows"""
         file_cache = FileCache.get()
         _logger.debug(f'waiting for requests; ready_batch_size={self.__ready_prefix_len()}')
         while not self.__has_ready_batch() and len(self.in_flight_requests) > 0:
-            done, _ = futures.wait(self.in_flight_requests, return_when=futures.FIRST_COMPLETED)
+            done, _ = await asyncio.wait(self.in_flight_requests, return_when=asyncio.FIRST_COMPLETED)
             for f in done:
                 url = self.in_flight_requests.pop(f)
                 tmp_path, exc = f.result()
@@ -162,10 +184,31 @@ class CachePrefetchNode(ExecNode):
                         del self.in_flight_rows[id(row)]
                         self.__add_ready_row(row, state.idx)
                         _logger.debug(f'row {state.idx} is ready (ready_batch_size={self.__ready_prefix_len()})')
-
-    async def __submit_input_batch(
-        self, input: AsyncIterator[DataRowBatch], executor: futures.ThreadPoolExecutor
-    ) -> None:
+            self.__start_requests()
+
+    def __start_requests(self) -> None:
+        """Start requests for pending urls, up to the current concurrency"""
+        while len(self.pending_urls) > 0 and len(self.in_flight_requests) < self.concurrency.batch_size:
+            url = self.pending_urls.popleft()
+            if self.window_start is None:
+                self.window_start = time.monotonic()
+            task = asyncio.create_task(self.__fetch_url(url))
+            self.in_flight_requests[task] = url
+
+    def __record_download(self, num_bytes: int) -> None:
+        """Record a completed download and adjust the concurrency at the end of a measurement window"""
+        self.window_bytes += num_bytes
+        self.window_downloads += 1
+        if self.window_downloads < self.concurrency.batch_size:
+            return
+        now = time.monotonic()
+        assert self.window_start is not None
+        elapsed = now - self.window_start
+        if elapsed > 0.0:
+            self.concurrency.record_throughput(self.concurrency.batch_size, self.window_bytes / elapsed)
+        self.window_start, self.window_bytes, self.window_downloads = now, 0, 0
+
+    async def __submit_input_batch(self, input: AsyncIterator[DataRowBatch]) -> None:
         assert not self.input_finished
         input_batch: Optional[DataRowBatch]
         try:
@@ -220,13 +263,13 @@ class CachePrefetchNode(ExecNode):
 
         _logger.debug(f'submitting {len(cache_misses)} urls')
         for url in cache_misses:
-            f = executor.submit(self.__fetch_url, url)
             _logger.debug(f'submitted {url} for idx {url_pos[url]}')
-            self.in_flight_requests[f] = url
+            self.pending_urls.append(url)
+        self.__start_requests()
 
-    def __fetch_url(self, url: str) -> tuple[Optional[Path], Optional[Exception]]:
+    async def __fetch_url(self, url: str) -> tuple[Optional[Path], Optional[Exception]]:
         """Fetches a remote URL into Env.tmp_dir and returns its path"""
-        _logger.debug(f'fetching url={url} thread_name={threading.current_thread().name}')
+        _logger.debug(f'fetching url={url}')
         parsed = urllib.parse.urlparse(url)
         # Use len(parsed.scheme) > 1 here to ensure we're not being passed
         # a Windows filename
@@ -239,27 +282,15 @@ class CachePrefetchNode(ExecNode):
         tmp_path = env.Env.get().create_tmp_path(extension=extension)
         try:
             _logger.debug(f'Downloading {url} to {tmp_path}')
-            if parsed.scheme == 's3':
-                from pixeltable.utils.s3 import get_client
-                with self.boto_client_lock:
-                    if self.boto_client is None:
-                        config = {
-                            'max_pool_connections': self.NUM_EXECUTOR_THREADS + 4,  # +4: leave some headroom
-                            'connect_timeout': 5,
-                            'read_timeout': 30,
-                            'retries': {'max_attempts': 3, 'mode': 'adaptive'},
-                        }
-                        self.boto_client = get_client(**config)
-                self.boto_client.download_file(parsed.netloc, parsed.path.lstrip('/'), str(tmp_path))
-            elif parsed.scheme == 'http' or parsed.scheme == 'https':
-                with urllib.request.urlopen(url) as resp, open(tmp_path, 'wb') as f:
-                    data = resp.read()
-                    f.write(data)
-            else:
-                assert False, f'Unsupported URL scheme: {parsed.scheme}'
+            num_bytes = await self.fetcher.fetch(url, tmp_path)
             _logger.debug(f'Downloaded {url} to {tmp_path}')
+            self.__record_download(num_bytes)
             return tmp_path, None
+        except asyncio.CancelledError:
+            tmp_path.unlink(missing_ok=True)
+            raise
         except Exception as e:
+            tmp_path.unlink(missing_ok=True)
             # we want to add the file url to the exception message
             exc = excs.Error(f'Failed to download {url}: {e}')
             _logger.debug(f'Failed to download {url}: {e}', exc_info=e)
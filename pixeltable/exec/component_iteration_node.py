@@ -1,9 +1,16 @@
+import asyncio
+import collections
 import inspect
-from typing import Iterator, Optional, AsyncIterator
+import itertools
+import os
+import threading
+from concurrent import futures
+from typing import Any, AsyncIterator, Optional, Union
 
 import pixeltable.catalog as catalog
 import pixeltable.exceptions as excs
 import pixeltable.exprs as exprs
+from pixeltable.env import Env
 
 from .data_row_batch import DataRowBatch
 from .exec_node import ExecNode
@@ -12,9 +19,19 @@ from .exec_node import ExecNode
 class ComponentIterationNode(ExecNode):
     """Expands each row from a base table into one row per component returned by an iterator
 
-    Returns row batches of OUTPUT_BATCH_SIZE size.
+    Returns row batches of OUTPUT_BATCH_SIZE size. The components of an input row are processed in chunks of
+    COMPONENT_CHUNK_SIZE, and the output rows of a chunk are initialized from the input row in one step
+    (see DataRowBatch.add_copies()).
+
+    The iterators of up to iterator_workers input rows run concurrently, in worker threads; their output
+    is merged in input order. The workers share a budget of MAX_LOOKAHEAD_COMPONENTS components that they may produce
+    ahead of the consumer (see _LookaheadBudget).
     """
     __OUTPUT_BATCH_SIZE = 1024
+    __COMPONENT_CHUNK_SIZE = 16
+    __MAX_LOOKAHEAD_COMPONENTS = 1024
+    # default max number of input rows that are expanded concurrently; configurable via iterator_workers
+    __DEFAULT_NUM_WORKERS = 4
 
     def __init__(self, view: catalog.TableVersion, input: ExecNode):
         assert view.is_component_view()
@@ -39,7 +56,34 @@ class ComponentIterationNode(ExecNode):
         }
 
     async def __aiter__(self) -> AsyncIterator[DataRowBatch]:
-        output_batch = DataRowBatch(self.view, self.row_builder)
+        output_batch = DataRowBatch(self.view, self.row_builder, capacity=self.__OUTPUT_BATCH_SIZE)
+        num_workers = self.__num_workers()
+        components = self.__expand_inline() if num_workers == 1 else self.__expand_concurrently(num_workers)
+        async for input_row, start_pos, chunk in components:
+            chunk_idx = 0
+            while chunk_idx < len(chunk):
+                # the output rows start out as copies of the input row
+                num_rows = min(len(chunk) - chunk_idx, self.__OUTPUT_BATCH_SIZE - len(output_batch))
+                start_idx = output_batch.add_copies(input_row, num_rows)
+                for i, output_row in enumerate(output_batch.rows[start_idx:]):
+                    # we're expanding the input and need to add the iterator position to the pk
+                    self.__populate_output_row(output_row, start_pos + chunk_idx + i, chunk[chunk_idx + i])
+                chunk_idx += num_rows
+                if len(output_batch) == self.__OUTPUT_BATCH_SIZE:
+                    yield output_batch
+                    output_batch = DataRowBatch(self.view, self.row_builder, capacity=self.__OUTPUT_BATCH_SIZE)
+
+        if len(output_batch) > 0:
+            yield output_batch
+
+    def __num_workers(self) -> int:
+        num_workers = Env.get().config.get_int_value('iterator_workers')
+        if num_workers is None:
+            num_workers = min(self.__DEFAULT_NUM_WORKERS, os.cpu_count() or 1)
+        return max(num_workers, 1)
+
+    async def __input_rows_with_args(self) -> AsyncIterator[tuple[exprs.DataRow, Optional[dict[str, Any]]]]:
+        """Returns the input rows with their iterator args, or None if the row doesn't get expanded"""
         async for input_batch in self.input:
             for input_row in input_batch:
                 self.row_builder.eval(input_row, self.iterator_args_ctx)
@@ -48,19 +92,97 @@ class ComponentIterationNode(ExecNode):
                 # We need to ensure that all of the required (non-nullable) parameters of the iterator are
                 # specified and are not null. If any of them are null, then we skip this row (i.e., we emit 0
                 # output rows for this input row).
-                if self.__non_nullable_args_specified(iterator_args):
-                    iterator = self.view.iterator_cls(**iterator_args)
-                    for pos, component_dict in enumerate(iterator):
-                        output_row = output_batch.add_row()
-                        input_row.copy(output_row)
-                        # we're expanding the input and need to add the iterator position to the pk
-                        self.__populate_output_row(output_row, pos, component_dict)
-                        if len(output_batch) == self.__OUTPUT_BATCH_SIZE:
-                            yield output_batch
-                            output_batch = DataRowBatch(self.view, self.row_builder)
+                yield input_row, iterator_args if self.__non_nullable_args_specified(iterator_args) else None
 
-        if len(output_batch) > 0:
-            yield output_batch
+    async def __expand_inline(self) -> AsyncIterator[tuple[exprs.DataRow, int, list[dict[str, Any]]]]:
+        async for input_row, iterator_args in self.__input_rows_with_args():
+            if iterator_args is not None:
+                iterator = self.view.iterator_cls(**iterator_args)
+                pos = 0
+                while True:
+                    chunk = list(itertools.islice(iterator, self.__COMPONENT_CHUNK_SIZE))
+                    if len(chunk) == 0:
+                        break
+                    yield input_row, pos, chunk
+                    pos += len(chunk)
+
+    async def __expand_concurrently(
+        self, num_workers: int
+    ) -> AsyncIterator[tuple[exprs.DataRow, int, list[dict[str, Any]]]]:
+        loop = asyncio.get_running_loop()
+        # input rows in input order, with the queue their components are delivered in
+        in_flight: collections.deque[tuple[exprs.DataRow, asyncio.Queue]] = collections.deque()
+        budget = _LookaheadBudget(self.__MAX_LOOKAHEAD_COMPONENTS, reserve=4 * self.__COMPONENT_CHUNK_SIZE)
+        with futures.ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='pxt-iter') as executor:
+            try:
+                seq = 0  # position of the next expanded input row in the output
+                async for input_row, iterator_args in self.__input_rows_with_args():
+                    if iterator_args is None:
+                        continue
+                    components: asyncio.Queue = asyncio.Queue()
+                    executor.submit(self.__run_iterator, iterator_args, seq, loop, components, budget)
+                    seq += 1
+                    in_flight.append((input_row, components))
+                    if len(in_flight) == num_workers:
+                        async for item in self.__drain(*in_flight.popleft(), budget):
+                            yield item
+                while len(in_flight) > 0:
+                    async for item in self.__drain(*in_flight.popleft(), budget):
+                        yield item
+            finally:
+                # tells the workers to stop if we don't consume their output
+                budget.cancel()
+
+    def __run_iterator(
+        self, iterator_args: dict[str, Any], seq: int, loop: asyncio.AbstractEventLoop, components: asyncio.Queue,
+        budget: '_LookaheadBudget'
+    ) -> None:
+        """Runs in a worker thread: puts chunks of the iterator output into components, followed by None, or the
+        exception raised by the iterator"""
+        def put(item: Union[list[dict[str, Any]], Exception, None]) -> bool:
+            if isinstance(item, list):
+                if not budget.acquire(seq, len(item)):
+                    return False
+            elif budget.is_cancelled():
+                return False
+            try:
+                loop.call_soon_threadsafe(components.put_nowait, item)
+            except RuntimeError:
+                # the event loop is closed: the consumer is gone
+                return False
+            return True
+
+        try:
+            chunk: list[dict[str, Any]] = []
+            for component_dict in self.view.iterator_cls(**iterator_args):
+                if budget.is_cancelled():
+                    return
+                chunk.append(component_dict)
+                if len(chunk) == self.__COMPONENT_CHUNK_SIZE:
+                    if not put(chunk):
+                        return
+                    chunk = []
+            if len(chunk) > 0 and not put(chunk):
+                return
+            put(None)
+        except Exception as exc:
+            put(exc)
+
+    @staticmethod
+    async def __drain(
+        input_row: exprs.DataRow, components: asyncio.Queue, budget: '_LookaheadBudget'
+    ) -> AsyncIterator[tuple[exprs.DataRow, int, list[dict[str, Any]]]]:
+        pos = 0
+        while True:
+            chunk = await components.get()
+            if chunk is None:
+                budget.advance()
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            budget.release(len(chunk))
+            yield input_row, pos, chunk
+            pos += len(chunk)
 
     def __non_nullable_args_specified(self, iterator_args: dict) -> bool:
         """
@@ -92,3 +214,50 @@ class ComponentIterationNode(ExecNode):
             raise excs.Error(
                 f'Invalid output of {self.view.iterator_cls.__name__}: '
                 f'missing fields {", ".join(missing_fields)}')
+
+
+class _LookaheadBudget:
+    """Number of components that the iterators of a ComponentIterationNode may produce ahead of the consumer
+
+    The iterators are identified by the position of their input row in the output (seq). The iterator of the row that
+    is currently being consumed (the head) may exceed the budget by reserve components: otherwise the iterators of
+    subsequent rows could exhaust the budget and stall the consumer.
+    """
+    def __init__(self, size: int, reserve: int):
+        self.available = size
+        self.reserve = reserve
+        self.head = 0
+        self.cancelled = False
+        self.cond = threading.Condition()
+
+    def acquire(self, seq: int, n: int) -> bool:
+        """Waits until n components can be produced by iterator seq; returns False if the budget was cancelled"""
+        with self.cond:
+            self.cond.wait_for(
+                lambda: self.cancelled or self.available >= n
+                or (seq == self.head and self.available >= n - self.reserve))
+            if self.cancelled:
+                return False
+            self.available -= n
+            return True
+
+    def release(self, n: int) -> None:
+        """Records that n components were consumed"""
+        with self.cond:
+            self.available += n
+            self.cond.notify_all()
+
+    def advance(self) -> None:
+        """Records that the head iterator was consumed completely"""
+        with self.cond:
+            self.head += 1
+            self.cond.notify_all()
+
+    def cancel(self) -> None:
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+
+    def is_cancelled(self) -> bool:
+        with self.cond:
+            return self.cancelled
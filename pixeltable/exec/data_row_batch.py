@@ -1,7 +1,9 @@
 from __future__ import annotations
-from typing import Iterator, Optional
+from typing import Any, Iterable, Iterator, Optional
 import logging
 
+import numpy as np
+
 import pixeltable.exprs as exprs
 import pixeltable.catalog as catalog
 from pixeltable.utils.media_store import MediaStore
@@ -13,6 +15,12 @@ class DataRowBatch:
     """Set of DataRows, indexed by rowid.
 
     Contains the metadata needed to initialize DataRows.
+
+    Storage is columnar: the state of the rows created by the batch lives in rows x slots arrays (one column per slot,
+    plus has_val/excs masks), and each DataRow is a thin view of one row of those arrays. This avoids per-row
+    allocations and lets scans, filters and stores operate on entire slot columns (see slot_vals()/set_slot_vals()).
+    Rows that were created elsewhere and are added via add_row(row) keep their own storage; once that happens the
+    batch is no longer columnar (is_columnar == False) and the column accessors gather/scatter row by row.
     """
     tbl: Optional[catalog.TableVersion]
     row_builder: exprs.RowBuilder
@@ -21,12 +29,29 @@ class DataRowBatch:
     array_slot_idxs: list[int]
     rows: list[exprs.DataRow]
 
+    # columnar storage, indexed by [row idx, slot idx]; only the first len(rows) rows are in use
+    is_columnar: bool  # True if rows[i] is a view of row i of the storage arrays
+    capacity: int  # number of allocated storage rows
+    vals: np.ndarray  # of object
+    has_val: np.ndarray  # of bool
+    excs: np.ndarray  # of object
+    missing_slots: np.ndarray  # of bool
+    missing_dependents: np.ndarray  # of int16
+    is_scheduled: np.ndarray  # of bool
+    file_urls: np.ndarray  # of str
+    file_paths: np.ndarray  # of str
+
+    __MIN_CAPACITY = 16
+
     def __init__(
         self, tbl: Optional[catalog.TableVersion], row_builder: exprs.RowBuilder, num_rows: Optional[int] = None,
-        rows: Optional[list[exprs.DataRow]] = None
+        rows: Optional[list[exprs.DataRow]] = None, capacity: Optional[int] = None
     ):
         """
         Requires either num_rows or rows to be specified, but not both.
+
+        Args:
+            capacity: number of rows to allocate storage for up front; the storage grows as needed
         """
         assert num_rows is None or rows is None
         self.tbl = tbl
@@ -38,25 +63,109 @@ class DataRowBatch:
             if e.col_type.is_media_type() and not e.col_type.is_image_type()
         ]
         self.array_slot_idxs = [e.slot_idx for e in row_builder.unique_exprs if e.col_type.is_array_type()]
+        # slots that DataRow.__setitem__() doesn't transform and that can therefore be assigned column-wise
+        self._plain_slots = np.ones(row_builder.num_materialized, dtype=bool)
+        self._plain_slots[self.img_slot_idxs + self.media_slot_idxs + self.array_slot_idxs] = False
+
+        self.rows = []
         if rows is not None:
+            # these rows have their own storage
+            self.is_columnar = False
+            self._alloc(0)
             self.rows = rows
         else:
+            self.is_columnar = True
             if num_rows is None:
                 num_rows = 0
-            self.rows = [
-                exprs.DataRow(row_builder.num_materialized, self.img_slot_idxs, self.media_slot_idxs, self.array_slot_idxs)
-                for _ in range(num_rows)
-            ]
+            self._alloc(max(num_rows, capacity or 0))
+            self.add_rows(num_rows)
+
+    def _alloc(self, capacity: int) -> None:
+        """(Re-)allocate storage with the given capacity, preserving the existing rows"""
+        num_slots = self.row_builder.num_materialized
+        vals = np.full((capacity, num_slots), None, dtype=object)
+        has_val = np.zeros((capacity, num_slots), dtype=bool)
+        excs = np.full((capacity, num_slots), None, dtype=object)
+        missing_slots = np.zeros((capacity, num_slots), dtype=bool)
+        missing_dependents = np.zeros((capacity, num_slots), dtype=np.int16)
+        is_scheduled = np.zeros((capacity, num_slots), dtype=bool)
+        file_urls = np.full((capacity, num_slots), None, dtype=object)
+        file_paths = np.full((capacity, num_slots), None, dtype=object)
+        if self.is_columnar and len(self.rows) > 0:
+            n = len(self.rows)
+            vals[:n] = self.vals[:n]
+            has_val[:n] = self.has_val[:n]
+            excs[:n] = self.excs[:n]
+            missing_slots[:n] = self.missing_slots[:n]
+            missing_dependents[:n] = self.missing_dependents[:n]
+            is_scheduled[:n] = self.is_scheduled[:n]
+            file_urls[:n] = self.file_urls[:n]
+            file_paths[:n] = self.file_paths[:n]
+        self.vals, self.has_val, self.excs = vals, has_val, excs
+        self.missing_slots, self.missing_dependents, self.is_scheduled = missing_slots, missing_dependents, is_scheduled
+        self.file_urls, self.file_paths = file_urls, file_paths
+        self.capacity = capacity
+        if self.is_columnar:
+            for i, row in enumerate(self.rows):
+                self._bind_row(row, i)
+
+    def _bind_row(self, row: exprs.DataRow, idx: int) -> None:
+        row.bind(
+            self.vals[idx], self.has_val[idx], self.excs[idx], self.missing_slots[idx], self.missing_dependents[idx],
+            self.is_scheduled[idx], self.file_urls[idx], self.file_paths[idx])
+
+    def _reserve(self, num_rows: int) -> None:
+        if num_rows > self.capacity:
+            self._alloc(max(num_rows, 2 * self.capacity, self.__MIN_CAPACITY))
+
+    def _new_row(self) -> exprs.DataRow:
+        if not self.is_columnar:
+            return exprs.DataRow(
+                self.row_builder.num_materialized, self.img_slot_idxs, self.media_slot_idxs, self.array_slot_idxs)
+        idx = len(self.rows)
+        self._reserve(idx + 1)
+        return exprs.DataRow.view(
+            self.img_slot_idxs, self.media_slot_idxs, self.array_slot_idxs,
+            self.vals[idx], self.has_val[idx], self.excs[idx], self.missing_slots[idx], self.missing_dependents[idx],
+            self.is_scheduled[idx], self.file_urls[idx], self.file_paths[idx])
 
     def add_row(self, row: Optional[exprs.DataRow] = None) -> exprs.DataRow:
         if row is None:
-            row = exprs.DataRow(
-                self.row_builder.num_materialized, self.img_slot_idxs, self.media_slot_idxs, self.array_slot_idxs)
+            row = self._new_row()
+        elif self.is_columnar:
+            # the row has its own storage
+            self.is_columnar = False
         self.rows.append(row)
         return row
 
-    def pop_row(self) -> exprs.DataRow:
-        return self.rows.pop()
+    def add_rows(self, num_rows: int) -> None:
+        """Add num_rows empty rows"""
+        self._reserve(len(self.rows) + num_rows)
+        for _ in range(num_rows):
+            self.rows.append(self._new_row())
+
+    def add_copies(self, row: exprs.DataRow, num_rows: int) -> int:
+        """Add num_rows rows that are copies of row (see DataRow.copy()); returns the index of the first new row
+
+        In a columnar batch, the populated slots of row are assigned to all new rows with one array operation, instead
+        of copying all of row's state into each new row: the storage of new rows is already cleared.
+        """
+        start = len(self.rows)
+        if not self.is_columnar:
+            for _ in range(num_rows):
+                row.copy(self.add_row())
+            return start
+        self.add_rows(num_rows)
+        stop = start + num_rows
+        slot_idxs = np.flatnonzero(row.has_val)
+        self.vals[start:stop, slot_idxs] = row.vals[slot_idxs]
+        self.has_val[start:stop, slot_idxs] = True
+        self.excs[start:stop, slot_idxs] = row.excs[slot_idxs]
+        self.file_urls[start:stop, slot_idxs] = row.file_urls[slot_idxs]
+        self.file_paths[start:stop, slot_idxs] = row.file_paths[slot_idxs]
+        for new_row in self.rows[start:stop]:
+            new_row.pk = row.pk
+        return start
 
     def __len__(self) -> int:
         return len(self.rows)
@@ -64,6 +173,65 @@ class DataRowBatch:
     def __getitem__(self, index: int) -> exprs.DataRow:
         return self.rows[index]
 
+    def slot_vals(self, slot_idx: int) -> np.ndarray:
+        """Returns the values of the given slot for all rows; a view of the storage if the batch is columnar"""
+        if self.is_columnar:
+            return self.vals[:len(self.rows), slot_idx]
+        return np.fromiter((row.vals[slot_idx] for row in self.rows), dtype=object, count=len(self.rows))
+
+    def slot_has_val(self, slot_idx: int) -> np.ndarray:
+        if self.is_columnar:
+            return self.has_val[:len(self.rows), slot_idx]
+        return np.fromiter((row.has_val[slot_idx] for row in self.rows), dtype=bool, count=len(self.rows))
+
+    def set_slot_vals(self, slot_idx: int, vals: Iterable[Any], start: int = 0) -> None:
+        """Assigns vals to the given slot of rows start, start + 1, ...
+
+        Slots that require per-value processing in DataRow.__setitem__() (media and array slots) are assigned row by
+        row; all other slots are assigned as a whole column.
+        """
+        if not self.is_columnar or not self._plain_slots[slot_idx]:
+            for row, val in zip(self.rows[start:], vals):
+                row[slot_idx] = val
+            return
+        # np.fromiter() treats each element as a scalar, even if it's a list (eg, for json slots)
+        col_vals = np.fromiter(vals, dtype=object)
+        stop = start + len(col_vals)
+        assert stop <= len(self.rows)
+        assert (self.excs[start:stop, slot_idx] == None).all()
+        self.vals[start:stop, slot_idx] = col_vals
+        self.has_val[start:stop, slot_idx] = True
+
+    def has_exc(self) -> bool:
+        """Returns True if any row has an exception in any slot"""
+        if self.is_columnar:
+            return bool((self.excs[:len(self.rows)] != None).any())
+        return any(row.has_exc() for row in self.rows)
+
+    def retain(self, mask: np.ndarray, start: int = 0) -> None:
+        """Removes rows start, start + 1, ... for which mask is False"""
+        assert len(mask) == len(self.rows) - start
+        if mask.all():
+            return
+        if not self.is_columnar:
+            self.rows[start:] = [row for row, keep in zip(self.rows[start:], mask) if keep]
+            return
+        # compact the storage
+        n = len(self.rows)
+        kept = start + np.flatnonzero(mask)
+        stop = start + len(kept)
+        for a in (
+            self.vals, self.has_val, self.excs, self.missing_slots, self.missing_dependents, self.is_scheduled,
+            self.file_urls, self.file_paths
+        ):
+            a[start:stop] = a[kept]
+        # reset the vacated storage rows: they get reused by subsequently added rows
+        for row in self.rows[stop:n]:
+            row.clear()
+        for row, src_idx in zip(self.rows[start:stop], kept.tolist()):
+            row.pk = self.rows[src_idx].pk
+        del self.rows[stop:]
+
     def flush_imgs(
             self, idx_range: Optional[slice] = None, stored_img_info: Optional[list[exprs.ColumnSlotIdx]] = None,
             flushed_slot_idxs: Optional[list[int]] = None
@@ -1,4 +1,5 @@
-from typing import Optional
+import contextlib
+from typing import ContextManager, Optional
 
 import sqlalchemy as sql
 
@@ -18,6 +19,8 @@ class ExecContext:
         # num_rows is used to compute the total number of computed cells used for the progress bar
         self.num_rows: Optional[int] = None
         self.conn: Optional[sql.engine.Connection] = None  # if present, use this to execute SQL queries
+        # held while using conn; a lock if conn is shared with plans that run in other threads
+        self.conn_lock: ContextManager = contextlib.nullcontext()
         self.pk_clause = pk_clause
         self.num_computed_exprs = num_computed_exprs
         self.ignore_errors = ignore_errors
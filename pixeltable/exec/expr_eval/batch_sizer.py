@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import logging
+import statistics
+from typing import Optional
+
+_logger = logging.getLogger('pixeltable')
+
+
+class AdaptiveBatchSizer:
+    """
+    Chooses the batch size of a batched function within [min_size, max_size], based on observed execution times.
+
+    The candidate sizes are the initial size times powers of 2, clipped to the bounds. The sizer performs a hill climb
+    over the candidates:
+    - for the current size, it collects the throughput (items/s) of NUM_SAMPLES full batches and records the median
+    - it then moves to the smallest measured size whose throughput is within MIN_IMPROVEMENT of the best throughput
+      seen so far, or, if that's the current size, to an unmeasured neighbor (larger sizes first)
+    - once there are no unmeasured neighbors left, the search has converged; it is restarted if the throughput at the
+      chosen size subsequently drops by more than MAX_DRIFT (eg, because the inputs got longer or fewer cores are
+      available)
+
+    Batches of a size other than the current one (eg, the final partial batch) are ignored.
+    """
+    min_size: int
+    max_size: int
+    batch_size: int  # the current batch size
+    sizes: list[int]  # the history of chosen batch sizes, starting with the initial size
+    throughput: dict[int, float]  # batch size -> median throughput in items/s
+    samples: list[float]  # throughput of the most recent full batches of the current size
+    is_converged: bool
+
+    NUM_SAMPLES = 3
+    MIN_IMPROVEMENT = 0.05
+    MAX_DRIFT = 0.3
+
+    def __init__(self, initial_size: int, min_size: int, max_size: int):
+        assert 1 <= min_size <= initial_size <= max_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.batch_size = initial_size
+        self.sizes = [initial_size]
+        self.throughput = {}
+        self.samples = []
+        self.is_converged = False
+
+    def _neighbor(self, size: int, grow: bool) -> Optional[int]:
+        """Returns the next candidate size in the given direction, or None if size is at the corresponding bound"""
+        if grow:
+            return min(2 * size, self.max_size) if size < self.max_size else None
+        return max(size // 2, self.min_size) if size > self.min_size else None
+
+    def record(self, num_items: int, elapsed: float) -> None:
+        """Record the execution time (in seconds) of a batch of num_items items"""
+        if elapsed <= 0.0:
+            return
+        self.record_throughput(num_items, num_items / elapsed)
+
+    def record_throughput(self, size: int, throughput: float) -> None:
+        """
+        Record a throughput measurement (in arbitrary units/s) for the given size; this allows the sizer to tune other
+        kinds of sizes, such as the number of concurrent requests.
+        """
+        if size != self.batch_size:
+            return
+        self.samples.append(throughput)
+        if len(self.samples) < self.NUM_SAMPLES:
+            return
+        throughput = statistics.median(self.samples)
+        self.samples.clear()
+
+        if self.is_converged:
+            if throughput >= self.throughput[self.batch_size] * (1 - self.MAX_DRIFT):
+                return
+            # the workload changed: forget the previous measurements and search again
+            _logger.debug(
+                f'AdaptiveBatchSizer: throughput at batch size {self.batch_size} dropped from '
+                f'{self.throughput[self.batch_size]:.1f} to {throughput:.1f} items/s; restarting search')
+            self.throughput = {}
+            self.is_converged = False
+        self.throughput[self.batch_size] = throughput
+
+        best_throughput = max(self.throughput.values())
+        next_size = min(
+            size for size, val in self.throughput.items() if val >= best_throughput * (1 - self.MIN_IMPROVEMENT))
+        if next_size == self.batch_size:
+            candidates = [self._neighbor(self.batch_size, grow=True), self._neighbor(self.batch_size, grow=False)]
+            unmeasured = [size for size in candidates if size is not None and size not in self.throughput]
+            if len(unmeasured) == 0:
+                self.is_converged = True
+                return
+            next_size = unmeasured[0]
+        self._set_batch_size(next_size)
+
+    def _set_batch_size(self, size: int) -> None:
+        _logger.debug(f'AdaptiveBatchSizer: batch size {self.batch_size} -> {size}')
+        self.batch_size = size
+        self.sizes.append(size)
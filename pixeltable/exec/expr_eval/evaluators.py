@@ -5,11 +5,17 @@ import datetime
 import itertools
 import logging
 import sys
+import time
 from typing import Iterator, Any, Optional, Callable, cast
 
+import pixeltable.exceptions as excs
 from pixeltable import exprs
 from pixeltable import func
+from pixeltable.env import Env
+from pixeltable.utils.udf_cache import UdfCache
+from .batch_sizer import AdaptiveBatchSizer
 from .globals import Dispatcher, Evaluator, FnCallArgs
+from .udf_executor import EXECUTOR_KINDS, UdfExecutor
 
 _logger = logging.getLogger('pixeltable')
 
@@ -57,8 +63,17 @@ class FnCallEvaluator(Evaluator):
     - async functions: one task per row
     - the rest: one task per set of rows handed to schedule()
 
-    TODO:
-    - adaptive batching: finding the optimal batch size based on observed execution times
+    For batched functions with batch size bounds (CallableFunction.is_adaptively_batched), the batch size is adjusted
+    based on the observed execution times (see AdaptiveBatchSizer); the adaptive_batch_size config option extends this
+    to batched functions without bounds, such as the built-in model functions. This only applies to batches that are
+    executed directly, not to those handed off to a resource pool scheduler.
+
+    Synchronous functions are executed inline (ie, on the event loop thread), unless the function's executor (or the
+    udf_executor config option) specifies a thread or process pool; in that case, calls are submitted to the pool (see
+    UdfExecutor), with scalar calls split into chunks of UdfExecutor.CHUNK_SIZE rows to spread them across workers.
+
+    For functions with cache=True, the UdfCache is consulted before calls are scheduled; the results of calls that are
+    executed here (ie, not by a resource pool scheduler) are added to it.
     """
     fn_call: exprs.FunctionCall
     fn: func.CallableFunction
@@ -67,6 +82,10 @@ class FnCallEvaluator(Evaluator):
     # only set if fn.is_batched
     call_args_queue: Optional[asyncio.Queue[FnCallArgs]]  # FnCallArgs waiting for execution
     batch_size: Optional[int]
+    batch_sizer: Optional[AdaptiveBatchSizer]  # only set if the batch size is adaptive
+
+    udf_executor: Optional[UdfExecutor]  # only set for sync functions that aren't executed inline
+    cache_fn_key: Optional[str]  # only set for functions with cache=True
 
     def __init__(self, fn_call: exprs.FunctionCall, dispatcher: Dispatcher):
         super().__init__(dispatcher)
@@ -76,14 +95,39 @@ class FnCallEvaluator(Evaluator):
             self.call_args_queue =  asyncio.Queue[FnCallArgs]()
             # we're not supplying sample arguments there, they're ignored anyway
             self.batch_size = self.fn.get_batch_size()
+            self.batch_sizer = None
+            if self.fn_call.resource_pool is None:
+                bounds = self.fn.batch_size_bounds(
+                    self.batch_size, Env.get().config.get_bool_value('adaptive_batch_size') or False)
+                if bounds is not None:
+                    self.batch_sizer = AdaptiveBatchSizer(self.batch_size, *bounds)
             self.scalar_py_fn = None
         else:
             self.call_args_queue = None
             self.batch_size = None
+            self.batch_sizer = None
             if isinstance(self.fn, func.CallableFunction):
                 self.scalar_py_fn = self.fn.py_fn
             else:
                 self.scalar_py_fn = None
+        self.udf_executor = self._create_udf_executor()
+        self.cache_fn_key = None
+        if isinstance(self.fn, func.CallableFunction) and self.fn.cache:
+            self.cache_fn_key = UdfCache.fn_key(self.fn)
+
+    def _create_udf_executor(self) -> Optional[UdfExecutor]:
+        if not isinstance(self.fn, func.CallableFunction) or self.fn.is_async:
+            return None
+        kind = self.fn.executor
+        if kind is None:
+            kind = Env.get().config.get_string_value('udf_executor') or 'inline'
+            if kind not in EXECUTOR_KINDS:
+                raise excs.Error(
+                    f"Invalid value for config option udf_executor: {kind!r} (expected one of 'inline', 'thread', "
+                    "'process')")
+        if kind == 'inline':
+            return None
+        return UdfExecutor(kind, self.fn.py_fn)
 
     def schedule(self, rows: list[exprs.DataRow], slot_idx: int) -> None:
         assert self.fn_call.slot_idx >= 0
@@ -103,6 +147,8 @@ class FnCallEvaluator(Evaluator):
 
         if len(skip_rows) > 0:
             self.dispatcher.dispatch(skip_rows)
+        if self.cache_fn_key is not None:
+            rows_call_args = self._lookup_cached(rows_call_args)
 
         if self.batch_size is not None:
             if not self.is_closed and (len(rows_call_args) + self.call_args_queue.qsize() < self.batch_size):
@@ -147,11 +193,45 @@ class FnCallEvaluator(Evaluator):
                     task = asyncio.create_task(self.eval_async(item))
                     self.dispatcher.register_task(task)
 
+        elif self.udf_executor is not None:
+            # create one task per chunk, so that the chunks can be executed in parallel
+            for i in range(0, len(rows_call_args), UdfExecutor.CHUNK_SIZE):
+                chunk = rows_call_args[i:i + UdfExecutor.CHUNK_SIZE]
+                task = asyncio.create_task(self.eval_in_executor(chunk))
+                self.dispatcher.register_task(task)
+
         else:
             # create a single task for all rows
             task = asyncio.create_task(self.eval(rows_call_args))
             self.dispatcher.register_task(task)
 
+    def _lookup_cached(self, rows_call_args: list[FnCallArgs]) -> list[FnCallArgs]:
+        """Dispatches the rows with cached results and returns the FnCallArgs of the remaining ones"""
+        cache = UdfCache.get()
+        hit_rows: list[exprs.DataRow] = []
+        missed_call_args: list[FnCallArgs] = []
+        for item in rows_call_args:
+            key = cache.call_key(item.args, item.kwargs, self.fn.signature)
+            if key is not None:
+                is_hit, val = cache.lookup(self.cache_fn_key, key)
+                if is_hit:
+                    item.row[self.fn_call.slot_idx] = val
+                    hit_rows.append(item.row)
+                    continue
+            item.cache_keys = [key]
+            missed_call_args.append(item)
+        if len(hit_rows) > 0:
+            self.dispatcher.dispatch(hit_rows)
+        return missed_call_args
+
+    def _cache_results(self, call_args: FnCallArgs, results: list[Any]) -> None:
+        if call_args.cache_keys is None:
+            return
+        cache = UdfCache.get()
+        for key, result in zip(call_args.cache_keys, results):
+            if key is not None:
+                cache.add(self.cache_fn_key, key, result)
+
     def _queued_call_args_iter(self) -> Iterator[FnCallArgs]:
         while not self.call_args_queue.empty():
             yield self.call_args_queue.get_nowait()
@@ -166,12 +246,15 @@ class FnCallEvaluator(Evaluator):
                 batch_args[j][i] = item.args[j]
             for k in item.kwargs.keys():
                 batch_kwargs[k][i] = item.kwargs[k]
+        cache_keys = [item.cache_keys[0] for item in call_args] if self.cache_fn_key is not None else None
         return FnCallArgs(
-            self.fn_call, [item.row for item in call_args], batch_args=batch_args, batch_kwargs=batch_kwargs)
+            self.fn_call, [item.row for item in call_args], batch_args=batch_args, batch_kwargs=batch_kwargs,
+            cache_keys=cache_keys)
 
     async def eval_batch(self, batched_call_args: FnCallArgs) -> None:
         result_batch: list[Any]
         try:
+            start_time = time.perf_counter()
             if self.fn.is_async:
                 result_batch = await self.fn.aexec_batch(
                     *batched_call_args.batch_args, **batched_call_args.batch_kwargs)
@@ -179,7 +262,13 @@ class FnCallEvaluator(Evaluator):
                 # check for cancellation before starting something potentially long-running
                 if asyncio.current_task().cancelled() or self.dispatcher.exc_event.is_set():
                     return
-                result_batch = self.fn.exec_batch(batched_call_args.batch_args, batched_call_args.batch_kwargs)
+                if self.udf_executor is not None:
+                    constant_kwargs, batched_kwargs = self.fn.create_batch_kwargs(batched_call_args.batch_kwargs)
+                    result_batch = await self.udf_executor.exec_batch(
+                        batched_call_args.batch_args, {**constant_kwargs, **batched_kwargs})
+                else:
+                    result_batch = self.fn.exec_batch(batched_call_args.batch_args, batched_call_args.batch_kwargs)
+            self._record_batch(len(batched_call_args.rows), time.perf_counter() - start_time)
         except Exception as exc:
             _, _, exc_tb = sys.exc_info()
             for row in batched_call_args.rows:
@@ -189,8 +278,23 @@ class FnCallEvaluator(Evaluator):
 
         for i, row in enumerate(batched_call_args.rows):
             row[self.fn_call.slot_idx] = result_batch[i]
+        self._cache_results(batched_call_args, result_batch)
         self.dispatcher.dispatch(batched_call_args.rows)
 
+    def _record_batch(self, num_rows: int, elapsed: float) -> None:
+        """Record the execution time of a batch in the profile and adjust the batch size, if it's adaptive"""
+        slot_idx = self.fn_call.slot_idx
+        profile = self.dispatcher.profile
+        if profile is not None:
+            profile.eval_time[slot_idx] += elapsed
+            profile.eval_count[slot_idx] += num_rows
+        if self.batch_sizer is None:
+            return
+        self.batch_sizer.record(num_rows, elapsed)
+        self.batch_size = self.batch_sizer.batch_size
+        if profile is not None and len(profile.batch_sizes[slot_idx]) != len(self.batch_sizer.sizes):
+            profile.batch_sizes[slot_idx] = self.batch_sizer.sizes.copy()
+
     async def eval_async(self, call_args: FnCallArgs) -> None:
         assert len(call_args.rows) == 1
         assert not call_args.row.has_val[self.fn_call.slot_idx]
@@ -199,9 +303,11 @@ class FnCallEvaluator(Evaluator):
         try:
             start_ts = datetime.datetime.now()
             _logger.debug(f'Start evaluating slot {self.fn_call.slot_idx}')
-            call_args.row[self.fn_call.slot_idx] = await self.fn.aexec(*call_args.args, **call_args.kwargs)
+            result = await self.fn.aexec(*call_args.args, **call_args.kwargs)
+            call_args.row[self.fn_call.slot_idx] = result
             end_ts = datetime.datetime.now()
             _logger.debug(f'Evaluated slot {self.fn_call.slot_idx} in {end_ts - start_ts}')
+            self._cache_results(call_args, [result])
             self.dispatcher.dispatch([call_args.row])
         except Exception as exc:
             import anthropic
@@ -221,15 +327,34 @@ class FnCallEvaluator(Evaluator):
             if asyncio.current_task().cancelled() or self.dispatcher.exc_event.is_set():
                 return
             try:
-                item.row[self.fn_call.slot_idx] = self.scalar_py_fn(*item.args, **item.kwargs)
+                result = self.scalar_py_fn(*item.args, **item.kwargs)
+                item.row[self.fn_call.slot_idx] = result
             except Exception as exc:
                 _, _, exc_tb = sys.exc_info()
                 item.row.set_exc(self.fn_call.slot_idx, exc)
                 rows_with_excs.add(idx)
                 self.dispatcher.dispatch_exc(item.rows, self.fn_call.slot_idx, exc_tb)
+            else:
+                self._cache_results(item, [result])
         self.dispatcher.dispatch(
             [call_args_batch[i].row for i in range(len(call_args_batch)) if i not in rows_with_excs])
 
+    async def eval_in_executor(self, call_args_batch: list[FnCallArgs]) -> None:
+        # check for cancellation before starting something potentially long-running
+        if asyncio.current_task().cancelled() or self.dispatcher.exc_event.is_set():
+            return
+        results = await self.udf_executor.exec_calls([(item.args, item.kwargs) for item in call_args_batch])
+        rows: list[exprs.DataRow] = []
+        for item, (exc, val) in zip(call_args_batch, results):
+            if exc is None:
+                item.row[self.fn_call.slot_idx] = val
+                self._cache_results(item, [val])
+                rows.append(item.row)
+            else:
+                item.row.set_exc(self.fn_call.slot_idx, exc)
+                self.dispatcher.dispatch_exc(item.rows, self.fn_call.slot_idx, UdfExecutor.exc_tb(exc))
+        self.dispatcher.dispatch(rows)
+
     def _close(self) -> None:
         """Create a task for the incomplete batch of queued FnCallArgs, if any"""
         _logger.debug(f'FnCallEvaluator.close(): slot_idx={self.fn_call.slot_idx}')
@@ -40,6 +40,7 @@ class ExprEvalNode(ExecNode):
       of which only contains a subset of the models which is known to fit onto the gpu simultaneously
     """
     maintain_input_order: bool  # True if we're returning rows in the order we received them from our input
+    dependencies: np.ndarray  # of int16; RowBuilder.dependencies as a numeric matrix, for row x slot matmuls
     num_dependencies: np.ndarray  # number of dependencies for our output slots; indexed by slot idx
     outputs: np.ndarray  # bool per slot; True if this slot is part of our output
     slot_evaluators: dict[int, Evaluator]  # key: slot idx
@@ -76,7 +77,8 @@ class ExprEvalNode(ExecNode):
     ):
         super().__init__(row_builder, output_exprs, input_exprs, input)
         self.maintain_input_order = maintain_input_order
-        self.num_dependencies = np.sum(row_builder.dependencies, axis=1)
+        self.dependencies = row_builder.dependencies.astype(np.int16)
+        self.num_dependencies = np.sum(self.dependencies, axis=1)
         self.outputs = np.zeros(row_builder.num_materialized, dtype=bool)
         output_slot_idxs = [e.slot_idx for e in output_exprs]
         self.outputs[output_slot_idxs] = True
@@ -108,6 +110,10 @@ class ExprEvalNode(ExecNode):
         self.schedulers = {}
         self._init_slot_evaluators()
 
+    @property
+    def profile(self) -> Optional[exprs.ExecProfile]:
+        return self.ctx.profile if self.ctx is not None else None
+
     def set_input_order(self, maintain_input_order: bool) -> None:
         self.maintain_input_order = maintain_input_order
 
@@ -321,9 +327,18 @@ class ExprEvalNode(ExecNode):
 
     def _init_input_rows(self, rows: list[exprs.DataRow]) -> None:
         """Set execution state in DataRow"""
-        for row in rows:
-            row.missing_dependents = np.sum(self.row_builder.dependencies[row.has_val == False], axis=0)
-            row.missing_slots = self.eval_ctx & (row.has_val == False)
+        if len(rows) == 0:
+            return
+        has_val = np.stack([row.has_val for row in rows])
+        missing_dependents = self._num_missing_dependents(has_val)
+        missing_slots = self.eval_ctx & ~has_val
+        for i, row in enumerate(rows):
+            row.missing_dependents[:] = missing_dependents[i]
+            row.missing_slots[:] = missing_slots[i]
+
+    def _num_missing_dependents(self, has_val: np.ndarray) -> np.ndarray:
+        """Returns rows x slots matrix: number of direct dependents of each slot that have not been materialized"""
+        return (~has_val).astype(np.int16) @ self.dependencies
 
     def dispatch_exc(self, rows: list[exprs.DataRow], slot_with_exc: int, exc_tb: TracebackType) -> None:
         """Propagate exception to main event loop or to dependent slots, depending on ignore_errors"""
@@ -349,45 +364,48 @@ class ExprEvalNode(ExecNode):
         self.dispatch(rows)
 
     def dispatch(self, rows: list[exprs.DataRow]) -> None:
-        """Dispatch rows to slot evaluators, based on materialized dependencies"""
+        """Dispatch rows to slot evaluators, based on materialized dependencies
+
+        The readiness and gc state is computed for all rows at once: the has_val masks of the rows are combined into a
+        rows x slots matrix, which is then multiplied with the dependency matrix.
+        """
         if len(rows) == 0 or self.exc_event.is_set():
             return
 
-        # slots ready for evaluation; rows x slots
-        ready_slots = np.zeros((len(rows), self.row_builder.num_materialized), dtype=bool)
-        completed_rows = np.zeros(len(rows), dtype=bool)
+        # rows x slots
+        has_val = np.stack([row.has_val for row in rows])
+        missing_slots = np.stack([row.missing_slots for row in rows]) & ~has_val
+        prev_missing_dependents = np.stack([row.missing_dependents for row in rows])
+        # all output slots have been materialized
+        completed_rows = ~missing_slots.any(axis=1)
+
+        # slots ready for evaluation: missing slots whose dependencies are all materialized and that haven't been
+        # scheduled yet
+        num_mat_dependencies = has_val.astype(np.int16) @ self.dependencies.T
+        ready_slots = (num_mat_dependencies == self.num_dependencies) & missing_slots
+        ready_slots &= ~np.stack([row.is_scheduled for row in rows])
+
+        # clear intermediate values that are no longer needed (ie, all dependents are materialized)
+        missing_dependents = self._num_missing_dependents(has_val)
+        gc_targets = (missing_dependents == 0) & (prev_missing_dependents > 0) & self.gc_targets
+
+        for i in np.flatnonzero(gc_targets.any(axis=1)).tolist():
+            rows[i].clear(gc_targets[i])
         for i, row in enumerate(rows):
-            row.missing_slots &= row.has_val == False
-            if row.missing_slots.sum() == 0:
-                # all output slots have been materialized
-                completed_rows[i] = True
-            else:
-                # dependencies of missing slots
-                missing_dependencies = self.num_dependencies * row.missing_slots
-                # determine ready slots that are not yet materialized and not yet scheduled
-                num_mat_dependencies = np.sum(self.row_builder.dependencies * row.has_val, axis=1)
-                num_missing = missing_dependencies - num_mat_dependencies
-                ready_slots[i] = (num_missing == 0) & (row.is_scheduled == False) & row.missing_slots
-                row.is_scheduled = row.is_scheduled | ready_slots[i]
-
-            # clear intermediate values that are no longer needed (ie, all dependents are materialized)
-            missing_dependents = np.sum(self.row_builder.dependencies[row.has_val == False], axis=0)
-            gc_targets = (missing_dependents == 0) & (row.missing_dependents > 0) & self.gc_targets
-            row.clear(gc_targets)
-            row.missing_dependents = missing_dependents
+            row.missing_slots[:] = missing_slots[i]
+            row.missing_dependents[:] = missing_dependents[i]
+            row.is_scheduled |= ready_slots[i]
 
         if np.any(completed_rows):
-            completed_idxs = list(completed_rows.nonzero()[0])
+            completed_idxs = np.flatnonzero(completed_rows).tolist()
             for i in completed_idxs:
                 self.completed_rows.put_nowait(rows[i])
             self.completed_event.set()
             self.num_in_flight -= len(completed_idxs)
 
         # schedule all ready slots
-        for slot_idx in np.sum(ready_slots, axis=0).nonzero()[0]:
-            ready_rows_v = ready_slots[:, slot_idx].flatten()
-            _ = ready_rows_v.nonzero()
-            ready_rows = [rows[i] for i in ready_rows_v.nonzero()[0]]
+        for slot_idx in np.flatnonzero(ready_slots.any(axis=0)).tolist():
+            ready_rows = [rows[i] for i in np.flatnonzero(ready_slots[:, slot_idx]).tolist()]
             _logger.debug(f'Scheduling {len(ready_rows)} rows for slot {slot_idx}')
             self.slot_evaluators[slot_idx].schedule(ready_rows, slot_idx)
 
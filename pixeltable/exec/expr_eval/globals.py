@@ -19,6 +19,8 @@ class FnCallArgs:
     # batch call
     batch_args: Optional[list[list[Optional[Any]]]] = None
     batch_kwargs: Optional[dict[str, list[Optional[Any]]]] = None
+    # UdfCache keys of the calls, parallel to rows; only set for functions with cache=True
+    cache_keys: Optional[list[Optional[str]]] = None
 
     @property
     def pxt_fn(self) -> func.CallableFunction:
@@ -66,6 +68,7 @@ class Dispatcher(Protocol):
     row_builder: exprs.RowBuilder
     exc_event: asyncio.Event
     schedulers: dict[str, Scheduler]  # key: resource pool id
+    profile: Optional[exprs.ExecProfile]  # evaluators record execution stats here, if set
 
     def dispatch(self, rows: list[exprs.DataRow]) -> None:
         """Dispatches row slots to the appropriate schedulers; does not block"""
@@ -0,0 +1,334 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import hashlib
+import pickle
+import sys
+import traceback
+from concurrent import futures
+from multiprocessing import shared_memory
+from typing import Any, Callable, Literal, Optional
+
+import cloudpickle  # type: ignore[import-untyped]
+import numpy as np
+import PIL.Image
+
+from pixeltable.env import Env
+
+ExecutorKind = Literal['thread', 'process']
+EXECUTOR_KINDS = ('inline', 'thread', 'process')
+
+# arrays (and images) of at least this size are passed to/from worker processes in shared memory, rather than pickled
+MIN_SHARED_BYTES = 64 * 1024
+# image modes that survive a round trip through np.asarray()/PIL.Image.fromarray()
+SHAREABLE_IMAGE_MODES = frozenset(['L', 'LA', 'RGB', 'RGBA', 'I', 'F'])
+
+
+@dataclasses.dataclass
+class SharedArray:
+    """Reference to an ndarray that was placed in a shared memory block"""
+    shm_name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+@dataclasses.dataclass
+class SharedImage:
+    """Reference to the pixel data of a PIL.Image.Image that was placed in a shared memory block"""
+    pixels: SharedArray
+    format: Optional[str]
+    info: dict[str, Any]
+
+
+class RemoteTraceback(Exception):
+    """Carries the formatted traceback of an exception raised in a worker process (as its __cause__)"""
+    def __init__(self, tb: str):
+        self.tb = tb
+
+    def __str__(self) -> str:
+        return self.tb
+
+
+def _share_array(arr: np.ndarray, shms: list[shared_memory.SharedMemory]) -> SharedArray:
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    shms.append(shm)
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return SharedArray(shm.name, arr.shape, arr.dtype.str)
+
+
+def _load_array(ref: SharedArray) -> np.ndarray:
+    shm = shared_memory.SharedMemory(name=ref.shm_name)
+    try:
+        # copy the data out of the block, so that it can be released right away
+        return np.ndarray(ref.shape, dtype=np.dtype(ref.dtype), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+
+
+def encode_val(val: Any, shms: list[shared_memory.SharedMemory]) -> Any:
+    """Replaces large ndarrays and images with references to shared memory blocks, which are appended to shms"""
+    if isinstance(val, np.ndarray) and val.nbytes >= MIN_SHARED_BYTES and val.dtype != np.object_:
+        return _share_array(val, shms)
+    if isinstance(val, PIL.Image.Image) and val.mode in SHAREABLE_IMAGE_MODES:
+        pixels = np.asarray(val)
+        if pixels.nbytes >= MIN_SHARED_BYTES:
+            return SharedImage(_share_array(pixels, shms), val.format, dict(val.info))
+    return val
+
+
+def decode_val(val: Any) -> Any:
+    if isinstance(val, SharedArray):
+        return _load_array(val)
+    if isinstance(val, SharedImage):
+        img = PIL.Image.fromarray(_load_array(val.pixels))
+        img.format = val.format
+        img.info.update(val.info)
+        return img
+    return val
+
+
+def encode_args(
+    args: list[Any], kwargs: dict[str, Any], shms: list[shared_memory.SharedMemory], is_batched: bool = False
+) -> tuple[list[Any], dict[str, Any]]:
+    """Encodes args and kwargs; for batched calls, the elements of list-valued arguments are encoded"""
+    def encode(val: Any) -> Any:
+        if is_batched and isinstance(val, list):
+            return [encode_val(v, shms) for v in val]
+        return encode_val(val, shms)
+    return [encode(arg) for arg in args], {k: encode(v) for k, v in kwargs.items()}
+
+
+def decode_args(args: list[Any], kwargs: dict[str, Any]) -> tuple[list[Any], dict[str, Any]]:
+    def decode(val: Any) -> Any:
+        if isinstance(val, list):
+            return [decode_val(v) for v in val]
+        return decode_val(val)
+    return [decode(arg) for arg in args], {k: decode(v) for k, v in kwargs.items()}
+
+
+def release(shms: list[shared_memory.SharedMemory]) -> None:
+    for shm in shms:
+        shm.close()
+        shm.unlink()
+
+
+def run_calls(
+    py_fn: Callable, calls: list[tuple[list[Any], dict[str, Any]]]
+) -> list[tuple[Optional[Exception], Any]]:
+    """Calls py_fn for each (args, kwargs) and returns the (exception, result) pairs; runs in a pool thread"""
+    results: list[tuple[Optional[Exception], Any]] = []
+    for args, kwargs in calls:
+        try:
+            results.append((None, py_fn(*args, **kwargs)))
+        except Exception as exc:
+            results.append((exc, None))
+    return results
+
+
+# worker process state: unpickled functions, keyed by the hash of their pickled form
+_worker_fns: dict[bytes, Callable] = {}
+
+
+def _worker_fn(fn_key: bytes, fn_bytes: bytes) -> Callable:
+    fn = _worker_fns.get(fn_key)
+    if fn is None:
+        fn = cloudpickle.loads(fn_bytes)
+        _worker_fns[fn_key] = fn
+    return fn
+
+
+def _worker_results(vals: list[Any]) -> list[Any]:
+    shms: list[shared_memory.SharedMemory] = []
+    try:
+        results = [encode_val(val, shms) for val in vals]
+    except BaseException:
+        release(shms)
+        raise
+    for shm in shms:
+        # the block is unlinked by the receiving process
+        shm.close()
+    return results
+
+
+def _worker_exc(exc: Exception) -> tuple[Exception, str]:
+    tb = ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+    try:
+        pickle.dumps(exc)
+    except Exception:
+        exc = RuntimeError(f'{type(exc).__name__}: {exc}')
+    return exc, tb
+
+
+def run_calls_in_worker(
+    fn_key: bytes, fn_bytes: bytes, calls: list[tuple[list[Any], dict[str, Any]]]
+) -> list[tuple[Optional[tuple[Exception, str]], Any]]:
+    """Process pool counterpart of run_calls(): args and results are encoded, exceptions come with a traceback"""
+    py_fn = _worker_fn(fn_key, fn_bytes)
+    results: list[tuple[Optional[tuple[Exception, str]], Any]] = []
+    for args, kwargs in calls:
+        args, kwargs = decode_args(args, kwargs)
+        try:
+            results.append((None, _worker_results([py_fn(*args, **kwargs)])[0]))
+        except Exception as exc:
+            results.append((_worker_exc(exc), None))
+    return results
+
+
+def run_batch_in_worker(
+    fn_key: bytes, fn_bytes: bytes, args: list[Any], kwargs: dict[str, Any]
+) -> tuple[Optional[tuple[Exception, str]], Optional[list[Any]]]:
+    py_fn = _worker_fn(fn_key, fn_bytes)
+    args, kwargs = decode_args(args, kwargs)
+    try:
+        return None, _worker_results(list(py_fn(*args, **kwargs)))
+    except Exception as exc:
+        return _worker_exc(exc), None
+
+
+def _shm_name(val: Any) -> Optional[str]:
+    if isinstance(val, SharedArray):
+        return val.shm_name
+    if isinstance(val, SharedImage):
+        return val.pixels.shm_name
+    return None
+
+
+def release_results(vals: list[Any]) -> None:
+    """Releases the shared memory blocks that a worker process created for vals"""
+    for val in vals:
+        shm_name = _shm_name(val)
+        if shm_name is None:
+            continue
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+        except FileNotFoundError:
+            continue
+        release([shm])
+
+
+def _remote_exc(exc_info: tuple[Exception, str]) -> Exception:
+    exc, tb = exc_info
+    exc.__cause__ = RemoteTraceback(tb)
+    return exc
+
+
+class UdfExecutor:
+    """
+    Executes calls of a synchronous Python function in the thread or process pool of the given kind.
+
+    Calls are submitted in groups (of at most CHUNK_SIZE calls, or as a single batch for batched functions), which are
+    awaited without blocking the event loop. For the process pool, the function is pickled (by reference, for module
+    functions), and large ndarrays and images are transferred in shared memory.
+    """
+    kind: ExecutorKind
+    py_fn: Callable
+    fn_bytes: Optional[bytes]  # only set for process pools
+    fn_key: Optional[bytes]
+
+    CHUNK_SIZE = 8
+
+    def __init__(self, kind: ExecutorKind, py_fn: Callable):
+        self.kind = kind
+        self.py_fn = py_fn
+        self.fn_bytes = None
+        self.fn_key = None
+        if kind == 'process':
+            self.fn_bytes = cloudpickle.dumps(py_fn)
+            self.fn_key = hashlib.sha256(self.fn_bytes).digest()
+
+    async def exec_calls(
+        self, calls: list[tuple[list[Any], dict[str, Any]]]
+    ) -> list[tuple[Optional[Exception], Any]]:
+        """Returns (exception, result) per call"""
+        loop = asyncio.get_running_loop()
+        executor = Env.get().get_udf_executor(self.kind)
+        if self.kind == 'thread':
+            return await loop.run_in_executor(executor, run_calls, self.py_fn, calls)
+
+        shms: list[shared_memory.SharedMemory] = []
+        try:
+            encoded_calls = [encode_args(args, kwargs, shms) for args, kwargs in calls]
+        except BaseException:
+            release(shms)
+            raise
+        results = await self._run_in_worker(
+            executor, shms, lambda results: [val for _, val in results],
+            run_calls_in_worker, self.fn_key, self.fn_bytes, encoded_calls)
+        vals = self._load_results([val for _, val in results])
+        return [
+            (_remote_exc(exc_info), None) if exc_info is not None else (None, val)
+            for (exc_info, _), val in zip(results, vals)
+        ]
+
+    async def exec_batch(self, args: list[Any], kwargs: dict[str, Any]) -> list[Any]:
+        """Executes a single call of a batched function; kwargs are passed as is"""
+        loop = asyncio.get_running_loop()
+        executor = Env.get().get_udf_executor(self.kind)
+        if self.kind == 'thread':
+            return await loop.run_in_executor(executor, lambda: self.py_fn(*args, **kwargs))
+
+        shms: list[shared_memory.SharedMemory] = []
+        try:
+            encoded_args, encoded_kwargs = encode_args(args, kwargs, shms, is_batched=True)
+        except BaseException:
+            release(shms)
+            raise
+        exc_info, results = await self._run_in_worker(
+            executor, shms, lambda result: result[1] or [],
+            run_batch_in_worker, self.fn_key, self.fn_bytes, encoded_args, encoded_kwargs)
+        if exc_info is not None:
+            raise _remote_exc(exc_info)
+        assert results is not None
+        return self._load_results(results)
+
+    @classmethod
+    async def _run_in_worker(
+        cls, executor: futures.Executor, shms: list[shared_memory.SharedMemory],
+        result_vals: Callable[[Any], list[Any]], fn: Callable, *args: Any
+    ) -> Any:
+        """
+        Runs fn in a worker process and returns its result; shms (the blocks of the encoded args) are released once
+        the call is done, and the blocks of result_vals(result) are released if the call is cancelled or fails
+        """
+        try:
+            fut = executor.submit(fn, *args)
+        except BaseException:
+            release(shms)
+            raise
+
+        def release_all(f: futures.Future) -> None:
+            release(shms)
+            if not f.cancelled() and f.exception() is None:
+                release_results(result_vals(f.result()))
+
+        try:
+            result = await asyncio.wrap_future(fut)
+        except asyncio.CancelledError:
+            # the worker might still be reading the args or creating blocks for its results; release them all once
+            # it's done
+            fut.add_done_callback(release_all)
+            raise
+        except BaseException:
+            release(shms)
+            raise
+        release(shms)
+        return result
+
+    @classmethod
+    def _load_results(cls, vals: list[Any]) -> list[Any]:
+        """Decodes results of a worker process and releases their shared memory blocks"""
+        try:
+            return [decode_val(val) for val in vals]
+        finally:
+            release_results(vals)
+
+    @classmethod
+    def exc_tb(cls, exc: Exception) -> Any:
+        """Returns a traceback for exc, which might have lost its own when it was passed back from a worker process"""
+        if exc.__traceback__ is not None:
+            return exc.__traceback__
+        try:
+            raise exc
+        except Exception:
+            return sys.exc_info()[2]
@@ -1,7 +1,8 @@
 import logging
-from typing import Any, Iterator, Optional, AsyncIterator
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Optional, Union
 
 import pixeltable.catalog as catalog
+import pixeltable.exceptions as excs
 import pixeltable.exprs as exprs
 from pixeltable.utils.media_store import MediaStore
 
@@ -12,22 +13,31 @@ _logger = logging.getLogger('pixeltable')
 
 class InMemoryDataNode(ExecNode):
     """
-    Outputs in-memory data as a DataRowBatch of a particular table.
+    Outputs in-memory data as DataRowBatches of a particular table.
+
+    The input rows can be any iterable or async iterable of dicts. They are consumed lazily and returned in batches of
+    at most OUTPUT_BATCH_SIZE rows, so that a stream of rows (eg, a generator) is never materialized in its entirety.
+    Synchronous iterables are advanced on the calling thread (ie, that of the event loop), because some iterators must
+    stay on the thread that created them (eg, sqlite3 cursors); while such an iterator blocks, the computed columns of
+    the preceding rows aren't evaluated. Async iterables don't have that restriction.
 
     Populates slots of all non-computed columns (ie, output ColumnRefs)
     - with the values provided in the input rows
     - if an input row doesn't provide a value, sets the slot to the column default
     """
     tbl: catalog.TableVersion
-    input_rows: list[dict[str, Any]]
+    input_rows: Union[Iterable[dict[str, Any]], AsyncIterable[dict[str, Any]]]
     start_row_id: int
-    output_rows: Optional[DataRowBatch]
+    user_cols_by_name: dict[str, exprs.ColumnSlotIdx]
+    output_slot_idxs: set[int]
 
     # output_exprs is declared in the superclass, but we redeclare it here with a more specific type
     output_exprs: list[exprs.ColumnRef]
 
+    __OUTPUT_BATCH_SIZE = 1024
+
     def __init__(
-        self, tbl: catalog.TableVersion, rows: list[dict[str, Any]],
+        self, tbl: catalog.TableVersion, rows: Union[Iterable[dict[str, Any]], AsyncIterable[dict[str, Any]]],
         row_builder: exprs.RowBuilder, start_row_id: int,
     ):
         # we materialize the input slots
@@ -37,45 +47,58 @@ class InMemoryDataNode(ExecNode):
         self.tbl = tbl
         self.input_rows = rows
         self.start_row_id = start_row_id
-        self.output_rows = None
 
     def _open(self) -> None:
-        """Create row batch and populate with self.input_rows"""
-        user_cols_by_name = {
+        self.user_cols_by_name = {
             col_ref.col.name: exprs.ColumnSlotIdx(col_ref.col, col_ref.slot_idx)
             for col_ref in self.output_exprs if col_ref.col.name is not None
         }
-        output_cols_by_idx = {
-            col_ref.slot_idx: exprs.ColumnSlotIdx(col_ref.col, col_ref.slot_idx)
-            for col_ref in self.output_exprs
-        }
-        output_slot_idxs = {e.slot_idx for e in self.output_exprs}
+        self.output_slot_idxs = {e.slot_idx for e in self.output_exprs}
+        if isinstance(self.input_rows, list):
+            self.ctx.num_rows = len(self.input_rows)
 
-        self.output_rows = DataRowBatch(self.tbl, self.row_builder, len(self.input_rows))
-        for row_idx, input_row in enumerate(self.input_rows):
-            # populate the output row with the values provided in the input row
-            input_slot_idxs: set[int] = set()
-            for col_name, val in input_row.items():
-                col_info = user_cols_by_name.get(col_name)
-                assert col_info is not None
+    def _populate_row(self, output_row: exprs.DataRow, input_row: dict[str, Any]) -> None:
+        # populate the output row with the values provided in the input row
+        input_slot_idxs: set[int] = set()
+        for col_name, val in input_row.items():
+            col_info = self.user_cols_by_name.get(col_name)
+            assert col_info is not None
 
-                if col_info.col.col_type.is_image_type() and isinstance(val, bytes):
-                    # this is a literal image, ie, a sequence of bytes; we save this as a media file and store the path
-                    path = str(MediaStore.prepare_media_path(self.tbl.id, col_info.col.id, self.tbl.version))
-                    open(path, 'wb').write(val)
-                    val = path
-                self.output_rows[row_idx][col_info.slot_idx] = val
-                input_slot_idxs.add(col_info.slot_idx)
+            if col_info.col.col_type.is_image_type() and isinstance(val, bytes):
+                # this is a literal image, ie, a sequence of bytes; we save this as a media file and store the path
+                path = str(MediaStore.prepare_media_path(self.tbl.id, col_info.col.id, self.tbl.version))
+                open(path, 'wb').write(val)
+                val = path
+            output_row[col_info.slot_idx] = val
+            input_slot_idxs.add(col_info.slot_idx)
 
-            # set the remaining output slots to their default values (presently None)
-            missing_slot_idxs =  output_slot_idxs - input_slot_idxs
-            for slot_idx in missing_slot_idxs:
-                col_info = output_cols_by_idx.get(slot_idx)
-                assert col_info is not None
-                self.output_rows[row_idx][col_info.slot_idx] = None
+        # set the remaining output slots to their default values (presently None)
+        for slot_idx in self.output_slot_idxs - input_slot_idxs:
+            output_row[slot_idx] = None
 
-        self.ctx.num_rows = len(self.output_rows)
+    async def _input_row_iter(self) -> AsyncIterator[dict[str, Any]]:
+        if isinstance(self.input_rows, AsyncIterable):
+            async for input_row in self.input_rows:
+                yield input_row
+        else:
+            for input_row in self.input_rows:
+                yield input_row
 
     async def __aiter__(self) -> AsyncIterator[DataRowBatch]:
-        _logger.debug(f'InMemoryDataNode: created row batch with {len(self.output_rows)} output_rows')
-        yield self.output_rows
+        num_rows = 0
+        output_batch: Optional[DataRowBatch] = None
+        async for input_row in self._input_row_iter():
+            if output_batch is None:
+                output_batch = DataRowBatch(self.tbl, self.row_builder, capacity=self.__OUTPUT_BATCH_SIZE)
+            self._populate_row(output_batch.add_row(), input_row)
+            num_rows += 1
+            if len(output_batch) == self.__OUTPUT_BATCH_SIZE:
+                _logger.debug(f'InMemoryDataNode: created row batch with {len(output_batch)} output_rows')
+                yield output_batch
+                output_batch = None
+        if num_rows == 0:
+            # a list of rows is checked up front (see InsertableTable.insert()); this catches empty streams
+            raise excs.Error('rows must not be empty')
+        if output_batch is not None:
+            _logger.debug(f'InMemoryDataNode: created row batch with {len(output_batch)} output_rows')
+            yield output_batch
@@ -0,0 +1,78 @@
+import logging
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+import pixeltable.catalog as catalog
+import pixeltable.exprs as exprs
+
+from .data_row_batch import DataRowBatch
+from .exec_node import ExecNode
+
+_logger = logging.getLogger('pixeltable')
+
+
+class SharedRowsNode(ExecNode):
+    """
+    Outputs the rows of batches that were produced by a different plan with a different RowBuilder (the shared scan of
+    an insert propagation, see Planner.create_shared_view_load_plan()).
+
+    Copies the slots of output_exprs (values, exceptions and files) from the input rows; input rows that don't satisfy
+    the predicate are skipped.
+    """
+    tbl: catalog.TableVersion
+    input_batches: list[DataRowBatch]
+    input_slot_idxs: np.ndarray  # of int; slot idxs of output_exprs in the input rows
+    output_slot_idxs: np.ndarray  # of int
+    predicate_slot_idx: Optional[int]  # slot idx of the predicate in the input rows
+
+    __OUTPUT_BATCH_SIZE = 1024
+
+    def __init__(
+        self, tbl: catalog.TableVersion, row_builder: exprs.RowBuilder, output_exprs: list[exprs.Expr],
+        input_row_builder: exprs.RowBuilder, input_batches: list[DataRowBatch],
+        predicate: Optional[exprs.Expr] = None
+    ):
+        super().__init__(row_builder, output_exprs, [], None)
+        self.tbl = tbl
+        self.input_batches = input_batches
+        self.input_slot_idxs = np.array([input_row_builder.unique_exprs[e].slot_idx for e in output_exprs], dtype=int)
+        self.output_slot_idxs = np.array([e.slot_idx for e in output_exprs], dtype=int)
+        self.predicate_slot_idx = (
+            input_row_builder.unique_exprs[predicate].slot_idx if predicate is not None else None
+        )
+
+    def _satisfies_predicate(self, input_row: exprs.DataRow) -> bool:
+        if self.predicate_slot_idx is None:
+            return True
+        # NULL and errors don't satisfy the predicate, as in a SQL WHERE clause
+        idx = self.predicate_slot_idx
+        return bool(input_row.has_val[idx] and input_row.excs[idx] is None and input_row.vals[idx])
+
+    def _copy_row(self, input_row: exprs.DataRow, output_row: exprs.DataRow) -> None:
+        src, dst = self.input_slot_idxs, self.output_slot_idxs
+        output_row.vals[dst] = input_row.vals[src]
+        output_row.has_val[dst] = input_row.has_val[src]
+        output_row.excs[dst] = input_row.excs[src]
+        output_row.file_urls[dst] = input_row.file_urls[src]
+        output_row.file_paths[dst] = input_row.file_paths[src]
+        output_row.pk = input_row.pk
+        if input_row.has_exc():
+            # the dependents of the copied exceptions are computed by this plan and need to see the exceptions
+            for slot_idx in dst[output_row.excs[dst] != None]:
+                self.row_builder.propagate_exc(output_row, int(slot_idx))
+
+    async def __aiter__(self) -> AsyncIterator[DataRowBatch]:
+        output_batch = DataRowBatch(self.tbl, self.row_builder, capacity=self.__OUTPUT_BATCH_SIZE)
+        for input_batch in self.input_batches:
+            for input_row in input_batch:
+                if not self._satisfies_predicate(input_row):
+                    continue
+                self._copy_row(input_row, output_batch.add_row())
+                if len(output_batch) == self.__OUTPUT_BATCH_SIZE:
+                    _logger.debug(f'SharedRowsNode: returning {len(output_batch)} rows')
+                    yield output_batch
+                    output_batch = DataRowBatch(self.tbl, self.row_builder, capacity=self.__OUTPUT_BATCH_SIZE)
+        if len(output_batch) > 0:
+            _logger.debug(f'SharedRowsNode: returning {len(output_batch)} rows')
+            yield output_batch
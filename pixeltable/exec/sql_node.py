@@ -1,9 +1,12 @@
+import dataclasses
+import enum
 import logging
 import warnings
 from decimal import Decimal
-from typing import Iterable, Iterator, NamedTuple, Optional, TYPE_CHECKING, Sequence, AsyncIterator
+from typing import Any, Iterable, Iterator, NamedTuple, Optional, TYPE_CHECKING, Sequence, AsyncIterator
 from uuid import UUID
 
+import numpy as np
 import sqlalchemy as sql
 
 import pixeltable.catalog as catalog
@@ -59,6 +62,33 @@ def print_order_by_clause(clause: OrderByClause) -> str:
     ])
 
 
+@dataclasses.dataclass
+class FilteredSimilaritySearch:
+    """How a similarity search (ORDER BY similarity LIMIT k) with a SQL filter uses the embedding index"""
+
+    class Strategy(enum.Enum):
+        # filter the rows returned by the index scan; the index search parameter is raised to num_candidates
+        INDEX = 0
+        # retrieve num_candidates rows via the index, filter them and re-rank the remaining rows; if that returns
+        # fewer than k rows, repeat with more candidates (and eventually fall back to an exact search)
+        OVERFETCH = 1
+        # filter first, then compute the distances of all remaining rows (the index isn't used)
+        EXACT = 2
+
+    strategy: Strategy
+    selectivity: Optional[float]  # estimated fraction of rows that pass the filter; None: there is no estimate
+    num_rows: Optional[int]  # estimated number of rows before filtering
+    num_candidates: int  # (initial) number of rows retrieved via the index; unused for EXACT
+
+    def __str__(self) -> str:
+        if self.selectivity is None:
+            return f'{self.strategy.name.lower()} (no estimated selectivity)'
+        s = f'{self.strategy.name.lower()} (estimated selectivity {self.selectivity:.4f} of {self.num_rows} rows'
+        if self.strategy != self.Strategy.EXACT:
+            s += f', {self.num_candidates} candidates'
+        return s + ')'
+
+
 class SqlNode(ExecNode):
     """
     Materializes data from the store via a Select stmt.
@@ -81,6 +111,16 @@ class SqlNode(ExecNode):
     order_by_clause: OrderByClause
     limit: Optional[int]
 
+    # batched similarity search (see set_similarity_queries()): a subquery with one row per query embedding and,
+    # during execution, the query index of each returned row
+    similarity_queries: Optional[sql.Subquery]
+    query_idxs: list[int]
+    # the strategy for a similarity search with a filter, as determined by the Planner
+    filtered_search: Optional[FilteredSimilaritySearch]
+
+    # number of rows fetched from the result cursor at a time if the ExecContext doesn't specify a batch size
+    __FETCH_SIZE = 1024
+
     def __init__(
             self, tbl: Optional[catalog.TableVersionPath], row_builder: exprs.RowBuilder,
             select_list: Iterable[exprs.Expr], sql_elements: exprs.SqlElementCache, set_pk: bool = False
@@ -127,6 +167,9 @@ class SqlNode(ExecNode):
         self.where_clause = None
         self.where_clause_element = None
         self.order_by_clause = []
+        self.similarity_queries = None
+        self.query_idxs = []
+        self.filtered_search = None
 
     def _create_stmt(self) -> sql.Select:
         """Create Select from local state"""
@@ -143,10 +186,35 @@ class SqlNode(ExecNode):
         )
         if where_clause_element is not None:
             stmt = stmt.where(where_clause_element)
+        sim_expr = self._similarity_ordering()
+        query_embedding = self.similarity_queries.c.query_embedding if self.similarity_queries is not None else None
+        if sim_expr is not None and self.py_filter is None and self.limit is not None:
+            assert self.tbl is not None
+            candidates_clause: Optional[sql.ColumnElement] = None
+            if where_clause_element is None:
+                # the index might only be usable for retrieving candidates
+                candidates_clause = sim_expr.candidates_clause(self.tbl, self.limit, embedding=query_embedding)
+            elif self._is_overfetch():
+                # the filter is applied to the candidates
+                candidates_clause = sim_expr.candidates_clause(
+                    self.tbl, self.limit, embedding=query_embedding,
+                    num_candidates=self.filtered_search.num_candidates)
+            if candidates_clause is not None:
+                stmt = stmt.where(candidates_clause)
+        hybrid_expr = self._hybrid_ordering()
+        if hybrid_expr is not None and where_clause_element is None and self.py_filter is None \
+                and self.limit is not None:
+            # the ranks are computed over the best matches of each ranking only
+            assert self.tbl is not None
+            hybrid_candidates = hybrid_expr.candidates_clause(self.tbl, self.limit)
+            if hybrid_candidates is not None:
+                stmt = stmt.where(hybrid_candidates)
 
         order_by_clause: list[sql.ColumnElement] = []
         for e, asc in self.order_by_clause:
-            if isinstance(e, exprs.SimilarityExpr):
+            if e is sim_expr and query_embedding is not None:
+                order_by_clause.append(e.as_order_by_clause(asc, embedding=query_embedding))
+            elif isinstance(e, (exprs.SimilarityExpr, exprs.TextMatchExpr)):
                 order_by_clause.append(e.as_order_by_clause(asc))
             else:
                 order_by_clause.append(self.sql_elements.get(e).desc() if asc is False else self.sql_elements.get(e))
@@ -158,6 +226,60 @@ class SqlNode(ExecNode):
 
         return stmt
 
+    def supports_similarity_queries(self, limit: int) -> bool:
+        """Returns True if the query can be run for multiple query embeddings with set_similarity_queries()"""
+        # an over-fetching search might need to be repeated, which we only do for individual queries
+        sim_expr = self._similarity_ordering()
+        return sim_expr is not None and self.limit == limit and self.py_filter is None \
+            and self.cte is None and not self._is_overfetch() and sim_expr.idx_info.idx.supports_sql_query_embeddings()
+
+    def is_filtered_similarity_search(self) -> bool:
+        """Returns True if this is a similarity search (ORDER BY similarity LIMIT k) with a filter in SQL only"""
+        return self._similarity_ordering() is not None and self.limit is not None and self.py_filter is None \
+            and (self.where_clause is not None or self.where_clause_element is not None)
+
+    def set_filtered_search(self, filtered_search: FilteredSimilaritySearch) -> None:
+        assert self.is_filtered_similarity_search()
+        self.filtered_search = filtered_search
+
+    def _is_overfetch(self) -> bool:
+        return self.filtered_search is not None \
+            and self.filtered_search.strategy == FilteredSimilaritySearch.Strategy.OVERFETCH
+
+    def set_similarity_queries(self, embeddings: list[np.ndarray]) -> None:
+        """
+        Run the query once for each of the embeddings, which take the place of the query item of the similarity()
+        expr that determines the ordering; each query returns up to self.limit rows.
+
+        All queries are run by a single statement that joins a list of the embeddings laterally with the query.
+        The rows are returned grouped by query, in the order of the embeddings; query_idxs records the query of
+        each returned row.
+        """
+        assert self.limit is not None and self.supports_similarity_queries(self.limit)
+        sim_expr = self._similarity_ordering()
+        col_type = sim_expr.idx_info.idx.index_col_type
+        self.similarity_queries = sql.union_all(*[
+            sql.select(
+                sql.literal(i).label('query_idx'),
+                sql.cast(sql.bindparam(None, embedding, type_=col_type), col_type).label('query_embedding'))
+            for i, embedding in enumerate(embeddings)
+        ]).subquery('similarity_queries')
+        # the similarity values in the select list are those of each row's query
+        self.sql_elements = exprs.SqlElementCache(exprs.ExprDict(
+            [(sim_expr, sim_expr.similarity_clause(self.similarity_queries.c.query_embedding))]))
+
+    def _similarity_ordering(self) -> Optional[exprs.SimilarityExpr]:
+        """Returns the SimilarityExpr that determines the ordering, if any"""
+        if len(self.order_by_clause) == 0 or not isinstance(self.order_by_clause[0].expr, exprs.SimilarityExpr):
+            return None
+        return self.order_by_clause[0].expr
+
+    def _hybrid_ordering(self) -> Optional[exprs.HybridRankExpr]:
+        """Returns the HybridRankExpr that determines the ordering, if any"""
+        if len(self.order_by_clause) == 0 or not isinstance(self.order_by_clause[0].expr, exprs.HybridRankExpr):
+            return None
+        return self.order_by_clause[0].expr
+
     def _ordering_tbl_ids(self) -> set[UUID]:
         return exprs.Expr.all_tbl_ids(e for e, _ in self.order_by_clause)
 
@@ -229,6 +351,9 @@ class SqlNode(ExecNode):
                 stmt = stmt \
                     .where(tbl.store_tbl.v_min_col <= tbl.version) \
                     .where(tbl.store_tbl.v_max_col > tbl.version)
+                if not tbl.is_snapshot:
+                    # equivalent for the current version, and required for using the indices (which are partial)
+                    stmt = stmt.where(tbl.store_tbl.live_rows_clause())
             prev_tbl = tbl
         return stmt
 
@@ -236,6 +361,13 @@ class SqlNode(ExecNode):
         assert self.where_clause_element is None
         self.where_clause = where_clause
 
+    def set_rowid_range(self, start: int, end: int) -> None:
+        """Restrict the output to rows of self.tbl whose (first) rowid is in [start, end)"""
+        assert self.tbl is not None
+        assert self.where_clause is None and self.where_clause_element is None
+        rowid_col = self.tbl.tbl_version.store_tbl.rowid_columns()[0]
+        self.where_clause_element = sql.and_(rowid_col >= start, rowid_col < end)
+
     def set_py_filter(self, py_filter: exprs.Expr) -> None:
         assert self.py_filter is None
         self.py_filter = py_filter
@@ -254,16 +386,97 @@ class SqlNode(ExecNode):
     def set_limit(self, limit: int) -> None:
         self.limit = limit
 
+    def _join_similarity_queries(self, stmt: sql.Select) -> sql.Select:
+        """
+        Turns stmt (which computes the result for a single query embedding) into a lateral subquery that is joined
+        to the list of query embeddings
+        """
+        order_by = list(stmt._order_by_clauses)
+        # the rank within each query's result, which preserves the ordering in the outer query
+        per_query = stmt.add_columns(sql.func.row_number().over(order_by=order_by).label('query_rank')).lateral()
+        per_query_cols = list(per_query.c)
+        return (
+            sql.select(*per_query_cols[:-1], self.similarity_queries.c.query_idx)
+            .select_from(self.similarity_queries.join(per_query, sql.true()))
+            .order_by(self.similarity_queries.c.query_idx, per_query_cols[-1])
+        )
+
+    def _search_settings(self) -> dict[str, str]:
+        """Returns the Postgres settings for the query"""
+        sim_expr = self._similarity_ordering()
+        if sim_expr is None:
+            hybrid_expr = self._hybrid_ordering()
+            if hybrid_expr is None or self.where_clause_element is not None or self.where_clause is not None \
+                    or self.py_filter is not None or self.limit is None:
+                return {}
+            return {name: str(val) for name, val in hybrid_expr.search_settings(self.limit).items()}
+        if self.filtered_search is None:
+            settings = sim_expr.search_settings(self.limit if self.py_filter is None else None)
+        elif self.filtered_search.strategy == FilteredSimilaritySearch.Strategy.EXACT:
+            # pgvector indices only support (ordered) index scans; other indices remain usable via bitmap scans
+            return {'enable_indexscan': 'off'}
+        else:
+            settings = sim_expr.search_settings(self.limit, num_candidates=self.filtered_search.num_candidates)
+        return {name: str(val) for name, val in settings.items()}
+
+    def _apply_search_settings(self) -> None:
+        # the settings only apply to the current transaction
+        for name, val in self._search_settings().items():
+            self.ctx.conn.execute(sql.text('SELECT set_config(:name, :val, true)'), {'name': name, 'val': val})
+
+    @classmethod
+    def _explain(cls, stmt: sql.Select, conn: sql.engine.Connection) -> list[str]:
+        from pixeltable.utils.sql import explain
+        return [row[0] for row in explain(stmt, conn)]
+
     def _log_explain(self, stmt: sql.Select) -> None:
         try:
-            # don't set dialect=Env.get().engine.dialect: x % y turns into x %% y, which results in a syntax error
-            stmt_str = str(stmt.compile(compile_kwargs={'literal_binds': True}))
-            explain_result = self.ctx.conn.execute(sql.text(f'EXPLAIN {stmt_str}'))
-            explain_str = '\n'.join([str(row) for row in explain_result])
+            explain_str = '\n'.join(self._explain(stmt, self.ctx.conn))
+            if self.filtered_search is not None:
+                explain_str = f'similarity search with filter: {self.filtered_search}\n{explain_str}'
             _logger.debug(f'SqlScanNode explain:\n{explain_str}')
         except Exception as e:
             _logger.warning(f'EXPLAIN failed with error: {e}')
 
+    def explain(self, conn: sql.engine.Connection) -> list[str]:
+        """Returns a description of the query: the choices made for similarity searches and the Postgres plan"""
+        lines: list[str] = []
+        if self.filtered_search is not None:
+            lines.append(f'similarity search with filter: {self.filtered_search}')
+        search_settings = self._search_settings()
+        if len(search_settings) > 0:
+            lines.append('settings: ' + ', '.join(f'{name}={val}' for name, val in search_settings.items()))
+        stmt = self._create_stmt()
+        if self.similarity_queries is not None:
+            stmt = self._join_similarity_queries(stmt)
+        for name, val in search_settings.items():
+            conn.execute(sql.text('SELECT set_config(:name, :val, true)'), {'name': name, 'val': val})
+        lines.extend(self._explain(stmt, conn))
+        return lines
+
+    def _execute_overfetch(self) -> sql.engine.Result:
+        """
+        Runs a filtered similarity search with the OVERFETCH strategy: the number of candidates is raised until the
+        query returns self.limit rows; beyond the maximum number of candidates, the search turns into an exact one
+        """
+        from pixeltable import index
+        assert self.filtered_search is not None and self.limit is not None
+        while True:
+            stmt = self._create_stmt()
+            self._apply_search_settings()
+            self._log_explain(stmt)
+            result = self.ctx.conn.execute(stmt).freeze()
+            if len(result.data) >= self.limit \
+                    or self.filtered_search.strategy == FilteredSimilaritySearch.Strategy.EXACT:
+                return result()
+            if self.filtered_search.num_candidates >= index.EmbeddingIndex.MAX_EF_SEARCH:
+                self.filtered_search.strategy = FilteredSimilaritySearch.Strategy.EXACT
+            else:
+                self.filtered_search.num_candidates = \
+                    min(2 * self.filtered_search.num_candidates, index.EmbeddingIndex.MAX_EF_SEARCH)
+            _logger.debug(
+                f'similarity search returned {len(result.data)} of {self.limit} rows, retrying: {self.filtered_search}')
+
     async def __aiter__(self) -> AsyncIterator[DataRowBatch]:
         # run the query; do this here rather than in _open(), exceptions are only expected during iteration
         assert self.ctx.conn is not None
@@ -275,61 +488,75 @@ class SqlNode(ExecNode):
                 _logger.debug(f'SqlLookupNode stmt:\n{stmt_str}')
             except Exception:
                 pass
-            self._log_explain(stmt)
-
-            result_cursor = self.ctx.conn.execute(stmt)
+            if self.similarity_queries is not None:
+                stmt = self._join_similarity_queries(stmt)
+            with self.ctx.conn_lock:
+                if self._is_overfetch():
+                    result_cursor = self._execute_overfetch()
+                else:
+                    self._apply_search_settings()
+                    self._log_explain(stmt)
+                    result_cursor = self.ctx.conn.execute(stmt)
             for warning in w:
                 pass
 
         tbl_version = self.tbl.tbl_version if self.tbl is not None else None
-        output_batch = DataRowBatch(tbl_version, self.row_builder)
-        output_row: Optional[exprs.DataRow] = None
+        fetch_size = self.ctx.batch_size if self.ctx.batch_size > 0 else self.__FETCH_SIZE
+        output_batch = DataRowBatch(tbl_version, self.row_builder, capacity=fetch_size)
         num_rows_returned = 0
+        # with batched similarity queries, the limit applies to each query
+        limit = self.limit if self.similarity_queries is None else None
+        num_select_cols = len(self.select_list)
+
+        while limit is None or num_rows_returned < limit:
+            num_requested = fetch_size - len(output_batch) if self.ctx.batch_size > 0 else fetch_size
+            if limit is not None:
+                num_requested = min(num_requested, limit - num_rows_returned)
+            with self.ctx.conn_lock:
+                sql_rows = result_cursor.fetchmany(num_requested)
+            if len(sql_rows) == 0:
+                break
 
-        for sql_row in result_cursor:
-            output_row = output_batch.add_row(output_row)
-
-            # populate output_row
+            # copy the output of the SQL query into the output batch, one column at a time
+            start_idx = len(output_batch)
+            output_batch.add_rows(len(sql_rows))
             if self.num_pk_cols > 0:
-                output_row.set_pk(tuple(sql_row[-self.num_pk_cols:]))
-            # copy the output of the SQL query into the output row
+                for output_row, sql_row in zip(output_batch.rows[start_idx:], sql_rows):
+                    output_row.set_pk(tuple(sql_row[num_select_cols:num_select_cols + self.num_pk_cols]))
+            if self.similarity_queries is not None:
+                self.query_idxs.extend(sql_row[-1] for sql_row in sql_rows)
             for i, e in enumerate(self.select_list):
-                slot_idx = e.slot_idx
-                # certain numerical operations can produce Decimals (eg, SUM(<int column>)); we need to convert them
-                if isinstance(sql_row[i], Decimal):
-                    if e.col_type.is_int_type():
-                        output_row[slot_idx] = int(sql_row[i])
-                    elif e.col_type.is_float_type():
-                        output_row[slot_idx] = float(sql_row[i])
-                    else:
-                        raise RuntimeError(f'Unexpected Decimal value for {e}')
-                else:
-                    output_row[slot_idx] = sql_row[i]
+                output_batch.set_slot_vals(
+                    e.slot_idx, self._convert_decimals(e, [sql_row[i] for sql_row in sql_rows]), start=start_idx)
 
             if self.py_filter is not None:
-                # evaluate filter
-                self.row_builder.eval(output_row, self.py_filter_eval_ctx, profile=self.ctx.profile)
-            if self.py_filter is not None and not output_row[self.py_filter.slot_idx]:
-                # we re-use this row for the next sql row since it didn't pass the filter
-                output_row = output_batch.pop_row()
-                output_row.clear()
-            else:
-                # reset output_row in order to add new one
-                output_row = None
-                num_rows_returned += 1
-
-            if self.limit is not None and num_rows_returned == self.limit:
-                break
+                # evaluate filter and drop the rows that didn't pass it
+                for output_row in output_batch.rows[start_idx:]:
+                    self.row_builder.eval(output_row, self.py_filter_eval_ctx, profile=self.ctx.profile)
+                filter_vals = output_batch.slot_vals(self.py_filter.slot_idx)[start_idx:]
+                output_batch.retain(filter_vals.astype(bool), start=start_idx)
+            num_rows_returned += len(output_batch) - start_idx
 
             if self.ctx.batch_size > 0 and len(output_batch) == self.ctx.batch_size:
                 _logger.debug(f'SqlScanNode: returning {len(output_batch)} rows')
                 yield output_batch
-                output_batch = DataRowBatch(tbl_version, self.row_builder)
+                output_batch = DataRowBatch(tbl_version, self.row_builder, capacity=fetch_size)
 
         if len(output_batch) > 0:
             _logger.debug(f'SqlScanNode: returning {len(output_batch)} rows')
             yield output_batch
 
+    @classmethod
+    def _convert_decimals(cls, e: exprs.Expr, vals: list[Any]) -> list[Any]:
+        """Certain numerical operations can produce Decimals (eg, SUM(<int column>)); we need to convert them"""
+        if not any(isinstance(val, Decimal) for val in vals):
+            return vals
+        if e.col_type.is_int_type():
+            return [int(val) if isinstance(val, Decimal) else val for val in vals]
+        if e.col_type.is_float_type():
+            return [float(val) if isinstance(val, Decimal) else val for val in vals]
+        raise RuntimeError(f'Unexpected Decimal value for {e}')
+
     def _close(self) -> None:
         if self.result_cursor is not None:
             self.result_cursor.close()
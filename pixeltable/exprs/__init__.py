@@ -9,6 +9,7 @@ from .expr import Expr
 from .expr_dict import ExprDict
 from .expr_set import ExprSet
 from .function_call import FunctionCall
+from .hybrid_rank_expr import HybridRankExpr
 from .in_predicate import InPredicate
 from .inline_expr import InlineArray, InlineDict, InlineList
 from .is_null import IsNull
@@ -21,6 +22,7 @@ from .row_builder import RowBuilder, ColumnSlotIdx, ExecProfile
 from .rowid_ref import RowidRef
 from .similarity_expr import SimilarityExpr
 from .sql_element_cache import SqlElementCache
+from .text_match_expr import TextMatchExpr
 from .type_cast import TypeCast
 from .variable import Variable
 from .globals import ComparisonOperator, LogicalOperator, ArithmeticOperator
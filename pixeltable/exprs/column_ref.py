@@ -119,9 +119,30 @@ class ColumnRef(Expr):
 
         return super().__getattr__(name)
 
-    def similarity(self, item: Any, *, idx: Optional[str] = None) -> Expr:
+    def similarity(
+        self, item: Any, *, idx: Optional[str] = None, ef_search: Optional[int] = None, probes: Optional[int] = None,
+        rerank_factor: Optional[int] = None
+    ) -> Expr:
         from .similarity_expr import SimilarityExpr
-        return SimilarityExpr(self, item, idx_name=idx)
+        search_params = {'ef_search': ef_search, 'probes': probes, 'rerank_factor': rerank_factor}
+        return SimilarityExpr(
+            self, item, idx_name=idx, search_params={k: v for k, v in search_params.items() if v is not None})
+
+    def text_match(self, query: str, *, idx: Optional[str] = None) -> Expr:
+        from .text_match_expr import TextMatchExpr
+        return TextMatchExpr(self, query, idx_name=idx)
+
+    def hybrid_rank(
+        self, query: str, *, text_idx: Optional[str] = None, embedding_idx: Optional[str] = None,
+        text_weight: float = 1.0, embedding_weight: float = 1.0, rrf_k: Optional[int] = None
+    ) -> Expr:
+        from .hybrid_rank_expr import HybridRankExpr
+        from .similarity_expr import SimilarityExpr
+        from .text_match_expr import TextMatchExpr
+        return HybridRankExpr(
+            TextMatchExpr(self, query, idx_name=text_idx), SimilarityExpr(self, query, idx_name=embedding_idx),
+            text_weight=text_weight, embedding_weight=embedding_weight,
+            rrf_k=HybridRankExpr.DEFAULT_RRF_K if rrf_k is None else rrf_k)
 
     def default_column_name(self) -> Optional[str]:
         return str(self)
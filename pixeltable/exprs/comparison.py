@@ -12,6 +12,7 @@ from .column_ref import ColumnRef
 from .data_row import DataRow
 from .expr import Expr
 from .globals import ComparisonOperator
+from .json_path import JsonPath
 from .literal import Literal
 from .row_builder import RowBuilder
 from .sql_element_cache import SqlElementCache
@@ -67,6 +68,9 @@ class Comparison(Expr):
         return self.components[1]
 
     def sql_expr(self, sql_elements: SqlElementCache) -> Optional[sql.ColumnElement]:
+        if isinstance(self._op1, JsonPath):
+            return self._json_path_clause()
+
         if str(self._op1.col_type.to_sa_type()) != str(self._op2.col_type.to_sa_type()):
             # Comparing columns of different SQL types (e.g., string vs. json); this can only be done in Python
             # TODO(aaron-siegel): We may be able to handle some cases in SQL by casting one side to the other's type
@@ -102,6 +106,27 @@ class Comparison(Expr):
         if self.operator == ComparisonOperator.GE:
             return left >= right
 
+    def _json_path_clause(self) -> Optional[sql.ColumnElement]:
+        """Returns a predicate that uses an index on the path, if this is <path> == <literal> for an indexed path"""
+        path = self._op1
+        assert isinstance(path, JsonPath)
+        if self.operator != ComparisonOperator.EQ or not isinstance(self._op2, Literal) \
+                or not isinstance(path._anchor, ColumnRef):
+            return None
+        col = path._anchor.col
+        if col.tbl.is_snapshot:
+            # indices don't apply to snapshots
+            return None
+        for info in col.get_idx_info().values():
+            if isinstance(info.idx, index.JsonPathIndex) and info.idx.matches(path):
+                clause = info.idx.eq_clause(info.val_col, self._op2.val)
+                if clause is not None:
+                    # the index value is NULL if the path is missing or its value isn't indexed, for which the
+                    # comparison is False in Python; make that explicit, so that it's also False under NOT
+                    # (an IS NOT NULL conjunct, rather than coalesce(), still lets Postgres use the index)
+                    return sql.and_(info.val_col.sa_col.is_not(None), clause)
+        return None
+
     def eval(self, data_row: DataRow, row_builder: RowBuilder) -> None:
         left = data_row[self._op1.slot_idx]
         right = data_row[self._op2.slot_idx]
@@ -32,6 +32,9 @@ class DataRow:
     - ArrayType: numpy.ndarray
     - ImageType: PIL.Image.Image
     - VideoType: local path if available, otherwise url
+
+    A DataRow either owns its arrays or is a view of one row of the columnar storage of a DataRowBatch (see bind()).
+    Methods that modify the row's state therefore update the arrays in place rather than replacing them.
     """
 
     vals: np.ndarray  # of object
@@ -68,6 +71,21 @@ class DataRow:
         self.array_slot_idxs = array_slot_idxs
         self.init(size)
 
+    @classmethod
+    def view(
+        cls, img_slot_idxs: list[int], media_slot_idxs: list[int], array_slot_idxs: list[int],
+        vals: np.ndarray, has_val: np.ndarray, excs: np.ndarray, missing_slots: np.ndarray,
+        missing_dependents: np.ndarray, is_scheduled: np.ndarray, file_urls: np.ndarray, file_paths: np.ndarray
+    ) -> DataRow:
+        """Create a DataRow that doesn't allocate its own arrays but uses the given ones (see bind())"""
+        row = cls.__new__(cls)
+        row.img_slot_idxs = img_slot_idxs
+        row.media_slot_idxs = media_slot_idxs
+        row.array_slot_idxs = array_slot_idxs
+        row.pk = None
+        row.bind(vals, has_val, excs, missing_slots, missing_dependents, is_scheduled, file_urls, file_paths)
+        return row
+
     def init(self, num_slots: int) -> None:
         self.vals = np.full(num_slots, None, dtype=object)
         self.has_val = np.zeros(num_slots, dtype=bool)
@@ -79,6 +97,20 @@ class DataRow:
         self.file_urls = np.full(num_slots, None, dtype=object)
         self.file_paths = np.full(num_slots, None, dtype=object)
 
+    def bind(
+        self, vals: np.ndarray, has_val: np.ndarray, excs: np.ndarray, missing_slots: np.ndarray,
+        missing_dependents: np.ndarray, is_scheduled: np.ndarray, file_urls: np.ndarray, file_paths: np.ndarray
+    ) -> None:
+        """Use the given arrays (typically row views of a DataRowBatch's columnar storage) as this row's state"""
+        self.vals = vals
+        self.has_val = has_val
+        self.excs = excs
+        self.missing_slots = missing_slots
+        self.missing_dependents = missing_dependents
+        self.is_scheduled = is_scheduled
+        self.file_urls = file_urls
+        self.file_paths = file_paths
+
     def clear(self, idxs: Optional[np.ndarray] = None) -> None:
         if idxs is not None:
             self.has_val[idxs] = False
@@ -87,7 +119,16 @@ class DataRow:
             self.file_urls[idxs] = None
             self.file_paths[idxs] = None
         else:
-            self.init(len(self.vals))
+            # reset in place: the arrays might be views of a DataRowBatch's storage
+            self.vals[:] = None
+            self.has_val[:] = False
+            self.excs[:] = None
+            self.missing_slots[:] = False
+            self.missing_dependents[:] = 0
+            self.is_scheduled[:] = False
+            self.pk = None
+            self.file_urls[:] = None
+            self.file_paths[:] = None
 
     def set_file_path(self, idx: int, path: str) -> None:
         """Augment an existing url with a local file path"""
@@ -102,12 +143,13 @@ class DataRow:
         The copy shares the cell values, but not the control structures (eg, self.has_val), because these
         need to be independently updateable.
         """
-        target.vals = self.vals.copy()
-        target.has_val = self.has_val.copy()
-        target.excs = self.excs.copy()
+        assert len(target.vals) == len(self.vals)
+        target.vals[:] = self.vals
+        target.has_val[:] = self.has_val
+        target.excs[:] = self.excs
         target.pk = self.pk
-        target.file_urls = self.file_urls.copy()
-        target.file_paths = self.file_paths.copy()
+        target.file_urls[:] = self.file_urls
+        target.file_paths[:] = self.file_paths
 
     def set_pk(self, pk: tuple[int, ...]) -> None:
         self.pk = pk
@@ -0,0 +1,118 @@
+from typing import Optional
+
+import sqlalchemy as sql
+
+import pixeltable.exceptions as excs
+import pixeltable.type_system as ts
+from pixeltable import catalog
+
+from .data_row import DataRow
+from .expr import Expr
+from .row_builder import RowBuilder
+from .similarity_expr import SimilarityExpr
+from .sql_element_cache import SqlElementCache
+from .text_match_expr import TextMatchExpr
+
+
+class HybridRankExpr(Expr):
+    """
+    Fuses the keyword ranking of a full-text match and the ranking by embedding similarity with Reciprocal Rank
+    Fusion (RRF), in SQL: the score of a row is
+        text_weight / (rrf_k + <rank by relevance>) + embedding_weight / (rrf_k + <rank by similarity>),
+    where the ranks are computed with window functions over the rows of the query; rows that don't match the text
+    query don't get a keyword score.
+    - higher scores are better; order by it with asc=False
+    - for ORDER BY ... LIMIT k queries without a filter, the rows are restricted to the k * CANDIDATES_FACTOR best
+      matches of each ranking (candidates_clause()); otherwise, all rows are ranked
+    """
+
+    DEFAULT_RRF_K = 60
+    CANDIDATES_FACTOR = 4
+
+    text_weight: float
+    embedding_weight: float
+    rrf_k: int
+
+    def __init__(
+        self, text_match: TextMatchExpr, similarity: SimilarityExpr, text_weight: float = 1.0,
+        embedding_weight: float = 1.0, rrf_k: int = DEFAULT_RRF_K
+    ):
+        super().__init__(ts.FloatType())
+        if text_weight < 0 or embedding_weight < 0:
+            raise excs.Error('hybrid_rank(): weights must be non-negative')
+        if rrf_k < 0:
+            raise excs.Error(f'hybrid_rank(): rrf_k must be non-negative, not {rrf_k}')
+        self.components = [text_match, similarity]
+        self.text_weight = float(text_weight)
+        self.embedding_weight = float(embedding_weight)
+        self.rrf_k = rrf_k
+        self.id = self._create_id()
+
+    def __repr__(self) -> str:
+        return f'hybrid_rank({self.components[0]}, {self.components[1]})'
+
+    def _id_attrs(self):
+        return super()._id_attrs() + [
+            ('text_weight', self.text_weight), ('embedding_weight', self.embedding_weight), ('rrf_k', self.rrf_k)]
+
+    def _equals(self, other: 'HybridRankExpr') -> bool:
+        return self.text_weight == other.text_weight and self.embedding_weight == other.embedding_weight \
+            and self.rrf_k == other.rrf_k
+
+    def default_column_name(self) -> str:
+        return 'hybrid_rank'
+
+    @property
+    def text_match(self) -> TextMatchExpr:
+        assert isinstance(self.components[0], TextMatchExpr)
+        return self.components[0]
+
+    @property
+    def similarity(self) -> SimilarityExpr:
+        assert isinstance(self.components[1], SimilarityExpr)
+        return self.components[1]
+
+    def sql_expr(self, _: SqlElementCache) -> Optional[sql.ColumnElement]:
+        is_match = self.text_match.sql_expr(_)
+        text_pos = sql.func.rank().over(partition_by=is_match, order_by=self.text_match.rank_clause().desc())
+        text_score = sql.case(
+            (is_match, sql.literal(self.text_weight, sql.Float) / (self.rrf_k + text_pos)), else_=0.0)
+        similarity_pos = sql.func.rank().over(order_by=self.similarity.as_order_by_clause(is_asc=False))
+        similarity_score = sql.literal(self.embedding_weight, sql.Float) / (self.rrf_k + similarity_pos)
+        return text_score + similarity_score
+
+    def num_candidates(self, limit: int) -> int:
+        return limit * self.CANDIDATES_FACTOR
+
+    def candidates_clause(self, tbl: 'catalog.TableVersionPath', limit: int) -> Optional[sql.ColumnElement]:
+        """
+        Returns a predicate that restricts a query against tbl to the best matches of either ranking, or None if the
+        embedding index is still being built
+        """
+        num_candidates = self.num_candidates(limit)
+        similarity_candidates = self.similarity.candidates_clause(tbl, limit, num_candidates=num_candidates)
+        if similarity_candidates is None:
+            return None
+        return sql.or_(self.text_match.candidates_clause(tbl, num_candidates), similarity_candidates)
+
+    def search_settings(self, limit: int) -> dict[str, int]:
+        """Returns the Postgres settings for retrieving the similarity candidates"""
+        return self.similarity.search_settings(None, num_candidates=self.num_candidates(limit))
+
+    def eval(self, data_row: DataRow, row_builder: RowBuilder) -> None:
+        raise excs.Error(f'{self}: hybrid_rank() can only be used in queries against the table')
+
+    def _as_dict(self) -> dict:
+        return {
+            'text_weight': self.text_weight, 'embedding_weight': self.embedding_weight, 'rrf_k': self.rrf_k,
+            **super()._as_dict()
+        }
+
+    @classmethod
+    def _from_dict(cls, d: dict, components: list[Expr]) -> 'HybridRankExpr':
+        assert len(components) == 2
+        assert isinstance(components[0], TextMatchExpr)
+        assert isinstance(components[1], SimilarityExpr)
+        return cls(
+            components[0], components[1], text_weight=d['text_weight'], embedding_weight=d['embedding_weight'],
+            rrf_k=d['rrf_k'])
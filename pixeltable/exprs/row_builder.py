@@ -23,6 +23,8 @@ class ExecProfile:
     def __init__(self, row_builder: RowBuilder):
         self.eval_time = [0.0] * row_builder.num_materialized
         self.eval_count = [0] * row_builder.num_materialized
+        # sequence of batch sizes chosen for adaptively batched function calls; empty for all other slots
+        self.batch_sizes: list[list[int]] = [[] for _ in range(row_builder.num_materialized)]
         self.row_builder = row_builder
 
     def print(self, num_rows: int) -> None:
@@ -33,6 +35,9 @@ class ExecProfile:
             calls_per_row = self.eval_count[i] / num_rows
             multiple_str = f'({calls_per_row}x)' if calls_per_row > 1 else ''
             Env.get().console_logger.info(f'{self.row_builder.unique_exprs[i]}: {utils.print_perf_counter_delta(per_call_time)} {multiple_str}')
+            if len(self.batch_sizes[i]) > 0:
+                sizes_str = ' -> '.join(str(size) for size in self.batch_sizes[i])
+                Env.get().console_logger.info(f'{self.row_builder.unique_exprs[i]}: batch sizes {sizes_str}')
 
 
 @dataclass
@@ -361,6 +366,14 @@ class RowBuilder:
         for slot_idx in self._exc_dependents[slot_idx]:
             data_row.set_exc(slot_idx, exc)
 
+    def propagate_exc(self, data_row: DataRow, slot_idx: int) -> None:
+        """Propagate the exception recorded for slot_idx to those of its dependents that don't have one yet"""
+        exc = data_row.get_exc(slot_idx)
+        assert exc is not None
+        for dependent_idx in self._exc_dependents[slot_idx]:
+            if data_row.excs[dependent_idx] is None:
+                data_row.set_exc(dependent_idx, exc)
+
     def eval(
             self, data_row: DataRow, ctx: EvalCtx, profile: Optional[ExecProfile] = None, ignore_errors: bool = False
     ) -> None:
@@ -1,9 +1,11 @@
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
+import numpy as np
 import sqlalchemy as sql
 
 import pixeltable.exceptions as excs
 import pixeltable.type_system as ts
+from pixeltable import catalog
 
 from .column_ref import ColumnRef
 from .data_row import DataRow
@@ -12,10 +14,18 @@ from .literal import Literal
 from .row_builder import RowBuilder
 from .sql_element_cache import SqlElementCache
 
+if TYPE_CHECKING:
+    from pixeltable import index
+
 
 class SimilarityExpr(Expr):
 
-    def __init__(self, col_ref: ColumnRef, item: Any, idx_name: Optional[str] = None):
+    search_params: dict[str, int]  # index search parameters, eg, ef_search for HNSW indices
+
+    def __init__(
+        self, col_ref: ColumnRef, item: Any, idx_name: Optional[str] = None,
+        search_params: Optional[dict[str, int]] = None
+    ):
         super().__init__(ts.FloatType())
         item_expr = Expr.from_object(item)
         if item_expr is None or not(item_expr.col_type.is_string_type() or item_expr.col_type.is_image_type()):
@@ -53,43 +63,85 @@ class SimilarityExpr(Expr):
             raise excs.Error(
                 f'Embedding index {self.idx_info.name!r} on column {self.idx_info.col.name!r} does not have an '
                 f"image embedding and does not support image queries")
+        self.search_params = dict(search_params) if search_params is not None else {}
+        idx.validate_search_params(self.search_params)
         self.id = self._create_id()
 
     def __repr__(self) -> str:
         return f'{self.components[0]}.similarity({self.components[1]})'
 
     def _id_attrs(self):
-        return super()._id_attrs() + [('idx_name', self.idx_info.name)]
+        return super()._id_attrs() + [('idx_name', self.idx_info.name), ('search_params', self.search_params)]
 
     def default_column_name(self) -> str:
         return 'similarity'
 
     def sql_expr(self, _: SqlElementCache) -> Optional[sql.ColumnElement]:
-        if not isinstance(self.components[1], Literal):
-             raise excs.Error(f'similarity(): requires a string or a PIL.Image.Image object, not an expression')
-        item = self.components[1].val
-        from pixeltable import index
-        assert isinstance(self.idx_info.idx, index.EmbeddingIndex)
-        return self.idx_info.idx.similarity_clause(self.idx_info.val_col, item)
+        return self.similarity_clause(self.embed())
 
-    def as_order_by_clause(self, is_asc: bool) -> Optional[sql.ColumnElement]:
+    def embed(self) -> np.ndarray:
+        """Returns the embedding of the query item"""
         if not isinstance(self.components[1], Literal):
             raise excs.Error(f'similarity(): requires a string or a PIL.Image.Image object, not an expression')
-        item = self.components[1].val
+        return self._idx.embed(self.components[1].val)
+
+    def similarity_clause(self, embedding: Any) -> sql.ColumnElement:
+        """
+        Returns the similarity between the indexed column and embedding, which is either an array or a
+        ColumnElement (eg, a column of query embeddings)
+        """
+        return self._idx.similarity_clause(self.idx_info.val_col, embedding)
+
+    def as_order_by_clause(self, is_asc: bool, embedding: Optional[Any] = None) -> Optional[sql.ColumnElement]:
+        if embedding is None:
+            embedding = self.embed()
+        return self._idx.order_by_clause(self.idx_info.val_col, embedding, is_asc)
+
+    def search_settings(self, limit: Optional[int], num_candidates: Optional[int] = None) -> dict[str, int]:
+        """Returns the Postgres settings for a query that orders by this expr"""
+        return self._idx.search_settings(self.search_params, limit, num_candidates=num_candidates)
+
+    def candidates_clause(
+        self, tbl: 'catalog.TableVersionPath', limit: int, embedding: Optional[Any] = None,
+        num_candidates: Optional[int] = None
+    ) -> Optional[sql.ColumnElement]:
+        """
+        Returns a predicate that restricts a query against tbl to the approximate nearest neighbors, if the index
+        can't be used in the ORDER BY clause directly or if num_candidates is given
+        (see EmbeddingIndex.candidates_clause()), and None while the index is still being built
+        """
+        tbl_version = self._tbl_version(tbl)
+        if not tbl_version.is_index_ready(self.idx_info.id):
+            # all rows are ranked by their exact distance
+            return None
+        if embedding is None:
+            embedding = self.embed()
+        return self._idx.candidates_clause(
+            self.idx_info.val_col, tbl_version, embedding, limit, self.search_params, num_candidates=num_candidates)
+
+    def is_index_ready(self, tbl: 'catalog.TableVersionPath') -> bool:
+        """False while the index structure is still being built (see TableVersion.is_index_ready())"""
+        return self._tbl_version(tbl).is_index_ready(self.idx_info.id)
+
+    def _tbl_version(self, tbl: 'catalog.TableVersionPath') -> 'catalog.TableVersion':
+        return next(tv for tv in tbl.get_tbl_versions() if tv.id == self.idx_info.val_col.tbl.id)
+
+    @property
+    def _idx(self) -> 'index.EmbeddingIndex':
         from pixeltable import index
         assert isinstance(self.idx_info.idx, index.EmbeddingIndex)
-        return self.idx_info.idx.order_by_clause(self.idx_info.val_col, item, is_asc)
+        return self.idx_info.idx
 
     def eval(self, data_row: DataRow, row_builder: RowBuilder) -> None:
         # this should never get called
         assert False
 
     def _as_dict(self) -> dict:
-        return {'idx_name': self.idx_info.name, **super()._as_dict()}
+        return {'idx_name': self.idx_info.name, 'search_params': self.search_params, **super()._as_dict()}
 
     @classmethod
     def _from_dict(cls, d: dict, components: list[Expr]) -> 'SimilarityExpr':
         iname = d['idx_name'] if 'idx_name' in d else None
         assert len(components) == 2
         assert isinstance(components[0], ColumnRef)
-        return cls(components[0], components[1], idx_name=iname)
+        return cls(components[0], components[1], idx_name=iname, search_params=d.get('search_params'))
@@ -0,0 +1,99 @@
+from typing import TYPE_CHECKING, Any, Optional
+
+import sqlalchemy as sql
+
+import pixeltable.exceptions as excs
+import pixeltable.type_system as ts
+from pixeltable import catalog
+
+from .column_ref import ColumnRef
+from .data_row import DataRow
+from .expr import Expr
+from .literal import Literal
+from .row_builder import RowBuilder
+from .sql_element_cache import SqlElementCache
+
+if TYPE_CHECKING:
+    from pixeltable import index
+
+
+class TextMatchExpr(Expr):
+    """
+    Full-text match of a string column against a query, via a full-text index on the column.
+    - as a predicate, it is true for the rows that match the query
+    - in an ORDER BY clause, it orders rows by their relevance for the query (as_order_by_clause())
+    """
+
+    def __init__(self, col_ref: ColumnRef, query: Any, idx_name: Optional[str] = None):
+        super().__init__(ts.BoolType())
+        query_expr = Expr.from_object(query)
+        if not isinstance(query_expr, Literal) or not query_expr.col_type.is_string_type():
+            raise excs.Error(f'text_match(): requires a string, not a {type(query)}')
+        self.components = [col_ref, query_expr]
+
+        # determine index to use
+        idx_info = col_ref.col.get_idx_info()
+        from pixeltable import index
+        text_idx_info = {
+            info.name: info for info in idx_info.values() if isinstance(info.idx, index.FullTextIndex)
+        }
+        if len(text_idx_info) == 0:
+            raise excs.Error(f'No full-text index found for column {col_ref.col.name!r}')
+        if idx_name is not None and idx_name not in text_idx_info:
+            raise excs.Error(f'Full-text index {idx_name!r} not found for column {col_ref.col.name!r}')
+        if len(text_idx_info) > 1:
+            if idx_name is None:
+                raise excs.Error(
+                    f'Column {col_ref.col.name!r} has multiple full-text indices; use the index name to disambiguate: '
+                    f'`{col_ref.col.name}.text_match(..., idx=<name>)`')
+            self.idx_info = text_idx_info[idx_name]
+        else:
+            self.idx_info = next(iter(text_idx_info.values()))
+        self.id = self._create_id()
+
+    def __repr__(self) -> str:
+        return f'{self.components[0]}.text_match({self.components[1]})'
+
+    def _id_attrs(self):
+        return super()._id_attrs() + [('idx_name', self.idx_info.name)]
+
+    def default_column_name(self) -> str:
+        return 'text_match'
+
+    @property
+    def query(self) -> str:
+        return self.components[1].val
+
+    def sql_expr(self, _: SqlElementCache) -> Optional[sql.ColumnElement]:
+        return self._idx.match_clause(self.idx_info.val_col, self.query)
+
+    def rank_clause(self) -> sql.ColumnElement:
+        """Returns the relevance of the rows for the query (higher is more relevant)"""
+        return self._idx.rank_clause(self.idx_info.val_col, self.query)
+
+    def as_order_by_clause(self, is_asc: bool) -> sql.ColumnElement:
+        rank = self.rank_clause()
+        return rank if is_asc else rank.desc()
+
+    def candidates_clause(self, tbl: 'catalog.TableVersionPath', num_candidates: int) -> sql.ColumnElement:
+        """Returns a predicate that restricts a query against tbl to the num_candidates most relevant matches"""
+        tbl_version = next(tv for tv in tbl.get_tbl_versions() if tv.id == self.idx_info.val_col.tbl.id)
+        return self._idx.candidates_clause(self.idx_info.val_col, tbl_version, self.query, num_candidates)
+
+    @property
+    def _idx(self) -> 'index.FullTextIndex':
+        from pixeltable import index
+        assert isinstance(self.idx_info.idx, index.FullTextIndex)
+        return self.idx_info.idx
+
+    def eval(self, data_row: DataRow, row_builder: RowBuilder) -> None:
+        raise excs.Error(f'{self}: text_match() can only be used in queries against the table')
+
+    def _as_dict(self) -> dict:
+        return {'idx_name': self.idx_info.name, **super()._as_dict()}
+
+    @classmethod
+    def _from_dict(cls, d: dict, components: list[Expr]) -> 'TextMatchExpr':
+        assert len(components) == 2
+        assert isinstance(components[0], ColumnRef)
+        return cls(components[0], components[1], idx_name=d.get('idx_name'))
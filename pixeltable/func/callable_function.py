@@ -23,6 +23,15 @@ class CallableFunction(Function):
     py_fns: list[Callable]
     self_name: Optional[str]
     batch_size: Optional[int]
+    # bounds for adaptive batch sizing; None if the batch size is fixed
+    min_batch_size: Optional[int]
+    max_batch_size: Optional[int]
+    # 'inline', 'thread' or 'process'; None: use the udf_executor config option
+    executor: Optional[str]
+    cache: bool  # if True, results are memoized in the UdfCache
+
+    # the default upper bound for adaptive batch sizing, as a multiple of the initial batch size
+    DEFAULT_MAX_BATCH_SIZE_FACTOR = 16
 
     def __init__(
         self,
@@ -32,7 +41,11 @@ class CallableFunction(Function):
         self_name: Optional[str] = None,
         batch_size: Optional[int] = None,
         is_method: bool = False,
-        is_property: bool = False
+        is_property: bool = False,
+        min_batch_size: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        executor: Optional[str] = None,
+        cache: bool = False
     ):
         assert len(signatures) > 0
         assert len(signatures) == len(py_fns)
@@ -41,6 +54,10 @@ class CallableFunction(Function):
         self.py_fns = py_fns
         self.self_name = self_name
         self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.executor = executor
+        self.cache = cache
         self.__doc__ = self.py_fns[0].__doc__
         super().__init__(signatures, self_path=self_path, is_method=is_method, is_property=is_property)
 
@@ -138,6 +155,22 @@ class CallableFunction(Function):
     def get_batch_size(self, *args: Any, **kwargs: Any) -> Optional[int]:
         return self.batch_size
 
+    @property
+    def is_adaptively_batched(self) -> bool:
+        return self.min_batch_size is not None
+
+    def batch_size_bounds(self, batch_size: int, adaptive_by_default: bool) -> Optional[tuple[int, int]]:
+        """
+        Returns the bounds for adaptive batch sizing, starting from batch_size, or None if the batch size is fixed.
+        If adaptive_by_default is True, functions that don't specify bounds get the default bounds.
+        """
+        if self.is_adaptively_batched:
+            assert self.max_batch_size is not None
+            return self.min_batch_size, self.max_batch_size
+        if adaptive_by_default:
+            return 1, self.DEFAULT_MAX_BATCH_SIZE_FACTOR * batch_size
+        return None
+
     @property
     def display_name(self) -> str:
         return self.self_name
@@ -181,6 +214,10 @@ class CallableFunction(Function):
         md = {
             'signature': self.signature.as_dict(),
             'batch_size': self.batch_size,
+            'min_batch_size': self.min_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'executor': self.executor,
+            'cache': self.cache,
         }
         return md, cloudpickle.dumps(self.py_fn)
 
@@ -190,7 +227,10 @@ class CallableFunction(Function):
         assert callable(py_fn)
         sig = Signature.from_dict(md['signature'])
         batch_size = md['batch_size']
-        return CallableFunction([sig], [py_fn], self_name=name, batch_size=batch_size)
+        return CallableFunction(
+            [sig], [py_fn], self_name=name, batch_size=batch_size,
+            min_batch_size=md.get('min_batch_size'), max_batch_size=md.get('max_batch_size'),
+            executor=md.get('executor'), cache=md.get('cache', False))
 
     def validate_call(self, bound_args: dict[str, Any]) -> None:
         from pixeltable import exprs
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import Any, Callable, Optional, Sequence, overload
+import inspect
+from typing import Any, Callable, Literal, Optional, Sequence, overload
 
 import pixeltable.exceptions as excs
 import pixeltable.type_system as ts
@@ -23,6 +24,10 @@ def udf(decorated_fn: Callable) -> CallableFunction: ...
 def udf(
     *,
     batch_size: Optional[int] = None,
+    min_batch_size: Optional[int] = None,
+    max_batch_size: Optional[int] = None,
+    executor: Optional[Literal['inline', 'thread', 'process']] = None,
+    cache: bool = False,
     substitute_fn: Optional[Callable] = None,
     is_method: bool = False,
     is_property: bool = False,
@@ -39,6 +44,27 @@ def udf(*args, **kwargs):
         >>> @pxt.udf
         ... def my_function(x: int) -> int:
         ...    return x + 1
+
+        A batched function whose batch size is adjusted between 4 and 128 (starting at 16), based on the observed
+        throughput:
+
+        >>> @pxt.udf(batch_size=16, min_batch_size=4, max_batch_size=128)
+        ... def my_batched_function(x: Batch[str]) -> Batch[int]:
+        ...    return [len(s) for s in x]
+
+        A CPU-bound function that is executed in a pool of worker processes (the default is given by the
+        `udf_executor` config option):
+
+        >>> @pxt.udf(executor='process')
+        ... def my_cpu_bound_function(img: PIL.Image.Image) -> PIL.Image.Image:
+        ...    return img.filter(PIL.ImageFilter.GaussianBlur(5))
+
+        A deterministic, expensive function whose results are cached across sessions (in `$PIXELTABLE_HOME/udf_cache`,
+        see `UdfCache`), so that calls with previously seen arguments aren't executed again:
+
+        >>> @pxt.udf(cache=True)
+        ... def my_expensive_function(video: pxt.Video) -> str:
+        ...    return transcribe(video)
     """
     if len(args) == 1 and len(kwargs) == 0 and callable(args[0]):
 
@@ -51,6 +77,10 @@ def udf(*args, **kwargs):
         # Decorator schema invoked with parentheses: @pxt.udf(**kwargs)
         # Create a decorator for the specified schema.
         batch_size = kwargs.pop('batch_size', None)
+        min_batch_size = kwargs.pop('min_batch_size', None)
+        max_batch_size = kwargs.pop('max_batch_size', None)
+        executor = kwargs.pop('executor', None)
+        cache = kwargs.pop('cache', False)
         substitute_fn = kwargs.pop('substitute_fn', None)
         is_method = kwargs.pop('is_method', None)
         is_property = kwargs.pop('is_property', None)
@@ -66,6 +96,10 @@ def udf(*args, **kwargs):
             return make_function(
                 decorated_fn,
                 batch_size=batch_size,
+                min_batch_size=min_batch_size,
+                max_batch_size=max_batch_size,
+                executor=executor,
+                cache=cache,
                 substitute_fn=substitute_fn,
                 is_method=is_method,
                 is_property=is_property,
@@ -87,6 +121,10 @@ def make_function(
     is_property: bool = False,
     resource_pool: Optional[str] = None,
     type_substitutions: Optional[Sequence[dict]] = None,
+    min_batch_size: Optional[int] = None,
+    max_batch_size: Optional[int] = None,
+    executor: Optional[Literal['inline', 'thread', 'process']] = None,
+    cache: bool = False,
     function_name: Optional[str] = None,
     force_stored: bool = False
 ) -> CallableFunction:
@@ -112,6 +150,13 @@ def make_function(
     # Display name to use for error messages
     errmsg_name = function_name if function_path is None else function_path
 
+    if executor is not None:
+        if executor not in ('inline', 'thread', 'process'):
+            raise excs.Error(
+                f"{errmsg_name}(): `executor` must be one of 'inline', 'thread', 'process' (got {executor!r})")
+        if inspect.iscoroutinefunction(decorated_fn if substitute_fn is None else substitute_fn):
+            raise excs.Error(f'{errmsg_name}(): `executor` cannot be specified for async functions')
+
     signatures: list[Signature]
     if type_substitutions is None:
         sig = Signature.create(decorated_fn, param_types, return_type)
@@ -124,6 +169,17 @@ def make_function(
             raise excs.Error(f'{errmsg_name}(): batch_size is specified; at least one Python parameter must be `Batch`')
         if batch_size is None and len(sig.batched_parameters) > 0:
             raise excs.Error(f'{errmsg_name}(): batched parameters in udf, but no `batch_size` given')
+        if min_batch_size is not None or max_batch_size is not None:
+            if batch_size is None:
+                raise excs.Error(f'{errmsg_name}(): min_batch_size/max_batch_size require `batch_size`')
+            # unspecified bounds default to 1 and 16x the initial batch size, respectively
+            min_batch_size = 1 if min_batch_size is None else min_batch_size
+            if max_batch_size is None:
+                max_batch_size = CallableFunction.DEFAULT_MAX_BATCH_SIZE_FACTOR * batch_size
+            if not 1 <= min_batch_size <= batch_size <= max_batch_size:
+                raise excs.Error(
+                    f'{errmsg_name}(): batch size bounds must satisfy 1 <= min_batch_size <= batch_size <= '
+                    f'max_batch_size (got {min_batch_size}, {batch_size}, {max_batch_size})')
 
         if is_method and is_property:
             raise excs.Error(f'Cannot specify both `is_method` and `is_property` (in function `{function_name}`)')
@@ -164,7 +220,11 @@ def make_function(
         self_name=function_name,
         batch_size=batch_size,
         is_method=is_method,
-        is_property=is_property
+        is_property=is_property,
+        min_batch_size=min_batch_size,
+        max_batch_size=max_batch_size,
+        executor=executor,
+        cache=cache
     )
     if resource_pool is not None:
         result.resource_pool(lambda: resource_pool)
@@ -1,3 +1,6 @@
 from .base import IndexBase
 from .embedding_index import EmbeddingIndex
+from .full_text_index import FullTextIndex
+from .json_path_index import JsonPathIndex
+from .local_embedding_index import LocalEmbeddingIndex
 from .btree import BtreeIndex
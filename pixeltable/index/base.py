@@ -12,7 +12,7 @@ class IndexBase(abc.ABC):
     """
     Internal interface used by the catalog and runtime system to interact with indices:
     - types and expressions needed to create and populate the index value column
-    - creating/dropping the index
+    - creating/dropping the index, and keeping index state outside of Postgres in sync with table reverts
     This doesn't cover querying the index, which is dependent on the index semantics and handled by
     the specific subclass.
     """
@@ -37,8 +37,31 @@ class IndexBase(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def create_index(self, index_name: str, index_value_col: catalog.Column, conn: sql.engine.Connection) -> None:
-        """Create the index on the index value column"""
+    def create_index(
+        self, index_name: str, index_value_col: catalog.Column, conn: sql.engine.Connection, concurrently: bool = False
+    ) -> None:
+        """
+        Create the index on the index value column
+
+        Args:
+            concurrently: if True, build the index without blocking writes to the table (CREATE INDEX CONCURRENTLY);
+                conn is then outside of a transaction
+        """
+        pass
+
+    def has_store_index(self) -> bool:
+        """True if create_index() creates a Postgres index, rather than state outside of Postgres"""
+        return True
+
+    def drop_index(self, index_name: str, index_value_col: catalog.Column) -> None:
+        """
+        Drop the state of the index that isn't stored in Postgres; Postgres indices are dropped together with their
+        index value column
+        """
+        pass
+
+    def revert_index(self, index_name: str, index_value_col: catalog.Column, version: int) -> None:
+        """Revert the state of the index that isn't stored in Postgres to the table version preceding version"""
         pass
 
     @classmethod
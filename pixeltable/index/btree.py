@@ -49,9 +49,13 @@ class BtreeIndex(IndexBase):
         """Return the sqlalchemy type of the index value column"""
         return self.value_expr.col_type.to_sa_type()
 
-    def create_index(self, index_name: str, index_value_col: 'catalog.Column', conn: sql.engine.Connection) -> None:
+    def create_index(
+        self, index_name: str, index_value_col: 'catalog.Column', conn: sql.engine.Connection, concurrently: bool = False
+    ) -> None:
         """Create the index on the index value column"""
-        idx = sql.Index(index_name, index_value_col.sa_col, postgresql_using='btree')
+        idx = sql.Index(
+            index_name, index_value_col.sa_col, postgresql_using='btree',
+            postgresql_where=index_value_col.tbl.store_tbl.live_rows_clause(), postgresql_concurrently=concurrently)
         idx.create(bind=conn)
 
     @classmethod
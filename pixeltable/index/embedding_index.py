@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import enum
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
 import numpy as np
 import pgvector.sqlalchemy  # type: ignore[import-untyped]
@@ -11,9 +11,21 @@ import sqlalchemy as sql
 import pixeltable.exceptions as excs
 import pixeltable.type_system as ts
 from pixeltable import catalog, exprs, func
+from pixeltable.utils.query_embedding_cache import QueryEmbeddingCache
 
 from .base import IndexBase
 
+if TYPE_CHECKING:
+    from pixeltable.catalog import TableVersion
+
+
+class HalfVector(pgvector.sqlalchemy.Vector):
+    """The pgvector halfvec type (vectors of 16-bit floats), which the pgvector package doesn't provide"""
+    cache_ok = True
+
+    def get_col_spec(self, **kw: Any) -> str:
+        return f'HALFVEC({self.dim})'
+
 
 class EmbeddingIndex(IndexBase):
     """
@@ -24,6 +36,14 @@ class EmbeddingIndex(IndexBase):
       the Order By clause
     - order_by_clause() is used exclusively in the ORDER BY clause
     - embedding function parameters are named '<type-name>_embed', where type-name is ColumnType.Type.name
+    - the index is either an HNSW or an IVFFlat index; the index type determines the build parameters (m and
+      ef_construction for HNSW, lists for IVFFlat) and the search parameter (ef_search for HNSW, probes for IVFFlat).
+      The search parameter can be set for each similarity() call; otherwise the value given at index creation applies.
+    - precision determines how embeddings are stored and indexed: full vectors (float32), half-precision
+      vectors (float16), or half-precision vectors with an index over their binary quantization (binary). With
+      binary precision, a query with a limit of k retrieves k * rerank_factor candidates via the binary index and
+      then re-ranks them by their exact distance.
+    - the IVFPQ index type is searched in-process rather than by pgvector (see LocalEmbeddingIndex)
     """
 
     class Metric(enum.Enum):
@@ -31,19 +51,49 @@ class EmbeddingIndex(IndexBase):
         IP = 2
         L2 = 3
 
+    class IndexType(enum.Enum):
+        HNSW = 1
+        IVFFLAT = 2
+        IVFPQ = 3
+
+    class Precision(enum.Enum):
+        FLOAT32 = 1
+        FLOAT16 = 2
+        BINARY = 3
+
     PGVECTOR_OPS = {
-        Metric.COSINE: 'vector_cosine_ops',
-        Metric.IP: 'vector_ip_ops',
-        Metric.L2: 'vector_l2_ops'
+        Metric.COSINE: 'cosine_ops',
+        Metric.IP: 'ip_ops',
+        Metric.L2: 'l2_ops'
+    }
+
+    # build parameters and their defaults (the pgvector defaults), per index type
+    BUILD_PARAMS = {
+        IndexType.HNSW: {'m': 16, 'ef_construction': 64},
+        IndexType.IVFFLAT: {'lists': 100},
+        # 0: chosen based on the number of rows and the embedding size
+        IndexType.IVFPQ: {'lists': 0, 'subvectors': 0},
+    }
+    # search parameter, its default, and the Postgres setting that controls it, per index type
+    SEARCH_PARAMS = {
+        IndexType.HNSW: ('ef_search', 40, 'hnsw.ef_search'),
+        IndexType.IVFFLAT: ('probes', 1, 'ivfflat.probes'),
+        IndexType.IVFPQ: ('probes', 8, None),
     }
+    DEFAULT_RERANK_FACTOR = 4
+    MAX_EF_SEARCH = 1000  # the maximum value of hnsw.ef_search
 
     metric: Metric
+    index_type: IndexType
+    index_params: dict[str, int]  # the user-specified build and search parameters
+    precision: Precision
     value_expr: exprs.FunctionCall
     string_embed: Optional[func.Function]
     image_embed: Optional[func.Function]
     string_embed_signature_idx: int
     image_embed_signature_idx: int
-    index_col_type: pgvector.sqlalchemy.Vector
+    vector_size: int
+    index_col_type: sql.types.TypeEngine
 
     def __init__(
         self,
@@ -52,12 +102,34 @@ class EmbeddingIndex(IndexBase):
         embed: Optional[func.Function] = None,
         string_embed: Optional[func.Function] = None,
         image_embed: Optional[func.Function] = None,
+        index_type: str = 'hnsw',
+        index_params: Optional[dict[str, int]] = None,
+        precision: str = 'float32',
     ):
         if embed is None and string_embed is None and image_embed is None:
             raise excs.Error('At least one of `embed`, `string_embed`, or `image_embed` must be specified')
         metric_names = [m.name.lower() for m in self.Metric]
         if metric.lower() not in metric_names:
             raise excs.Error(f'Invalid metric {metric}, must be one of {metric_names}')
+        index_type_names = [t.name.lower() for t in self.IndexType]
+        if index_type.lower() not in index_type_names:
+            raise excs.Error(f'Invalid index type {index_type}, must be one of {index_type_names}')
+        precision_names = [p.name.lower() for p in self.Precision]
+        if precision.lower() not in precision_names:
+            raise excs.Error(f'Invalid precision {precision}, must be one of {precision_names}')
+        self.index_type = self.IndexType[index_type.upper()]
+        if self.index_type == self.IndexType.IVFPQ and type(self) is EmbeddingIndex:
+            raise excs.Error("Index type 'ivfpq' is only supported by in-process indices")
+        self.precision = self.Precision[precision.upper()]
+        self.index_params = dict(index_params) if index_params is not None else {}
+        valid_params = [*self.BUILD_PARAMS[self.index_type], *self._search_param_names()]
+        for name, val in self.index_params.items():
+            if name not in valid_params:
+                raise excs.Error(
+                    f'Invalid parameter {name!r} for a {self.index_type.name.lower()} index with precision '
+                    f'{self.precision.name.lower()}, must be one of {valid_params}')
+            if not isinstance(val, int) or isinstance(val, bool) or val < 1:
+                raise excs.Error(f'Invalid value for index parameter {name!r}: {val!r} (must be a positive integer)')
         if not c.col_type.is_string_type() and not c.col_type.is_image_type():
             raise excs.Error(f'Embedding index requires string or image column')
 
@@ -122,7 +194,12 @@ class EmbeddingIndex(IndexBase):
         assert isinstance(self.value_expr.col_type, ts.ArrayType)
         vector_size = self.value_expr.col_type.shape[0]
         assert vector_size is not None
-        self.index_col_type = pgvector.sqlalchemy.Vector(vector_size)
+        self.vector_size = vector_size
+        if self.precision == self.Precision.FLOAT32:
+            self.index_col_type = pgvector.sqlalchemy.Vector(vector_size)
+        else:
+            # binary quantization re-ranks with the half-precision vectors
+            self.index_col_type = HalfVector(vector_size)
 
     def index_value_expr(self) -> exprs.Expr:
         """Return expression that computes the value that goes into the index"""
@@ -135,55 +212,198 @@ class EmbeddingIndex(IndexBase):
         """Return the sqlalchemy type of the index value column"""
         return self.index_col_type
 
-    def create_index(self, index_name: str, index_value_col: catalog.Column, conn: sql.engine.Connection) -> None:
+    def create_index(
+        self, index_name: str, index_value_col: catalog.Column, conn: sql.engine.Connection, concurrently: bool = False
+    ) -> None:
         """Create the index on the index value column"""
+        build_params = {
+            name: self.index_params.get(name, default) for name, default in self.BUILD_PARAMS[self.index_type].items()
+        }
+        if self.precision == self.Precision.BINARY:
+            # an expression index over the binary quantization of the vectors; this needs to match the expression in
+            # candidates_clause() exactly
+            with_clause = ', '.join(f'{name} = {val}' for name, val in build_params.items())
+            store_tbl = index_value_col.tbl.store_tbl
+            live_rows = store_tbl.live_rows_clause().compile(compile_kwargs={'literal_binds': True})
+            stmt = (
+                f'CREATE INDEX {"CONCURRENTLY " if concurrently else ""}{index_name} ON {store_tbl.sa_tbl.name} '
+                f'USING {self.index_type.name.lower()} '
+                f'((binary_quantize({index_value_col.sa_col.name})::bit({self.vector_size})) bit_hamming_ops) '
+                f'WITH ({with_clause}) '
+                f'WHERE {live_rows}'
+            )
+            conn.execute(sql.text(stmt))
+            return
+        ops_prefix = 'vector' if self.precision == self.Precision.FLOAT32 else 'halfvec'
         idx = sql.Index(
             index_name, index_value_col.sa_col,
-            postgresql_using='hnsw',
-            postgresql_with={'m': 16, 'ef_construction': 64},
-            postgresql_ops={index_value_col.sa_col.name: self.PGVECTOR_OPS[self.metric]}
+            postgresql_using=self.index_type.name.lower(),
+            postgresql_with=build_params,
+            postgresql_ops={index_value_col.sa_col.name: f'{ops_prefix}_{self.PGVECTOR_OPS[self.metric]}'},
+            postgresql_where=index_value_col.tbl.store_tbl.live_rows_clause(),
+            postgresql_concurrently=concurrently
         )
         idx.create(bind=conn)
 
-    def similarity_clause(self, val_column: catalog.Column, item: Any) -> sql.ColumnElement:
-        """Create a ColumnElement that represents '<val_column> <op> <item>'"""
+    def has_index_scan(self) -> bool:
+        """
+        Returns True if Postgres can order rows by distance via the index, rather than only retrieve candidates (see
+        candidates_clause())
+        """
+        return self.precision != self.Precision.BINARY
+
+    def supports_sql_query_embeddings(self) -> bool:
+        """Returns True if the query embedding can be a ColumnElement, such as a column of a list of query embeddings"""
+        return True
+
+    def _search_param_names(self) -> list[str]:
+        names = [self.SEARCH_PARAMS[self.index_type][0]]
+        if self.precision == self.Precision.BINARY:
+            names.append('rerank_factor')
+        return names
+
+    def validate_search_params(self, search_params: dict[str, int]) -> None:
+        """Validate the parameters of a similarity() call"""
+        valid_params = self._search_param_names()
+        for name, val in search_params.items():
+            if name not in valid_params:
+                raise excs.Error(
+                    f'similarity(): {name!r} is not supported by a {self.index_type.name.lower()} index with '
+                    f'precision {self.precision.name.lower()}; supported parameters: {valid_params}')
+            if not isinstance(val, int) or isinstance(val, bool) or val < 1:
+                raise excs.Error(f'similarity(): invalid value for {name!r}: {val!r} (must be a positive integer)')
+
+    def _search_param(self, name: str, default: int, search_params: dict[str, int]) -> int:
+        return search_params.get(name, self.index_params.get(name, default))
+
+    def _num_candidates(self, limit: int, search_params: dict[str, int]) -> int:
+        return limit * self._search_param('rerank_factor', self.DEFAULT_RERANK_FACTOR, search_params)
+
+    def search_settings(
+        self, search_params: dict[str, int], limit: Optional[int], num_candidates: Optional[int] = None
+    ) -> dict[str, int]:
+        """
+        Returns the Postgres settings (name -> value) for a query that orders by similarity with this index
+
+        Args:
+            num_candidates: if not None, the number of candidates the index scan needs to return
+        """
+        param_name, default, setting = self.SEARCH_PARAMS[self.index_type]
+        val = self._search_param(param_name, default, search_params)
+        if num_candidates is None and limit is not None:
+            num_candidates = self._num_candidates(limit, search_params) \
+                if self.precision == self.Precision.BINARY else limit
+        if self.index_type == self.IndexType.HNSW and num_candidates is not None:
+            # an HNSW index scan returns at most ef_search rows
+            val = min(max(val, num_candidates), self.MAX_EF_SEARCH)
+        return {setting: val}
+
+    def candidates_clause(
+        self, val_column: catalog.Column, tbl_version: TableVersion, embedding: Any, limit: int,
+        search_params: dict[str, int], num_candidates: Optional[int] = None
+    ) -> Optional[sql.ColumnElement]:
+        """
+        Returns a predicate that restricts the rows of tbl_version to the approximate nearest neighbors of embedding,
+        or None if the index can be used directly in the ORDER BY clause.
+
+        Args:
+            num_candidates: if not None, the number of nearest neighbors; the predicate is then returned regardless
+                of the precision of the index (for filtered searches that retrieve candidates before filtering)
+        """
+        if num_candidates is None:
+            if self.precision != self.Precision.BINARY:
+                return None
+            num_candidates = self._num_candidates(limit, search_params)
+        store_tbl = tbl_version.store_tbl
+        # we need an alias, otherwise the subquery would be correlated with the enclosing query
+        sa_tbl = store_tbl.sa_tbl.alias()
+        if isinstance(embedding, np.ndarray):
+            embedding = sql.bindparam(None, embedding, type_=self.index_col_type)
+        sa_col = sa_tbl.c[val_column.sa_col.name]
+        if self.precision == self.Precision.BINARY:
+            bit_type = sql.dialects.postgresql.BIT(self.vector_size)
+            quantized_col = sql.cast(sql.func.binary_quantize(sa_col), bit_type)
+            quantized_item = sql.func.binary_quantize(sql.cast(embedding, self.index_col_type))
+            distance = quantized_col.op('<~>', return_type=sql.Float)(quantized_item)
+        else:
+            distance = self._distance(sa_col, embedding)
+        candidates = (
+            sql.select(*[sa_tbl.c[c.name] for c in store_tbl.rowid_columns()])
+            .where(sa_tbl.c[store_tbl.v_min_col.name] <= tbl_version.version)
+            .where(sa_tbl.c[store_tbl.v_max_col.name] > tbl_version.version)
+            .order_by(distance)
+            .limit(num_candidates)
+        )
+        if not tbl_version.is_snapshot:
+            # the index only covers the live rows
+            candidates = candidates.where(store_tbl.live_rows_clause(sa_tbl))
+        return sql.tuple_(*store_tbl.rowid_columns()).in_(candidates)
+
+    def embed(self, item: Any) -> np.ndarray:
+        """Returns the embedding of a query item; embeddings are cached across queries"""
         assert isinstance(item, (str, PIL.Image.Image))
-        if isinstance(item, str):
-            assert self.string_embed is not None
-            embedding = self.string_embed.exec([item], {})
-        if isinstance(item, PIL.Image.Image):
-            assert self.image_embed is not None
-            embedding = self.image_embed.exec([item], {})
+        embed_fn = self.string_embed if isinstance(item, str) else self.image_embed
+        assert embed_fn is not None
+        return QueryEmbeddingCache.get().get_embedding(embed_fn, item, lambda: embed_fn.exec([item], {}))
+
+    def embed_batch(self, items: list[Any]) -> list[np.ndarray]:
+        """Returns the embeddings of the query items, computing the ones that aren't cached in batches"""
+        cache = QueryEmbeddingCache.get()
+        result: list[Optional[np.ndarray]] = [None] * len(items)
+        for embed_fn, item_type in [(self.string_embed, str), (self.image_embed, PIL.Image.Image)]:
+            missing_idxs = [i for i, item in enumerate(items) if isinstance(item, item_type)]
+            if len(missing_idxs) == 0:
+                continue
+            assert embed_fn is not None
+            for i in missing_idxs:
+                result[i] = cache.lookup(embed_fn, items[i])
+            missing_idxs = [i for i in missing_idxs if result[i] is None]
+            if isinstance(embed_fn, func.CallableFunction) and embed_fn.is_batched:
+                batch_size = embed_fn.get_batch_size()
+                for start in range(0, len(missing_idxs), batch_size):
+                    batch_idxs = missing_idxs[start:start + batch_size]
+                    embeddings = embed_fn.exec_batch([[items[i] for i in batch_idxs]], {})
+                    for i, embedding in zip(batch_idxs, embeddings):
+                        result[i] = embedding
+            else:
+                for i in missing_idxs:
+                    result[i] = embed_fn.exec([items[i]], {})
+            for i in missing_idxs:
+                cache.add(embed_fn, items[i], result[i])
+        assert all(embedding is not None for embedding in result)
+        return result
 
+    def distance_clause(self, val_column: catalog.Column, embedding: Any) -> sql.ColumnElement:
+        """
+        Create a ColumnElement that represents the pgvector distance between val_column and embedding (an array or
+        a ColumnElement); ordering by it in ascending order returns the most similar rows first.
+        """
+        return self._distance(val_column.sa_col, embedding)
+
+    def _distance(self, sa_col: sql.ColumnElement, embedding: Any) -> sql.ColumnElement:
         if self.metric == self.Metric.COSINE:
-            return val_column.sa_col.cosine_distance(embedding) * -1 + 1
+            return sa_col.cosine_distance(embedding)
         elif self.metric == self.Metric.IP:
-            return val_column.sa_col.max_inner_product(embedding) * -1
+            return sa_col.max_inner_product(embedding)
         else:
             assert self.metric == self.Metric.L2
-            return val_column.sa_col.l2_distance(embedding)
-
-    def order_by_clause(self, val_column: catalog.Column, item: Any, is_asc: bool) -> sql.ColumnElement:
-        """Create a ColumnElement that is used in an ORDER BY clause"""
-        assert isinstance(item, (str, PIL.Image.Image))
-        embedding: Optional[np.ndarray] = None
-        if isinstance(item, str):
-            assert self.string_embed is not None
-            embedding = self.string_embed.exec([item], {})
-        if isinstance(item, PIL.Image.Image):
-            assert self.image_embed is not None
-            embedding = self.image_embed.exec([item], {})
-        assert embedding is not None
+            return sa_col.l2_distance(embedding)
 
+    def similarity_clause(self, val_column: catalog.Column, embedding: Any) -> sql.ColumnElement:
+        """Create a ColumnElement that represents '<val_column> <op> <embedding>'"""
+        distance = self.distance_clause(val_column, embedding)
         if self.metric == self.Metric.COSINE:
-            result = val_column.sa_col.cosine_distance(embedding)
-            result = result.desc() if is_asc else result
+            return distance * -1 + 1
         elif self.metric == self.Metric.IP:
-            result = val_column.sa_col.max_inner_product(embedding)
-            result = result.desc() if is_asc else result
+            return distance * -1
         else:
-            assert self.metric == self.Metric.L2
-            result = val_column.sa_col.l2_distance(embedding)
+            return distance
+
+    def order_by_clause(self, val_column: catalog.Column, embedding: Any, is_asc: bool) -> sql.ColumnElement:
+        """Create a ColumnElement that is used in an ORDER BY clause"""
+        result = self.distance_clause(val_column, embedding)
+        if self.metric != self.Metric.L2 and is_asc:
+            result = result.desc()
         return result
 
     @classmethod
@@ -237,11 +457,18 @@ class EmbeddingIndex(IndexBase):
         return {
             'metric': self.metric.name.lower(),
             'string_embed': None if self.string_embed is None else self.string_embed.as_dict(),
-            'image_embed': None if self.image_embed is None else self.image_embed.as_dict()
+            'image_embed': None if self.image_embed is None else self.image_embed.as_dict(),
+            'index_type': self.index_type.name.lower(),
+            'index_params': self.index_params,
+            'precision': self.precision.name.lower(),
         }
 
     @classmethod
     def from_dict(cls, c: catalog.Column, d: dict) -> EmbeddingIndex:
         string_embed = func.Function.from_dict(d['string_embed']) if d['string_embed'] is not None else None
         image_embed = func.Function.from_dict(d['image_embed']) if d['image_embed'] is not None else None
-        return cls(c, metric=d['metric'], string_embed=string_embed, image_embed=image_embed)
+        # indices created before index types and precisions were introduced are float32 HNSW indices
+        return cls(
+            c, metric=d['metric'], string_embed=string_embed, image_embed=image_embed,
+            index_type=d.get('index_type', 'hnsw'), index_params=d.get('index_params'),
+            precision=d.get('precision', 'float32'))
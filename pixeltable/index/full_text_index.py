@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import re
+from typing import TYPE_CHECKING, Any
+
+import sqlalchemy as sql
+
+import pixeltable.exceptions as excs
+from pixeltable import catalog, exprs
+
+from .base import IndexBase
+
+if TYPE_CHECKING:
+    from pixeltable.catalog import TableVersion
+
+
+class FullTextIndex(IndexBase):
+    """
+    Interface to full-text search in Postgres: a GIN index over the tsvector of the index value column.
+    - the index value column holds the complete string; the tsvector isn't stored, but is the key of an expression
+      index, which requires the two-argument form of to_tsvector() with a constant text search configuration;
+      _tsvector() creates that expression, which queries need to match exactly in order to use the index
+    - queries are parsed with websearch_to_tsquery(), which accepts arbitrary user input ("quoted phrases", OR,
+      -exclusions) without raising syntax errors
+    - relevance is ts_rank_cd() (cover density) normalized by the document length, as in BM25: each match
+      contributes less in longer documents; unlike BM25, it doesn't weight terms by their inverse document frequency
+    """
+
+    DEFAULT_LANGUAGE = 'english'
+    # ts_rank_cd() normalization: divide by 1 + log(number of words)
+    RANK_NORMALIZATION = 1
+
+    language: str  # the Postgres text search configuration
+    value_expr: exprs.Expr
+
+    def __init__(self, c: catalog.Column, language: str = DEFAULT_LANGUAGE):
+        if not c.col_type.is_string_type():
+            raise excs.Error(f'Index on column {c.name}: full-text index requires a string column, got {c.col_type}')
+        if re.fullmatch(r'[a-z_][a-z0-9_]*', language) is None:
+            raise excs.Error(f'Invalid text search language: {language!r}')
+        self.language = language
+        self.value_expr = exprs.ColumnRef(c)
+
+    def index_value_expr(self) -> exprs.Expr:
+        return self.value_expr
+
+    def records_value_errors(self) -> bool:
+        return False
+
+    def index_sa_type(self) -> sql.types.TypeEngine:
+        """Return the sqlalchemy type of the index value column"""
+        return self.value_expr.col_type.to_sa_type()
+
+    def create_index(
+        self, index_name: str, index_value_col: catalog.Column, conn: sql.engine.Connection, concurrently: bool = False
+    ) -> None:
+        """Create a GIN index on the tsvector of the index value column"""
+        # an expression index doesn't infer its table from the expression
+        idx = sql.Index(
+            index_name, self._tsvector(index_value_col.sa_col), postgresql_using='gin',
+            postgresql_where=index_value_col.tbl.store_tbl.live_rows_clause(), postgresql_concurrently=concurrently,
+            _table=index_value_col.sa_col.table)
+        idx.create(bind=conn)
+
+    def _config(self) -> sql.ColumnElement:
+        # a regconfig constant (rather than a bound parameter), so that expressions match the index expression
+        return sql.literal_column(f"'{self.language}'::regconfig")
+
+    def _tsvector(self, sa_col: sql.ColumnElement) -> sql.ColumnElement:
+        return sql.func.to_tsvector(self._config(), sa_col)
+
+    def _tsquery(self, query: str) -> sql.ColumnElement:
+        return sql.func.websearch_to_tsquery(self._config(), query)
+
+    def _match(self, sa_col: sql.ColumnElement, query: str) -> sql.ColumnElement:
+        return self._tsvector(sa_col).op('@@', return_type=sql.Boolean)(self._tsquery(query))
+
+    def _rank(self, sa_col: sql.ColumnElement, query: str) -> sql.ColumnElement:
+        return sql.func.ts_rank_cd(
+            self._tsvector(sa_col), self._tsquery(query), self.RANK_NORMALIZATION, type_=sql.Float)
+
+    def match_clause(self, val_column: catalog.Column, query: str) -> sql.ColumnElement:
+        """Create a ColumnElement that is true for the rows that match query"""
+        return self._match(val_column.sa_col, query)
+
+    def rank_clause(self, val_column: catalog.Column, query: str) -> sql.ColumnElement:
+        """Create a ColumnElement for the relevance of a row for query (higher is more relevant; 0 if no match)"""
+        return self._rank(val_column.sa_col, query)
+
+    def candidates_clause(
+        self, val_column: catalog.Column, tbl_version: TableVersion, query: str, num_candidates: int
+    ) -> sql.ColumnElement:
+        """Returns a predicate that restricts the rows of tbl_version to the num_candidates most relevant matches"""
+        store_tbl = tbl_version.store_tbl
+        # we need an alias, otherwise the subquery would be correlated with the enclosing query
+        sa_tbl = store_tbl.sa_tbl.alias()
+        sa_col = sa_tbl.c[val_column.sa_col.name]
+        candidates = (
+            sql.select(*[sa_tbl.c[c.name] for c in store_tbl.rowid_columns()])
+            .where(sa_tbl.c[store_tbl.v_min_col.name] <= tbl_version.version)
+            .where(sa_tbl.c[store_tbl.v_max_col.name] > tbl_version.version)
+            .where(self._match(sa_col, query))
+            .order_by(self._rank(sa_col, query).desc())
+            .limit(num_candidates)
+        )
+        if not tbl_version.is_snapshot:
+            # the index only covers the live rows
+            candidates = candidates.where(store_tbl.live_rows_clause(sa_tbl))
+        return sql.tuple_(*store_tbl.rowid_columns()).in_(candidates)
+
+    @classmethod
+    def display_name(cls) -> str:
+        return 'full-text'
+
+    def as_dict(self) -> dict:
+        return {'language': self.language}
+
+    @classmethod
+    def from_dict(cls, c: catalog.Column, d: dict[str, Any]) -> FullTextIndex:
+        return cls(c, language=d['language'])
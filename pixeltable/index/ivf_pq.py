@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import json
+import logging
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+_logger = logging.getLogger('pixeltable')
+
+
+class IvfPq:
+    """
+    An inverted file index with product quantization (IVF-PQ) over the row versions of a table, implemented with numpy.
+
+    - the vectors are partitioned into `lists` clusters by k-means (the inverted lists); a search only looks at the
+      entries of the `probes` lists whose centroids are closest to the query
+    - an entry stores the residual of its vector (the difference to its centroid) as a product-quantized code: the
+      residual is split into `subvectors` pieces, each of which is replaced by the index of the nearest of up to 256
+      centroids of a per-piece codebook; distances to a query are computed from per-piece lookup tables
+    - the cosine metric is handled as the l2 distance between normalized vectors
+    - each entry records the rowid and the [v_min, v_max) version range of its row version, so that a search can be
+      answered for any table version up to `version`, the version the index has been synced with
+    - the entries are kept sorted by list; offsets[i] is the position of the first entry of list i
+
+    The arrays are stored as .npy files in a directory per synced version and memory-mapped when loaded.
+    """
+
+    # number of entries used to train the centroids and codebooks
+    MAX_TRAINING_SAMPLES = 10_000
+    KMEANS_ITERS = 10
+    MAX_CODEBOOK_SIZE = 256
+
+    metric: str  # 'cosine', 'ip' or 'l2'
+    version: int
+    num_trained: int  # number of vectors the centroids and codebooks were trained with
+    centroids: np.ndarray  # (lists, dim)
+    codebooks: np.ndarray  # (subvectors, codebook size, dim / subvectors)
+    list_ids: np.ndarray  # (n,)
+    codes: np.ndarray  # (n, subvectors)
+    rowids: np.ndarray  # (n, number of rowid columns)
+    v_min: np.ndarray  # (n,)
+    v_max: np.ndarray  # (n,)
+    offsets: np.ndarray  # (lists + 1,)
+
+    ARRAYS = ('centroids', 'codebooks', 'list_ids', 'codes', 'rowids', 'v_min', 'v_max', 'offsets')
+
+    def __init__(
+        self, metric: str, version: int, num_trained: int, centroids: np.ndarray, codebooks: np.ndarray,
+        list_ids: np.ndarray, codes: np.ndarray, rowids: np.ndarray, v_min: np.ndarray, v_max: np.ndarray,
+        offsets: np.ndarray
+    ):
+        self.metric = metric
+        self.version = version
+        self.num_trained = num_trained
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self.list_ids = list_ids
+        self.codes = codes
+        self.rowids = rowids
+        self.v_min = v_min
+        self.v_max = v_max
+        self.offsets = offsets
+
+    @classmethod
+    def build(
+        cls, metric: str, version: int, vectors: np.ndarray, rowids: np.ndarray, v_min: np.ndarray, v_max: np.ndarray,
+        num_lists: int = 0, num_subvectors: int = 0, seed: int = 0
+    ) -> IvfPq:
+        """
+        Trains the centroids and codebooks on (a sample of) vectors and adds all vectors
+
+        Args:
+            num_lists: the number of inverted lists; 0: approximately the square root of the number of vectors
+            num_subvectors: the number of pieces of the product quantization; 0: pieces of 8 (or fewer) dimensions
+        """
+        assert len(vectors) == len(rowids) == len(v_min) == len(v_max)
+        dim = vectors.shape[1]
+        if num_subvectors == 0:
+            dsub = next(d for d in (8, 4, 2, 1) if dim % d == 0)
+            num_subvectors = dim // dsub
+        elif dim % num_subvectors != 0:
+            raise ValueError(f'vector size {dim} is not a multiple of the number of subvectors {num_subvectors}')
+        dsub = dim // num_subvectors
+        rng = np.random.default_rng(seed)
+        vectors = cls._prepare(metric, vectors)
+        if len(vectors) > cls.MAX_TRAINING_SAMPLES:
+            sample = vectors[rng.choice(len(vectors), cls.MAX_TRAINING_SAMPLES, replace=False)]
+        else:
+            sample = vectors
+        if len(sample) == 0:
+            # nothing to train on: a single list at the origin and an all-zero codebook, until the index is rebuilt
+            centroids = np.zeros((1, dim), dtype=np.float32)
+            codebooks = np.zeros((num_subvectors, 1, dsub), dtype=np.float32)
+        else:
+            if num_lists == 0:
+                num_lists = max(1, int(np.sqrt(len(vectors))))
+            centroids = cls._kmeans(sample[None], num_lists, rng)[0]
+            residuals = sample - centroids[cls._nearest(sample[None], centroids[None])[0]]
+            codebook_size = min(cls.MAX_CODEBOOK_SIZE, len(sample))
+            codebooks = cls._kmeans(cls._split(residuals, num_subvectors), codebook_size, rng)
+        result = cls(
+            metric, version, len(vectors), centroids, codebooks,
+            list_ids=np.zeros(0, dtype=np.int32), codes=np.zeros((0, num_subvectors), dtype=np.uint8),
+            rowids=np.zeros((0, rowids.shape[1]), dtype=np.int64), v_min=np.zeros(0, dtype=np.int64),
+            v_max=np.zeros(0, dtype=np.int64), offsets=np.zeros(len(centroids) + 1, dtype=np.int64))
+        result._add_prepared(vectors, rowids, v_min, v_max)
+        return result
+
+    @property
+    def num_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def num_subvectors(self) -> int:
+        return self.codebooks.shape[0]
+
+    def __len__(self) -> int:
+        return len(self.list_ids)
+
+    @classmethod
+    def _prepare(cls, metric: str, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if metric == 'cosine':
+            norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    @classmethod
+    def _split(cls, x: np.ndarray, num_subvectors: int) -> np.ndarray:
+        """Returns the subvectors of the rows of x, as an array of shape (num_subvectors, len(x), dsub)"""
+        return np.ascontiguousarray(x.reshape(len(x), num_subvectors, -1).transpose(1, 0, 2))
+
+    @classmethod
+    def _nearest(cls, x: np.ndarray, centers: np.ndarray, batch_size: int = 1024) -> np.ndarray:
+        """
+        Returns the index of the nearest (l2) center for each vector, for m sets of vectors and centers at once
+
+        Args:
+            x: shape (m, n, d)
+            centers: shape (m, k, d)
+
+        Returns:
+            shape (m, n)
+        """
+        center_norms = (centers ** 2).sum(axis=2)[:, None, :]
+        center_ts = np.ascontiguousarray(centers.transpose(0, 2, 1))
+        result = np.empty(x.shape[:2], dtype=np.int32)
+        for start in range(0, x.shape[1], batch_size):
+            # |x - c|^2 = |x|^2 - 2 x.c + |c|^2; |x|^2 doesn't affect the argmin
+            dists = center_norms - 2 * np.matmul(x[:, start:start + batch_size], center_ts)
+            result[:, start:start + batch_size] = dists.argmin(axis=2)
+        return result
+
+    @classmethod
+    def _kmeans(cls, x: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+        """Runs k-means on m sets of vectors (shape (m, n, d)) at once; returns the centers (shape (m, k, d))"""
+        m, n, d = x.shape
+        k = min(k, n)
+        centers = x[:, rng.choice(n, k, replace=False)].copy()
+        for _ in range(cls.KMEANS_ITERS):
+            # the cluster of each vector, numbered consecutively across the m sets
+            assignment = (cls._nearest(x, centers) + np.arange(m)[:, None] * k).ravel()
+            counts = np.bincount(assignment, minlength=m * k).reshape(m, k)
+            sums = np.stack(
+                [np.bincount(assignment, weights=x[:, :, i].ravel(), minlength=m * k) for i in range(d)], axis=-1)
+            sums = sums.reshape(m, k, d)
+            # empty clusters keep their previous center
+            non_empty = counts > 0
+            centers[non_empty] = (sums[non_empty] / counts[non_empty][:, None]).astype(np.float32)
+        return centers
+
+    def _encode(self, vectors: np.ndarray, list_ids: np.ndarray) -> np.ndarray:
+        residuals = vectors - self.centroids[list_ids]
+        return self._nearest(self._split(residuals, self.num_subvectors), self.codebooks).T.astype(np.uint8)
+
+    def add(self, vectors: np.ndarray, rowids: np.ndarray, v_min: np.ndarray, v_max: np.ndarray) -> None:
+        """Adds entries for the given row versions"""
+        self._add_prepared(self._prepare(self.metric, vectors), rowids, v_min, v_max)
+
+    def _add_prepared(self, vectors: np.ndarray, rowids: np.ndarray, v_min: np.ndarray, v_max: np.ndarray) -> None:
+        if len(vectors) == 0:
+            return
+        list_ids = self._nearest(vectors[None], self.centroids[None])[0]
+        codes = self._encode(vectors, list_ids)
+        list_ids = np.concatenate([self.list_ids, list_ids])
+        # a stable sort keeps the existing entries of each list in front
+        order = np.argsort(list_ids, kind='stable')
+        self.list_ids = list_ids[order]
+        self.codes = np.concatenate([self.codes, codes])[order]
+        self.rowids = np.concatenate([self.rowids, np.asarray(rowids, dtype=np.int64)])[order]
+        self.v_min = np.concatenate([self.v_min, np.asarray(v_min, dtype=np.int64)])[order]
+        self.v_max = np.concatenate([self.v_max, np.asarray(v_max, dtype=np.int64)])[order]
+        self.offsets = np.searchsorted(self.list_ids, np.arange(self.num_lists + 1)).astype(np.int64)
+
+    def _positions(self, rowids: np.ndarray, v_min: np.ndarray) -> np.ndarray:
+        """Returns the positions of the entries of the given row versions (-1 for the ones that don't have one)"""
+        entry_keys = zip(map(tuple, self.rowids.tolist()), self.v_min.tolist())
+        positions = {key: i for i, key in enumerate(entry_keys)}
+        keys = zip(map(tuple, np.asarray(rowids).tolist()), np.asarray(v_min).tolist())
+        return np.array([positions.get(key, -1) for key in keys], dtype=np.int64)
+
+    def set_v_max(self, rowids: np.ndarray, v_min: np.ndarray, v_max: np.ndarray) -> None:
+        """Records the deletion of the given row versions"""
+        if len(rowids) == 0:
+            return
+        positions = self._positions(rowids, v_min)
+        found = positions >= 0
+        self.v_max = np.array(self.v_max)  # the array might be memory-mapped
+        self.v_max[positions[found]] = np.asarray(v_max, dtype=np.int64)[found]
+
+    def revert(self, version: int, max_version: int) -> None:
+        """Removes the entries of rows created at version and undeletes the rows deleted at version"""
+        keep = self.v_min != version
+        self.list_ids = self.list_ids[keep]
+        self.codes = self.codes[keep]
+        self.rowids = self.rowids[keep]
+        self.v_min = self.v_min[keep]
+        self.v_max = np.where(self.v_max[keep] == version, max_version, self.v_max[keep])
+        self.offsets = np.searchsorted(self.list_ids, np.arange(self.num_lists + 1)).astype(np.int64)
+        self.version = min(self.version, version - 1)
+
+    def search(self, query: np.ndarray, k: int, probes: int, version: int) -> np.ndarray:
+        """
+        Returns the rowids of the (approximate) k nearest neighbors of query among the rows that are visible at
+        version, ordered by increasing (approximate) distance
+        """
+        query = self._prepare(self.metric, query)
+        if query.shape != (self.centroids.shape[1],):
+            raise ValueError(f'Expected a query vector of shape {self.centroids.shape[1:]}, got {query.shape}')
+        m, _, dsub = self.codebooks.shape
+        query_pieces = query.reshape(m, dsub)
+        if self.metric == 'ip':
+            # we rank by -<q, c + r> = -<q, c> - <q, r>; the table for the residuals is the same for all lists
+            list_dists = -(self.centroids @ query)
+            ip_table = -np.einsum('jkd,jd->jk', self.codebooks, query_pieces)
+        else:
+            list_dists = ((self.centroids - query) ** 2).sum(axis=1)
+        probes = min(probes, self.num_lists)
+        probed_lists = np.argpartition(list_dists, probes - 1)[:probes]
+
+        positions: list[np.ndarray] = []
+        dists: list[np.ndarray] = []
+        subvector_idxs = np.arange(m)[None, :]
+        for list_id in probed_lists:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            list_positions = np.arange(start, end)
+            visible = (self.v_min[start:end] <= version) & (self.v_max[start:end] > version)
+            list_positions = list_positions[visible]
+            if len(list_positions) == 0:
+                continue
+            codes = self.codes[list_positions]
+            if self.metric == 'ip':
+                list_entry_dists = list_dists[list_id] + ip_table[subvector_idxs, codes].sum(axis=1)
+            else:
+                # the distance between the query and the quantized vectors is that between the query's residual and
+                # the quantized residuals
+                query_residual = (query - self.centroids[list_id]).reshape(m, 1, dsub)
+                table = ((query_residual - self.codebooks) ** 2).sum(axis=2)
+                list_entry_dists = table[subvector_idxs, codes].sum(axis=1)
+            positions.append(list_positions)
+            dists.append(list_entry_dists)
+        if len(positions) == 0:
+            return np.zeros((0, self.rowids.shape[1]), dtype=np.int64)
+        all_positions = np.concatenate(positions)
+        all_dists = np.concatenate(dists)
+        if len(all_dists) > k:
+            top_k = np.argpartition(all_dists, k - 1)[:k]
+        else:
+            top_k = np.arange(len(all_dists))
+        top_k = top_k[np.argsort(all_dists[top_k], kind='stable')]
+        return np.asarray(self.rowids[all_positions[top_k]])
+
+    def save(self, dir_path: Path) -> Path:
+        """
+        Stores the index in a new subdirectory of dir_path for its version and removes the subdirectories of other
+        versions; returns the path of the subdirectory
+        """
+        dir_path.mkdir(parents=True, exist_ok=True)
+        # write to a temp directory first, so that readers never see a partially written version
+        tmp_path = dir_path / f'tmp_{uuid.uuid4().hex}'
+        tmp_path.mkdir()
+        for name in self.ARRAYS:
+            np.save(tmp_path / f'{name}.npy', np.ascontiguousarray(getattr(self, name)))
+        md = {'metric': self.metric, 'version': self.version, 'num_trained': self.num_trained}
+        (tmp_path / 'md.json').write_text(json.dumps(md))
+        version_path = dir_path / f'v{self.version}'
+        if version_path.exists():
+            shutil.rmtree(version_path)
+        tmp_path.rename(version_path)
+        for p in dir_path.iterdir():
+            if p != version_path:
+                shutil.rmtree(p, ignore_errors=True)
+        return version_path
+
+    @classmethod
+    def load(cls, dir_path: Path) -> Optional[IvfPq]:
+        """Loads the most recent version stored in dir_path, or returns None if there is none"""
+        if not dir_path.is_dir():
+            return None
+        versions = [int(p.name[1:]) for p in dir_path.iterdir() if p.name.startswith('v') and p.name[1:].isdigit()]
+        if len(versions) == 0:
+            return None
+        version_path = dir_path / f'v{max(versions)}'
+        try:
+            md = json.loads((version_path / 'md.json').read_text())
+            arrays = {name: np.load(version_path / f'{name}.npy', mmap_mode='r') for name in cls.ARRAYS}
+        except (OSError, ValueError) as e:
+            _logger.warning(f'could not load index from {version_path}: {e}')
+            return None
+        return cls(metric=md['metric'], version=md['version'], num_trained=md['num_trained'], **arrays)
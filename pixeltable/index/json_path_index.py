@@ -0,0 +1,125 @@
+import enum
+import json
+import math
+from typing import Any, Optional, Union
+
+import sqlalchemy as sql
+
+import pixeltable.exceptions as excs
+import pixeltable.type_system as ts
+from pixeltable import catalog, exprs
+from pixeltable.func.udf import udf
+
+from .base import IndexBase
+
+
+class JsonPathIndex(IndexBase):
+    """
+    Index on the value at a path of a JSON column.
+    - the index value column holds the value at the path, as computed by JsonPath (so that the index agrees with
+      the Python evaluation of the path), and the index is on that column:
+      - B-tree: for scalar values; other values, and strings that are too long for a B-tree entry, aren't indexed
+      - GIN (jsonb_path_ops): for values of any size and shape; lookups are containment queries (@>), which are
+        rechecked for equality
+    - queries use the index for comparisons of the (same) path with a literal (eq_clause())
+    """
+
+    class IndexType(enum.Enum):
+        BTREE = 0
+        GIN = 1
+
+    # max length of the JSON encoding of an indexed value in a B-tree
+    MAX_STRING_LEN = 256
+
+    path: list[Union[str, int]]
+    index_type: IndexType
+    value_expr: 'exprs.Expr'
+
+    @staticmethod
+    @udf
+    def scalar_filter(val: ts.Json) -> ts.Json:
+        if not JsonPathIndex.is_indexable_scalar(val):
+            return None
+        return val
+
+    def __init__(self, c: 'catalog.Column', path: list[Union[str, int]], index_type: str = 'btree'):
+        if not c.col_type.is_json_type():
+            raise excs.Error(f'Index on column {c.name}: JSON path index requires a JSON column, got {c.col_type}')
+        if len(path) == 0 or not all(isinstance(el, (str, int)) and not isinstance(el, bool) for el in path):
+            raise excs.Error(f'Index on column {c.name}: invalid JSON path {path!r} (only keys and list indices)')
+        try:
+            self.index_type = self.IndexType[index_type.upper()]
+        except KeyError:
+            valid_types = ', '.join(repr(t.name.lower()) for t in self.IndexType)
+            raise excs.Error(f'Invalid JSON index type {index_type!r}, must be one of {valid_types}') from None
+        self.path = list(path)
+        path_expr = exprs.JsonPath(exprs.ColumnRef(c), self.path)
+        self.value_expr = JsonPathIndex.scalar_filter(path_expr) if self.index_type == self.IndexType.BTREE \
+            else path_expr
+
+    @classmethod
+    def is_indexable_scalar(cls, val: Any) -> bool:
+        """True if val is a string or number that can go into a B-tree"""
+        if isinstance(val, str):
+            return len(json.dumps(val)) < cls.MAX_STRING_LEN
+        return isinstance(val, (int, float)) and not isinstance(val, bool)
+
+    def index_value_expr(self) -> 'exprs.Expr':
+        return self.value_expr
+
+    def records_value_errors(self) -> bool:
+        return False
+
+    def index_sa_type(self) -> sql.types.TypeEngine:
+        """Return the sqlalchemy type of the index value column"""
+        return ts.JsonType().to_sa_type()
+
+    def create_index(
+        self, index_name: str, index_value_col: 'catalog.Column', conn: sql.engine.Connection, concurrently: bool = False
+    ) -> None:
+        """Create the index on the index value column"""
+        live_rows = index_value_col.tbl.store_tbl.live_rows_clause()
+        if self.index_type == self.IndexType.BTREE:
+            idx = sql.Index(
+                index_name, index_value_col.sa_col, postgresql_using='btree', postgresql_where=live_rows,
+                postgresql_concurrently=concurrently)
+        else:
+            idx = sql.Index(
+                index_name, index_value_col.sa_col, postgresql_using='gin',
+                postgresql_ops={index_value_col.sa_col.name: 'jsonb_path_ops'}, postgresql_where=live_rows,
+                postgresql_concurrently=concurrently)
+        idx.create(bind=conn)
+
+    def matches(self, path: 'exprs.JsonPath') -> bool:
+        """True if path is the indexed path"""
+        return path.path_elements == self.path
+
+    def eq_clause(self, val_column: 'catalog.Column', val: Any) -> Optional[sql.ColumnElement]:
+        """
+        Returns a predicate on the index value column that is equivalent to <path> == val, or None if the index can't
+        be used for val.
+        Comparisons need to have the same outcome as in Python, which limits the values to strings and numbers: in
+        Python, True == 1 and False == 0, but not in jsonb, so that 0 and 1 aren't supported either.
+        """
+        if isinstance(val, str):
+            if self.index_type == self.IndexType.BTREE and not self.is_indexable_scalar(val):
+                return None
+        elif not isinstance(val, (int, float)) or isinstance(val, bool) or val in (0, 1) or not math.isfinite(val):
+            return None
+        # a cast string rather than a JSONB bind parameter, which can't be rendered as a literal (for EXPLAIN)
+        json_val = sql.cast(sql.literal(json.dumps(val)), self.index_sa_type())
+        if self.index_type == self.IndexType.BTREE:
+            return val_column.sa_col == json_val
+        # containment is also true for an array that contains val
+        return sql.and_(val_column.sa_col.op('@>', return_type=sql.Boolean)(json_val), val_column.sa_col == json_val)
+
+    @classmethod
+    def display_name(cls) -> str:
+        return 'json'
+
+    def as_dict(self) -> dict:
+        return {'path': self.path, 'index_type': self.index_type.name.lower()}
+
+    @classmethod
+    def from_dict(cls, c: 'catalog.Column', d: dict) -> 'JsonPathIndex':
+        return cls(c, d['path'], index_type=d['index_type'])
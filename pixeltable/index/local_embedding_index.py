@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import logging
+import shutil
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+import numpy as np
+import sqlalchemy as sql
+
+import pixeltable.exceptions as excs
+from pixeltable import catalog
+from pixeltable.env import Env
+from pixeltable.metadata import schema
+
+from .embedding_index import EmbeddingIndex
+from .ivf_pq import IvfPq
+
+if TYPE_CHECKING:
+    from pixeltable.catalog import TableVersion
+
+_logger = logging.getLogger('pixeltable')
+
+
+class LocalEmbeddingIndex(EmbeddingIndex):
+    """
+    An embedding index that is searched in-process, with an IVF-PQ structure (see IvfPq), instead of by pgvector.
+    - the embeddings are stored in the index value column, as with EmbeddingIndex, but there is no Postgres index:
+      a query with a limit of k retrieves k * rerank_factor candidates from the IVF-PQ structure, which Postgres then
+      re-ranks by their exact distance
+    - the structure covers all row versions, including deleted ones, so that it can answer queries against earlier
+      versions (snapshots)
+    - it is synced lazily: a query against a table version that is newer than the structure first adds the rows
+      created since, and records the rows deleted since
+    - the structure is cached in memory and stored in Env.index_dir after every change; it is retrained when the
+      number of rows has grown by RETRAIN_FACTOR since the last training
+    """
+
+    DEFAULT_RERANK_FACTOR = 10
+    RETRAIN_FACTOR = 4
+
+    # (table id, value column id) -> IvfPq; index instances get recreated when the catalog is reloaded
+    _structures: dict[tuple[str, int], IvfPq] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, c: catalog.Column, metric: str, **kwargs: Any):
+        super().__init__(c, metric, **kwargs)
+        if self.index_type != self.IndexType.IVFPQ:
+            raise excs.Error(f'Invalid index type {self.index_type.name.lower()} for an in-process index')
+        if self.precision != self.Precision.FLOAT32:
+            raise excs.Error(f"Index type 'ivfpq' requires precision 'float32', not {self.precision.name.lower()!r}")
+        num_subvectors = self.index_params.get('subvectors')
+        if num_subvectors is not None and self.vector_size % num_subvectors != 0:
+            raise excs.Error(
+                f"Invalid value for index parameter 'subvectors': {num_subvectors} (must divide the embedding size "
+                f'{self.vector_size})')
+
+    def create_index(
+        self, index_name: str, index_value_col: catalog.Column, conn: sql.engine.Connection, concurrently: bool = False
+    ) -> None:
+        """Build the IVF-PQ structure from the (already populated) index value column; this doesn't block the table"""
+        with self._lock:
+            self._remove(index_value_col)
+            structure = self._build(index_value_col, index_value_col.tbl.version, conn)
+            self._store(index_value_col, structure)
+
+    def drop_index(self, index_name: str, index_value_col: catalog.Column) -> None:
+        with self._lock:
+            self._remove(index_value_col)
+
+    def revert_index(self, index_name: str, index_value_col: catalog.Column, version: int) -> None:
+        with self._lock:
+            structure = self._load(index_value_col)
+            if structure is None or structure.version < version:
+                return
+            structure.revert(version, schema.Table.MAX_VERSION)
+            self._store(index_value_col, structure)
+
+    def has_store_index(self) -> bool:
+        return False
+
+    def has_index_scan(self) -> bool:
+        return False
+
+    def supports_sql_query_embeddings(self) -> bool:
+        # the search happens before the query is run
+        return False
+
+    def _search_param_names(self) -> list[str]:
+        return [self.SEARCH_PARAMS[self.index_type][0], 'rerank_factor']
+
+    def search_settings(
+        self, search_params: dict[str, int], limit: Optional[int], num_candidates: Optional[int] = None
+    ) -> dict[str, int]:
+        return {}
+
+    def candidates_clause(
+        self, val_column: catalog.Column, tbl_version: TableVersion, embedding: Any, limit: int,
+        search_params: dict[str, int], num_candidates: Optional[int] = None
+    ) -> Optional[sql.ColumnElement]:
+        """
+        Returns a predicate that restricts the rows of tbl_version to the candidates found by the IVF-PQ search; the
+        search returns rerank_factor times the number of requested rows (limit or num_candidates)
+        """
+        assert isinstance(embedding, np.ndarray)
+        num_candidates = self._num_candidates(limit if num_candidates is None else num_candidates, search_params)
+        param_name, default, _ = self.SEARCH_PARAMS[self.index_type]
+        probes = self._search_param(param_name, default, search_params)
+        with self._lock:
+            structure = self._get_structure(val_column, tbl_version.version)
+            rowids = structure.search(embedding, num_candidates, probes, tbl_version.version)
+        if len(rowids) == 0:
+            return sql.false()
+        return sql.tuple_(*tbl_version.store_tbl.rowid_columns()).in_([tuple(rowid) for rowid in rowids.tolist()])
+
+    @classmethod
+    def _key(cls, val_col: catalog.Column) -> tuple[str, int]:
+        return val_col.tbl.id.hex, val_col.id
+
+    @classmethod
+    def _dir(cls, val_col: catalog.Column) -> Path:
+        return Env.get().index_dir / f'{val_col.tbl.id.hex}_{val_col.id}'
+
+    def _get_structure(self, val_col: catalog.Column, version: int) -> IvfPq:
+        """Returns the structure for val_col, synced with version; requires _lock"""
+        structure = self._load(val_col)
+        if structure is not None and structure.version >= version:
+            return structure
+        with Env.get().engine.connect() as conn:
+            if structure is None:
+                structure = self._build(val_col, version, conn)
+            else:
+                structure = self._sync(structure, val_col, version, conn)
+        self._store(val_col, structure)
+        return structure
+
+    def _load(self, val_col: catalog.Column) -> Optional[IvfPq]:
+        key = self._key(val_col)
+        structure = self._structures.get(key)
+        if structure is None:
+            structure = IvfPq.load(self._dir(val_col))
+            if structure is not None:
+                self._structures[key] = structure
+        return structure
+
+    def _store(self, val_col: catalog.Column, structure: IvfPq) -> None:
+        structure.save(self._dir(val_col))
+        self._structures[self._key(val_col)] = structure
+
+    def _remove(self, val_col: catalog.Column) -> None:
+        self._structures.pop(self._key(val_col), None)
+        shutil.rmtree(self._dir(val_col), ignore_errors=True)
+
+    def _build(self, val_col: catalog.Column, version: int, conn: sql.engine.Connection) -> IvfPq:
+        """Trains a new structure on all row versions up to version"""
+        store_tbl = val_col.tbl.store_tbl
+        vectors, rowids, v_min, v_max = self._read_rows(val_col, store_tbl.v_min_col <= version, conn)
+        # deletions after version get recorded by the next sync
+        v_max = np.where(v_max > version, schema.Table.MAX_VERSION, v_max)
+        structure = IvfPq.build(
+            self.metric.name.lower(), version, vectors, rowids, v_min, v_max,
+            num_lists=self.index_params.get('lists', 0), num_subvectors=self.index_params.get('subvectors', 0))
+        _logger.debug(
+            f'built IVF-PQ index for column {val_col.tbl.name}.{val_col.id} at version {version}: {len(structure)} '
+            f'rows, {structure.num_lists} lists, {structure.num_subvectors} subvectors')
+        return structure
+
+    def _sync(self, structure: IvfPq, val_col: catalog.Column, version: int, conn: sql.engine.Connection) -> IvfPq:
+        """Adds the changes between structure.version and version"""
+        store_tbl = val_col.tbl.store_tbl
+        if len(structure) + self._count_new_rows(val_col, structure.version, version, conn) \
+                > self.RETRAIN_FACTOR * structure.num_trained:
+            return self._build(val_col, version, conn)
+        vectors, rowids, v_min, v_max = self._read_rows(
+            val_col, sql.and_(store_tbl.v_min_col > structure.version, store_tbl.v_min_col <= version), conn)
+        v_max = np.where(v_max > version, schema.Table.MAX_VERSION, v_max)
+        deleted = conn.execute(
+            sql.select(*store_tbl.rowid_columns(), store_tbl.v_min_col, store_tbl.v_max_col)
+            .where(store_tbl.v_min_col <= structure.version)
+            .where(store_tbl.v_max_col > structure.version)
+            .where(store_tbl.v_max_col <= version)
+        ).fetchall()
+        structure.add(vectors, rowids, v_min, v_max)
+        if len(deleted) > 0:
+            deleted_rows = np.array(deleted, dtype=np.int64)
+            structure.set_v_max(deleted_rows[:, :-2], deleted_rows[:, -2], deleted_rows[:, -1])
+        _logger.debug(
+            f'synced IVF-PQ index for column {val_col.tbl.name}.{val_col.id} from version {structure.version} to '
+            f'{version}: {len(vectors)} new and {len(deleted)} deleted rows')
+        structure.version = version
+        return structure
+
+    @classmethod
+    def _embedding_clause(cls, val_col: catalog.Column) -> sql.ColumnElement:
+        undo_col = next(
+            info.undo_col for info in val_col.tbl.idxs_by_name.values() if info.val_col.id == val_col.id)
+        if undo_col is None:
+            return val_col.sa_col
+        # the embeddings of deleted rows are in the undo column
+        return sql.func.coalesce(val_col.sa_col, undo_col.sa_col)
+
+    def _count_new_rows(
+        self, val_col: catalog.Column, from_version: int, to_version: int, conn: sql.engine.Connection
+    ) -> int:
+        store_tbl = val_col.tbl.store_tbl
+        stmt = (
+            sql.select(sql.func.count())
+            .select_from(store_tbl.sa_tbl)
+            .where(store_tbl.v_min_col > from_version)
+            .where(store_tbl.v_min_col <= to_version)
+            .where(self._embedding_clause(val_col) != None)
+        )
+        return conn.execute(stmt).scalar()
+
+    def _read_rows(
+        self, val_col: catalog.Column, where_clause: sql.ColumnElement, conn: sql.engine.Connection
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the embeddings, rowids, v_min and v_max of the row versions that satisfy where_clause"""
+        store_tbl = val_col.tbl.store_tbl
+        rowid_cols = store_tbl.rowid_columns()
+        embedding = self._embedding_clause(val_col)
+        stmt = (
+            sql.select(*rowid_cols, store_tbl.v_min_col, store_tbl.v_max_col, embedding)
+            .where(where_clause)
+            .where(embedding != None)  # rows for which the embedding couldn't be computed
+        )
+        rows = conn.execute(stmt).fetchall()
+        if len(rows) == 0:
+            return (
+                np.zeros((0, self.vector_size), dtype=np.float32), np.zeros((0, len(rowid_cols)), dtype=np.int64),
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        num_rowid_cols = len(rowid_cols)
+        vectors = np.stack([row[-1] for row in rows]).astype(np.float32)
+        rowids = np.array([row[:num_rowid_cols] for row in rows], dtype=np.int64)
+        v_min = np.array([row[num_rowid_cols] for row in rows], dtype=np.int64)
+        v_max = np.array([row[num_rowid_cols + 1] for row in rows], dtype=np.int64)
+        return vectors, rowids, v_min, v_max
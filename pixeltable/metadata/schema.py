@@ -115,7 +115,8 @@ class IndexMd:
     indexed_col_tbl_id: str  # UUID of the table (as string) that contains column being indexed
     indexed_col_id: int  # column being indexed
     index_val_col_id: int  # column holding the values to be indexed
-    index_val_undo_col_id: int  # column holding index values for deleted rows
+    # column holding index values for deleted rows; None for indices that retain them in the index value column
+    index_val_undo_col_id: Optional[int]
     schema_version_add: int
     schema_version_drop: Optional[int]
     class_fqn: str
@@ -2,7 +2,9 @@ from __future__ import annotations
 
 import dataclasses
 import enum
-from typing import Any, Iterable, Optional, Sequence, Literal
+import logging
+import math
+from typing import Any, AsyncIterable, Iterable, Optional, Sequence, Literal, Union
 from uuid import UUID
 
 
@@ -13,8 +15,11 @@ import pixeltable.exec as exec
 from pixeltable import catalog
 from pixeltable import exceptions as excs
 from pixeltable import exprs
+from pixeltable.env import Env
 from pixeltable.exec.sql_node import OrderByItem, OrderByClause, combine_order_by_clauses, print_order_by_clause
 
+_logger = logging.getLogger('pixeltable')
+
 
 def _is_agg_fn_call(e: exprs.Expr) -> bool:
     return isinstance(e, exprs.FunctionCall) and e.is_agg_fn_call and not e.is_window_fn_call
@@ -243,6 +248,12 @@ class Analyzer:
 
 
 class Planner:
+    # filtered similarity searches use the index scan directly if at least this fraction of the rows pass the filter
+    FILTERED_SEARCH_INDEX_MIN_SELECTIVITY = 0.5
+    # the number of candidates retrieved via the index is this multiple of the expected number of candidates needed
+    # to find k rows that pass the filter
+    FILTERED_SEARCH_OVERFETCH_FACTOR = 2
+
     # TODO: create an exec.CountNode and change this to create_count_plan()
     @classmethod
     def create_count_stmt(
@@ -263,7 +274,8 @@ class Planner:
 
     @classmethod
     def create_insert_plan(
-        cls, tbl: catalog.TableVersion, rows: list[dict[str, Any]], ignore_errors: bool
+        cls, tbl: catalog.TableVersion, rows: Union[Iterable[dict[str, Any]], AsyncIterable[dict[str, Any]]],
+        ignore_errors: bool
     ) -> exec.ExecNode:
         """Creates a plan for TableVersion.insert()"""
         assert not tbl.is_view()
@@ -505,15 +517,43 @@ class Planner:
         plan.set_stored_img_cols(stored_img_col_info)
         return plan
 
+    @classmethod
+    def _create_view_row_builder(
+        cls, view: catalog.TableVersionPath
+    ) -> tuple[exprs.RowBuilder, list[exprs.Expr], list[exprs.Expr]]:
+        """Returns the RowBuilder for populating a view, together with the exprs computed from the base and the
+        exprs computed from the view that are needed for its stored columns"""
+        # things we need to materialize as DataRows:
+        # 1. stored computed cols
+        # - iterator columns are effectively computed, just not with a value_expr
+        # - we can ignore stored non-computed columns because they have a default value that is supplied directly by
+        #   the store
+        target = view.tbl_version  # the one we need to populate
+        stored_cols = [c for c in target.cols_by_id.values() if c.is_stored]
+        # 2. for component views: iterator args
+        iterator_args = [target.iterator_args] if target.iterator_args is not None else []
+
+        row_builder = exprs.RowBuilder(iterator_args, stored_cols, [])
+        base_output_exprs = [e for e in row_builder.default_eval_ctx.exprs if e.is_bound_by([view.base])]
+        view_output_exprs = [
+            e for e in row_builder.default_eval_ctx.target_exprs
+            if e.is_bound_by([view]) and not e.is_bound_by([view.base])
+        ]
+        return row_builder, base_output_exprs, view_output_exprs
+
     @classmethod
     def create_view_load_plan(
-        cls, view: catalog.TableVersionPath, propagates_insert: bool = False
+        cls, view: catalog.TableVersionPath, propagates_insert: bool = False,
+        shared_plan: Optional[exec.ExecNode] = None, shared_batches: Optional[list[exec.DataRowBatch]] = None
     ) -> tuple[exec.ExecNode, int]:
         """Creates a query plan for populating a view.
 
         Args:
             view: the view to populate
             propagates_insert: if True, we're propagating a base update to this view
+            shared_plan: if not None, the base rows are the rows in shared_batches, which were produced by shared_plan
+                (see create_shared_view_load_plan()), instead of the result of a scan of the base
+            shared_batches: output of shared_plan
 
         Returns:
             - root node of the plan
@@ -521,34 +561,35 @@ class Planner:
         """
         assert isinstance(view, catalog.TableVersionPath)
         assert view.is_view()
-        # things we need to materialize as DataRows:
-        # 1. stored computed cols
-        # - iterator columns are effectively computed, just not with a value_expr
-        # - we can ignore stored non-computed columns because they have a default value that is supplied directly by
-        #   the store
+        assert (shared_plan is None) == (shared_batches is None)
         target = view.tbl_version  # the one we need to populate
-        stored_cols = [c for c in target.cols_by_id.values() if c.is_stored]
-        # 2. for component views: iterator args
-        iterator_args = [target.iterator_args] if target.iterator_args is not None else []
-
-        row_builder = exprs.RowBuilder(iterator_args, stored_cols, [])
+        row_builder, base_output_exprs, view_output_exprs = cls._create_view_row_builder(view)
 
         # execution plan:
         # 1. materialize exprs computed from the base that are needed for stored view columns
         # 2. if it's an iterator view, expand the base rows into component rows
         # 3. materialize stored view columns that haven't been produced by step 1
-        base_output_exprs = [e for e in row_builder.default_eval_ctx.exprs if e.is_bound_by([view.base])]
-        view_output_exprs = [
-            e for e in row_builder.default_eval_ctx.target_exprs
-            if e.is_bound_by([view]) and not e.is_bound_by([view.base])
-        ]
-        # if we're propagating an insert, we only want to see those base rows that were created for the current version
-        base_analyzer = Analyzer(FromClause(tbls=[view.base]), base_output_exprs, where_clause=target.predicate)
-        base_eval_ctx = row_builder.create_eval_ctx(base_analyzer.all_exprs)
-        plan = cls._create_query_plan(
-            row_builder=row_builder, analyzer=base_analyzer, eval_ctx=base_eval_ctx, with_pk=True,
-            exact_version_only=view.get_bases() if propagates_insert else [])
-        exec_ctx = plan.ctx
+        plan: exec.ExecNode
+        if shared_plan is None:
+            # if we're propagating an insert, we only want to see those base rows that were created for the current
+            # version
+            base_analyzer = Analyzer(FromClause(tbls=[view.base]), base_output_exprs, where_clause=target.predicate)
+            base_eval_ctx = row_builder.create_eval_ctx(base_analyzer.all_exprs)
+            plan = cls._create_query_plan(
+                row_builder=row_builder, analyzer=base_analyzer, eval_ctx=base_eval_ctx, with_pk=True,
+                exact_version_only=view.get_bases() if propagates_insert else [])
+            exec_ctx = plan.ctx
+        else:
+            # copy what the shared plan materialized and evaluate the rest for the rows that satisfy the predicate
+            shared_exprs = shared_plan.row_builder.output_exprs
+            copied_exprs = [e for e in base_output_exprs if e in shared_exprs]
+            plan = exec.SharedRowsNode(
+                view.base.tbl_version, row_builder, copied_exprs, shared_plan.row_builder, shared_batches,
+                predicate=target.predicate)
+            remaining_exprs = [e for e in base_output_exprs if e not in shared_exprs]
+            if len(remaining_exprs) > 0:
+                plan = exec.ExprEvalNode(row_builder, remaining_exprs, copied_exprs, input=plan)
+            exec_ctx = exec.ExecContext(row_builder)
         if target.is_component_view():
             plan = exec.ComponentIterationNode(target, plan)
         if len(view_output_exprs) > 0:
@@ -558,9 +599,56 @@ class Planner:
         stored_img_col_info = [info for info in row_builder.output_slot_idxs() if info.col.col_type.is_image_type()]
         plan.set_stored_img_cols(stored_img_col_info)
         exec_ctx.ignore_errors = True
+        exec_ctx.num_computed_exprs = sum(
+            1 for col in target.cols_by_name.values() if col.is_computed and col.is_stored)
         plan.set_ctx(exec_ctx)
         return plan, len(row_builder.default_eval_ctx.target_exprs)
 
+    @classmethod
+    def create_shared_view_load_plan(
+        cls, views: list[catalog.TableVersionPath], batch_size: int
+    ) -> tuple[Optional[exec.ExecNode], list[catalog.TableVersionPath]]:
+        """Creates a plan that scans the base rows of the current version once on behalf of several views of the
+        same base, for the purpose of propagating an insert.
+
+        The plan materializes the predicates of the views and the exprs computed from the base that the views need,
+        each of them once. Views with a predicate only share the exprs that are evaluated in SQL: their other exprs
+        are evaluated by their own load plans (see create_view_load_plan()), and only for the rows that satisfy the
+        predicate. Views with a predicate that can't be evaluated in SQL don't share the plan.
+
+        Returns:
+            - the plan, or None if fewer than two views can share it
+            - the views that share the plan
+        """
+        sql_elements = exprs.SqlElementCache()
+        shared_views: list[catalog.TableVersionPath] = []
+        shared_exprs: exprs.ExprSet[exprs.Expr] = exprs.ExprSet()
+        for view in views:
+            predicate = view.tbl_version.predicate
+            if predicate is not None and not sql_elements.contains(predicate):
+                continue
+            shared_views.append(view)
+            _, base_output_exprs, _ = cls._create_view_row_builder(view)
+            if predicate is not None:
+                shared_exprs.add(predicate)
+                shared_exprs.update(e for e in base_output_exprs if sql_elements.contains(e))
+            else:
+                shared_exprs.update(base_output_exprs)
+        if len(shared_views) < 2:
+            return None, []
+
+        base = shared_views[0].base
+        row_builder = exprs.RowBuilder(list(shared_exprs), [], [])
+        analyzer = Analyzer(FromClause(tbls=[base]), row_builder.get_output_exprs())
+        eval_ctx = row_builder.create_eval_ctx(analyzer.all_exprs)
+        plan = cls._create_query_plan(
+            row_builder=row_builder, analyzer=analyzer, eval_ctx=eval_ctx, with_pk=True,
+            exact_version_only=shared_views[0].get_bases())
+        # the views consume the base rows in batches
+        plan.ctx.batch_size = batch_size
+        plan.ctx.ignore_errors = True
+        return plan, shared_views
+
     @classmethod
     def _verify_join_clauses(cls, analyzer: Analyzer) -> None:
         """Verify that join clauses are expressible in SQL"""
@@ -795,19 +883,90 @@ class Planner:
 
         if limit is not None:
             plan.set_limit(limit)
+            if sql_node is not None and sql_node.is_filtered_similarity_search():
+                sql_node.set_filtered_search(cls._plan_filtered_similarity_search(sql_node))
 
         plan.set_ctx(ctx)
         return plan
 
+    @classmethod
+    def _plan_filtered_similarity_search(cls, sql_node: exec.SqlNode) -> exec.FilteredSimilaritySearch:
+        """
+        Choose how a similarity search with a filter uses the embedding index, based on the estimated selectivity
+        of the filter:
+        - if most rows pass the filter, the rows returned by the index scan are filtered
+        - if the filter is selective, but k matching rows are still likely to be among a limited number of nearest
+          neighbors, those are retrieved as candidates, filtered and re-ranked (with more candidates if needed)
+        - otherwise (or if there is no estimate), the rows that pass the filter are ranked by their exact distance
+        """
+        from pixeltable import index
+        estimate = cls._estimate_selectivity(sql_node)
+        if estimate is None:
+            # the filter might be arbitrarily selective: only an exact search is guaranteed to find k matching rows
+            return exec.FilteredSimilaritySearch(exec.FilteredSimilaritySearch.Strategy.EXACT, None, None, 0)
+        selectivity, num_rows = estimate
+        assert sql_node.limit is not None
+        num_candidates = math.ceil(sql_node.limit * cls.FILTERED_SEARCH_OVERFETCH_FACTOR / max(selectivity, 1e-9))
+        sim_expr = sql_node.order_by_clause[0].expr
+        assert isinstance(sim_expr, exprs.SimilarityExpr)
+        idx = sim_expr.idx_info.idx
+        assert isinstance(idx, index.EmbeddingIndex)
+        strategy: exec.FilteredSimilaritySearch.Strategy
+        if not sim_expr.is_index_ready(sql_node.tbl):
+            # the index is still being built
+            strategy = exec.FilteredSimilaritySearch.Strategy.EXACT
+        elif selectivity >= cls.FILTERED_SEARCH_INDEX_MIN_SELECTIVITY and idx.has_index_scan():
+            # (otherwise, the index can only be used to retrieve candidates)
+            strategy = exec.FilteredSimilaritySearch.Strategy.INDEX
+        elif num_candidates <= index.EmbeddingIndex.MAX_EF_SEARCH:
+            strategy = exec.FilteredSimilaritySearch.Strategy.OVERFETCH
+        else:
+            strategy = exec.FilteredSimilaritySearch.Strategy.EXACT
+        return exec.FilteredSimilaritySearch(
+            strategy, selectivity, num_rows, min(num_candidates, index.EmbeddingIndex.MAX_EF_SEARCH))
+
+    @classmethod
+    def _estimate_selectivity(cls, sql_node: exec.SqlNode) -> Optional[tuple[float, int]]:
+        """
+        Returns the fraction of rows that pass the filter of sql_node and the total number of rows, as estimated by
+        Postgres, or None if Postgres can't produce an estimate
+        """
+        tbl = sql_node.tbl
+        assert tbl is not None
+        if sql_node.where_clause is not None:
+            where_clause_element = sql_node.sql_elements.get(sql_node.where_clause)
+            refd_tbl_ids = sql_node.where_clause.tbl_ids()
+        else:
+            where_clause_element = sql_node.where_clause_element
+            refd_tbl_ids = set()
+        all_rows = exec.SqlScanNode.create_from_clause(
+            tbl, sql.select(*tbl.tbl_version.store_tbl.rowid_columns()), refd_tbl_ids)
+        try:
+            with Env.get().engine.connect() as conn:
+                num_rows = cls._estimate_num_rows(all_rows, conn)
+                num_filtered_rows = cls._estimate_num_rows(all_rows.where(where_clause_element), conn)
+        except (sql.exc.SQLAlchemyError, KeyError, IndexError, TypeError, ValueError) as e:
+            _logger.debug(f'could not estimate selectivity: {e}')
+            return None
+        return min(num_filtered_rows / max(num_rows, 1), 1.0), num_rows
+
+    @classmethod
+    def _estimate_num_rows(cls, stmt: sql.Select, conn: sql.engine.Connection) -> int:
+        from pixeltable.utils.sql import explain
+        explain_result = explain(stmt, conn, fmt='JSON').scalar()
+        return int(explain_result[0]['Plan']['Plan Rows'])
+
     @classmethod
     def analyze(cls, tbl: catalog.TableVersionPath, where_clause: exprs.Expr) -> Analyzer:
         return Analyzer(FromClause(tbls=[tbl]), [], where_clause=where_clause)
 
     @classmethod
     def create_add_column_plan(
-            cls, tbl: catalog.TableVersionPath, col: catalog.Column
+            cls, tbl: catalog.TableVersionPath, col: catalog.Column, rowid_range: Optional[tuple[int, int]] = None
     ) -> tuple[exec.ExecNode, Optional[int]]:
         """Creates a plan for InsertableTable.add_column()
+        Args:
+            rowid_range: if not None, only populate the rows whose (first) rowid is in [start, end)
         Returns:
             plan: the plan to execute
             value_expr slot idx for the plan output (for computed cols)
@@ -820,6 +979,10 @@ class Planner:
         plan.ctx.batch_size = 16
         plan.ctx.show_pbar = True
         plan.ctx.ignore_errors = True
+        if rowid_range is not None:
+            scan_node = plan.get_node(exec.SqlScanNode)
+            assert scan_node is not None
+            scan_node.set_rowid_range(*rowid_range)
 
         # we want to flush images
         if col.is_computed and col.is_stored and col.col_type.is_image_type():
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import abc
+import datetime
 import logging
 import os
 import sys
@@ -9,6 +10,7 @@ import urllib.request
 import warnings
 from typing import Any, Iterator, Literal, Optional, Union
 
+import pgvector.sqlalchemy  # type: ignore[import-untyped]
 import sqlalchemy as sql
 from tqdm import TqdmWarning, tqdm
 
@@ -41,6 +43,15 @@ class StoreBase:
     base: Optional[StoreBase]
 
     __INSERT_BATCH_SIZE = 1000
+    # batch size for inserts via COPY; needs to be bounded, because we can't execute other statements (such as the
+    # queries of the exec plan) on the connection while a COPY is in progress
+    __COPY_BATCH_SIZE = 10000
+    # default minimum number of rows for an insert to go through COPY; configurable via copy_insert_min_rows
+    __DEFAULT_COPY_INSERT_MIN_ROWS = 1000
+    # number of rows that load_column() stages and applies to the store table at a time
+    __LOAD_COLUMN_CHUNK_SIZE = 10000
+    # width of the rowid ranges in which resumable backfills populate a column (see start_backfill())
+    __BACKFILL_RANGE_SIZE = 10000
 
     def __init__(self, tbl_version: catalog.TableVersion):
         self.tbl_version = tbl_version
@@ -51,6 +62,19 @@ class StoreBase:
         self.base = None if tbl_version.base is None else tbl_version.base.store_tbl
         self.create_sa_tbl()
 
+    def live_rows_clause(self, sa_tbl: Optional[sql.FromClause] = None) -> sql.ColumnElement[bool]:
+        """
+        Return the predicate for the live rows (the rows of the current version), for self.sa_tbl or an alias of it.
+        It is also the predicate of the (partial) indices on index value columns, which queries against the current
+        version need to include verbatim in order to use them:
+        - MAX_VERSION is a literal rather than a parameter, so that the predicate also matches in generic plans of
+          prepared statements
+        - >= rather than ==: both are equivalent, but without column statistics Postgres estimates the selectivity of
+          an equality at 0.5%, which would distort the row estimates of queries against recently populated tables
+        """
+        v_max_col = self.v_max_col if sa_tbl is None else sa_tbl.c[self.v_max_col.name]
+        return v_max_col >= sql.literal_column(str(schema.Table.MAX_VERSION), sql.BigInteger)
+
     def pk_columns(self) -> list[sql.Column]:
         return self._pk_cols
 
@@ -178,6 +202,7 @@ class StoreBase:
     def drop(self, conn: sql.engine.Connection) -> None:
         """Drop store table"""
         self.sa_md.drop_all(bind=conn)
+        conn.execute(sql.text(f'DROP TABLE IF EXISTS {self._backfill_tbl_name()}'))
 
     def add_column(self, col: catalog.Column, conn: sql.engine.Connection) -> None:
         """Add column(s) to the store-resident table based on a catalog column
@@ -213,6 +238,113 @@ class StoreBase:
             stmt = f'ALTER TABLE {self._storage_name()} DROP COLUMN {col.errortype_store_name()}'
             conn.execute(sql.text(stmt))
 
+    def _backfill_tbl_name(self) -> str:
+        return f'{self._storage_name()}_backfill'
+
+    def _create_backfill_sa_tbl(self) -> sql.Table:
+        """Create the sql.Table that records the progress of a resumable backfill
+
+        The table contains one header row for the backfill itself (with NULL rowid range) and one row per rowid range
+        [rowid_start, rowid_end) of the first rowid column that has been loaded into the store column.
+        """
+        return sql.Table(
+            self._backfill_tbl_name(), sql.MetaData(),
+            sql.Column('col_id', sql.Integer, nullable=False),
+            sql.Column('tbl_version', sql.BigInteger, nullable=False),
+            sql.Column('col_spec', sql.String, nullable=False),
+            sql.Column('rowid_start', sql.BigInteger, nullable=True),
+            sql.Column('rowid_end', sql.BigInteger, nullable=True),
+            sql.Column('num_excs', sql.Integer, nullable=True))
+
+    @classmethod
+    def _backfill_col_spec(cls, col: catalog.Column) -> str:
+        # Expr.id and Expr.as_dict() aren't stable across processes (for lambdas and local UDFs), so we identify the
+        # column by its name, type and the display form of its value expr
+        return f'{col.name}: {col.col_type} = {col.value_expr}'
+
+    def start_backfill(self, col: catalog.Column, conn: sql.engine.Connection) -> tuple[list[tuple[int, int]], int]:
+        """Prepare the resumable population of a new computed column col, which has been added to self.tbl_version.cols
+
+        If the store contains the progress of an earlier backfill of the same column (same id, spec and table version),
+        its loaded rowid ranges are kept; any other earlier backfill is discarded and the store column is added.
+
+        Returns:
+            (rowid ranges that still need to be loaded, number of exceptions in the ranges that were already loaded)
+        """
+        backfill_tbl = self._create_backfill_sa_tbl()
+        col_spec = self._backfill_col_spec(col)
+        loaded_ranges: Optional[list[tuple[int, int]]] = None
+        num_excs = 0
+        if sql.inspect(conn).has_table(backfill_tbl.name):
+            rows = conn.execute(sql.select(backfill_tbl)).all()
+            header = [row for row in rows if row.rowid_start is None]
+            if (
+                len(header) == 1 and header[0].col_id == col.id
+                and header[0].tbl_version == self.tbl_version.version and header[0].col_spec == col_spec
+            ):
+                loaded_ranges = [(row.rowid_start, row.rowid_end) for row in rows if row.rowid_start is not None]
+                num_excs = sum(row.num_excs for row in rows if row.rowid_start is not None)
+                _logger.info(
+                    f'Resuming backfill of column {col.name} in {self._storage_name()}: '
+                    f'{len(loaded_ranges)} rowid range(s) already loaded')
+            else:
+                self.discard_backfill(conn)
+
+        if loaded_ranges is None:
+            loaded_ranges = []
+            backfill_tbl.create(bind=conn)
+            conn.execute(
+                sql.insert(backfill_tbl).values(col_id=col.id, tbl_version=self.tbl_version.version, col_spec=col_spec))
+            self.add_column(col, conn)
+        else:
+            # the store column already exists
+            self.create_sa_tbl()
+
+        # divide the rowids that aren't covered by the loaded ranges into ranges of __BACKFILL_RANGE_SIZE
+        rowid_col = self.rowid_columns()[0]
+        stmt = (
+            sql.select(sql.func.min(rowid_col), sql.func.max(rowid_col))
+            .where(self.v_min_col <= self.tbl_version.version)
+            .where(self.v_max_col > self.tbl_version.version)
+        )
+        min_rowid, max_rowid = conn.execute(stmt).one()
+        ranges: list[tuple[int, int]] = []
+        if min_rowid is not None:
+            pos, stop = min_rowid, max_rowid + 1
+            for start, end in sorted(loaded_ranges) + [(stop, stop)]:
+                while pos < min(start, stop):
+                    range_end = min(pos + self.__BACKFILL_RANGE_SIZE, start, stop)
+                    ranges.append((pos, range_end))
+                    pos = range_end
+                pos = max(pos, end)
+        return ranges, num_excs
+
+    def record_backfill_range(
+        self, col: catalog.Column, rowid_start: int, rowid_end: int, num_excs: int, conn: sql.engine.Connection
+    ) -> None:
+        """Record that the values of col for the given rowid range have been loaded"""
+        backfill_tbl = self._create_backfill_sa_tbl()
+        conn.execute(sql.insert(backfill_tbl).values(
+            col_id=col.id, tbl_version=self.tbl_version.version, col_spec=self._backfill_col_spec(col),
+            rowid_start=rowid_start, rowid_end=rowid_end, num_excs=num_excs))
+
+    def finish_backfill(self, conn: sql.engine.Connection) -> None:
+        """Drop the progress of a completed backfill; the store column is retained"""
+        conn.execute(sql.text(f'DROP TABLE {self._backfill_tbl_name()}'))
+
+    def discard_backfill(self, conn: sql.engine.Connection) -> None:
+        """Drop the progress and the store column of an unfinished backfill, if there is one"""
+        backfill_tbl = self._create_backfill_sa_tbl()
+        if not sql.inspect(conn).has_table(backfill_tbl.name):
+            return
+        col_ids = conn.execute(
+            sql.select(backfill_tbl.c.col_id).where(backfill_tbl.c.rowid_start == None).distinct()).scalars().all()
+        for col_id in col_ids:
+            for store_name in [f'col_{col_id}', f'col_{col_id}_errormsg', f'col_{col_id}_errortype']:
+                conn.execute(sql.text(f'ALTER TABLE {self._storage_name()} DROP COLUMN IF EXISTS {store_name}'))
+        backfill_tbl.drop(bind=conn)
+        _logger.info(f'Discarded unfinished backfill of column(s) {col_ids} in {self._storage_name()}')
+
     def load_column(
         self,
         col: catalog.Column,
@@ -223,6 +355,11 @@ class StoreBase:
     ) -> int:
         """Update store column of a computed column with values produced by an execution plan
 
+        The values are staged in a temp table (with COPY, if the column types allow it) and applied to the store table
+        in chunks of __LOAD_COLUMN_CHUNK_SIZE rows: each chunk is staged, merged into the store table with an
+        UPDATE ... FROM, and then removed from the temp table. This bounds the memory needed for buffered values,
+        the size of the temp table and the number of rows touched by each UPDATE.
+
         Returns:
             number of rows with exceptions
         Raises:
@@ -248,12 +385,44 @@ class StoreBase:
         tmp_tbl = sql.Table(tmp_name, self.sa_md, *tmp_cols, prefixes=['TEMPORARY'])
         tmp_tbl.create(bind=conn)
 
+        copy_types: Optional[dict[str, str]] = {}
+        for tmp_col in tmp_cols:
+            type_name = self._copy_type_name(tmp_col.type)
+            if type_name is None:
+                copy_types = None
+                break
+            copy_types[tmp_col.name] = type_name
+
+        # update store table with values from temp table
+        update_stmt = sql.update(self.sa_tbl)
+        for pk_col, tmp_pk_col in zip(self.pk_columns(), tmp_pk_cols):
+            update_stmt = update_stmt.where(pk_col == tmp_pk_col)
+        update_stmt = update_stmt.values({col.sa_col: tmp_val_col})
+        if col.records_errors:
+            update_stmt = update_stmt.values({
+                col.sa_errortype_col: tmp_errortype_col,
+                col.sa_errormsg_col: tmp_errormsg_col
+            })
+        tbl_rows: list[dict[str, Any]] = []
+
+        def apply_chunk(is_first: bool) -> None:
+            # stage the buffered rows, merge them into the store table and clear the temp table
+            if copy_types is not None:
+                self._copy_rows(tmp_name, tbl_rows, copy_types, conn)
+            else:
+                conn.execute(sql.insert(tmp_tbl), tbl_rows)
+            if is_first:
+                log_explain(_logger, update_stmt, conn)
+            conn.execute(update_stmt)
+            conn.execute(sql.text(f'TRUNCATE TABLE {tmp_name}'))
+            tbl_rows.clear()
+
         try:
             # insert rows from exec_plan into temp table
             # TODO: unify the table row construction logic with RowBuilder.create_table_row()
+            num_chunks = 0
             for row_batch in exec_plan:
                 num_rows += len(row_batch)
-                tbl_rows: list[dict[str, Any]] = []
                 for result_row in row_batch:
                     tbl_row: dict[str, Any] = {}
                     for pk_col, pk_val in zip(self.pk_columns(), result_row.pk):
@@ -287,20 +456,11 @@ class StoreBase:
                                 tbl_row[col.sa_errormsg_col.name] = None
 
                     tbl_rows.append(tbl_row)
-                conn.execute(sql.insert(tmp_tbl), tbl_rows)
-
-            # update store table with values from temp table
-            update_stmt = sql.update(self.sa_tbl)
-            for pk_col, tmp_pk_col in zip(self.pk_columns(), tmp_pk_cols):
-                update_stmt = update_stmt.where(pk_col == tmp_pk_col)
-            update_stmt = update_stmt.values({col.sa_col: tmp_val_col})
-            if col.records_errors:
-                update_stmt = update_stmt.values({
-                    col.sa_errortype_col: tmp_errortype_col,
-                    col.sa_errormsg_col: tmp_errormsg_col
-                })
-            log_explain(_logger, update_stmt, conn)
-            conn.execute(update_stmt)
+                    if len(tbl_rows) == self.__LOAD_COLUMN_CHUNK_SIZE:
+                        apply_chunk(is_first=num_chunks == 0)
+                        num_chunks += 1
+            if len(tbl_rows) > 0:
+                apply_chunk(is_first=num_chunks == 0)
 
         finally:
             tmp_tbl.drop(bind=conn)
@@ -312,6 +472,10 @@ class StoreBase:
             show_progress: bool = True, rowids: Optional[Iterator[int]] = None, abort_on_exc: bool = False
     ) -> tuple[int, int, set[int]]:
         """Insert rows into the store table and update the catalog table's md
+
+        Table rows are buffered and written in batches, either with INSERT or, for large inserts, with
+        COPY ... FROM STDIN (see _copy_rows()).
+
         Returns:
             number of inserted rows, number of exceptions, set of column ids that have exceptions
         """
@@ -324,47 +488,143 @@ class StoreBase:
         progress_bar: Optional[tqdm] = None  # create this only after we started executing
         row_builder = exec_plan.row_builder
         media_cols = [info.col for info in row_builder.table_columns if info.col.col_type.is_media_type()]
+        copy_min_rows = self._copy_insert_min_rows()
+        copy_types = self._copy_types(row_builder) if copy_min_rows > 0 else None
+        batch_size = self.__COPY_BATCH_SIZE if copy_types is not None else self.__INSERT_BATCH_SIZE
+        table_rows: list[dict[str, Any]] = []
+
+        def flush() -> None:
+            # insert batch of rows
+            self._move_tmp_media_files(table_rows, media_cols, v_min)
+            with exec_plan.ctx.conn_lock:
+                if copy_types is not None and num_rows >= copy_min_rows:
+                    self._copy_rows(self._storage_name(), table_rows, copy_types, conn)
+                else:
+                    for batch_start_idx in range(0, len(table_rows), self.__INSERT_BATCH_SIZE):
+                        conn.execute(
+                            sql.insert(self.sa_tbl),
+                            table_rows[batch_start_idx:batch_start_idx + self.__INSERT_BATCH_SIZE])
+            table_rows.clear()
+
         try:
             exec_plan.open()
             for row_batch in exec_plan:
                 num_rows += len(row_batch)
-                for batch_start_idx in range(0, len(row_batch), self.__INSERT_BATCH_SIZE):
-                    # compute batch of rows and convert them into table rows
-                    table_rows: list[dict[str, Any]] = []
-                    batch_stop_idx = min(batch_start_idx + self.__INSERT_BATCH_SIZE, len(row_batch))
-                    for row_idx in range(batch_start_idx, batch_stop_idx):
-                        row = row_batch[row_idx]
-                        # if abort_on_exc == True, we need to check for media validation exceptions
-                        if abort_on_exc and row.has_exc():
-                            exc = row.get_first_exc()
-                            raise exc
-
-                        rowid = (next(rowids),) if rowids is not None else row.pk[:-1]
-                        pk = rowid + (v_min,)
-                        table_row, num_row_exc = self._create_table_row(row, row_builder, cols_with_excs, pk=pk)
-                        num_excs += num_row_exc
-                        table_rows.append(table_row)
-
-                        if show_progress:
-                            if progress_bar is None:
-                                warnings.simplefilter("ignore", category=TqdmWarning)
-                                progress_bar = tqdm(
-                                    desc=f'Inserting rows into `{self.tbl_version.name}`',
-                                    unit=' rows',
-                                    ncols=100,
-                                    file=sys.stdout
-                                )
-                            progress_bar.update(1)
-
-                    # insert batch of rows
-                    self._move_tmp_media_files(table_rows, media_cols, v_min)
-                    conn.execute(sql.insert(self.sa_tbl), table_rows)
+                # if abort_on_exc == True, we need to check for media validation exceptions
+                if abort_on_exc and row_batch.has_exc():
+                    exc = next(row.get_first_exc() for row in row_batch if row.has_exc())
+                    raise exc
+                # convert rows into table rows
+                for row in row_batch:
+                    rowid = (next(rowids),) if rowids is not None else row.pk[:-1]
+                    pk = rowid + (v_min,)
+                    table_row, num_row_exc = self._create_table_row(row, row_builder, cols_with_excs, pk=pk)
+                    num_excs += num_row_exc
+                    table_rows.append(table_row)
+
+                    if show_progress:
+                        if progress_bar is None:
+                            warnings.simplefilter("ignore", category=TqdmWarning)
+                            progress_bar = tqdm(
+                                desc=f'Inserting rows into `{self.tbl_version.name}`',
+                                unit=' rows',
+                                ncols=100,
+                                file=sys.stdout
+                            )
+                        progress_bar.update(1)
+
+                    if len(table_rows) == batch_size:
+                        flush()
+            if len(table_rows) > 0:
+                flush()
             if progress_bar is not None:
                 progress_bar.close()
             return num_rows, num_excs, cols_with_excs
         finally:
             exec_plan.close()
 
+    @classmethod
+    def _copy_insert_min_rows(cls) -> int:
+        """Minimum number of rows for which insert_rows() uses COPY; 0 disables COPY"""
+        min_rows = env.Env.get().config.get_int_value('copy_insert_min_rows')
+        return cls.__DEFAULT_COPY_INSERT_MIN_ROWS if min_rows is None else min_rows
+
+    @classmethod
+    def _copy_type_name(cls, sa_type: sql.types.TypeEngine) -> Optional[str]:
+        """Returns the name of the Postgres type used to encode values of sa_type for a binary COPY, if supported"""
+        if isinstance(sa_type, pgvector.sqlalchemy.Vector):
+            # subclasses are other vector types (eg, halfvec), for which pgvector.psycopg doesn't have binary dumpers
+            return 'vector' if type(sa_type) is pgvector.sqlalchemy.Vector else None
+        if isinstance(sa_type, sql.dialects.postgresql.JSONB):
+            return 'jsonb'
+        if isinstance(sa_type, sql.BigInteger):
+            return 'int8'
+        if isinstance(sa_type, sql.Integer):
+            return 'int4'
+        if isinstance(sa_type, sql.Float):
+            return 'float8'
+        if isinstance(sa_type, sql.Boolean):
+            return 'bool'
+        if isinstance(sa_type, sql.TIMESTAMP):
+            return 'timestamptz' if sa_type.timezone else 'timestamp'
+        if isinstance(sa_type, sql.LargeBinary):
+            return 'bytea'
+        if isinstance(sa_type, sql.String):
+            return 'text'
+        return None
+
+    def _copy_types(self, row_builder: exprs.RowBuilder) -> Optional[dict[str, str]]:
+        """Returns the store columns of the table rows created by row_builder with their COPY type names, or None
+        if any of the columns can't be written with a binary COPY"""
+        store_cols = list(self._pk_cols)
+        for info in row_builder.table_columns:
+            store_cols.append(info.col.sa_col)
+            if info.col.records_errors:
+                store_cols.extend([info.col.sa_errortype_col, info.col.sa_errormsg_col])
+        result: dict[str, str] = {}
+        for col in store_cols:
+            type_name = self._copy_type_name(col.type)
+            if type_name is None:
+                return None
+            result[col.name] = type_name
+        return result
+
+    def _copy_rows(
+        self, tbl_name: str, table_rows: list[dict[str, Any]], copy_types: dict[str, str],
+        conn: sql.engine.Connection
+    ) -> None:
+        """Insert table rows (dicts keyed by column name) into tbl_name with COPY ... FROM STDIN (FORMAT BINARY)
+
+        The rows are streamed through psycopg's copy API on the DBAPI connection underlying conn, which means they're
+        part of conn's current transaction.
+        """
+        # the table rows only contain the columns for which we have values
+        col_names = [name for name in copy_types if name in table_rows[0]]
+        stmt = f'COPY {tbl_name} ({", ".join(col_names)}) FROM STDIN (FORMAT BINARY)'
+        log_stmt(_logger, sql.text(stmt))
+        driver_conn = conn.connection.driver_connection
+        session_tz = driver_conn.info.timezone
+        with driver_conn.cursor() as cursor:
+            if 'vector' in copy_types.values():
+                # the vector dumpers are only registered for this cursor
+                import pgvector.psycopg  # type: ignore[import-untyped]
+                from psycopg.types import TypeInfo
+                pgvector.psycopg.register_vector_info(cursor, TypeInfo.fetch(driver_conn, 'vector'))
+            with cursor.copy(stmt) as copy:
+                copy.set_types([copy_types[name] for name in col_names])
+                for table_row in table_rows:
+                    copy.write_row([self._copy_val(table_row[name], session_tz) for name in col_names])
+
+    @classmethod
+    def _copy_val(cls, val: Any, session_tz: datetime.tzinfo) -> Any:
+        if isinstance(val, sql.sql.elements.Null):
+            # explicit NULL for json columns (see DataRow.get_stored_val())
+            return None
+        if isinstance(val, datetime.datetime) and val.tzinfo is None:
+            # with INSERT, Postgres interprets naive timestamps in the session time zone
+            return val.replace(tzinfo=session_tz)
+        return val
+
     def _versions_clause(self, versions: list[Optional[int]], match_on_vmin: bool) -> sql.ColumnElement[bool]:
         """Return filter for base versions"""
         v = versions[0]
@@ -382,7 +642,7 @@ class StoreBase:
             self, current_version: int, base_versions: list[Optional[int]], match_on_vmin: bool,
             where_clause: Optional[sql.ColumnElement[bool]], conn: sql.engine.Connection) -> int:
         """Mark rows as deleted that are live and were created prior to current_version.
-        Also: populate the undo columns
+        Also: populate the undo columns of indices that have them (see TableVersion._add_index())
         Args:
             base_versions: if non-None, join only to base rows that were created at that version,
                 otherwise join to rows that are live in the base's current version (which is distinct from the
@@ -402,6 +662,9 @@ class StoreBase:
             else self.base._versions_clause(base_versions, match_on_vmin)
         set_clause: dict[sql.Column, Union[int, sql.Column]] = {self.v_max_col: current_version}
         for index_info in self.tbl_version.idxs_by_name.values():
+            if index_info.undo_col is None:
+                # the row drops out of the partial index
+                continue
             # copy value column to undo column
             set_clause[index_info.undo_col.sa_col] = index_info.val_col.sa_col
             # set value column to NULL
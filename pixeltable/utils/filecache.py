@@ -1,15 +1,17 @@
 from __future__ import annotations
 
-import glob
 import hashlib
 import logging
 import os
+import sqlite3
+import threading
+import time
 import warnings
-from collections import OrderedDict, defaultdict, namedtuple
+from collections import namedtuple
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 from uuid import UUID
 
 import pixeltable.exceptions as excs
@@ -45,6 +47,11 @@ class CacheEntry:
         last_used = datetime.fromtimestamp(file_info.st_mtime, tz=timezone.utc)
         return cls(key, tbl_id, col_id, file_info.st_size, last_used, path.suffix)
 
+    @classmethod
+    def from_index_row(cls, row: tuple[Any, ...]) -> CacheEntry:
+        key, tbl_id, col_id, size, last_used, ext = row
+        return cls(key, UUID(tbl_id), col_id, size, datetime.fromtimestamp(last_used, tz=timezone.utc), ext)
+
 
 class FileCache:
     """
@@ -53,13 +60,23 @@ class FileCache:
     Cache entries are identified by a hash of the file url and stored in Env.filecache_dir. The time of last
     access of a cache entries is its file's mtime.
 
+    The entries are recorded in an index (a SQLite database next to the cache directory), which makes startup cost
+    independent of the number of cached files: entries are looked up, counted and evicted (in order of last access)
+    with indexed queries, rather than by scanning the directory. The index is reconciled with the directory only if
+    the directory was modified by something other than the cache itself (detected by comparing the directory's mtime
+    with the one recorded after the last modification), eg, after a crash, or if the index doesn't exist yet. Index
+    entries whose file has gone missing are also removed when they're looked up.
+
+    The cache is thread-safe: plans that run concurrently in different threads (eg, when loading several views) share
+    it.
+
     TODO:
     - implement MRU eviction for queries that exceed the capacity
     """
     __instance: Optional[FileCache] = None
 
-    cache: OrderedDict[str, CacheEntry]
-    total_size: int
+    index: sqlite3.Connection
+    lock: threading.RLock  # guards index and the stats
     capacity_bytes: int
     num_requests: int
     num_hits: int
@@ -83,6 +100,9 @@ class FileCache:
         ('total_size', 'num_requests', 'num_hits', 'num_evictions', 'column_stats')
     )
 
+    INDEX_FILE_NAME = 'file_cache_index.db'
+    __EVICTION_BATCH_SIZE = 64
+
     @classmethod
     def get(cls) -> FileCache:
         if cls.__instance is None:
@@ -91,11 +111,11 @@ class FileCache:
 
     @classmethod
     def init(cls) -> None:
+        if cls.__instance is not None:
+            cls.__instance.index.close()
         cls.__instance = cls()
 
     def __init__(self):
-        self.cache = OrderedDict()
-        self.total_size = 0
         self.capacity_bytes = int(Env.get()._file_cache_size_g * (1 << 30))
         self.num_requests = 0
         self.num_hits = 0
@@ -104,48 +124,139 @@ class FileCache:
         self.keys_evicted_after_retrieval = set()
         self.evicted_working_set_keys = set()
         self.new_redownload_witnessed = False
-        paths = glob.glob(str(Env.get().file_cache_dir / '*'))
-        entries = [CacheEntry.from_file(Path(path_str)) for path_str in paths]
-        # we need to insert entries in access order
-        entries.sort(key=lambda e: e.last_used)
-        for entry in entries:
-            self.cache[entry.key] = entry
-            self.total_size += entry.size
+        self.lock = threading.RLock()
+        self.index = self._open_index()
+        recorded_mtime = self._get_meta('dir_mtime_ns')
+        if recorded_mtime is None or recorded_mtime != self._dir_mtime():
+            self._reconcile()
+
+    @classmethod
+    def index_path(cls) -> Path:
+        return Env.get().file_cache_dir.with_name(cls.INDEX_FILE_NAME)
+
+    def _open_index(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.index_path()), check_same_thread=False)
+        # with WAL, commits don't need to wait for an fsync
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, tbl_id TEXT NOT NULL, '
+                'col_id INTEGER NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL, ext TEXT NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_tbl_id ON entries (tbl_id)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('total_size', 0)")
+        return conn
+
+    def _get_meta(self, name: str) -> Optional[int]:
+        row = self.index.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def _dir_mtime(self) -> int:
+        return os.stat(str(Env.get().file_cache_dir)).st_mtime_ns
+
+    def _record_dir_mtime(self) -> None:
+        """Record the mtime of the directory after we modified it"""
+        self.index.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('dir_mtime_ns', ?)", (self._dir_mtime(),))
+
+    def _reconcile(self) -> None:
+        """Make the index consistent with the contents of the cache directory"""
+        start = time.monotonic()
+        with self.lock, self.index:
+            indexed_keys = {row[0] for row in self.index.execute('SELECT key FROM entries')}
+            file_keys: set[str] = set()
+            new_entries: list[CacheEntry] = []
+            with os.scandir(str(Env.get().file_cache_dir)) as it:
+                for dir_entry in it:
+                    if not dir_entry.is_file() or dir_entry.name.startswith('.'):
+                        continue
+                    try:
+                        entry = CacheEntry.from_file(Path(dir_entry.path))
+                    except (AssertionError, ValueError):
+                        _logger.debug(f'ignoring unexpected file in file cache: {dir_entry.name}')
+                        continue
+                    file_keys.add(entry.key)
+                    if entry.key not in indexed_keys:
+                        new_entries.append(entry)
+            self.index.executemany(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                [(e.key, e.tbl_id.hex, e.col_id, e.size, e.last_used.timestamp(), e.ext) for e in new_entries])
+            missing_keys = indexed_keys - file_keys
+            self.index.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in missing_keys])
+            self.index.execute(
+                "UPDATE meta SET value = (SELECT COALESCE(SUM(size), 0) FROM entries) WHERE name = 'total_size'")
+            self._record_dir_mtime()
+        _logger.debug(
+            f'reconciled file cache index with {len(file_keys)} files: added {len(new_entries)}, '
+            f'removed {len(missing_keys)} entries ({time.monotonic() - start:.2f}s)')
+
+    @property
+    def total_size(self) -> int:
+        with self.lock:
+            return self._get_meta('total_size')
+
+    def _get_entry(self, key: str) -> Optional[CacheEntry]:
+        row = self.index.execute(
+            'SELECT key, tbl_id, col_id, size, last_used, ext FROM entries WHERE key = ?', (key,)).fetchone()
+        return None if row is None else CacheEntry.from_index_row(row)
+
+    def _remove_entry(self, entry: CacheEntry) -> bool:
+        """
+        Remove entry from the index and the directory; requires the lock and an open transaction.
+        Returns False if the entry had already been removed.
+        """
+        # the size that is subtracted is the one of the entry that is deleted, which might have been replaced since
+        # entry was read
+        row = self.index.execute('SELECT size FROM entries WHERE key = ?', (entry.key,)).fetchone()
+        if row is None:
+            return False
+        self.index.execute('DELETE FROM entries WHERE key = ?', (entry.key,))
+        self.index.execute("UPDATE meta SET value = value - ? WHERE name = 'total_size'", (row[0],))
+        entry.path.unlink(missing_ok=True)
+        return True
 
     def avg_file_size(self) -> int:
-        if len(self.cache) == 0:
+        with self.lock:
+            num_files, total_size = \
+                self.index.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        if num_files == 0:
             return 0
-        return int(self.total_size / len(self.cache))
+        return int(total_size / num_files)
 
     def num_files(self, tbl_id: Optional[UUID] = None) -> int:
-        if tbl_id is None:
-            return len(self.cache)
-        return sum(e.tbl_id == tbl_id for e in self.cache.values())
+        with self.lock:
+            if tbl_id is None:
+                return self.index.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            return self.index.execute('SELECT COUNT(*) FROM entries WHERE tbl_id = ?', (tbl_id.hex,)).fetchone()[0]
 
     def clear(self, tbl_id: Optional[UUID] = None) -> None:
         """
         For testing purposes: allow resetting capacity and stats.
         """
-        if tbl_id is None:
-            # We need to store the entries to remove in a list, because we can't remove items from a dict while iterating
-            entries_to_remove = list(self.cache.values())
-            _logger.debug(f'clearing {self.num_files()} entries from file cache')
-            self.num_requests, self.num_hits, self.num_evictions = 0, 0, 0
-            self.keys_retrieved.clear()
-            self.keys_evicted_after_retrieval.clear()
-            self.new_redownload_witnessed = False
-        else:
-            entries_to_remove = [e for e in self.cache.values() if e.tbl_id == tbl_id]
-            _logger.debug(f'clearing {self.num_files(tbl_id)} entries from file cache for table {tbl_id}')
-        for entry in entries_to_remove:
-            os.remove(entry.path)
-            del self.cache[entry.key]
-            self.total_size -= entry.size
+        query = 'SELECT key, tbl_id, col_id, size, last_used, ext FROM entries'
+        with self.lock, self.index:
+            if tbl_id is None:
+                _logger.debug(f'clearing {self.num_files()} entries from file cache')
+                self.num_requests, self.num_hits, self.num_evictions = 0, 0, 0
+                self.keys_retrieved.clear()
+                self.keys_evicted_after_retrieval.clear()
+                self.new_redownload_witnessed = False
+                rows = self.index.execute(query).fetchall()
+            else:
+                _logger.debug(f'clearing {self.num_files(tbl_id)} entries from file cache for table {tbl_id}')
+                rows = self.index.execute(f'{query} WHERE tbl_id = ?', (tbl_id.hex,)).fetchall()
+            for row in rows:
+                self._remove_entry(CacheEntry.from_index_row(row))
+            self._record_dir_mtime()
 
     def emit_eviction_warnings(self) -> None:
         if self.new_redownload_witnessed:
             # Compute the additional capacity that would be needed in order to retain all the re-downloaded files
-            extra_capacity_needed = sum(self.cache[key].size for key in self.evicted_working_set_keys)
+            with self.lock:
+                entries = [self._get_entry(key) for key in self.evicted_working_set_keys]
+            extra_capacity_needed = sum(entry.size for entry in entries if entry is not None)
             suggested_cache_size = self.capacity_bytes + extra_capacity_needed + (1 << 30)
             warnings.warn(
                 f'{len(self.evicted_working_set_keys)} media file(s) had to be downloaded multiple times this session, '
@@ -164,20 +275,27 @@ class FileCache:
         return h.hexdigest()
 
     def lookup(self, url: str) -> Optional[Path]:
-        self.num_requests += 1
         key = self._url_hash(url)
-        entry = self.cache.get(key, None)
-        if entry is None:
-            _logger.debug(f'file cache miss for {url}')
-            return None
-        # update mtime and cache
-        path = entry.path
-        path.touch(exist_ok=True)
-        file_info = os.stat(str(path))
-        entry.last_used = datetime.fromtimestamp(file_info.st_mtime)
-        self.cache.move_to_end(key, last=True)
-        self.num_hits += 1
-        self.keys_retrieved.add(key)
+        # the lock is held until the mtime is updated, so that the entry can't get evicted in the meantime
+        with self.lock, self.index:
+            self.num_requests += 1
+            entry = self._get_entry(key)
+            if entry is None:
+                _logger.debug(f'file cache miss for {url}')
+                return None
+            # update mtime and index
+            path = entry.path
+            now = time.time()
+            try:
+                os.utime(str(path), (now, now))
+            except FileNotFoundError:
+                # the file disappeared without us noticing
+                _logger.debug(f'file cache entry for {url} has no file; removing it')
+                self._remove_entry(entry)
+                return None
+            self.index.execute('UPDATE entries SET last_used = ? WHERE key = ?', (now, key))
+            self.num_hits += 1
+            self.keys_retrieved.add(key)
         _logger.debug(f'file cache hit for {url}')
         return path
 
@@ -186,21 +304,30 @@ class FileCache:
         'path' will not be accessible after this call. Retains the extension of 'path'.
         """
         file_info = os.stat(str(path))
-        self.ensure_capacity(file_info.st_size)
         key = self._url_hash(url)
-        assert key not in self.cache
-        if key in self.keys_evicted_after_retrieval:
-            # This key was evicted after being retrieved earlier this session, and is now being retrieved again.
-            # Add it to `keys_multiply_downloaded` so that we may generate a warning later.
-            self.evicted_working_set_keys.add(key)
-            self.new_redownload_witnessed = True
-        self.keys_retrieved.add(key)
-        entry = CacheEntry(key, tbl_id, col_id, file_info.st_size, datetime.fromtimestamp(file_info.st_mtime), path.suffix)
-        self.cache[key] = entry
-        self.total_size += entry.size
+        with self.lock:
+            self.ensure_capacity(file_info.st_size)
+            if key in self.keys_evicted_after_retrieval:
+                # This key was evicted after being retrieved earlier this session, and is now being retrieved again.
+                # Add it to `keys_multiply_downloaded` so that we may generate a warning later.
+                self.evicted_working_set_keys.add(key)
+                self.new_redownload_witnessed = True
+            self.keys_retrieved.add(key)
+        now = time.time()
+        entry = CacheEntry(
+            key, tbl_id, col_id, file_info.st_size, datetime.fromtimestamp(now, tz=timezone.utc), path.suffix)
         new_path = entry.path
-        os.rename(str(path), str(new_path))
-        new_path.touch(exist_ok=True)
+        with self.lock, self.index:
+            prev_size = self.index.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            # another process might have added the same url in the meantime
+            size_delta = entry.size - (prev_size[0] if prev_size is not None else 0)
+            self.index.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                (key, tbl_id.hex, col_id, entry.size, now, entry.ext))
+            self.index.execute("UPDATE meta SET value = value + ? WHERE name = 'total_size'", (size_delta,))
+            os.rename(str(path), str(new_path))
+            os.utime(str(new_path), (now, now))
+            self._record_dir_mtime()
         _logger.debug(f'added entry for cell {url} to file cache')
         return new_path
 
@@ -208,35 +335,52 @@ class FileCache:
         """
         Evict entries from the cache until there is at least 'size' bytes of free space.
         """
-        while len(self.cache) > 0 and self.total_size + size > self.capacity_bytes:
-            _, lru_entry = self.cache.popitem(last=False)
-            self.total_size -= lru_entry.size
-            self.num_evictions += 1
-            if lru_entry.key in self.keys_retrieved:
-                # This key was retrieved at some point earlier this session and is now being evicted.
-                # Make a record of the eviction, so that we can generate a warning later if the key is retrieved again.
-                self.keys_evicted_after_retrieval.add(lru_entry.key)
-            os.remove(str(lru_entry.path))
-            _logger.debug(f'evicted entry for cell {lru_entry.key} from file cache (of size {lru_entry.size // (1 << 20)} MiB)')
+        with self.lock:
+            while self.total_size + size > self.capacity_bytes:
+                with self.index:
+                    # the selected entries are removed in the same transaction, under the same lock
+                    rows = self.index.execute(
+                        'SELECT key, tbl_id, col_id, size, last_used, ext FROM entries ORDER BY last_used LIMIT ?',
+                        (self.__EVICTION_BATCH_SIZE,)).fetchall()
+                    if len(rows) == 0:
+                        break
+                    for row in rows:
+                        if self.total_size + size <= self.capacity_bytes:
+                            break
+                        lru_entry = CacheEntry.from_index_row(row)
+                        if not self._remove_entry(lru_entry):
+                            # another process evicted it
+                            continue
+                        self.num_evictions += 1
+                        if lru_entry.key in self.keys_retrieved:
+                            # This key was retrieved at some point earlier this session and is now being evicted.
+                            # Make a record of the eviction, so that we can generate a warning later if the key is
+                            # retrieved again.
+                            self.keys_evicted_after_retrieval.add(lru_entry.key)
+                        _logger.debug(
+                            f'evicted entry for cell {lru_entry.key} from file cache '
+                            f'(of size {lru_entry.size // (1 << 20)} MiB)')
+                    self._record_dir_mtime()
 
     def set_capacity(self, capacity_bytes: int) -> None:
         self.capacity_bytes = capacity_bytes
         self.ensure_capacity(0)  # evict entries if necessary
 
     def stats(self) -> FileCacheStats:
-        # collect column stats
-        # (tbl_id, col_id) -> (num_files, total_size)
-        d: dict[tuple[UUID, int], list[int]] = defaultdict(lambda: [0, 0])
-        for entry in self.cache.values():
-            t = d[(entry.tbl_id, entry.col_id)]
-            t[0] += 1
-            t[1] += entry.size
+        with self.lock:
+            # collect column stats
+            rows = self.index.execute(
+                'SELECT tbl_id, col_id, COUNT(*), SUM(size) FROM entries GROUP BY tbl_id, col_id').fetchall()
+            total_size, num_requests, num_hits, num_evictions = \
+                self.total_size, self.num_requests, self.num_hits, self.num_evictions
         col_stats = [
-            self.FileCacheColumnStats(tbl_id, col_id, num_files, size) for (tbl_id, col_id), (num_files, size) in d.items()
+            self.FileCacheColumnStats(UUID(tbl_id), col_id, num_files, size) for tbl_id, col_id, num_files, size in rows
         ]
         col_stats.sort(key=lambda e: e[3], reverse=True)
-        return self.FileCacheStats(self.total_size, self.num_requests, self.num_hits, self.num_evictions, col_stats)
+        return self.FileCacheStats(total_size, num_requests, num_hits, num_evictions, col_stats)
 
     def debug_print(self) -> None:
-        for entry in self.cache.values():
-            _logger.debug(f'CacheEntry: tbl_id={entry.tbl_id}, col_id={entry.col_id}, size={entry.size}')
+        with self.lock:
+            rows = self.index.execute('SELECT tbl_id, col_id, size FROM entries').fetchall()
+        for tbl_id, col_id, size in rows:
+            _logger.debug(f'CacheEntry: tbl_id={UUID(tbl_id)}, col_id={col_id}, size={size}')
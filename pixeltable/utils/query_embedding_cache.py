@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+import numpy as np
+import PIL.Image
+
+from pixeltable.env import Env
+
+if TYPE_CHECKING:
+    from pixeltable import func
+
+_logger = logging.getLogger('pixeltable')
+
+
+class QueryEmbeddingCache:
+    """
+    An in-process LRU cache of the embeddings of similarity() query items (strings and images).
+
+    Entries are keyed by the embedding function and a digest of the item. Entries hold a reference to their function,
+    so that a function's id() identifies it for as long as it has entries. Function instances are recreated when the
+    catalog is reloaded, which means that entries never outlive the definition of their function.
+
+    The capacity (number of entries) is given by the config option query_embedding_cache_size; 0 disables the cache.
+    """
+    __instance: Optional[QueryEmbeddingCache] = None
+
+    cache: OrderedDict[tuple[int, bytes], tuple[func.Function, np.ndarray]]
+    capacity: int
+    num_requests: int
+    num_hits: int
+    num_evictions: int
+    lock: threading.Lock
+
+    QueryEmbeddingCacheStats = namedtuple(
+        'QueryEmbeddingCacheStats', ('num_entries', 'num_requests', 'num_hits', 'num_evictions'))
+
+    DEFAULT_CAPACITY = 1024
+
+    @classmethod
+    def get(cls) -> QueryEmbeddingCache:
+        if cls.__instance is None:
+            cls.init()
+        return cls.__instance
+
+    @classmethod
+    def init(cls) -> None:
+        cls.__instance = cls()
+
+    def __init__(self):
+        self.cache = OrderedDict()
+        capacity = Env.get().config.get_int_value('query_embedding_cache_size')
+        self.capacity = self.DEFAULT_CAPACITY if capacity is None else capacity
+        self.num_requests = 0
+        self.num_hits = 0
+        self.num_evictions = 0
+        self.lock = threading.Lock()
+
+    def get_embedding(self, embed_fn: func.Function, item: Any, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        """Returns the embedding of item under embed_fn, calling compute() on a miss"""
+        embedding = self.lookup(embed_fn, item)
+        if embedding is None:
+            embedding = compute()
+            self.add(embed_fn, item, embedding)
+        return embedding
+
+    def lookup(self, embed_fn: func.Function, item: Any) -> Optional[np.ndarray]:
+        if self.capacity == 0:
+            return None
+        key = (id(embed_fn), self._item_digest(item))
+        with self.lock:
+            self.num_requests += 1
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            self.cache.move_to_end(key)
+            self.num_hits += 1
+            return entry[1]
+
+    def add(self, embed_fn: func.Function, item: Any, embedding: np.ndarray) -> None:
+        if self.capacity == 0:
+            return
+        key = (id(embed_fn), self._item_digest(item))
+        with self.lock:
+            self.cache[key] = (embed_fn, embedding)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+                self.num_evictions += 1
+
+    @classmethod
+    def _item_digest(cls, item: Any) -> bytes:
+        h = hashlib.sha256()
+        if isinstance(item, str):
+            h.update(b'str:')
+            h.update(item.encode())
+        else:
+            assert isinstance(item, PIL.Image.Image)
+            h.update(f'image:{item.mode}:{item.size}:'.encode())
+            h.update(item.tobytes())
+        return h.digest()
+
+    def clear(self) -> None:
+        """Removes all entries and resets the stats"""
+        with self.lock:
+            _logger.debug(f'clearing {len(self.cache)} entries from query embedding cache')
+            self.cache.clear()
+            self.num_requests, self.num_hits, self.num_evictions = 0, 0, 0
+
+    def set_capacity(self, capacity: int) -> None:
+        with self.lock:
+            self.capacity = capacity
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+                self.num_evictions += 1
+
+    def stats(self) -> QueryEmbeddingCacheStats:
+        with self.lock:
+            return self.QueryEmbeddingCacheStats(len(self.cache), self.num_requests, self.num_hits, self.num_evictions)
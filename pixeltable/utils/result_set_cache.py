@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import logging
+import pickle
+import threading
+from collections import OrderedDict, namedtuple
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+from uuid import UUID
+
+from pixeltable.env import Env
+
+if TYPE_CHECKING:
+    from pixeltable.dataframe import DataFrameResultSet
+
+_logger = logging.getLogger('pixeltable')
+
+
+@dataclass
+class _SpilledEntry:
+    path: Path
+    size: int
+    tbl_ids: frozenset[UUID]
+
+
+class ResultSetCache:
+    """
+    An in-process LRU cache of the results of DataFrame.collect() (and of show(), head() and tail(), which call it).
+
+    Entries are keyed by DataFrame._hash_result_set(), which covers the query and the versions of the tables it
+    references, so that an entry no longer matches once one of those tables has changed. Reverting a table returns it
+    to an earlier version number, which is why reverts invalidate the entries of the table explicitly (invalidate()).
+    Results of queries with non-deterministic functions are returned from the cache as well, which is the caller's
+    responsibility when enabling it.
+
+    The capacity (number of result sets kept in memory) is given by the config option result_set_cache_size; 0 (the
+    default) disables the cache. Result sets evicted from memory are spilled to files in Env.tmp_dir, up to
+    result_set_cache_spill_g GiB in total (default: 0, ie, they're discarded); a hit on a spilled entry moves it back
+    into memory.
+    """
+    __instance: Optional[ResultSetCache] = None
+
+    # key -> (referenced table ids, rows, schema)
+    cache: OrderedDict[str, tuple[frozenset[UUID], list[list[Any]], dict]]
+    spilled: OrderedDict[str, _SpilledEntry]
+    capacity: int
+    spill_capacity_bytes: int
+    spilled_size: int
+    num_requests: int
+    num_hits: int
+    num_spilled_hits: int
+    num_evictions: int
+    lock: threading.Lock
+
+    ResultSetCacheStats = namedtuple(
+        'ResultSetCacheStats',
+        ('num_entries', 'num_spilled_entries', 'spilled_size', 'num_requests', 'num_hits', 'num_spilled_hits',
+         'num_evictions', 'hit_rate'))
+
+    @classmethod
+    def get(cls) -> ResultSetCache:
+        if cls.__instance is None:
+            cls.init()
+        return cls.__instance
+
+    @classmethod
+    def init(cls) -> None:
+        cls.__instance = cls()
+
+    def __init__(self):
+        self.cache = OrderedDict()
+        self.spilled = OrderedDict()
+        capacity = Env.get().config.get_int_value('result_set_cache_size')
+        self.capacity = 0 if capacity is None else capacity
+        spill_g = Env.get().config.get_float_value('result_set_cache_spill_g')
+        self.spill_capacity_bytes = int((0.0 if spill_g is None else spill_g) * (1 << 30))
+        self.spilled_size = 0
+        self.num_requests = 0
+        self.num_hits = 0
+        self.num_spilled_hits = 0
+        self.num_evictions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.capacity > 0
+
+    def lookup(self, key: str) -> Optional[DataFrameResultSet]:
+        """Returns a copy of the cached result set, or None on a miss"""
+        from pixeltable.dataframe import DataFrameResultSet
+
+        if not self.is_enabled:
+            return None
+        with self.lock:
+            self.num_requests += 1
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+            else:
+                entry = self._unspill(key)
+                if entry is None:
+                    return None
+                self.num_spilled_hits += 1
+                self._add(key, entry)
+            self.num_hits += 1
+            _, rows, schema = entry
+        # callers can modify the result set (eg, tail() reverses its rows)
+        return DataFrameResultSet([list(row) for row in rows], schema)
+
+    def add(self, key: str, tbl_ids: frozenset[UUID], result_set: DataFrameResultSet) -> None:
+        if not self.is_enabled:
+            return
+        entry = (tbl_ids, [list(row) for row in result_set._rows], result_set.schema)
+        with self.lock:
+            self._add(key, entry)
+
+    def _add(self, key: str, entry: tuple[frozenset[UUID], list[list[Any]], dict]) -> None:
+        self.cache[key] = entry
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.capacity:
+            lru_key, lru_entry = self.cache.popitem(last=False)
+            self.num_evictions += 1
+            self._spill(lru_key, lru_entry)
+
+    def _spill(self, key: str, entry: tuple[frozenset[UUID], list[list[Any]], dict]) -> None:
+        if self.spill_capacity_bytes == 0:
+            return
+        try:
+            data = pickle.dumps(entry[1:])
+        except Exception:
+            return
+        if len(data) > self.spill_capacity_bytes:
+            return
+        while len(self.spilled) > 0 and self.spilled_size + len(data) > self.spill_capacity_bytes:
+            _, lru_spilled = self.spilled.popitem(last=False)
+            self._discard(lru_spilled)
+        path = Env.get().create_tmp_path('.pkl')
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+        except OSError as exc:
+            # a failure to spill an entry shouldn't fail the query
+            _logger.warning(f'failed to spill result set cache entry: {exc}')
+            path.unlink(missing_ok=True)
+            return
+        self.spilled[key] = _SpilledEntry(path, len(data), entry[0])
+        self.spilled_size += len(data)
+
+    def _unspill(self, key: str) -> Optional[tuple[frozenset[UUID], list[list[Any]], dict]]:
+        spilled_entry = self.spilled.pop(key, None)
+        if spilled_entry is None:
+            return None
+        self.spilled_size -= spilled_entry.size
+        try:
+            with open(spilled_entry.path, 'rb') as f:
+                rows, schema = pickle.load(f)
+        except Exception as exc:
+            _logger.debug(f'discarding unreadable result set cache entry {spilled_entry.path.name}: {exc}')
+            return None
+        finally:
+            spilled_entry.path.unlink(missing_ok=True)
+        return spilled_entry.tbl_ids, rows, schema
+
+    def _discard(self, spilled_entry: _SpilledEntry) -> None:
+        self.spilled_size -= spilled_entry.size
+        spilled_entry.path.unlink(missing_ok=True)
+
+    def invalidate(self, tbl_id: UUID) -> None:
+        """Removes the entries of queries that reference the given table"""
+        with self.lock:
+            for key in [key for key, entry in self.cache.items() if tbl_id in entry[0]]:
+                del self.cache[key]
+            for key in [key for key, entry in self.spilled.items() if tbl_id in entry.tbl_ids]:
+                self._discard(self.spilled.pop(key))
+
+    def clear(self) -> None:
+        """Removes all entries and resets the stats"""
+        with self.lock:
+            _logger.debug(f'clearing {len(self.cache) + len(self.spilled)} entries from result set cache')
+            self.cache.clear()
+            for spilled_entry in self.spilled.values():
+                self._discard(spilled_entry)
+            self.spilled.clear()
+            self.num_requests, self.num_hits, self.num_spilled_hits, self.num_evictions = 0, 0, 0, 0
+
+    def set_capacity(self, capacity: int, spill_capacity_bytes: Optional[int] = None) -> None:
+        with self.lock:
+            self.capacity = capacity
+            if spill_capacity_bytes is not None:
+                self.spill_capacity_bytes = spill_capacity_bytes
+            while len(self.spilled) > 0 and self.spilled_size > self.spill_capacity_bytes:
+                _, lru_spilled = self.spilled.popitem(last=False)
+                self._discard(lru_spilled)
+            while len(self.cache) > self.capacity:
+                lru_key, lru_entry = self.cache.popitem(last=False)
+                self.num_evictions += 1
+                self._spill(lru_key, lru_entry)
+
+    def stats(self) -> ResultSetCacheStats:
+        with self.lock:
+            hit_rate = self.num_hits / self.num_requests if self.num_requests > 0 else 0.0
+            return self.ResultSetCacheStats(
+                len(self.cache), len(self.spilled), self.spilled_size, self.num_requests, self.num_hits,
+                self.num_spilled_hits, self.num_evictions, hit_rate)
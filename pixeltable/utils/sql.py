@@ -7,6 +7,12 @@ from sqlalchemy.dialects import postgresql
 def log_stmt(logger: logging.Logger, stmt) -> None:
     logger.debug(f'executing {str(stmt.compile(dialect=postgresql.dialect()))}')
 
+def explain(stmt: sql.Select, conn: sql.engine.Connection, fmt: str = 'TEXT') -> sql.engine.CursorResult:
+    """Runs EXPLAIN for stmt, which is compiled for the dialect of conn and executed with bound parameters"""
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={'render_postcompile': True})
+    # the driver turns the escaped % operator (%%) back into % when it binds the parameters
+    return conn.exec_driver_sql(f'EXPLAIN (FORMAT {fmt}) {compiled.string}', compiled.params)
+
 def log_explain(logger: logging.Logger, stmt: sql.sql.ClauseElement, conn: sql.engine.Connection) -> None:
     try:
         # don't set dialect=Env.get().engine.dialect: x % y turns into x %% y, which results in a syntax error
@@ -0,0 +1,418 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from dataclasses import dataclass
+from datetime import timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+import numpy as np
+import PIL.Image
+
+import pixeltable.type_system as ts
+from pixeltable.env import Env
+
+if TYPE_CHECKING:
+    from pixeltable import func
+
+_logger = logging.getLogger('pixeltable')
+
+
+@dataclass
+class UdfCacheEntry:
+
+    fn_key: str
+    key: str
+    size: int
+    last_used: datetime.datetime
+
+    @property
+    def path(self) -> Path:
+        return Env.get().udf_cache_dir / f'{self.fn_key}_{self.key}.pkl'
+
+    @classmethod
+    def from_file(cls, path: Path) -> UdfCacheEntry:
+        components = path.stem.split('_')
+        assert len(components) == 2
+        file_info = os.stat(str(path))
+        # as in FileCache, the mtime of the file represents the last used time of the entry
+        last_used = datetime.datetime.fromtimestamp(file_info.st_mtime, tz=timezone.utc)
+        return cls(components[0], components[1], file_info.st_size, last_used)
+
+    @classmethod
+    def from_index_row(cls, row: tuple[Any, ...]) -> UdfCacheEntry:
+        fn_key, key, size, last_used = row
+        return cls(fn_key, key, size, datetime.datetime.fromtimestamp(last_used, tz=timezone.utc))
+
+
+class _UnhashableArgError(Exception):
+    pass
+
+
+class UdfCache:
+    """
+    A persistent cache of the results of UDFs that were created with cache=True.
+
+    Entries are content-addressed: an entry is identified by the function key (a hash of the function's identity, ie,
+    its path or name, and its version, ie, its source code) and a hash of the call's arguments. Media file arguments
+    (eg, videos) are hashed by content, images and arrays by their pixel/element data. Calls with arguments that can't
+    be hashed (and results that can't be pickled) bypass the cache.
+
+    Results are stored as pickle files in Env.udf_cache_dir, the time of last access of an entry is its file's mtime.
+    The total size of the entries is limited to udf_cache_size_g GiB; least recently used entries are evicted first.
+
+    As in FileCache, the entries are recorded in an index (a SQLite database next to the cache directory), so that
+    startup doesn't need to scan the directory; the index is reconciled with the directory only if the directory was
+    modified by something other than the cache itself.
+
+    The cache is thread-safe: plans that run concurrently in different threads (eg, when loading several views) share
+    it.
+    """
+    __instance: Optional[UdfCache] = None
+
+    index: sqlite3.Connection
+    lock: threading.RLock  # guards index, the stats and file_digests
+    capacity_bytes: int
+    num_requests: int
+    num_hits: int
+    num_evictions: int
+    # (path, mtime_ns, size) -> content digest, for the most recently hashed media files
+    file_digests: OrderedDict[tuple[str, int, int], bytes]
+
+    UdfCacheFunctionStats = namedtuple('UdfCacheFunctionStats', ('fn_key', 'num_entries', 'total_size'))
+    UdfCacheStats = namedtuple(
+        'UdfCacheStats',
+        ('total_size', 'num_requests', 'num_hits', 'num_evictions', 'function_stats')
+    )
+
+    DEFAULT_SIZE_G = 1.0
+    INDEX_FILE_NAME = 'udf_cache_index.db'
+    __EVICTION_BATCH_SIZE = 64
+    __MAX_FILE_DIGESTS = 4096
+
+    @classmethod
+    def get(cls) -> UdfCache:
+        if cls.__instance is None:
+            cls.init()
+        return cls.__instance
+
+    @classmethod
+    def init(cls) -> None:
+        if cls.__instance is not None:
+            cls.__instance.index.close()
+        cls.__instance = cls()
+
+    def __init__(self):
+        size_g = Env.get().config.get_float_value('udf_cache_size_g')
+        self.capacity_bytes = int((self.DEFAULT_SIZE_G if size_g is None else size_g) * (1 << 30))
+        self.num_requests = 0
+        self.num_hits = 0
+        self.num_evictions = 0
+        self.file_digests = OrderedDict()
+        self.lock = threading.RLock()
+        self.index = self._open_index()
+        recorded_mtime = self._get_meta('dir_mtime_ns')
+        if recorded_mtime is None or recorded_mtime != self._dir_mtime():
+            self._reconcile()
+
+    @classmethod
+    def index_path(cls) -> Path:
+        return Env.get().udf_cache_dir.with_name(cls.INDEX_FILE_NAME)
+
+    def _open_index(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.index_path()), check_same_thread=False)
+        # with WAL, commits don't need to wait for an fsync
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries (fn_key TEXT NOT NULL, key TEXT NOT NULL, size INTEGER NOT NULL, '
+                'last_used REAL NOT NULL, PRIMARY KEY (fn_key, key))')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('total_size', 0)")
+        return conn
+
+    def _get_meta(self, name: str) -> Optional[int]:
+        row = self.index.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def _dir_mtime(self) -> int:
+        return os.stat(str(Env.get().udf_cache_dir)).st_mtime_ns
+
+    def _record_dir_mtime(self) -> None:
+        """Record the mtime of the directory after we modified it"""
+        self.index.execute("INSERT OR REPLACE INTO meta VALUES ('dir_mtime_ns', ?)", (self._dir_mtime(),))
+
+    def _reconcile(self) -> None:
+        """Make the index consistent with the contents of the cache directory"""
+        start = time.monotonic()
+        with self.lock, self.index:
+            indexed = {(row[0], row[1]) for row in self.index.execute('SELECT fn_key, key FROM entries')}
+            in_dir: set[tuple[str, str]] = set()
+            new_entries: list[UdfCacheEntry] = []
+            with os.scandir(str(Env.get().udf_cache_dir)) as it:
+                for dir_entry in it:
+                    if not dir_entry.is_file() or not dir_entry.name.endswith('.pkl'):
+                        continue
+                    try:
+                        entry = UdfCacheEntry.from_file(Path(dir_entry.path))
+                    except (AssertionError, OSError):
+                        _logger.debug(f'ignoring unexpected file in udf cache: {dir_entry.name}')
+                        continue
+                    in_dir.add((entry.fn_key, entry.key))
+                    if (entry.fn_key, entry.key) not in indexed:
+                        new_entries.append(entry)
+            self.index.executemany(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                [(e.fn_key, e.key, e.size, e.last_used.timestamp()) for e in new_entries])
+            missing = indexed - in_dir
+            self.index.executemany('DELETE FROM entries WHERE fn_key = ? AND key = ?', list(missing))
+            self.index.execute(
+                "UPDATE meta SET value = (SELECT COALESCE(SUM(size), 0) FROM entries) WHERE name = 'total_size'")
+            self._record_dir_mtime()
+        _logger.debug(
+            f'reconciled udf cache index with {len(in_dir)} files: added {len(new_entries)}, '
+            f'removed {len(missing)} entries ({time.monotonic() - start:.2f}s)')
+
+    @property
+    def total_size(self) -> int:
+        with self.lock:
+            return self._get_meta('total_size')
+
+    def _get_entry(self, fn_key: str, key: str) -> Optional[UdfCacheEntry]:
+        row = self.index.execute(
+            'SELECT fn_key, key, size, last_used FROM entries WHERE fn_key = ? AND key = ?', (fn_key, key)).fetchone()
+        return None if row is None else UdfCacheEntry.from_index_row(row)
+
+    def _remove_entry(self, entry: UdfCacheEntry) -> None:
+        """Remove entry from the index and the directory; requires an open transaction"""
+        self.index.execute('DELETE FROM entries WHERE fn_key = ? AND key = ?', (entry.fn_key, entry.key))
+        self.index.execute("UPDATE meta SET value = value - ? WHERE name = 'total_size'", (entry.size,))
+        entry.path.unlink(missing_ok=True)
+
+    def num_entries(self, fn_key: Optional[str] = None) -> int:
+        with self.lock:
+            if fn_key is None:
+                return self.index.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            return self.index.execute('SELECT COUNT(*) FROM entries WHERE fn_key = ?', (fn_key,)).fetchone()[0]
+
+    def clear(self, fn_key: Optional[str] = None) -> None:
+        """
+        Removes all entries (or those of the given function); clearing the entire cache also resets the stats.
+        """
+        query = 'SELECT fn_key, key, size, last_used FROM entries'
+        with self.lock, self.index:
+            if fn_key is None:
+                _logger.debug(f'clearing {self.num_entries()} entries from udf cache')
+                self.num_requests, self.num_hits, self.num_evictions = 0, 0, 0
+                rows = self.index.execute(query).fetchall()
+            else:
+                _logger.debug(f'clearing {self.num_entries(fn_key)} entries from udf cache for function {fn_key}')
+                rows = self.index.execute(f'{query} WHERE fn_key = ?', (fn_key,)).fetchall()
+            for row in rows:
+                self._remove_entry(UdfCacheEntry.from_index_row(row))
+            self._record_dir_mtime()
+
+    @classmethod
+    def fn_key(cls, fn: func.CallableFunction) -> str:
+        """Returns the key that identifies the cache entries of fn"""
+        identity = fn.self_path if fn.self_path is not None else fn.self_name
+        try:
+            version = inspect.getsource(fn.py_fn)
+        except (OSError, TypeError):
+            # no source available (eg, for functions defined in a REPL): fall back to the bytecode
+            code = fn.py_fn.__code__
+            version = f'{code.co_code.hex()}{code.co_consts!r}'
+        h = hashlib.sha256()
+        h.update(f'{identity}\0{fn.signature}\0{version}'.encode())
+        return h.hexdigest()[:32]
+
+    def call_key(self, args: list[Any], kwargs: dict[str, Any], signature: func.Signature) -> Optional[str]:
+        """Returns the hash of the given call arguments, or None if they can't be hashed"""
+        h = hashlib.sha256()
+        try:
+            col_type: Optional[ts.ColumnType]
+            params = signature.parameters_by_pos
+            for i, val in enumerate(args):
+                if i >= len(params) or params[i].kind == inspect.Parameter.VAR_POSITIONAL:
+                    # this and all following args are expanded *args: we don't know their types
+                    params = []
+                    col_type = None
+                else:
+                    col_type = params[i].col_type
+                self._hash_val(h, val, col_type)
+            h.update(b'kwargs:')
+            for name in sorted(kwargs.keys()):
+                param = signature.parameters.get(name)
+                is_typed = param is not None and param.kind != inspect.Parameter.VAR_KEYWORD
+                col_type = param.col_type if is_typed else None
+                self._hash_val(h, name, None)
+                self._hash_val(h, kwargs[name], col_type)
+        except _UnhashableArgError:
+            return None
+        return h.hexdigest()
+
+    def _hash_val(self, h: Any, val: Any, col_type: Optional[ts.ColumnType]) -> None:
+        if val is None or isinstance(val, (bool, int, float)):
+            h.update(f'{type(val).__name__}:{val!r};'.encode())
+        elif isinstance(val, str):
+            if col_type is not None and col_type.is_media_type() and os.path.isfile(val):
+                h.update(b'file:')
+                h.update(self._file_digest(val))
+            else:
+                h.update(f'str:{len(val)}:'.encode())
+                h.update(val.encode())
+        elif isinstance(val, (list, tuple)):
+            h.update(f'list:{len(val)}:'.encode())
+            for v in val:
+                self._hash_val(h, v, None)
+        elif isinstance(val, dict):
+            h.update(f'dict:{len(val)}:'.encode())
+            for k in sorted(val.keys()):
+                self._hash_val(h, k, None)
+                self._hash_val(h, val[k], None)
+        elif isinstance(val, np.ndarray):
+            if val.dtype == np.object_:
+                raise _UnhashableArgError()
+            h.update(f'array:{val.dtype.str}:{val.shape}:'.encode())
+            h.update(np.ascontiguousarray(val).tobytes())
+        elif isinstance(val, PIL.Image.Image):
+            h.update(f'image:{val.mode}:{val.size}:'.encode())
+            h.update(val.tobytes())
+        elif isinstance(val, (datetime.datetime, datetime.date)):
+            h.update(f'{type(val).__name__}:{val.isoformat()};'.encode())
+        elif isinstance(val, uuid.UUID):
+            h.update(f'uuid:{val.hex};'.encode())
+        else:
+            raise _UnhashableArgError()
+
+    def _file_digest(self, path: str) -> bytes:
+        file_info = os.stat(path)
+        file_id = (path, file_info.st_mtime_ns, file_info.st_size)
+        with self.lock:
+            digest = self.file_digests.get(file_id)
+            if digest is not None:
+                self.file_digests.move_to_end(file_id, last=True)
+                return digest
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+        digest = h.digest()
+        with self.lock:
+            self.file_digests[file_id] = digest
+            if len(self.file_digests) > self.__MAX_FILE_DIGESTS:
+                self.file_digests.popitem(last=False)
+        return digest
+
+    def lookup(self, fn_key: str, key: str) -> tuple[bool, Any]:
+        """Returns (True, result) on a hit and (False, None) on a miss"""
+        with self.lock:
+            self.num_requests += 1
+            entry = self._get_entry(fn_key, key)
+        if entry is None:
+            return False, None
+        path = entry.path
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except Exception as exc:
+            # the entry is unreadable (eg, it was written by an incompatible version of a library, or its file is
+            # gone)
+            _logger.debug(f'removing unreadable udf cache entry {path.name}: {exc}')
+            with self.lock, self.index:
+                # another thread might have removed it already
+                if self._get_entry(fn_key, key) is not None:
+                    self._remove_entry(entry)
+                    self._record_dir_mtime()
+            return False, None
+        now = time.time()
+        with self.lock, self.index:
+            try:
+                os.utime(str(path), (now, now))
+            except FileNotFoundError:
+                pass
+            self.index.execute(
+                'UPDATE entries SET last_used = ? WHERE fn_key = ? AND key = ?', (now, fn_key, key))
+            self.num_hits += 1
+        return True, result
+
+    def add(self, fn_key: str, key: str, result: Any) -> None:
+        try:
+            data = pickle.dumps(result)
+        except Exception:
+            return
+        if len(data) > self.capacity_bytes:
+            return
+        now = time.time()
+        entry = UdfCacheEntry(fn_key, key, len(data), datetime.datetime.fromtimestamp(now, tz=timezone.utc))
+        # write to a temp file first, so that we never leave a partially written entry behind
+        tmp_path = Env.get().create_tmp_path()
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            with self.lock:
+                if self._get_entry(fn_key, key) is not None:
+                    # we computed the same result concurrently
+                    tmp_path.unlink(missing_ok=True)
+                    return
+                self.ensure_capacity(len(data))
+                with self.index:
+                    prev_size = self.index.execute(
+                        'SELECT size FROM entries WHERE fn_key = ? AND key = ?', (fn_key, key)).fetchone()
+                    # another process might have added the same entry in the meantime
+                    size_delta = entry.size - (prev_size[0] if prev_size is not None else 0)
+                    self.index.execute(
+                        'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (fn_key, key, entry.size, now))
+                    self.index.execute("UPDATE meta SET value = value + ? WHERE name = 'total_size'", (size_delta,))
+                    os.replace(str(tmp_path), str(entry.path))
+                    self._record_dir_mtime()
+        except OSError as exc:
+            # a failure to cache a result shouldn't fail the call
+            _logger.warning(f'failed to add entry {entry.path.name} to udf cache: {exc}')
+            tmp_path.unlink(missing_ok=True)
+
+    def ensure_capacity(self, size: int) -> None:
+        """
+        Evict entries from the cache until there is at least 'size' bytes of free space.
+        """
+        with self.lock:
+            while self.total_size + size > self.capacity_bytes:
+                rows = self.index.execute(
+                    'SELECT fn_key, key, size, last_used FROM entries ORDER BY last_used LIMIT ?',
+                    (self.__EVICTION_BATCH_SIZE,)).fetchall()
+                if len(rows) == 0:
+                    break
+                with self.index:
+                    for row in rows:
+                        if self.total_size + size <= self.capacity_bytes:
+                            break
+                        lru_entry = UdfCacheEntry.from_index_row(row)
+                        self._remove_entry(lru_entry)
+                        self.num_evictions += 1
+                        _logger.debug(
+                            f'evicted entry {lru_entry.path.name} from udf cache (of size {lru_entry.size} bytes)')
+                    self._record_dir_mtime()
+
+    def set_capacity(self, capacity_bytes: int) -> None:
+        with self.lock:
+            self.capacity_bytes = capacity_bytes
+            self.ensure_capacity(0)  # evict entries if necessary
+
+    def stats(self) -> UdfCacheStats:
+        with self.lock:
+            rows = self.index.execute('SELECT fn_key, COUNT(*), SUM(size) FROM entries GROUP BY fn_key').fetchall()
+            fn_stats = [self.UdfCacheFunctionStats(fn_key, num_entries, size) for fn_key, num_entries, size in rows]
+            fn_stats.sort(key=lambda e: e[2], reverse=True)
+            return self.UdfCacheStats(self.total_size, self.num_requests, self.num_hits, self.num_evictions, fn_stats)
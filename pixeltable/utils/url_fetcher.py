@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import threading
+import urllib.parse
+from pathlib import Path
+from typing import Any, BinaryIO, Optional
+
+import httpx
+
+_logger = logging.getLogger('pixeltable')
+
+
+class UrlFetcher:
+    """
+    Downloads http(s) and s3 URLs into local files.
+
+    http(s) downloads share a pool of keep-alive connections and stream the response body to disk in chunks of
+    CHUNK_SIZE bytes (the writes run in worker threads, so as not to block the event loop). Each download starts with
+    a request for the first PART_SIZE bytes: if the server honors the range and the object is larger than that, the
+    remaining parts are requested concurrently (at most MAX_PARTS_IN_FLIGHT at a time) and written to their offsets
+    in the file. If the server ignores the range, the response contains the entire object, which is then streamed as
+    a whole.
+
+    s3 downloads use boto3's download_file() (which does its own multipart download) in a worker thread.
+    """
+    max_connections: int
+    http_client: Optional[httpx.AsyncClient]
+    boto_client: Optional[Any]
+    boto_client_lock: threading.Lock
+
+    CHUNK_SIZE = 1 << 20
+    PART_SIZE = 16 << 20
+    MAX_PARTS_IN_FLIGHT = 4
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        # clients are constructed as needed, because it's time-consuming
+        self.http_client = None
+        self.boto_client = None
+        self.boto_client_lock = threading.Lock()
+
+    async def fetch(self, url: str, path: Path) -> int:
+        """Downloads url into path and returns the number of bytes"""
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme == 's3':
+            return await asyncio.to_thread(self._fetch_s3, parsed, path)
+        assert parsed.scheme == 'http' or parsed.scheme == 'https', f'Unsupported URL scheme: {parsed.scheme}'
+        return await self._fetch_http(url, path)
+
+    async def aclose(self) -> None:
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+
+    def _fetch_s3(self, parsed: urllib.parse.ParseResult, path: Path) -> int:
+        from pixeltable.utils.s3 import get_client
+        with self.boto_client_lock:
+            if self.boto_client is None:
+                config = {
+                    'max_pool_connections': self.max_connections + 4,  # +4: leave some headroom
+                    'connect_timeout': 5,
+                    'read_timeout': 30,
+                    'retries': {'max_attempts': 3, 'mode': 'adaptive'},
+                }
+                self.boto_client = get_client(**config)
+        self.boto_client.download_file(parsed.netloc, parsed.path.lstrip('/'), str(path))
+        return path.stat().st_size
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        if self.http_client is None:
+            self.http_client = httpx.AsyncClient(
+                follow_redirects=True,
+                # requests wait for a free connection for as long as it takes
+                timeout=httpx.Timeout(30.0, connect=5.0, pool=None),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self.http_client
+
+    async def _fetch_http(self, url: str, path: Path) -> int:
+        client = self._get_http_client()
+        # serializes the seek()/write() pairs of concurrently fetched parts
+        file_lock = threading.Lock()
+        with open(path, 'wb') as f:
+            headers = {'Range': f'bytes=0-{self.PART_SIZE - 1}'}
+            async with client.stream('GET', url, headers=headers) as resp:
+                if resp.status_code == 416:
+                    # consume the (empty) body, so that the connection can be reused
+                    await resp.aread()
+                else:
+                    resp.raise_for_status()
+                    total_size = self._total_size(resp)
+                    num_bytes = await self._write_body(resp, f, file_lock, 0)
+            if resp.status_code == 416:
+                # the object is empty, or the server doesn't like our range for another reason
+                async with client.stream('GET', url) as resp:
+                    resp.raise_for_status()
+                    return await self._write_body(resp, f, file_lock, 0)
+            if total_size is None or num_bytes >= total_size:
+                return num_bytes
+
+            _logger.debug(f'fetching {url} ({total_size} bytes) in parts of {self.PART_SIZE} bytes')
+            part_semaphore = asyncio.Semaphore(self.MAX_PARTS_IN_FLIGHT)
+
+            async def fetch_part(start: int, end: int) -> None:
+                headers = {'Range': f'bytes={start}-{end}'}
+                async with part_semaphore, client.stream('GET', url, headers=headers) as resp:
+                    resp.raise_for_status()
+                    if resp.status_code != 206:
+                        raise RuntimeError(f'Expected a partial response for bytes {start}-{end}: {resp.status_code}')
+                    num_part_bytes = await self._write_body(resp, f, file_lock, start)
+                    if num_part_bytes != end - start + 1:
+                        raise RuntimeError(f'Received {num_part_bytes} bytes for bytes {start}-{end}')
+
+            tasks = [
+                asyncio.create_task(fetch_part(start, min(start + self.PART_SIZE, total_size) - 1))
+                for start in range(num_bytes, total_size, self.PART_SIZE)
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # wait for the cancelled tasks to finish before the file gets closed
+                await asyncio.gather(*tasks, return_exceptions=True)
+            return total_size
+
+    @classmethod
+    def _total_size(cls, resp: httpx.Response) -> Optional[int]:
+        """Returns the size of the object if resp is a partial response, otherwise None"""
+        if resp.status_code != 206:
+            return None
+        match = re.fullmatch(r'bytes \d+-\d+/(\d+)', resp.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match is not None else None
+
+    async def _write_body(self, resp: httpx.Response, f: BinaryIO, file_lock: threading.Lock, offset: int) -> int:
+        """Writes the body of resp to f, starting at offset, and returns the number of bytes"""
+        num_bytes = 0
+        async for chunk in resp.aiter_bytes(self.CHUNK_SIZE):
+            await asyncio.to_thread(self._write_chunk, f, file_lock, offset + num_bytes, chunk)
+            num_bytes += len(chunk)
+        return num_bytes
+
+    @classmethod
+    def _write_chunk(cls, f: BinaryIO, file_lock: threading.Lock, offset: int, chunk: bytes) -> None:
+        with file_lock:
+            f.seek(offset)
+            f.write(chunk)
@@ -1,3 +1,5 @@
+import threading
+import time
 from typing import Any, Union
 
 import numpy as np
@@ -60,6 +62,44 @@ class ConstantImgIterator(ComponentIterator):
         self.next_frame_idx = pos
 
 
+class CountingIterator(ComponentIterator):
+    """Component iterator that generates NUM_COMPONENTS positions, slowly, and records how many instances are active"""
+    NUM_COMPONENTS = 3000
+    lock = threading.Lock()
+    num_active = 0
+    max_active = 0
+
+    def __init__(self, video: str):
+        self.next_pos = 0
+        with CountingIterator.lock:
+            CountingIterator.num_active += 1
+            CountingIterator.max_active = max(CountingIterator.max_active, CountingIterator.num_active)
+
+    @classmethod
+    def input_schema(cls) -> dict[str, pxt.ColumnType]:
+        return {'video': pxt.VideoType(nullable=False)}
+
+    @classmethod
+    def output_schema(cls, *args: Any, **kwargs: Any) -> tuple[dict[str, pxt.ColumnType], list[str]]:
+        return {'component_idx': pxt.IntType()}, []
+
+    def __next__(self) -> dict[str, Any]:
+        if self.next_pos == self.NUM_COMPONENTS:
+            with CountingIterator.lock:
+                CountingIterator.num_active -= 1
+            raise StopIteration
+        time.sleep(0.0001)
+        result = {'component_idx': self.next_pos}
+        self.next_pos += 1
+        return result
+
+    def close(self) -> None:
+        pass
+
+    def set_pos(self, pos: int) -> None:
+        self.next_pos = pos
+
+
 class TestComponentView:
 
     def test_basic(self, reset_db) -> None:
@@ -116,6 +156,41 @@ class TestComponentView:
         assert len(result) > 0
         assert np.all(result['frame_idx'] == pd.Series(range(len(result))))
 
+    @pytest.mark.parametrize('num_workers', [1, 3])
+    def test_iteration_workers(self, num_workers: int, reset_db, monkeypatch) -> None:
+        """Input rows are expanded concurrently and their components are merged in input order"""
+        from pixeltable.exec import ComponentIterationNode
+        monkeypatch.setattr(
+            ComponentIterationNode, '_ComponentIterationNode__num_workers', lambda self: num_workers)
+        video_t = pxt.create_table('video_tbl', {'video': pxt.Video})
+        view_t = pxt.create_view('test_view', video_t, iterator=ConstantImgIterator.create(video=video_t.video))
+        video_filepaths = get_test_video_files()
+        status = video_t.insert({'video': p} for p in video_filepaths)
+        assert status.num_excs == 0
+        assert status.num_rows == len(video_filepaths) * (1 + 10)
+
+        res = view_t.select(view_t.pos, view_t.frame_idx).collect()
+        assert res['pos'] == res['frame_idx']
+        for video_url in video_t.select(url=video_t.video.fileurl).collect()['url']:
+            assert view_t.where(view_t.video == video_url).order_by(view_t.pos).collect()['pos'] == list(range(10))
+
+    def test_iteration_workers_lookahead(self, reset_db, monkeypatch) -> None:
+        """Iterators that produce more components than the lookahead budget still run concurrently"""
+        from pixeltable.exec import ComponentIterationNode
+        monkeypatch.setattr(ComponentIterationNode, '_ComponentIterationNode__num_workers', lambda self: 3)
+        monkeypatch.setattr(CountingIterator, 'max_active', 0)
+        video_t = pxt.create_table('video_tbl', {'video': pxt.Video})
+        view_t = pxt.create_view('test_view', video_t, iterator=CountingIterator.create(video=video_t.video))
+        video_filepaths = get_test_video_files()[:4]
+        status = video_t.insert({'video': p} for p in video_filepaths)
+        assert status.num_excs == 0
+        assert status.num_rows == len(video_filepaths) * (1 + CountingIterator.NUM_COMPONENTS)
+        assert CountingIterator.max_active > 1
+        for video_url in video_t.select(url=video_t.video.fileurl).collect()['url']:
+            res = view_t.where(view_t.video == video_url).order_by(view_t.pos) \
+                .select(view_t.pos, view_t.component_idx).collect()
+            assert res['pos'] == res['component_idx'] == list(range(CountingIterator.NUM_COMPONENTS))
+
     def test_add_column(self, reset_db) -> None:
         # create video table
         video_t = pxt.create_table('video_tbl', {'video': pxt.Video})
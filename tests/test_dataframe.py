@@ -13,6 +13,7 @@ import pixeltable as pxt
 from pixeltable import catalog
 from pixeltable import exceptions as excs
 from pixeltable.iterators import FrameIterator
+from pixeltable.utils.result_set_cache import ResultSetCache
 
 from .utils import (get_audio_files, get_documents, get_video_files, skip_test_if_not_installed, strip_lines,
                     validate_update_status)
@@ -277,6 +278,28 @@ class TestDataFrame:
             _ = t.order_by(datetime.datetime.now()).collect()  # type: ignore[arg-type]
         assert 'Invalid expression' in str(exc_info.value)
 
+    @staticmethod
+    @pxt.udf
+    def is_multiple_of_3(x: int) -> bool:
+        return x % 3 == 0
+
+    def test_python_filter(self, reset_db) -> None:
+        # the scan populates row batches column-wise and drops rows that fail the Python filter in bulk;
+        # the number of rows exceeds the scan's fetch size
+        num_rows = 2500
+        t = pxt.create_table('filter_tbl', {'id': pxt.Int, 's': pxt.String, 'j': pxt.Json})
+        validate_update_status(
+            t.insert({'id': i, 's': f'str {i}', 'j': [i, {'a': i}]} for i in range(num_rows)), expected_rows=num_rows)
+
+        res = t.where(self.is_multiple_of_3(t.id)).select(t.id, t.s, t.j).order_by(t.id).collect()
+        expected_ids = [i for i in range(num_rows) if i % 3 == 0]
+        assert res['id'] == expected_ids
+        assert res['s'] == [f'str {i}' for i in expected_ids]
+        assert res['j'] == [[i, {'a': i}] for i in expected_ids]
+
+        res = t.where(self.is_multiple_of_3(t.id)).select(t.id).order_by(t.id).limit(500).collect()
+        assert res['id'] == expected_ids[:500]
+
     def test_head_tail(self, test_tbl: catalog.Table) -> None:
         t = test_tbl
         res = t.head(10).to_pandas()
@@ -298,6 +321,67 @@ class TestDataFrame:
             _ = t.order_by(t.c2).tail(10)
         assert 'cannot be used with order_by' in str(exc_info.value)
 
+    def test_result_set_cache(self, reset_db) -> None:
+        t = pxt.create_table('test_tbl', {'c1': pxt.Int, 'c2': pxt.String})
+        t.insert({'c1': i, 'c2': f'str {i}'} for i in range(20))
+        v = pxt.create_view('test_view', t.where(t.c1 < 10))
+        cache = ResultSetCache.get()
+        cache.clear()
+        cache.set_capacity(2, spill_capacity_bytes=0)
+        try:
+            res = t.order_by(t.c1).collect()
+            assert cache.stats().num_hits == 0
+            assert t.order_by(t.c1).collect() == res
+            assert cache.stats().num_hits == 1
+            # callers get copies of the cached result set
+            assert t.tail(5)['c1'] == list(range(15, 20))
+            assert t.tail(5)['c1'] == list(range(15, 20))
+            stats = cache.stats()
+            assert stats.num_hits == 2 and stats.num_requests == 4 and stats.hit_rate == 0.5
+
+            # a change of a referenced table invalidates the result set
+            t.insert(c1=20, c2='str 20')
+            assert len(t.order_by(t.c1).collect()) == 21
+            assert cache.stats().num_hits == 2
+            _ = v.collect()
+            assert len(v.collect()) == 10
+            assert cache.stats().num_hits == 3
+            # reverts reuse version numbers
+            t.revert()
+            assert len(t.order_by(t.c1).collect()) == 20
+            assert cache.stats().num_hits == 3
+            # views are invalidated with their base
+            t.insert(c1=-1, c2='str -1')
+            t.revert()
+            assert len(v.collect()) == 10
+            assert cache.stats().num_hits == 3
+
+            # evicted result sets are spilled to disk, up to the spill capacity
+            cache.clear()
+            cache.set_capacity(1, spill_capacity_bytes=1 << 20)
+            res = t.where(t.c1 < 5).collect()
+            _ = t.where(t.c1 >= 5).collect()
+            stats = cache.stats()
+            assert stats.num_entries == 1 and stats.num_spilled_entries == 1 and stats.spilled_size > 0
+            assert t.where(t.c1 < 5).collect() == res
+            stats = cache.stats()
+            assert stats.num_hits == 1 and stats.num_spilled_hits == 1 and stats.num_spilled_entries == 1
+            t.insert(c1=20, c2='str 20')
+            stats = cache.stats()
+            assert stats.num_entries == 1 and stats.num_spilled_entries == 1
+            t.revert()
+            stats = cache.stats()
+            assert stats.num_entries == 0 and stats.num_spilled_entries == 0 and stats.spilled_size == 0
+
+            # a capacity of 0 disables the cache
+            cache.set_capacity(0, spill_capacity_bytes=0)
+            _ = t.collect()
+            _ = t.collect()
+            assert cache.stats().num_entries == 0
+        finally:
+            cache.set_capacity(0, spill_capacity_bytes=0)
+            cache.clear()
+
     def test_repr(self, test_tbl: catalog.Table) -> None:
         t = test_tbl
         df = (
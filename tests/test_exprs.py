@@ -17,6 +17,7 @@ import pixeltable as pxt
 import pixeltable.exceptions as excs
 import pixeltable.functions as pxtf
 from pixeltable import catalog, exprs
+from pixeltable.exec import ExprEvalNode
 from pixeltable.exprs import RELATIVE_PATH_ROOT as R
 from pixeltable.exprs import ColumnRef, Expr, Literal
 from pixeltable.functions.globals import cast
@@ -992,6 +993,31 @@ class TestExprs:
             _ = str(e)
             print(_)
 
+    @staticmethod
+    @pxt.udf
+    def add_ints(a: int, b: int) -> int:
+        return a + b
+
+    def test_dispatch(self, reset_db) -> None:
+        """ExprEvalNode.dispatch() for a wide expression graph (see tool/benchmark_dispatch.py for timings)"""
+        num_rows, depth = 100, 10
+        t = pxt.create_table('dispatch_tbl', {'c': pxt.Int})
+        validate_update_status(t.insert({'c': i} for i in range(num_rows)), expected_rows=num_rows)
+        # a chain of Python function calls, all of which are part of the output
+        chain: list[exprs.Expr] = [t.c]
+        for i in range(depth):
+            chain.append(self.add_ints(chain[-1], i))
+        df = t.select(*chain[1:]).order_by(t.c)
+
+        plan = df._create_query_plan()
+        eval_node = plan.get_node(ExprEvalNode)
+        assert eval_node is not None
+        assert eval_node.row_builder.num_materialized > depth
+        res = df.collect()
+        for level in range(depth):
+            col_name = list(res.schema.keys())[level]
+            assert res[col_name] == [i + sum(range(level + 1)) for i in range(num_rows)]
+
     def test_subexprs(self, img_tbl: catalog.Table) -> None:
         t = img_tbl
         e = t.img
@@ -1,5 +1,7 @@
 import os
 import platform
+import shutil
+import uuid
 from collections import OrderedDict
 from pathlib import Path
 
@@ -10,6 +12,7 @@ import pixeltable.exceptions as excs
 from pixeltable.env import Env
 from pixeltable.utils.filecache import FileCache
 
+from .test_url_fetcher import file_server, file_url  # noqa: F401
 from .utils import get_image_files
 
 
@@ -78,3 +81,99 @@ class TestFileCache:
             t.insert({'index': len(image_files) + n, 'image': image_urls[n]} for n in range(10, 15))
         # Check that we saw the warning exactly once
         assert sum(r.category is excs.PixeltableWarning for r in record) == 1
+
+    def test_index(self, reset_db, monkeypatch) -> None:
+        fc = FileCache.get()
+        fc.clear()
+        fc.set_capacity(10 << 30)
+        tbl_id = uuid.uuid4()
+        image_files = get_image_files()[:20]
+        urls = [f'https://example.com/images/{Path(f).name}' for f in image_files]
+        for i, (f, url) in enumerate(zip(image_files, urls)):
+            tmp_path = Env.get().create_tmp_path('.JPEG')
+            shutil.copyfile(f, tmp_path)
+            fc.add(tbl_id, i % 2, url, tmp_path)
+        total_size = sum(os.stat(f).st_size for f in image_files)
+        assert fc.total_size == total_size
+        assert fc.num_files(tbl_id) == len(urls)
+        # access the first 5 urls, so that they're the most recently used ones
+        for url in urls[:5]:
+            assert fc.lookup(url) is not None
+
+        # a new instance doesn't need to scan the cache directory
+        def fail_reconcile(_: FileCache) -> None:
+            raise AssertionError('unexpected reconciliation')
+        with monkeypatch.context() as m:
+            m.setattr(FileCache, '_reconcile', fail_reconcile)
+            FileCache.init()
+            fc = FileCache.get()
+            assert fc.total_size == total_size
+            assert fc.num_files() == len(urls)
+            assert len(fc.stats().column_stats) == 2
+            assert fc.lookup(urls[10]) is not None
+            # the LRU order survived: evicting all but 6 entries keeps the 6 most recently accessed ones
+            kept_size = sum(os.stat(f).st_size for f in image_files[:5] + image_files[10:11])
+            fc.set_capacity(kept_size)
+            assert fc.num_files() == 6
+            assert all(fc.lookup(url) is not None for url in urls[:5] + urls[10:11])
+            assert fc.num_evictions == 14
+            assert sorted(p.name for p in Env.get().file_cache_dir.iterdir()) == sorted(
+                f'{tbl_id.hex}_{i % 2}_{fc._url_hash(urls[i])}.JPEG' for i in [0, 1, 2, 3, 4, 10])
+
+        # changes made behind the cache's back are picked up at startup
+        removed_path = next(Env.get().file_cache_dir.iterdir())
+        removed_path.unlink()
+        tmp_path = Env.get().create_tmp_path('.JPEG')
+        shutil.copyfile(image_files[19], tmp_path)
+        new_url = 'https://example.com/images/new.JPEG'
+        tmp_path.rename(Env.get().file_cache_dir / f'{tbl_id.hex}_7_{fc._url_hash(new_url)}.JPEG')
+        FileCache.init()
+        fc = FileCache.get()
+        assert fc.num_files() == 6
+        assert fc.num_files(tbl_id) == 6
+        assert fc.total_size == sum(p.stat().st_size for p in Env.get().file_cache_dir.iterdir())
+        assert fc.lookup(new_url) is not None
+
+        # entries whose file disappeared are removed on lookup
+        with monkeypatch.context() as m:
+            m.setattr(FileCache, '_dir_mtime', lambda _: 0)
+            m.setattr(FileCache, '_reconcile', fail_reconcile)
+            path = fc.lookup(new_url)
+            os.remove(path)
+            assert fc.lookup(new_url) is None
+            assert fc.num_files() == 5
+
+        # without an index, it gets rebuilt from the directory
+        FileCache.get().index.close()
+        FileCache.index_path().unlink()
+        FileCache.init()
+        fc = FileCache.get()
+        assert fc.num_files() == 5
+        assert fc.total_size == sum(p.stat().st_size for p in Env.get().file_cache_dir.iterdir())
+
+    def test_concurrent_view_loads(self, reset_db, file_server: str, monkeypatch) -> None:
+        # views are loaded concurrently and share the cache, which evicts entries while the views look them up
+        from pixeltable.catalog.table_version import TableVersion
+        monkeypatch.setattr(TableVersion, '_view_maintenance_workers', classmethod(lambda cls: 4))
+        fc = FileCache.get()
+        fc.clear()
+        image_files = get_image_files()[:40]
+        fc.set_capacity(sum(os.stat(f).st_size for f in image_files[:10]))
+        t = pxt.create_table('images', {'idx': pxt.Int, 'img': pxt.Image})
+        views = [
+            pxt.create_view(f'v{i}', t.where(t.idx % (i + 1) == 0), additional_columns={'rot': t.img.rotate(90 * i)})
+            for i in range(4)
+        ]
+        status = t.insert({'idx': i, 'img': file_url(file_server, Path(f))} for i, f in enumerate(image_files))
+        assert status.num_excs == 0
+
+        # the index is consistent with the directory
+        cache_files = list(Env.get().file_cache_dir.iterdir())
+        assert fc.num_files() == len(cache_files)
+        assert fc.total_size == sum(p.stat().st_size for p in cache_files)
+        assert fc.num_evictions > 0
+        stats = fc.stats()
+        assert stats.num_requests >= stats.num_hits
+        for i, v in enumerate(views):
+            res = v.select(v.idx, v.rot.width, v.rot.height).order_by(v.idx).collect()
+            assert res['idx'] == list(range(0, len(image_files), i + 1))
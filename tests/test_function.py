@@ -1,16 +1,22 @@
+import os
+import threading
 import typing
-from typing import Optional
+from typing import Any, Optional
 
 import numpy as np
+import PIL.Image
+import PIL.ImageFilter
 import pytest
 
 import pixeltable as pxt
 import pixeltable.exceptions as excs
 import pixeltable.func as func
 from pixeltable import catalog
+from pixeltable.env import Env
 from pixeltable.func import Batch, Function, FunctionRegistry
+from pixeltable.utils.udf_cache import UdfCache
 
-from .utils import ReloadTester, assert_resultset_eq, reload_catalog, validate_update_status
+from .utils import ReloadTester, assert_resultset_eq, get_image_files, reload_catalog, validate_update_status
 
 
 def dummy_fn(i: int) -> int:
@@ -416,6 +422,18 @@ class TestFunction:
                 return ''
         assert 'cannot infer pixeltable type for parameter untyped' in str(exc_info.value).lower()
 
+        with pytest.raises(excs.Error) as exc_info:
+            @pxt.udf(max_batch_size=32)
+            def udf5a(name: str) -> str:
+                return name
+        assert 'min_batch_size/max_batch_size require `batch_size`' in str(exc_info.value)
+
+        with pytest.raises(excs.Error) as exc_info:
+            @pxt.udf(batch_size=16, min_batch_size=32)
+            def udf5b(name: Batch[str]) -> Batch[str]:
+                return name
+        assert 'batch size bounds must satisfy' in str(exc_info.value)
+
         with pytest.raises(ValueError) as v_exc_info:
             @udf6.conditional_return_type
             def _(wrong_param: str) -> pxt.ColumnType:
@@ -426,6 +444,331 @@ class TestFunction:
             from .module_with_duplicate_udf import duplicate_udf
         assert 'A UDF with that name already exists: tests.module_with_duplicate_udf.duplicate_udf' in str(exc_info.value)
 
+    def test_adaptive_batch_sizer(self) -> None:
+        from pixeltable.exec.expr_eval.batch_sizer import AdaptiveBatchSizer
+
+        def elapsed(n: int) -> float:
+            # fixed per-call overhead; per-item cost goes up beyond 64 items
+            return 0.01 + 0.001 * n + (0.002 * (n - 64) if n > 64 else 0.0)
+
+        sizer = AdaptiveBatchSizer(8, 1, 512)
+        for _ in range(100):
+            n = sizer.batch_size
+            sizer.record(n, elapsed(n))
+        assert sizer.is_converged
+        assert sizer.batch_size == 64
+        # 128 was tried, but has a lower throughput
+        assert sizer.sizes == [8, 16, 32, 64, 128, 64]
+
+        # partial batches are ignored
+        sizer.record(3, 100.0)
+        assert sizer.batch_size == 64
+
+        # the workload changes: larger batches now have a much higher per-item cost
+        for _ in range(100):
+            n = sizer.batch_size
+            sizer.record(n, 0.01 + 0.05 * n + 0.01 * n * n / 8)
+        assert sizer.is_converged
+        assert sizer.batch_size < 64
+        assert sizer.min_size <= min(sizer.sizes)
+
+    # records the sizes of the batches it gets called with
+    _batch_sizes: list[int] = []
+
+    @staticmethod
+    @pxt.udf(batch_size=4, min_batch_size=2, max_batch_size=64)
+    def adaptive_fn(x: Batch[int]) -> Batch[int]:
+        TestFunction._batch_sizes.append(len(x))
+        return [i + 1 for i in x]
+
+    @classmethod
+    def record_batch_sizers(cls, monkeypatch) -> list[tuple[int, int, int]]:
+        """Returns the list to which the (initial size, min size, max size) of each new AdaptiveBatchSizer is added"""
+        from pixeltable.exec.expr_eval.batch_sizer import AdaptiveBatchSizer
+        sizers: list[tuple[int, int, int]] = []
+        init = AdaptiveBatchSizer.__init__
+
+        def record_init(self: AdaptiveBatchSizer, initial_size: int, min_size: int, max_size: int) -> None:
+            sizers.append((initial_size, min_size, max_size))
+            init(self, initial_size, min_size, max_size)
+
+        monkeypatch.setattr(AdaptiveBatchSizer, '__init__', record_init)
+        return sizers
+
+    # the sizes that AdaptiveBatchSizer converges to are checked in test_adaptive_batch_sizer(); they depend on the
+    # observed throughput, so the end-to-end tests only check the bounds
+    def test_adaptive_batching(self, reset_db, monkeypatch) -> None:
+        monkeypatch.setattr(TestFunction, '_batch_sizes', [])
+        sizers = self.record_batch_sizers(monkeypatch)
+        t = pxt.create_table('test', {'c1': pxt.Int})
+        t.insert({'c1': i} for i in range(2000))
+        status = t.add_computed_column(out=self.adaptive_fn(t.c1), print_stats=True)
+        assert status.num_excs == 0
+        assert t.where(t.out != t.c1 + 1).count() == 0
+        assert sizers == [(4, 2, 64)]
+        batch_sizes = TestFunction._batch_sizes
+        assert batch_sizes[0] == 4
+        assert sum(batch_sizes) == 2000
+        # the final batch can be partial
+        assert all(2 <= n <= 64 for n in batch_sizes[:-1])
+
+        # the bounds survive serialization of stored functions
+        @pxt.udf(batch_size=8, max_batch_size=32, _force_stored=True)
+        def stored_fn(x: Batch[int]) -> Batch[int]:
+            return x
+        t.add_computed_column(out2=stored_fn(t.c1))
+        func.FunctionRegistry.get().clear_cache()
+        reload_catalog()
+        t = pxt.get_table('test')
+        fn = t.out2.col.value_expr.fn
+        assert (fn.batch_size, fn.min_batch_size, fn.max_batch_size) == (8, 1, 32)
+
+    @staticmethod
+    @pxt.udf(batch_size=4)
+    def fixed_batch_fn(x: Batch[int]) -> Batch[int]:
+        TestFunction._batch_sizes.append(len(x))
+        return [i + 1 for i in x]
+
+    def test_adaptive_batching_config(self, reset_db, monkeypatch) -> None:
+        monkeypatch.setattr(TestFunction, '_batch_sizes', [])
+        sizers = self.record_batch_sizers(monkeypatch)
+        t = pxt.create_table('test', {'c1': pxt.Int})
+        t.insert({'c1': i} for i in range(2000))
+        t.add_computed_column(out1=self.fixed_batch_fn(t.c1))
+        assert sizers == []
+        assert set(TestFunction._batch_sizes) == {4}
+
+        # the config option makes batched functions without bounds adaptive, with the default bounds
+        monkeypatch.setenv('PIXELTABLE_ADAPTIVE_BATCH_SIZE', 'true')
+        TestFunction._batch_sizes.clear()
+        t.add_computed_column(out2=self.fixed_batch_fn(t.c1))
+        assert t.where(t.out2 != t.c1 + 1).count() == 0
+        max_batch_size = 4 * func.CallableFunction.DEFAULT_MAX_BATCH_SIZE_FACTOR
+        assert sizers == [(4, 1, max_batch_size)]
+        batch_sizes = TestFunction._batch_sizes
+        assert batch_sizes[0] == 4
+        assert sum(batch_sizes) == 2000
+        assert all(1 <= n <= max_batch_size for n in batch_sizes)
+
+        # explicit bounds take precedence
+        sizers.clear()
+        TestFunction._batch_sizes.clear()
+        t.add_computed_column(out3=self.adaptive_fn(t.c1))
+        assert sizers == [(4, 2, 64)]
+        assert all(2 <= n <= 64 for n in TestFunction._batch_sizes[:-1])
+
+    @staticmethod
+    @pxt.udf(executor='thread')
+    def thread_name_fn(x: int) -> str:
+        return threading.current_thread().name
+
+    @staticmethod
+    @pxt.udf
+    def default_executor_fn(x: int) -> str:
+        return threading.current_thread().name
+
+    def test_thread_executor(self, reset_db, monkeypatch) -> None:
+        t = pxt.create_table('test', {'c1': pxt.Int})
+        t.insert({'c1': i} for i in range(100))
+        res = t.select(out=self.thread_name_fn(t.c1), out2=self.default_executor_fn(t.c1)).collect()
+        assert all(name.startswith('pxt-udf') for name in res['out'])
+        assert all(name == threading.current_thread().name for name in res['out2'])
+
+        # the config option applies to functions that don't specify an executor
+        monkeypatch.setenv('PIXELTABLE_UDF_EXECUTOR', 'thread')
+        res = t.select(out=self.default_executor_fn(t.c1)).collect()
+        assert all(name.startswith('pxt-udf') for name in res['out'])
+
+        # threads that ask for a pool concurrently get the same one
+        env = Env.get()
+        env._shut_down_udf_executors()
+        pools: list[Any] = []
+        threads = [threading.Thread(target=lambda: pools.append(env.get_udf_executor('thread'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(pools) == 8 and all(pool is pools[0] for pool in pools)
+
+        monkeypatch.setenv('PIXELTABLE_UDF_EXECUTOR', 'gpu')
+        with pytest.raises(excs.Error, match='Invalid value for config option udf_executor'):
+            t.select(out=self.default_executor_fn(t.c1)).collect()
+
+        with pytest.raises(excs.Error, match='`executor` must be one of'):
+            @pxt.udf(executor='gpu')  # type: ignore[arg-type]
+            def udf1(x: int) -> int:
+                return x
+
+        with pytest.raises(excs.Error, match='`executor` cannot be specified for async functions'):
+            @pxt.udf(executor='thread')
+            async def udf2(x: int) -> int:
+                return x
+
+    @staticmethod
+    @pxt.udf(executor='process')
+    def pid_fn(x: int) -> int:
+        if x == 13:
+            raise ValueError('unlucky number')
+        return os.getpid()
+
+    @staticmethod
+    @pxt.udf(executor='process')
+    def blur_fn(img: PIL.Image.Image) -> PIL.Image.Image:
+        return img.filter(PIL.ImageFilter.GaussianBlur(2))
+
+    @staticmethod
+    @pxt.udf(batch_size=4, executor='process')
+    def double_fn(a: Batch[pxt.Array[(None,), pxt.Float]]) -> Batch[pxt.Array[(None,), pxt.Float]]:
+        return [x * 2.0 for x in a]
+
+    @staticmethod
+    @pxt.udf(batch_size=4, executor='process')
+    def failing_double_fn(a: Batch[pxt.Array[(None,), pxt.Float]]) -> Batch[pxt.Array[(None,), pxt.Float]]:
+        raise ValueError('unlucky batch')
+
+    def test_process_executor(self, reset_db) -> None:
+        t = pxt.create_table('test', {'c1': pxt.Int})
+        t.insert({'c1': i} for i in range(20))
+        status = t.add_computed_column(pid=self.pid_fn(t.c1), on_error='ignore')
+        assert status.num_excs == 1
+        assert t.where(t.pid == os.getpid()).count() == 0
+        res = t.where(t.c1 == 13).select(t.pid.errortype, t.pid.errormsg).collect()
+        assert res[0] == {'pid_errortype': 'ValueError', 'pid_errormsg': 'unlucky number'}
+        with pytest.raises(excs.Error, match='unlucky number'):
+            t.select(self.pid_fn(t.c1)).collect()
+
+        # images and large arrays are passed through shared memory
+        shm_blocks = set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+        imgs = pxt.create_table('imgs', {'img': pxt.Image})
+        imgs.insert({'img': f} for f in get_image_files()[:10])
+        res = imgs.select(imgs.img, out=self.blur_fn(imgs.img)).collect()
+        for img, out in zip(res['img'], res['out']):
+            assert out.size == img.size
+            assert np.array_equal(np.asarray(out), np.asarray(img.filter(PIL.ImageFilter.GaussianBlur(2))))
+
+        arrs = pxt.create_table('arrs', {'a': pxt.Array[(None,), pxt.Float]})
+        vals = [np.random.rand(100_000).astype(np.float32) for _ in range(6)]
+        arrs.insert({'a': v} for v in vals)
+        res = arrs.select(arrs.a, out=self.double_fn(arrs.a)).collect()
+        for a, out in zip(res['a'], res['out']):
+            assert np.array_equal(out, a * 2.0)
+
+        # the shared memory blocks are released, also if the calls fail
+        with pytest.raises(excs.Error, match='unlucky batch'):
+            arrs.select(out=self.failing_double_fn(arrs.a)).collect()
+        if os.path.isdir('/dev/shm'):
+            assert not any(name.startswith('psm_') for name in set(os.listdir('/dev/shm')) - shm_blocks)
+
+        # the pools are shut down with the Env and recreated on demand
+        env = Env.get()
+        pools = list(env._udf_executors.values())
+        assert len(pools) == 1
+        env._shut_down_udf_executors()
+        assert len(env._udf_executors) == 0
+        with pytest.raises(RuntimeError):
+            pools[0].submit(os.getpid)
+        assert len(t.where(t.c1 != 13).select(self.pid_fn(t.c1)).collect()) == 19
+
+    _cache_calls: list[int] = []
+
+    @staticmethod
+    @pxt.udf(cache=True)
+    def cached_fn(x: int, s: str = '') -> str:
+        TestFunction._cache_calls.append(x)
+        return f'{s}{x}'
+
+    @staticmethod
+    @pxt.udf(batch_size=4, cache=True)
+    def cached_batched_fn(x: Batch[int]) -> Batch[int]:
+        TestFunction._cache_calls.extend(x)
+        return [i * 2 for i in x]
+
+    def test_udf_cache(self, reset_db, monkeypatch) -> None:
+        monkeypatch.setattr(TestFunction, '_cache_calls', [])
+        cache = UdfCache.get()
+        cache.clear()
+        t = pxt.create_table('test', {'c1': pxt.Int})
+        t.insert({'c1': i % 10} for i in range(20))
+        t.add_computed_column(out1=self.cached_fn(t.c1))
+        # each distinct argument is computed once
+        assert sorted(set(TestFunction._cache_calls)) == list(range(10))
+        num_calls = len(TestFunction._cache_calls)
+        stats = cache.stats()
+        assert stats.num_requests == 20
+        assert stats.num_hits == 20 - num_calls
+        assert cache.num_entries(UdfCache.fn_key(self.cached_fn)) == 10
+
+        # the same calls in a new column and in a query are served from the cache
+        t.add_computed_column(out2=self.cached_fn(t.c1))
+        assert t.where(t.out1 != t.out2).count() == 0
+        res = t.select(out=self.cached_fn(t.c1)).collect()
+        assert len(TestFunction._cache_calls) == num_calls
+        assert cache.stats().num_hits == 60 - num_calls
+
+        # different arguments are separate entries
+        res = t.select(out=self.cached_fn(t.c1, s='x')).collect()
+        assert all(out.startswith('x') for out in res['out'])
+        assert cache.num_entries(UdfCache.fn_key(self.cached_fn)) == 20
+
+        # the cache persists across sessions
+        TestFunction._cache_calls.clear()
+        reload_catalog()
+        UdfCache.init()
+        cache = UdfCache.get()
+        assert cache.num_entries() == 20
+        t = pxt.get_table('test')
+        t.insert({'c1': i} for i in range(8, 12))
+        assert sorted(TestFunction._cache_calls) == [10, 11]
+        # out1 and out2 share the same function call
+        assert cache.stats()[:3] == (cache.total_size, 4, 2)
+
+        # batched functions
+        TestFunction._cache_calls.clear()
+        t.add_computed_column(out3=self.cached_batched_fn(t.c1))
+        assert sorted(set(TestFunction._cache_calls)) == list(range(12))
+        t.add_computed_column(out4=self.cached_batched_fn(t.c1))
+        assert t.where(t.out3 != t.out4).count() == 0
+        assert len(TestFunction._cache_calls) <= 24
+        assert cache.num_entries(UdfCache.fn_key(self.cached_batched_fn)) == 12
+
+        # least recently used entries are evicted first
+        cache.clear(UdfCache.fn_key(self.cached_batched_fn))
+        assert cache.num_entries() == 22
+        entry_size = cache.total_size // cache.num_entries()
+        cache.set_capacity(entry_size * 15)
+        assert cache.num_entries() < 22
+        assert cache.stats().num_evictions == 22 - cache.num_entries()
+        assert len(cache.stats().function_stats) == 1
+
+        # entries are recorded in an index, which is reconciled with files that were removed behind the cache's back
+        num_entries = cache.num_entries()
+        next(Env.get().udf_cache_dir.glob('*.pkl')).unlink()
+        UdfCache.init()
+        assert UdfCache.get().num_entries() == num_entries - 1
+
+    def test_udf_cache_threads(self, reset_db) -> None:
+        """The cache is shared by plans that run in different threads"""
+        from concurrent import futures
+        cache = UdfCache.get()
+        cache.clear()
+
+        def run(thread_idx: int) -> None:
+            for i in range(100):
+                key = f'{i:064x}'
+                is_hit, val = cache.lookup('threadtest', key)
+                if is_hit:
+                    assert val == i
+                else:
+                    cache.add('threadtest', key, i)
+
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            for f in [executor.submit(run, i) for i in range(8)]:
+                f.result()
+        stats = cache.stats()
+        assert cache.num_entries('threadtest') == 100
+        assert stats.num_requests == 800
+        assert stats.total_size == stats.function_stats[0].total_size
+
     def test_udf_docstring(self) -> None:
         assert self.func.__doc__ == "A UDF."
         assert self.agg.__doc__ == "An aggregator."
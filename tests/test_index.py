@@ -1,15 +1,22 @@
 import random
 import string
 import sys
+import zlib
 from datetime import datetime, timedelta
-from typing import Union, _GenericAlias  # type: ignore[attr-defined]
+from typing import Any, Optional, Union, _GenericAlias  # type: ignore[attr-defined]
 
 import numpy as np
 import PIL.Image
 import pytest
+import sqlalchemy as sql
 
 import pixeltable as pxt
+from pixeltable.env import Env
+from pixeltable.func import Batch
+from pixeltable.index import LocalEmbeddingIndex
+from pixeltable.plan import Planner
 from pixeltable.functions.huggingface import clip
+from pixeltable.utils.query_embedding_cache import QueryEmbeddingCache
 
 from .utils import (ReloadTester, assert_img_eq, assert_resultset_eq, clip_embed, e5_embed, get_sentences,
                     reload_catalog, skip_test_if_not_installed, validate_update_status)
@@ -560,6 +567,636 @@ class TestIndex:
             sim = img_t.img.similarity('red truck')
             _ = img_t.order_by(sim, asc=False).limit(1).collect()
 
+    # deterministic, model-free embedding with random (Gaussian) components
+    @staticmethod
+    @pxt.udf
+    def random_embed(s: str) -> pxt.Array[(32,), pxt.Float]:  # type: ignore[misc]
+        return np.random.default_rng(zlib.crc32(s.encode())).standard_normal(32).astype(np.float32)
+
+    @pytest.mark.parametrize(
+        'index_type,precision,search_params',
+        [
+            ('hnsw', 'float32', {'ef_search': 200}),
+            ('hnsw', 'float16', {'ef_search': 200}),
+            ('ivfflat', 'float16', {'probes': 8}),
+            ('hnsw', 'binary', {'rerank_factor': 100}),
+            ('ivfflat', 'binary', {'probes': 8, 'rerank_factor': 200}),
+            ('ivfpq', 'float32', {'probes': 8, 'rerank_factor': 50}),
+        ]
+    )
+    def test_index_types(self, index_type: str, precision: str, search_params: dict, reset_db) -> None:
+        t = pxt.create_table('vector_tbl', {'s': pxt.String})
+        strs = [f'str {i}' for i in range(1500)]
+        t.insert({'s': s} for s in strs[:500])
+        index_params = {'lists': 8} if index_type in ('ivfflat', 'ivfpq') else {'m': 8, 'ef_construction': 32}
+        t.add_embedding_index(
+            's', idx_name='idx', embedding=self.random_embed, metric='cosine', index_type=index_type,
+            index_params=index_params, precision=precision)
+        # populate the index column with a COPY, if the column type allows it
+        validate_update_status(t.insert({'s': s} for s in strs[500:]), expected_rows=1000)
+
+        reload_catalog()
+        t = pxt.get_table('vector_tbl')
+        vectors = np.stack([self.random_embed.py_fn(s) for s in strs])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        for query in ['a', 'b', 'c']:
+            query_vector = self.random_embed.py_fn(query)
+            query_vector /= np.linalg.norm(query_vector)
+            expected = [strs[i] for i in np.argsort(-(vectors @ query_vector))[:10]]
+            # the search parameters are generous enough to find the exact nearest neighbors
+            sim = t.s.similarity(query, **search_params)
+            res = t.select(t.s, sim).order_by(sim, asc=False).limit(10).collect()
+            assert res['s'] == expected
+            sims = vectors[[strs.index(s) for s in expected]] @ query_vector
+            assert np.allclose(res['similarity'], sims, atol=1e-5 if precision == 'float32' else 1e-2)
+
+        idx = t._tbl_version.idxs_by_name['idx'].idx
+        assert idx.as_dict()['index_params'] == index_params
+        assert idx.as_dict()['precision'] == precision
+
+    def test_index_type_errors(self, reset_db) -> None:
+        t = pxt.create_table('vector_tbl', {'s': pxt.String})
+        with pytest.raises(pxt.Error, match='Invalid index type'):
+            t.add_embedding_index('s', embedding=self.random_embed, index_type='diskann')  # type: ignore[arg-type]
+        with pytest.raises(pxt.Error, match='Invalid precision'):
+            t.add_embedding_index('s', embedding=self.random_embed, precision='int8')  # type: ignore[arg-type]
+        with pytest.raises(pxt.Error, match="Invalid parameter 'lists' for a hnsw index"):
+            t.add_embedding_index('s', embedding=self.random_embed, index_params={'lists': 10})
+        with pytest.raises(pxt.Error, match="Invalid parameter 'rerank_factor'"):
+            t.add_embedding_index('s', embedding=self.random_embed, index_params={'rerank_factor': 10})
+        with pytest.raises(pxt.Error, match="Invalid value for index parameter 'm'"):
+            t.add_embedding_index('s', embedding=self.random_embed, index_params={'m': 0})
+
+        t.add_embedding_index('s', embedding=self.random_embed, index_type='ivfflat')
+        with pytest.raises(pxt.Error, match="'ef_search' is not supported by a ivfflat index"):
+            _ = t.s.similarity('a', ef_search=100)
+        with pytest.raises(pxt.Error, match="invalid value for 'probes'"):
+            _ = t.s.similarity('a', probes=-1)
+
+        with pytest.raises(pxt.Error, match="Index type 'ivfpq' requires precision 'float32'"):
+            t.add_embedding_index('s', embedding=self.random_embed, index_type='ivfpq', precision='float16')
+        with pytest.raises(pxt.Error, match="Invalid value for index parameter 'subvectors'"):
+            t.add_embedding_index('s', embedding=self.random_embed, index_type='ivfpq', index_params={'subvectors': 5})
+
+    def test_local_index(self, reset_db, monkeypatch) -> None:
+        t = pxt.create_table('vector_tbl', {'i': pxt.Int, 's': pxt.String})
+        strs = [f'str {i}' for i in range(3000)]
+        t.insert({'i': i, 's': s} for i, s in enumerate(strs[:1000]))
+        t.add_embedding_index('s', idx_name='idx', embedding=self.random_embed, metric='l2', index_type='ivfpq')
+        idx_info = t._tbl_version.idxs_by_name['idx']
+        index_dir = Env.get().index_dir / f'{t._tbl_version.id.hex}_{idx_info.val_col.id}'
+        # the structure for the current version was stored when the index was created
+        assert [p.name for p in index_dir.iterdir()] == [f'v{t._tbl_version.version}']
+
+        def check(tbl: pxt.Table, live_strs: list[str], where: Optional[pxt.exprs.Expr] = None) -> None:
+            vectors = np.stack([self.random_embed.py_fn(s) for s in live_strs])
+            for query in ['a', 'b', 'c']:
+                query_vector = self.random_embed.py_fn(query)
+                dists = np.linalg.norm(vectors - query_vector, axis=1)
+                expected = [live_strs[i] for i in np.argsort(dists)[:10]]
+                # the search parameters are generous enough to find the exact nearest neighbors
+                sim = tbl.s.similarity(query, probes=64, rerank_factor=50)
+                df = tbl.select(tbl.s, sim) if where is None else tbl.where(where).select(tbl.s, sim)
+                res = df.order_by(sim).limit(10).collect()
+                assert res['s'] == expected
+                assert np.allclose(res['similarity'], np.sort(dists)[:10], atol=1e-4)
+
+        check(t, strs[:1000])
+        snapshot = pxt.create_snapshot('vector_snap', t)
+        # new rows are added to the structure by the next query
+        t.insert({'i': i, 's': s} for i, s in enumerate(strs[1000:2000], start=1000))
+        check(t, strs[:2000])
+        assert [p.name for p in index_dir.iterdir()] == [f'v{t._tbl_version.version}']
+        # the snapshot is answered by the same structure
+        check(snapshot, strs[:1000])
+        # deleted and updated rows
+        t.delete(t.i < 500)
+        t.update({'s': t.s.upper()}, where=t.i >= 1900)
+        live_strs = strs[500:1900] + [s.upper() for s in strs[1900:2000]]
+        check(t, live_strs)
+
+        # reverts are applied to the stored structure
+        t.revert()
+        check(t, strs[500:2000])
+        t.revert()
+        check(t, strs[:2000])
+
+        # the structure gets loaded from disk after a restart; growing the table past RETRAIN_FACTOR times the
+        # trained size retrains it
+        monkeypatch.setattr(LocalEmbeddingIndex, '_structures', {})
+        monkeypatch.setattr(LocalEmbeddingIndex, 'RETRAIN_FACTOR', 2)
+        reload_catalog()
+        t = pxt.get_table('vector_tbl')
+        check(t, strs[:2000])
+        assert next(iter(LocalEmbeddingIndex._structures.values())).num_trained == 1000
+        t.insert({'i': i, 's': s} for i, s in enumerate(strs[2000:], start=2000))
+        check(t, strs)
+        assert next(iter(LocalEmbeddingIndex._structures.values())).num_trained == 3000
+        check(t, strs[::2], where=t.i % 2 == 0)
+        # batched searches run the queries individually
+        results = t.similarity_search(t.s, ['a', 'b'], k=5, probes=64, rerank_factor=50)
+        for query, res in zip(['a', 'b'], results):
+            sim = t.s.similarity(query, probes=64, rerank_factor=50)
+            assert res['s'] == t.select(t.s).order_by(sim).limit(5).collect()['s']
+
+        pxt.drop_table('vector_snap')
+        pxt.drop_table('vector_tbl')
+        assert not index_dir.exists()
+
+    def test_text_index(self, reset_db, reload_tester: ReloadTester) -> None:
+        t = pxt.create_table('text_tbl', {'i': pxt.Int, 's': pxt.String})
+        rng = random.Random(1)
+        words = ['alpha', 'beta', 'gamma', 'delta']
+        docs = [' '.join(rng.choice(words) for _ in range(8)) for _ in range(5000)]
+        docs += [
+            'brown fox brown fox brown fox',
+            'the quick brown fox jumps over the lazy dog',
+            # longer than BtreeIndex.MAX_STRING_LEN
+            ' '.join(['alpha'] * 60) + ' fox',
+        ]
+        t.insert({'i': i, 's': s} for i, s in enumerate(docs))
+        t.add_text_index('s', idx_name='text_idx')
+        with Env.get().engine.begin() as conn:
+            conn.execute(sql.text(f'ANALYZE {t._tbl_version.store_tbl.sa_tbl.name}'))
+
+        # matches are found via the GIN index; documents with denser matches rank higher
+        match = t.s.text_match('fox')
+        df = t.where(match).select(t.i).order_by(match, asc=False)
+        assert df.collect()['i'] == [5000, 5001, 5002]
+        assert t._tbl_version._store_idx_name(t._tbl_version.idxs_by_name['text_idx'].id) in df.explain()
+        # stemming and web search syntax
+        assert t.where(t.s.text_match('jumping foxes')).count() == 1
+        assert t.where(t.s.text_match('"quick brown"')).count() == 1
+        assert t.where(t.s.text_match('"brown quick"')).count() == 0
+        assert t.where(t.s.text_match('fox -lazy')).count() == 2
+        assert t.where(t.s.text_match('dog or brown')).count() == 2
+        assert t.where(t.s.text_match('fox') & (t.i > 5000)).count() == 2
+        # queries without searchable terms match nothing
+        assert t.where(t.s.text_match('the')).count() == 0
+        # ordering by relevance with a limit, without a filter
+        res = t.select(t.i).order_by(t.s.text_match('brown'), asc=False).limit(2).collect()
+        assert res['i'] == [5000, 5001]
+
+        # the index is maintained across deletes, updates and reverts
+        t.delete(t.i == 5000)
+        assert t.where(t.s.text_match('fox')).count() == 2
+        t.update({'s': 'a fox in the henhouse'}, where=t.i == 0)
+        assert t.where(t.s.text_match('fox')).count() == 3
+        assert t.where(t.s.text_match('henhouse')).select(t.i).collect()['i'] == [0]
+        t.revert()
+        t.revert()
+        assert t.where(t.s.text_match('fox')).count() == 3
+        assert t.where(t.s.text_match('henhouse')).count() == 0
+
+        # views see the index of their base
+        v = pxt.create_view('text_view', t.where(t.i >= 5000))
+        assert v.where(v.s.text_match('brown')).select(v.i).order_by(v.i).collect()['i'] == [5000, 5001]
+
+        _ = reload_tester.run_query(t.where(t.s.text_match('fox')).select(t.i).order_by(t.i))
+        reload_tester.run_reload_test()
+
+    def test_text_index_errors(self, reset_db) -> None:
+        t = pxt.create_table('text_tbl', {'i': pxt.Int, 's': pxt.String})
+        with pytest.raises(pxt.Error, match='No full-text index found'):
+            _ = t.s.text_match('fox')
+        with pytest.raises(pxt.Error, match='full-text index requires a string column'):
+            t.add_text_index('i')
+        with pytest.raises(pxt.Error, match='Invalid text search language'):
+            t.add_text_index('s', language="english'; drop table x; --")
+        t.add_text_index('s', idx_name='text_idx0')
+        with pytest.raises(pxt.Error, match='text_match\\(\\): requires a string'):
+            _ = t.s.text_match(1)  # type: ignore[arg-type]
+        with pytest.raises(pxt.Error, match="Full-text index 'text_idx1' not found"):
+            _ = t.s.text_match('fox', idx='text_idx1')
+        with pytest.raises(pxt.Error, match='Duplicate index name'):
+            t.add_text_index('s', idx_name='text_idx0')
+        t.add_text_index('s', idx_name='text_idx0', if_exists='ignore')
+        t.add_text_index('s', idx_name='text_idx1', language='simple')
+        with pytest.raises(pxt.Error, match='multiple full-text indices'):
+            _ = t.s.text_match('fox')
+        _ = t.where(t.s.text_match('fox', idx='text_idx1')).collect()
+        t.add_embedding_index('s', idx_name='emb_idx', embedding=self.random_embed)
+        with pytest.raises(pxt.Error, match='is not a full-text index'):
+            t.add_text_index('s', idx_name='emb_idx', if_exists='replace')
+        with pytest.raises(pxt.Error, match='weights must be non-negative'):
+            _ = t.s.hybrid_rank('fox', text_idx='text_idx0', text_weight=-1.0)
+        t.drop_index(idx_name='emb_idx')
+        with pytest.raises(pxt.Error, match='No index found'):
+            _ = t.s.hybrid_rank('fox', text_idx='text_idx0')
+
+    def test_hybrid_rank(self, reset_db) -> None:
+        t = pxt.create_table('text_tbl', {'i': pxt.Int, 's': pxt.String})
+        rng = random.Random(1)
+        words = ['alpha', 'beta', 'gamma', 'delta', 'fox', 'dog']
+        docs = [' '.join(rng.choice(words) for _ in range(rng.randint(3, 12))) for _ in range(200)]
+        t.insert({'i': i, 's': s} for i, s in enumerate(docs))
+        t.add_text_index('s')
+        t.add_embedding_index('s', embedding=self.random_embed, metric='cosine')
+
+        # expected Reciprocal Rank Fusion scores, with the SQL semantics of rank(): ties share the lowest rank
+        query = 'fox dog'
+        with Env.get().engine.begin() as conn:
+            text_scores = np.array([
+                conn.execute(
+                    sql.text(
+                        "SELECT ts_rank_cd(to_tsvector('english', :s), websearch_to_tsquery('english', :q), 1)"
+                        " * (to_tsvector('english', :s) @@ websearch_to_tsquery('english', :q))::int"),
+                    {'s': s, 'q': query}).scalar()
+                for s in docs
+            ])
+        vectors = np.stack([self.random_embed.py_fn(s) for s in docs])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        query_vector = self.random_embed.py_fn(query)
+        sims = vectors @ (query_vector / np.linalg.norm(query_vector))
+
+        def positions(scores: np.ndarray) -> np.ndarray:
+            return np.array([1 + np.sum(scores > score) for score in scores])
+
+        rrf_k, text_weight = 60, 2.0
+        is_match = text_scores > 0
+        text_pos = positions(np.where(is_match, text_scores, -1.0))
+        expected = np.where(is_match, text_weight / (rrf_k + text_pos), 0.0) + 1.0 / (rrf_k + positions(sims))
+
+        # without a limit, all rows are ranked
+        rank = t.s.hybrid_rank(query, text_weight=text_weight)
+        res = t.select(t.i, score=rank).order_by(rank, asc=False).collect()
+        assert len(res) == len(docs)
+        assert np.allclose(res['score'], expected[res['i']], atol=1e-5)
+        assert np.allclose(res['score'], np.sort(expected)[::-1], atol=1e-5)
+
+        # with a limit, only the best matches of each ranking are ranked
+        res = t.select(t.i).order_by(rank, asc=False).limit(5).collect()
+        assert len(res) == 5
+        assert res['i'][0] == int(np.argmax(expected))
+        # a filter applies to the ranked rows
+        res = t.where(t.i < 100).select(t.i, score=rank).order_by(rank, asc=False).limit(5).collect()
+        assert all(i < 100 for i in res['i'])
+
+    def test_json_index(self, reset_db, reload_tester: ReloadTester) -> None:
+        t = pxt.create_table('json_tbl', {'i': pxt.Int, 'd': pxt.Json})
+        long_str = 'x' * 300
+        # labels of different types, including values that are equal in Python but not in jsonb (True == 1)
+        special_labels = ['rare', 1, True, 2.5, long_str, ['rare', 'other'], {'rare': 1}]
+
+        def make_doc(i: int) -> dict:
+            if i < len(special_labels):
+                return {'label': special_labels[i], 'tags': 'red' if i == 0 else ['red', 'blue']}
+            if i % 1000 == 999:
+                # missing path
+                return {'tags': []}
+            return {'label': f'label{i % 100}', 'tags': [f'tag{i % 7}', 'blue'] if i % 2 == 0 else f'tag{i % 7}'}
+
+        docs = [make_doc(i) for i in range(self.BTREE_TEST_NUM_ROWS)]
+        t.insert({'i': i, 'd': d} for i, d in enumerate(docs[:5000]))
+        t.add_json_index(t.d.label, idx_name='label_idx')
+        t.add_json_index(t.d.tags, idx_name='tags_idx', index_type='gin')
+        # populate the index columns for new rows
+        t.insert({'i': i, 'd': d} for i, d in enumerate(docs[5000:], start=5000))
+        with Env.get().engine.begin() as conn:
+            conn.execute(sql.text(f'ANALYZE {t._tbl_version.store_tbl.sa_tbl.name}'))
+
+        def store_idx_name(idx_name: str) -> str:
+            return t._tbl_version._store_idx_name(t._tbl_version.idxs_by_name[idx_name].id)
+
+        def check(tbl: pxt.Table, docs: list[dict], path: str, val: Any) -> None:
+            df = tbl.where(getattr(tbl.d, path) == val).select(tbl.i).order_by(tbl.i)
+            assert df.collect()['i'] == [i for i, d in enumerate(docs) if d.get(path) == val]
+
+        # the indices are used for equality with strings and numbers
+        for path, val in [('label', 'rare'), ('label', 'label7'), ('label', 2.5), ('tags', 'red'), ('tags', 'tag3')]:
+            check(t, docs, path, val)
+            explain = t.where(getattr(t.d, path) == val).select(t.i).explain()
+            assert store_idx_name(f'{path}_idx') in explain
+        # other comparisons are evaluated in Python
+        for path, val in [('label', 1), ('label', True), ('label', long_str), ('tags', 'missing')]:
+            check(t, docs, path, val)
+        assert store_idx_name('label_idx') not in t.where(t.d.label == 1).select(t.i).explain()
+        res = t.where(t.d.label != 'rare').select(t.i).collect()
+        assert len(res) == sum(1 for d in docs if d.get('label') != 'rare')
+        # negated comparisons include the rows for which the path is missing or its value isn't indexed
+        for path, val in [('label', 'rare'), ('label', 'label7'), ('tags', 'red')]:
+            df = t.where(~(getattr(t.d, path) == val)).select(t.i).order_by(t.i)
+            assert df.collect()['i'] == [i for i, d in enumerate(docs) if not d.get(path) == val]
+
+        # the indices are maintained across updates, deletes and reverts; snapshots don't use them
+        snapshot = pxt.create_snapshot('json_snap', t)
+        t.update({'d': {'label': 'rare'}}, where=t.i == 100)
+        t.delete(t.i == 0)
+        updated_docs = [{'label': 'rare'} if i == 100 else d for i, d in enumerate(docs)]
+        check(t, [{} if i == 0 else d for i, d in enumerate(updated_docs)], 'label', 'rare')
+        check(snapshot, docs, 'label', 'rare')
+        t.revert()
+        check(t, updated_docs, 'label', 'rare')
+        t.revert()
+        check(t, docs, 'label', 'rare')
+
+        # views see the indices of their base
+        v = pxt.create_view('json_view', t.where(t.i < 1000))
+        check(v, docs[:1000], 'label', 'label7')
+
+        _ = reload_tester.run_query(t.where(t.d.label == 'rare').select(t.i).order_by(t.i))
+        reload_tester.run_reload_test()
+
+    def test_json_index_errors(self, reset_db) -> None:
+        t = pxt.create_table('json_tbl', {'i': pxt.Int, 'd': pxt.Json})
+        with pytest.raises(pxt.Error, match='requires a path of a JSON column'):
+            t.add_json_index(t.i)  # type: ignore[arg-type]
+        with pytest.raises(pxt.Error, match='requires a path of a JSON column'):
+            t.add_json_index(t.d)  # type: ignore[arg-type]
+        with pytest.raises(pxt.Error, match='invalid JSON path'):
+            t.add_json_index(t.d.tags[0:2])
+        with pytest.raises(pxt.Error, match="Invalid JSON index type 'hash'"):
+            t.add_json_index(t.d.label, index_type='hash')  # type: ignore[arg-type]
+        t.add_json_index(t.d.label, idx_name='label_idx')
+        with pytest.raises(pxt.Error, match='Duplicate index name'):
+            t.add_json_index(t.d.label, idx_name='label_idx')
+        t.add_json_index(t.d.label, idx_name='label_idx', if_exists='replace', index_type='gin')
+        assert t._tbl_version.idxs_by_name['label_idx'].idx.as_dict() == {'path': ['label'], 'index_type': 'gin'}
+        t.drop_index(idx_name='label_idx')
+
+    # queries passed to counting_embed
+    embed_calls: list[str] = []
+
+    @staticmethod
+    @pxt.udf
+    def counting_embed(s: str) -> pxt.Array[(32,), pxt.Float]:  # type: ignore[misc]
+        TestIndex.embed_calls.append(s)
+        return np.random.default_rng(zlib.crc32(s.encode())).standard_normal(32).astype(np.float32)
+
+    def test_query_embedding_cache(self, reset_db, monkeypatch) -> None:
+        t = pxt.create_table('vector_tbl', {'s': pxt.String})
+        t.insert({'s': f'str {i}'} for i in range(100))
+        t.add_embedding_index('s', idx_name='idx1', embedding=self.counting_embed)
+        t.add_embedding_index('s', idx_name='idx2', embedding=self.random_embed)
+        cache = QueryEmbeddingCache.get()
+        cache.clear()
+        monkeypatch.setattr(TestIndex, 'embed_calls', [])
+
+        def run_query(query: str) -> list[str]:
+            sim = t.s.similarity(query, idx='idx1')
+            return t.select(t.s, sim).order_by(sim, asc=False).limit(5).collect()['s']
+
+        # the embedding is computed once for the select list and the order by clause
+        res = run_query('a')
+        assert TestIndex.embed_calls == ['a']
+        stats = cache.stats()
+        assert stats.num_entries == 1 and stats.num_hits == stats.num_requests - 1
+        # and it is reused across queries
+        assert run_query('a') == res
+        assert TestIndex.embed_calls == ['a']
+        _ = run_query('b')
+        assert TestIndex.embed_calls == ['a', 'b']
+        # entries are specific to the embedding function
+        sim = t.s.similarity('a', idx='idx2')
+        _ = t.order_by(sim, asc=False).limit(5).collect()
+        stats = cache.stats()
+        assert stats.num_entries == 3 and stats.num_hits == stats.num_requests - 3
+
+        # least recently used entries are evicted first
+        cache.set_capacity(2)
+        assert cache.stats().num_evictions == 1
+        _ = run_query('b')
+        assert TestIndex.embed_calls == ['a', 'b']
+        _ = run_query('a')
+        assert TestIndex.embed_calls == ['a', 'b', 'a']
+
+        # module-level embedding functions are the same instances after a catalog reload
+        reload_catalog()
+        t = pxt.get_table('vector_tbl')
+        _ = run_query('a')
+        assert TestIndex.embed_calls == ['a', 'b', 'a']
+
+        # a capacity of 0 disables the cache
+        cache.set_capacity(0)
+        _ = run_query('a')
+        assert len(TestIndex.embed_calls) >= 5
+        assert cache.stats().num_entries == 0
+        cache.set_capacity(QueryEmbeddingCache.DEFAULT_CAPACITY)
+
+    # sizes of the batches passed to batched_embed
+    embed_batch_sizes: list[int] = []
+
+    @staticmethod
+    @pxt.udf(batch_size=16)
+    def batched_embed(strs: Batch[str]) -> Batch[pxt.Array[(32,), pxt.Float]]:  # type: ignore[misc]
+        TestIndex.embed_batch_sizes.append(len(strs))
+        return [np.random.default_rng(zlib.crc32(s.encode())).standard_normal(32).astype(np.float32) for s in strs]
+
+    @staticmethod
+    @pxt.udf
+    def is_odd(i: int) -> bool:
+        return i % 2 == 1
+
+    @pytest.mark.parametrize('precision', ['float32', 'binary'])
+    def test_similarity_search(self, precision: str, reset_db, monkeypatch) -> None:
+        t = pxt.create_table('vector_tbl', {'s': pxt.String, 'i': pxt.Int})
+        t.insert({'s': f'str {i}', 'i': i} for i in range(200))
+        t.add_embedding_index('s', embedding=self.batched_embed, precision=precision)
+        QueryEmbeddingCache.get().clear()
+        monkeypatch.setattr(TestIndex, 'embed_batch_sizes', [])
+        # with binary precision, all rows are candidates, so that the results are exact
+        search_params = {'rerank_factor': 50} if precision == 'binary' else {}
+        queries = ['str 3', 'str 17', 'xyz', 'str 3'] + [f'query {i}' for i in range(20)]
+
+        def check_results(
+            results: list[pxt.dataframe.DataFrameResultSet], where: Optional[pxt.exprs.Expr] = None
+        ) -> None:
+            assert len(results) == len(queries)
+            for query, result in zip(queries, results):
+                sim = t.s.similarity(query, **search_params)
+                df = t.where(where) if where is not None else t
+                expected = df.select(t.s, t.i, similarity=sim).order_by(sim, asc=False).limit(5).collect()
+                assert list(result.schema.keys()) == list(expected.schema.keys())
+                assert result['s'] == expected['s']
+                assert np.allclose(result['similarity'], expected['similarity'], atol=1e-3)
+
+        results = t.select(t.s, t.i).similarity_search(t.s, queries, k=5, **search_params)
+        check_results(results)
+        assert results[0]['s'][0] == 'str 3' and results[1]['s'][0] == 'str 17'
+        # the queries were embedded in batches of the UDF's batch size
+        assert TestIndex.embed_batch_sizes == [16, 8]
+
+        # filters in SQL still result in a single statement
+        results = t.where(t.i % 2 == 1).similarity_search(t.s, queries, k=5, **search_params)
+        check_results(results, where=t.i % 2 == 1)
+        assert all(i % 2 == 1 for result in results for i in result['i'])
+        assert len(results[0]) == 5 and results[1]['s'][0] == 'str 17'
+
+        # filters in Python result in one query per item, but the items still get embedded in batches
+        QueryEmbeddingCache.get().clear()
+        TestIndex.embed_batch_sizes.clear()
+        results = t.where(self.is_odd(t.i)).similarity_search(t.s, queries, k=5, **search_params)
+        check_results(results, where=t.i % 2 == 1)
+        assert TestIndex.embed_batch_sizes == [16, 8]
+
+        # the results of the table method are those of its DataFrame
+        results = t.similarity_search(t.s, queries[:2], k=3, **search_params)
+        assert list(results[0].schema.keys()) == ['s', 'i', 'similarity']
+        assert [len(result) for result in results] == [3, 3]
+        assert t.similarity_search(t.s, [], k=3) == []
+
+        with pytest.raises(pxt.Error, match='cannot be used with order_by'):
+            _ = t.order_by(t.i).similarity_search(t.s, queries, k=5)
+        with pytest.raises(pxt.Error, match='cannot be used with limit'):
+            _ = t.limit(10).similarity_search(t.s, queries, k=5)
+        with pytest.raises(pxt.Error, match='must be a positive integer'):
+            _ = t.similarity_search(t.s, queries, k=0)
+        with pytest.raises(pxt.Error, match='must be a column reference'):
+            _ = t.similarity_search(t.i + 1, queries, k=5)
+        with pytest.raises(pxt.Error, match='already contains a column named `similarity`'):
+            _ = t.select(similarity=t.i).similarity_search(t.s, queries, k=5)
+        with pytest.raises(pxt.Error, match='No index found'):
+            _ = t.similarity_search(t.i, queries, k=5)
+
+    def test_index_deletes(self, reset_db) -> None:
+        t = pxt.create_table('vector_tbl', {'s': pxt.String, 'i': pxt.Int})
+        t.insert({'s': f'str {i}', 'i': i} for i in range(50))
+        t.add_embedding_index('s', idx_name='emb_idx', embedding=self.batched_embed)
+        # new indices don't have undo columns: the values of deleted rows are retained
+        assert all(info.undo_col is None for info in t._tbl_version.idxs_by_name.values())
+
+        def top_match(tbl: pxt.Table, query: str) -> str:
+            sim = tbl.s.similarity(query)
+            return tbl.select(tbl.s).order_by(sim, asc=False).limit(1).collect()['s'][0]
+
+        snapshot = pxt.create_snapshot('vector_snap', t)
+        t.delete(t.i < 10)
+        # the deleted rows are excluded by the indices, but still visible in the snapshot
+        assert top_match(t, 'str 3') != 'str 3'
+        assert t.where(t.i == 3).count() == 0
+        assert top_match(snapshot, 'str 3') == 'str 3'
+        assert snapshot.where(snapshot.i == 3).count() == 1
+        t.update({'i': t.i + 100}, where=t.i == 17)
+        assert top_match(t, 'str 17') == 'str 17'
+        assert t.where(t.i == 117).count() == 1
+
+        # reverting makes the rows reappear in the indices
+        t.revert()
+        assert t.where(t.i == 17).count() == 1
+        t.revert()
+        assert top_match(t, 'str 3') == 'str 3'
+        assert t.where(t.i == 3).count() == 1
+        assert t.count() == 50
+
+    @pytest.mark.parametrize('precision', ['float32', 'binary'])
+    def test_concurrent_index_build(self, precision: str, reset_db, monkeypatch) -> None:
+        t = pxt.create_table('vector_tbl', {'s': pxt.String, 'i': pxt.Int})
+        t.insert({'s': f'str {i}', 'i': i} for i in range(200))
+        monkeypatch.setenv('PIXELTABLE_INDEX_BUILD_MEMORY_MB', '128')
+        monkeypatch.setenv('PIXELTABLE_INDEX_BUILD_WORKERS', '1')
+        sim = lambda: t.s.similarity('str 3')
+        df = lambda: t.select(t.s, t.i).order_by(sim(), asc=False).limit(5)
+        df_filtered = lambda: t.where(t.i % 2 == 1).select(t.s, t.i).order_by(sim(), asc=False).limit(5)
+
+        def is_valid() -> Optional[bool]:
+            """Returns the validity of the Postgres index, or None if it doesn't exist"""
+            store_idx_name = t._tbl_version._store_idx_name(t._tbl_version.idxs_by_name['emb_idx'].id)
+            with Env.get().engine.connect() as conn:
+                stmt = 'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :n'
+                return conn.execute(sql.text(stmt), {'n': store_idx_name}).scalar()
+
+        # before the index structure is built, queries rank the rows by their exact distance
+        create_index = pxt.index.EmbeddingIndex.create_index
+        results_during_build: list[pxt.dataframe.DataFrameResultSet] = []
+
+        def create_index_and_query(self, index_name, index_value_col, conn, concurrently=False) -> None:
+            assert concurrently
+            assert conn.execute(sql.text('SHOW maintenance_work_mem')).scalar() == '128MB'
+            assert is_valid() is None
+            assert not t._tbl_version.is_index_ready(t._tbl_version.idxs_by_name['emb_idx'].id)
+            assert 'binary_quantize' not in df().explain()
+            assert 'exact' in df_filtered().explain()
+            results_during_build.extend([df().collect(), df_filtered().collect()])
+            create_index(self, index_name, index_value_col, conn, concurrently=concurrently)
+
+        monkeypatch.setattr(pxt.index.EmbeddingIndex, 'create_index', create_index_and_query)
+        t.add_embedding_index('s', idx_name='emb_idx', embedding=self.batched_embed, precision=precision,
+                              concurrently=True)
+        assert results_during_build[0]['s'][0] == 'str 3'
+        assert all(i % 2 == 1 for i in results_during_build[1]['i'])
+        assert is_valid() is True
+        assert t._tbl_version.is_index_ready(t._tbl_version.idxs_by_name['emb_idx'].id)
+        assert ('binary_quantize' in df().explain()) == (precision == 'binary')
+        res = df().collect()
+        assert res['s'] == results_during_build[0]['s']
+        # the build settings don't outlive the build
+        with Env.get().engine.connect() as conn:
+            assert conn.execute(sql.text('SHOW maintenance_work_mem')).scalar() != '128MB'
+
+        # the index is ready after reloading the catalog
+        reload_catalog()
+        t = pxt.get_table('vector_tbl')
+        assert t._tbl_version.is_index_ready(t._tbl_version.idxs_by_name['emb_idx'].id)
+
+        # a failed build drops the index again
+        def fail(*args: Any, **kwargs: Any) -> None:
+            raise RuntimeError('build failed')
+
+        monkeypatch.setattr(pxt.index.EmbeddingIndex, 'create_index', fail)
+        with pytest.raises(pxt.Error, match="Failed to build index 'other_idx': build failed"):
+            t.add_embedding_index('s', idx_name='other_idx', embedding=self.batched_embed, concurrently=True)
+        assert 'other_idx' not in t._tbl_version.idxs_by_name
+        assert df().collect()['s'] == res['s']
+
+    def test_filtered_similarity_search(self, reset_db, monkeypatch) -> None:
+        t = pxt.create_table('vector_tbl', {'s': pxt.String, 'i': pxt.Int})
+        strs = [f'str {i}' for i in range(5000)]
+        t.insert({'s': s, 'i': i} for i, s in enumerate(strs))
+        t.add_embedding_index('s', embedding=self.batched_embed, metric='cosine')
+        # the strategy depends on the Postgres statistics
+        with Env.get().engine.begin() as conn:
+            conn.execute(sql.text(f'ANALYZE {t._tbl_version.store_tbl.sa_tbl.name}'))
+        vectors = np.stack(self.batched_embed.py_fn(strs))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        query_vector = self.batched_embed.py_fn(['query'])[0]
+        ranked = np.argsort(-(vectors @ (query_vector / np.linalg.norm(query_vector))))
+
+        def run_query(pred: pxt.exprs.Expr, max_i: int) -> tuple[str, float]:
+            """Returns the explain output and the recall"""
+            sim = t.s.similarity('query', ef_search=200)
+            df = t.where(pred).select(t.i).order_by(sim, asc=False).limit(10)
+            expected = [i for i in ranked if i < max_i][:10]
+            res = df.collect()
+            assert len(res) == 10
+            return df.explain(), len(set(res['i']) & set(expected)) / 10
+
+        # most rows pass the filter: the index scan is filtered
+        explain, recall = run_query(t.i < 4900, 4900)
+        assert 'similarity search with filter: index' in explain and 'hnsw.ef_search=200' in explain
+        assert recall >= 0.9
+        # selective filter: candidates are retrieved via the index and then filtered
+        explain, recall = run_query(t.i < 1000, 1000)
+        assert 'similarity search with filter: overfetch' in explain and '100 candidates' in explain
+        assert recall >= 0.9
+        # very selective filter: exact search
+        explain, recall = run_query(t.i < 10, 10)
+        assert 'similarity search with filter: exact' in explain and 'enable_indexscan=off' in explain
+        assert recall == 1.0
+        # without a filter, the index is used as before
+        sim = t.s.similarity('query')
+        assert 'similarity search with filter' not in t.order_by(sim, asc=False).limit(10).explain()
+
+        # with too few candidates, the search is repeated with more candidates
+        monkeypatch.setattr(Planner, 'FILTERED_SEARCH_OVERFETCH_FACTOR', 0.1)
+        explain, recall = run_query(t.i < 1000, 1000)
+        assert '5 candidates' in explain
+        assert recall >= 0.9
+        monkeypatch.undo()
+
+        # filters with operators that need escaping in the driver's paramstyle (%) and with parameters are estimated
+        sim = t.s.similarity('query')
+        df = t.where((t.i % 2 == 0) & (t.s != 'str 0')).select(t.i).order_by(sim, asc=False).limit(10)
+        assert 'estimated selectivity' in df.explain()
+        assert set(df.collect()['i']) <= {int(i) for i in ranked if i % 2 == 0 and i != 0}
+
+        # without an estimate, the search is exact
+        def fail(cls: type, stmt: sql.Select, conn: sql.engine.Connection) -> int:
+            raise sql.exc.OperationalError('EXPLAIN', {}, Exception('no estimate'))
+        monkeypatch.setattr(Planner, '_estimate_num_rows', classmethod(fail))
+        explain, recall = run_query(t.i < 4900, 4900)
+        assert 'similarity search with filter: exact (no estimated selectivity)' in explain
+        assert recall == 1.0
+
     def run_btree_test(self, data: list, data_type: Union[type, _GenericAlias]) -> pxt.Table:
         t = pxt.create_table('btree_test', {'data': data_type})
         num_rows = len(data)
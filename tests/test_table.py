@@ -3,26 +3,29 @@ import math
 import os
 import random
 import re
-from typing import Any, Union, _GenericAlias  # type: ignore[attr-defined]
+from typing import Any, Iterator, Optional, Union, _GenericAlias  # type: ignore[attr-defined]
 
 import av  # type: ignore[import-untyped]
 import numpy as np
 import pandas as pd
 import PIL
 import pytest
+import sqlalchemy as sql
 from jsonschema.exceptions import ValidationError
 
 import pixeltable as pxt
 import pixeltable.functions as pxtf
 from pixeltable import catalog
 from pixeltable import exceptions as excs
+from pixeltable.env import Env
 from pixeltable.exprs import ColumnRef
 from pixeltable.io.external_store import MockProject
 from pixeltable.iterators import FrameIterator
+from pixeltable.metadata import schema
 from pixeltable.utils.filecache import FileCache
 from pixeltable.utils.media_store import MediaStore
 
-from .utils import (ReloadTester, assert_resultset_eq, create_table_data, get_audio_files, get_documents,
+from .utils import (ReloadTester, assert_resultset_eq, char_embed, create_table_data, get_audio_files, get_documents,
                     get_image_files, get_multimedia_commons_video_uris, get_video_files, make_tbl, read_data_file,
                     reload_catalog, skip_test_if_not_installed, strip_lines, validate_update_status)
 
@@ -45,6 +48,18 @@ class TestTable:
     def add1(a: int) -> int:
         return a + 1
 
+    # records its calls and fails for a == _backfill_fail_on
+    _backfill_calls: list[int] = []
+    _backfill_fail_on: Optional[int] = None
+
+    @staticmethod
+    @pxt.udf
+    def backfill_fn(a: int) -> int:
+        TestTable._backfill_calls.append(a)
+        if a == TestTable._backfill_fail_on:
+            raise RuntimeError(f'failed on {a}')
+        return a * 2
+
     @pxt.uda(requires_order_by=True, allows_window=True)
     class window_fn(pxt.Aggregator):
         def __init__(self):
@@ -1066,6 +1081,226 @@ class TestTable:
         t.insert(str_col='Hello there.') # Succeeds because column 'bad' is dropped
         pxt.drop_table('test')
 
+    def test_insert_copy(self, reset_db, monkeypatch) -> None:
+        # inserts via COPY and via INSERT produce identical tables (see tool/benchmark_insert.py for their speed)
+        num_rows = 3000
+        rows = [
+            {
+                'c_int': i, 'c_float': i / 3, 'c_bool': i % 2 == 0, 'c_str': f'str {i}' if i % 7 != 0 else None,
+                'c_ts': datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=i),
+                'c_json': {'a': i, 'b': [i, str(i)]} if i % 5 != 0 else None,
+                'c_array': np.full((2, 2), i, dtype=np.int64),
+            }
+            for i in range(num_rows)
+        ]
+        results = {}
+        num_excs = {}
+        for min_rows in [0, 1]:
+            # copy_insert_min_rows == 0 disables COPY
+            monkeypatch.setenv('PIXELTABLE_COPY_INSERT_MIN_ROWS', str(min_rows))
+            t = pxt.create_table(f'copy_test_{min_rows}', {
+                'c_int': pxt.Int, 'c_float': pxt.Float, 'c_bool': pxt.Bool, 'c_str': pxt.String,
+                'c_ts': pxt.Timestamp, 'c_json': pxt.Json, 'c_array': pxt.Array[(2, 2), pxt.Int],  # type: ignore[misc]
+            })
+            status = t.insert(rows[:-1000], on_error='ignore')
+            assert status.num_rows == num_rows - 1000
+
+            # a computed column with errors and an embedding index (vector columns)
+            t.add_computed_column(c_computed=self.f1(t.c_int), on_error='ignore')
+            t.add_embedding_index('c_str', string_embed=char_embed)
+            status = t.insert(rows[-1000:], on_error='ignore')
+            assert status.num_rows == 1000
+            num_excs[min_rows] = status.num_excs
+            results[min_rows] = (
+                t.select(
+                    t.c_int, t.c_float, t.c_bool, t.c_str, t.c_ts, t.c_json, t.c_array, t.c_computed,
+                    t.c_computed.errortype, t.c_str.similarity('str 17')
+                ).order_by(t.c_int).collect()
+            )
+        assert num_excs[0] == num_excs[1] > 0
+        assert_resultset_eq(results[0], results[1])
+
+    # the number of rows a stream had yielded at each call of stream_progress()
+    _stream_progress: list[int] = []
+    _stream_num_consumed = 0
+
+    @staticmethod
+    @pxt.udf
+    def stream_progress(x: int) -> int:
+        TestTable._stream_progress.append(TestTable._stream_num_consumed)
+        return x
+
+    def test_insert_stream(self, reset_db, monkeypatch) -> None:
+        # generators and async iterables are consumed in batches, with computed columns evaluated as the rows arrive
+        monkeypatch.setattr(TestTable, '_stream_progress', [])
+        t = pxt.create_table('test_tbl', {'c1': pxt.Int, 'c2': pxt.String})
+        t.add_computed_column(c3=t.c1 * 2)
+        t.add_computed_column(c4=self.stream_progress(t.c1))
+        num_rows = 5000
+        num_consumed = 0
+
+        def gen():
+            nonlocal num_consumed
+            for i in range(num_rows):
+                num_consumed += 1
+                TestTable._stream_num_consumed = num_consumed
+                yield {'c1': i, 'c2': f'str {i}'}
+
+        status = t.insert(gen())
+        assert status.num_rows == num_consumed == num_rows
+        assert status.num_excs == 0
+        # the computed column was evaluated for the first rows while the stream was still being read
+        assert len(TestTable._stream_progress) == num_rows
+        assert TestTable._stream_progress[0] < num_rows
+
+        # iterables that aren't collections are streamed as well, without being materialized up front
+        class Rows:
+            def __iter__(self) -> Iterator[dict[str, Any]]:
+                return gen()
+
+        t2 = pxt.create_table('test_tbl2', {'c1': pxt.Int, 'c2': pxt.String})
+        num_consumed = 0
+        status = t2.insert(Rows())
+        assert status.num_rows == num_consumed == num_rows
+
+        async def agen():
+            for i in range(num_rows, num_rows + 10):
+                yield {'c1': i, 'c2': f'str {i}'}
+
+        status = t.insert(agen())
+        assert status.num_rows == 10
+        assert t.count() == num_rows + 10
+        res = t.select(t.c1, t.c3).order_by(t.c1).collect()
+        assert res['c1'] == list(range(num_rows + 10))
+        assert res['c3'] == [2 * i for i in range(num_rows + 10)]
+
+        # rows of streams are validated as they are consumed
+        version, next_rowid = t._tbl_version.version, t._tbl_version.next_rowid
+        with pytest.raises(excs.Error) as exc_info:
+            t.insert({'c1': i} if i < 2000 else {'c1': 'a'} for i in range(3000))
+        assert 'Error in column c1' in str(exc_info.value)
+        with pytest.raises(excs.Error) as exc_info:
+            t.insert(x for x in [{'c1': 1}, 2])
+        assert 'must be a list of dictionaries' in str(exc_info.value)
+        with pytest.raises(excs.Error) as exc_info:
+            t.insert(x for x in [])
+        assert 'must not be empty' in str(exc_info.value)
+
+        # the failed inserts didn't use up a version or rowids
+        assert (t._tbl_version.version, t._tbl_version.next_rowid) == (version, next_rowid)
+        status = t.insert(c1=num_rows + 10, c2='after')
+        assert status.num_rows == 1
+        assert t._tbl_version.version == version + 1
+        assert t.count() == num_rows + 11
+        reload_catalog()
+        t = pxt.get_table('test_tbl')
+        assert t._tbl_version.version == version + 1
+        assert t.where(t.c2 == 'after').count() == 1
+
+    def test_add_computed_column_chunked(self, reset_db, monkeypatch) -> None:
+        # load_column() applies the computed values in chunks; the chunking must not affect the result
+        from pixeltable.store import StoreBase
+        rows = [{'c_int': i, 'c_str': f'str {i}'} for i in range(100)]
+        results = {}
+        for chunk_size in [7, 100, 10000]:
+            monkeypatch.setattr(StoreBase, '_StoreBase__LOAD_COLUMN_CHUNK_SIZE', chunk_size)
+            t = pxt.create_table(f'test_{chunk_size}', {'c_int': pxt.Int, 'c_str': pxt.String})
+            t.insert(rows)
+            status = t.add_computed_column(c_computed=self.f1(t.c_int), on_error='ignore')
+            assert status.num_excs == 10
+            t.add_computed_column(c_json={'a': t.c_int, 'b': t.c_str})
+            results[chunk_size] = (
+                t.select(t.c_int, t.c_computed, t.c_computed.errortype, t.c_json).order_by(t.c_int).collect()
+            )
+        assert_resultset_eq(results[7], results[100])
+        assert_resultset_eq(results[7], results[10000])
+
+    def test_add_computed_column_resumable(self, reset_db, monkeypatch) -> None:
+        from pixeltable.store import StoreBase
+        monkeypatch.setattr(StoreBase, '_StoreBase__BACKFILL_RANGE_SIZE', 10)
+        monkeypatch.setattr(TestTable, '_backfill_calls', [])
+        t = pxt.create_table('test', {'c_int': pxt.Int})
+        t.insert({'c_int': i} for i in range(100))
+        version = t._tbl_version.version
+
+        # the backfill fails in the rowid range [50, 60): the column doesn't become visible
+        TestTable._backfill_fail_on = 55
+        with pytest.raises(excs.Error, match='failed on 55'):
+            t.add_computed_column(c=self.backfill_fn(t.c_int), resumable=True)
+        assert 'c' not in t.columns
+        assert t._tbl_version.version == version
+        assert t.count() == 100
+
+        # after a restart, only the remaining ranges get computed
+        reload_catalog()
+        t = pxt.get_table('test')
+        TestTable._backfill_fail_on = None
+        TestTable._backfill_calls.clear()
+        status = t.add_computed_column(c=self.backfill_fn(t.c_int), resumable=True)
+        assert status.num_rows == 100
+        assert status.num_excs == 0
+        assert sorted(TestTable._backfill_calls) == list(range(50, 100))
+        assert t._tbl_version.version == version + 1
+        reload_catalog()
+        t = pxt.get_table('test')
+        assert t.select(t.c_int, t.c).order_by(t.c_int).collect()['c'] == [2 * i for i in range(100)]
+
+        # the progress of a failed backfill is discarded if the table changes in the meantime
+        TestTable._backfill_fail_on = 5
+        with pytest.raises(excs.Error, match='failed on 5'):
+            t.add_computed_column(d=self.backfill_fn(t.c_int), resumable=True)
+        t.insert(c_int=100)
+        TestTable._backfill_fail_on = None
+        TestTable._backfill_calls.clear()
+        status = t.add_computed_column(d=self.backfill_fn(t.c_int), resumable=True)
+        assert status.num_rows == 101
+        assert sorted(TestTable._backfill_calls) == list(range(101))
+
+        # ... or if another column gets added in the meantime
+        TestTable._backfill_fail_on = 95
+        with pytest.raises(excs.Error, match='failed on 95'):
+            t.add_computed_column(e=self.backfill_fn(t.c_int), on_error='abort', resumable=True)
+        t.add_computed_column(f=t.c_int + 1)
+        assert t.select(t.f).order_by(t.c_int).collect()['f'] == list(range(1, 102))
+        TestTable._backfill_calls.clear()
+        status = t.add_computed_column(e=self.backfill_fn(t.c_int), on_error='ignore', resumable=True)
+        assert status.num_excs == 1
+        assert sorted(TestTable._backfill_calls) == list(range(101))
+        assert t.where(t.e.errortype != None).count() == 1
+
+        # the column isn't added if another process modifies the table while it's being populated
+        version = t._tbl_version.version
+        tbl_id = t._tbl_version.id
+
+        def set_current_version(v: int) -> None:
+            with Env.get().engine.begin() as conn:
+                md = conn.execute(sql.select(schema.Table.md).where(schema.Table.id == tbl_id)).scalar_one()
+                md['current_version'] = v
+                conn.execute(sql.update(schema.Table).values(md=md).where(schema.Table.id == tbl_id))
+
+        record_backfill_range = StoreBase.record_backfill_range
+
+        def concurrent_update(*args: Any, **kwargs: Any) -> None:
+            record_backfill_range(*args, **kwargs)
+            set_current_version(version + 1)
+
+        monkeypatch.setattr(StoreBase, 'record_backfill_range', concurrent_update)
+        with pytest.raises(excs.Error, match="Table 'test' was modified while column 'g' was being populated"):
+            t.add_computed_column(g=self.backfill_fn(t.c_int), resumable=True)
+        monkeypatch.setattr(StoreBase, 'record_backfill_range', record_backfill_range)
+        set_current_version(version)
+        assert 'g' not in t.columns
+        assert t._tbl_version.version == version
+        status = t.add_computed_column(g=self.backfill_fn(t.c_int), resumable=True)
+        assert status.num_rows == 101
+        assert t._tbl_version.version == version + 1
+
+        # dropping the table drops the progress of an unfinished backfill as well
+        TestTable._backfill_fail_on = 0
+        with pytest.raises(excs.Error, match='failed on 0'):
+            t.add_computed_column(h=self.backfill_fn(t.c_int), resumable=True)
+        pxt.drop_table('test')
+
     def test_insert_string_with_null(self, reset_db) -> None:
         t = pxt.create_table('test', {'c1': pxt.String})
 
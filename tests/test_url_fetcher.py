@@ -0,0 +1,163 @@
+import asyncio
+import http.server
+import os
+import re
+import threading
+import urllib.request
+from pathlib import Path
+from typing import Iterator, Optional
+
+import httpx
+import numpy as np
+import PIL.Image
+import pytest
+
+import pixeltable as pxt
+from pixeltable.env import Env
+from pixeltable.utils.filecache import FileCache
+from pixeltable.utils.url_fetcher import UrlFetcher
+
+from .utils import get_image_files
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves absolute paths with keep-alive connections and (optionally) support for Range requests"""
+    protocol_version = 'HTTP/1.1'
+    supports_ranges = True
+    # requests for this range fail
+    failing_range: Optional[str] = None
+    # (client port, range header) of all requests
+    requests: list[tuple[int, str]] = []
+
+    def do_GET(self) -> None:
+        path = Path(urllib.request.url2pathname(self.path.split('?', 1)[0]))
+        range_header = self.headers.get('Range', '')
+        self.requests.append((self.client_address[1], range_header))
+        if not path.is_file():
+            self.send_error(404)
+            return
+        if range_header == self.failing_range:
+            self.send_error(500)
+            return
+        data = path.read_bytes()
+        match = re.fullmatch(r'bytes=(\d+)-(\d+)', range_header)
+        if match is None or not self.supports_ranges:
+            self.send_response(200)
+            body = data
+        elif int(match.group(1)) >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(data)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        else:
+            start, end = int(match.group(1)), min(int(match.group(2)), len(data) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+            body = data[start:end + 1]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def file_server(monkeypatch) -> Iterator[str]:
+    monkeypatch.setattr(RangeRequestHandler, 'requests', [])
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def file_url(server: str, path: Path) -> str:
+    return f'{server}{urllib.request.pathname2url(str(path))}'
+
+
+class TestUrlFetcher:
+    def test_fetch(self, reset_db, file_server: str, monkeypatch) -> None:
+        monkeypatch.setattr(UrlFetcher, 'PART_SIZE', 64 << 10)
+        monkeypatch.setattr(UrlFetcher, 'CHUNK_SIZE', 8 << 10)
+        tmp_dir = Env.get().tmp_dir
+        large_file = tmp_dir / 'large.bin'
+        large_file.write_bytes(np.random.bytes(1_000_000))
+        small_file = tmp_dir / 'small.bin'
+        small_file.write_bytes(b'0123456789')
+        empty_file = tmp_dir / 'empty.bin'
+        empty_file.write_bytes(b'')
+
+        def fetch_all(fetcher: UrlFetcher, files: list[Path]) -> list[int]:
+            async def run() -> list[int]:
+                try:
+                    return await asyncio.gather(
+                        *(fetcher.fetch(file_url(file_server, f), tmp_dir / f'out_{i}') for i, f in enumerate(files)))
+                finally:
+                    await fetcher.aclose()
+            # we can't use asyncio.run(): the current event loop might have been patched by nest_asyncio
+            loop = asyncio.new_event_loop()
+            try:
+                return loop.run_until_complete(run())
+            finally:
+                loop.close()
+
+        files = [large_file, small_file, empty_file, large_file]
+        sizes = fetch_all(UrlFetcher(max_connections=4), files)
+        assert sizes == [os.path.getsize(f) for f in files]
+        for i, f in enumerate(files):
+            assert (tmp_dir / f'out_{i}').read_bytes() == f.read_bytes()
+        # the large files were downloaded in parts
+        range_headers = [r for _, r in RangeRequestHandler.requests]
+        assert range_headers.count('bytes=65536-131071') == 2
+        # connections were reused
+        num_connections = len({port for port, _ in RangeRequestHandler.requests})
+        assert num_connections <= 4 < len(RangeRequestHandler.requests)
+
+        # servers that don't support ranges return the entire file
+        monkeypatch.setattr(RangeRequestHandler, 'supports_ranges', False)
+        RangeRequestHandler.requests.clear()
+        sizes = fetch_all(UrlFetcher(max_connections=4), [large_file])
+        assert sizes == [os.path.getsize(large_file)]
+        assert (tmp_dir / 'out_0').read_bytes() == large_file.read_bytes()
+        assert len(RangeRequestHandler.requests) == 1
+
+        # if a part fails, the other parts are cancelled and awaited before the download fails
+        monkeypatch.setattr(RangeRequestHandler, 'supports_ranges', True)
+        monkeypatch.setattr(RangeRequestHandler, 'failing_range', 'bytes=131072-196607')
+
+        async def fetch_failing() -> None:
+            fetcher = UrlFetcher(max_connections=4)
+            try:
+                with pytest.raises(httpx.HTTPStatusError):
+                    await fetcher.fetch(file_url(file_server, large_file), tmp_dir / 'out_failing')
+                assert asyncio.all_tasks() == {asyncio.current_task()}
+            finally:
+                await fetcher.aclose()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(fetch_failing())
+        finally:
+            loop.close()
+
+    def test_prefetch(self, reset_db, file_server: str) -> None:
+        FileCache.get().clear()
+        image_files = [Path(f) for f in get_image_files()[:40]]
+        urls = [file_url(file_server, f) for f in image_files]
+        urls.append(f'{file_server}/does/not/exist.jpg')
+        t = pxt.create_table('test', {'idx': pxt.Int, 'img': pxt.Image})
+        status = t.insert(({'idx': i, 'img': url} for i, url in enumerate(urls)), on_error='ignore')
+        assert 'test.img' in status.cols_with_excs
+        assert FileCache.get().num_files() == len(image_files)
+
+        res = t.where(t.idx < len(image_files)).order_by(t.idx).select(t.img).collect()
+        for img, f in zip(res['img'], image_files):
+            assert np.array_equal(np.asarray(img), np.asarray(PIL.Image.open(f)))
+        res = t.where(t.idx == len(image_files)).select(t.img.errormsg).collect()
+        assert 'Failed to download' in res[0]['img_errormsg']
+        assert '404' in res[0]['img_errormsg']
+        # nothing is left behind in the tmp dir
+        assert len(list(Env.get().tmp_dir.glob('*.jpg'))) == 0
@@ -387,6 +387,87 @@ class TestView:
         assert_resultset_eq(v1_query.collect(), b1_query.collect())
         assert_resultset_eq(v2_query.collect(), b2_query.collect())
 
+    _double_calls: list[int] = []
+
+    @staticmethod
+    @pxt.udf
+    def double(x: int) -> int:
+        TestView._double_calls.append(x)
+        return 2 * x
+
+    def test_shared_insert_propagation(self, reset_db, monkeypatch) -> None:
+        """Views over the same base table are populated from a single scan of the inserted rows"""
+        from pixeltable.catalog.table_version import TableVersion
+        # propagate in several batches
+        monkeypatch.setattr(TableVersion, '_TableVersion__PROPAGATION_BATCH_SIZE', 7)
+        monkeypatch.setattr(TestView, '_double_calls', [])
+        t = pxt.create_table('base_tbl', {'c1': pxt.Int, 'c2': pxt.String})
+        v1 = pxt.create_view('v1', t, additional_columns={'a': self.double(t.c1)})
+        v2 = pxt.create_view('v2', t, additional_columns={'b': self.double(t.c1) + 1, 'c': t.c2 + '!'})
+        v3 = pxt.create_view('v3', t.where(t.c1 < 10), additional_columns={'d': self.double(t.c1) + 2})
+        v4 = pxt.create_view('v4', t.where(t.c1 >= 20), additional_columns={'e': self.double(t.c1 + 1)})
+        # a view of a view
+        v5 = pxt.create_view('v5', v1.where(v1.a >= 10), additional_columns={'f': v1.a + v1.c1})
+
+        status = t.insert({'c1': i, 'c2': f'str {i}'} for i in range(30))
+        assert status.num_excs == 0
+        assert status.num_rows == 30 + 30 + 30 + 10 + 10 + 25
+        # one value per row for each stored computed view column
+        assert status.num_computed_values == 30 + 30 * 2 + 10 + 10 + 25
+        # double(c1) is evaluated once per base row for v1-v3; double(c1 + 1) only for the rows of v4
+        assert sorted(TestView._double_calls) == sorted(list(range(30)) + list(range(21, 31)))
+
+        assert_resultset_eq(
+            v1.select(v1.c1, v1.a).order_by(v1.c1).collect(),
+            t.select(t.c1, t.c1 * 2).order_by(t.c1).collect())
+        assert_resultset_eq(
+            v2.select(v2.c1, v2.b, v2.c).order_by(v2.c1).collect(),
+            t.select(t.c1, t.c1 * 2 + 1, t.c2 + '!').order_by(t.c1).collect())
+        assert_resultset_eq(
+            v3.select(v3.c1, v3.d).order_by(v3.c1).collect(),
+            t.where(t.c1 < 10).select(t.c1, t.c1 * 2 + 2).order_by(t.c1).collect())
+        assert_resultset_eq(
+            v4.select(v4.c1, v4.e).order_by(v4.c1).collect(),
+            t.where(t.c1 >= 20).select(t.c1, (t.c1 + 1) * 2).order_by(t.c1).collect())
+        assert_resultset_eq(
+            v5.select(v5.c1, v5.f).order_by(v5.c1).collect(),
+            t.where(t.c1 >= 5).select(t.c1, t.c1 * 3).order_by(t.c1).collect())
+
+        # subsequent inserts add to the existing rows
+        t.insert(c1=30, c2='str 30')
+        assert v1.count() == v2.count() == 31
+        assert v3.count() == 10
+        assert v4.count() == 11
+        assert v5.where(v5.c1 == 30).select(v5.f).collect()['f'] == [90]
+
+    @pytest.mark.parametrize('num_workers', [1, 4])
+    def test_view_maintenance_workers(self, num_workers: int, reset_db, monkeypatch) -> None:
+        """Inserts and updates are propagated to independent views concurrently"""
+        from pixeltable.catalog.table_version import TableVersion
+        monkeypatch.setattr(TableVersion, '_view_maintenance_workers', classmethod(lambda cls: num_workers))
+        t = pxt.create_table('base_tbl', {'c1': pxt.Int, 'c2': pxt.String})
+        views = [
+            pxt.create_view(f'v{i}', t.where(t.c1 % (i + 2) == 0), additional_columns={'v': t.c2 + str(i)})
+            for i in range(4)
+        ]
+        # a view of a view, which is maintained after its base
+        v_views = pxt.create_view('v_views', views[0], additional_columns={'w': views[0].v + '!'})
+
+        status = t.insert({'c1': i, 'c2': f'str {i}'} for i in range(60))
+        assert status.num_excs == 0
+        assert status.num_rows == 60 + 30 + 20 + 15 + 12 + 30
+        status = t.update({'c2': t.c2 + '?'}, where=t.c1 < 30)
+        assert status.num_excs == 0
+        assert status.num_rows == 30 + 15 + 10 + 8 + 6 + 15
+
+        for i, v in enumerate(views):
+            assert_resultset_eq(
+                v.select(v.c1, v.v).order_by(v.c1).collect(),
+                t.where(t.c1 % (i + 2) == 0).select(t.c1, t.c2 + str(i)).order_by(t.c1).collect())
+        assert_resultset_eq(
+            v_views.select(v_views.c1, v_views.w).order_by(v_views.c1).collect(),
+            t.where(t.c1 % 2 == 0).select(t.c1, t.c2 + '0!').order_by(t.c1).collect())
+
     def test_chained_views(self, reset_db) -> None:
         """Two views, the second one is a view over the first one"""
         t = self.create_tbl()
@@ -529,6 +529,16 @@ clip_embed = clip.using(model_id='openai/clip-vit-base-patch32')
 e5_embed = sentence_transformer.using(model_id='intfloat/e5-large-v2')
 
 
+@pxt.udf
+def char_embed(s: str) -> pxt.Array[(16,), pxt.Float]:  # type: ignore[misc]
+    """Deterministic, model-free string embedding (normalized character histogram), for index tests"""
+    v = np.zeros(16, dtype=np.float32)
+    for c in s:
+        v[ord(c) % 16] += 1.0
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
 # Mock UDF for testing LLM tool invocations
 @pxt.udf
 def stock_price(ticker: str) -> float:
@@ -0,0 +1,73 @@
+"""
+Measures the cost of ExprEvalNode.dispatch() for a wide expression graph.
+
+The query selects a chain of Python function calls of the given depth, all of which are part of the output, so that
+every call makes its dependents ready and each row gets dispatched once per level. The script reports the time spent
+in dispatch() per dispatched row and per input row.
+
+Example:
+    python tool/benchmark_dispatch.py --num-rows 2000 --depth 40
+"""
+import argparse
+import time
+
+import pixeltable as pxt
+from pixeltable import exprs
+from pixeltable.env import Env
+from pixeltable.exec import ExprEvalNode
+
+TBL_NAME = 'dispatch_benchmark'
+
+
+@pxt.udf
+def add_ints(a: int, b: int) -> int:
+    return a + b
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-rows', type=int, default=2000)
+    parser.add_argument('--depth', type=int, default=40)
+    args = parser.parse_args()
+
+    pxt.drop_table(TBL_NAME, if_not_exists='ignore')
+    t = pxt.create_table(TBL_NAME, {'c': pxt.Int})
+    t.insert({'c': i} for i in range(args.num_rows))
+    chain: list[exprs.Expr] = [t.c]
+    for i in range(args.depth):
+        chain.append(add_ints(chain[-1], i))
+    df = t.select(*chain[1:]).order_by(t.c)
+
+    plan = df._create_query_plan()
+    eval_node = plan.get_node(ExprEvalNode)
+    assert eval_node is not None
+    dispatch_time = 0.0
+    num_dispatched_rows = 0
+    dispatch = eval_node.dispatch
+
+    def timed_dispatch(rows: list[exprs.DataRow]) -> None:
+        nonlocal dispatch_time, num_dispatched_rows
+        start = time.perf_counter()
+        dispatch(rows)
+        dispatch_time += time.perf_counter() - start
+        num_dispatched_rows += len(rows)
+
+    eval_node.dispatch = timed_dispatch  # type: ignore[method-assign]
+    with Env.get().engine.begin() as conn:
+        plan.ctx.set_conn(conn)
+        plan.open()
+        try:
+            for _ in plan:
+                pass
+        finally:
+            plan.close()
+    print(
+        f'dispatch(): {eval_node.row_builder.num_materialized} slots, '
+        f'{1e6 * dispatch_time / num_dispatched_rows:.2f} us/row, '
+        f'{1e6 * dispatch_time / args.num_rows:.2f} us/input row'
+    )
+    pxt.drop_table(TBL_NAME)
+
+
+if __name__ == '__main__':
+    main()
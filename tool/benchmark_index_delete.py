@@ -0,0 +1,94 @@
+"""
+Measures the throughput of deletes and updates on a table with an embedding index, and the storage they use.
+
+The table has an embedding index on a string column; the embeddings are random vectors that are computed by a UDF
+from the string keys of the rows, so that no model is needed. The script deletes and updates batches of rows and
+reports, for each step, the throughput and the total size of the table (including TOAST storage and indices), and
+finally the throughput of reverting the deletes.
+
+Example:
+    python tool/benchmark_index_delete.py --num-rows 20000 --dim 1024 --batch-size 1000
+"""
+import argparse
+import time
+import zlib
+
+import numpy as np
+import sqlalchemy as sql
+
+import pixeltable as pxt
+from pixeltable.env import Env
+from pixeltable.func import Batch
+
+TBL_NAME = 'index_delete_benchmark'
+
+
+def create_embed_fn(dim: int) -> pxt.Function:
+    @pxt.udf(batch_size=256)
+    def random_embed(keys: Batch[str]) -> Batch[pxt.Array[(dim,), pxt.Float]]:  # type: ignore[valid-type]
+        return [
+            np.random.default_rng(zlib.crc32(key.encode())).standard_normal(dim).astype(np.float32) for key in keys
+        ]
+
+    return random_embed
+
+
+def table_size(tbl: pxt.Table) -> int:
+    """Returns the size of the store table, including TOAST storage and indices"""
+    with Env.get().engine.connect() as conn:
+        stmt = sql.text('SELECT pg_total_relation_size(:name)')
+        return conn.execute(stmt, {'name': tbl._tbl_version.store_tbl.sa_tbl.name}).scalar()
+
+
+def report(step: str, num_rows: int, elapsed: float, tbl: pxt.Table) -> None:
+    print(
+        f'{step:<8} {num_rows:>8} rows  {num_rows / elapsed:>10.0f} rows/s  '
+        f'table size {table_size(tbl) / (1 << 20):>8.1f} MiB')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-rows', type=int, default=20_000)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--num-batches', type=int, default=5)
+    args = parser.parse_args()
+
+    pxt.drop_table(TBL_NAME, if_not_exists='ignore')
+    tbl = pxt.create_table(TBL_NAME, {'i': pxt.Int, 'key': pxt.String})
+    start = time.monotonic()
+    tbl.insert({'i': i, 'key': f'row {i}'} for i in range(args.num_rows))
+    tbl.add_embedding_index('key', idx_name='idx', embedding=create_embed_fn(args.dim), metric='cosine')
+    report('insert', args.num_rows, time.monotonic() - start, tbl)
+
+    num_deleted = 0
+    for batch in range(args.num_batches):
+        lo, hi = batch * args.batch_size, (batch + 1) * args.batch_size
+        start = time.monotonic()
+        status = tbl.delete((tbl.i >= lo) & (tbl.i < hi))
+        report('delete', status.num_rows, time.monotonic() - start, tbl)
+        num_deleted += status.num_rows
+
+    # updates of a non-indexed column: each one is a delete plus an insert of the same embedding
+    offset = args.num_batches * args.batch_size
+    for batch in range(args.num_batches):
+        lo, hi = offset + batch * args.batch_size, offset + (batch + 1) * args.batch_size
+        start = time.monotonic()
+        status = tbl.update({'i': tbl.i + args.num_rows}, where=(tbl.i >= lo) & (tbl.i < hi))
+        report('update', status.num_rows, time.monotonic() - start, tbl)
+
+    start = time.monotonic()
+    for _ in range(args.num_batches):
+        tbl.revert()
+    report('revert', args.num_batches * args.batch_size, time.monotonic() - start, tbl)
+
+    sim = tbl.key.similarity('query')
+    start = time.monotonic()
+    for _ in range(10):
+        _ = tbl.select(tbl.key).order_by(sim, asc=False).limit(10).collect()
+    print(f'similarity query latency: {(time.monotonic() - start) * 100:.1f}ms')
+    pxt.drop_table(TBL_NAME)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Measures the ingestion rate of inserts via COPY and via INSERT statements.
+
+The script inserts the same rows (of scalar, json and array columns) into two tables: one with copy_insert_min_rows
+set to 0, which disables COPY, and one with the default setting. It reports the throughput of each in rows/s. If
+--with-index is given, the tables also have a computed column and an embedding index, whose vectors are written
+along with the rows.
+
+Example:
+    python tool/benchmark_insert.py --num-rows 100000 --num-runs 3
+"""
+import argparse
+import datetime
+import os
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+import pixeltable as pxt
+from pixeltable.func import Batch
+
+TBL_NAME = 'insert_benchmark'
+
+
+@pxt.udf(batch_size=256)
+def char_embed(strs: Batch[str]) -> Batch[pxt.Array[(16,), pxt.Float]]:  # type: ignore[valid-type]
+    # a cheap deterministic embedding, so that no model is needed
+    return [np.array([s.count(c) for c in 'abcdefghijklmnop'], dtype=np.float32) for s in strs]
+
+
+def make_rows(num_rows: int) -> list[dict[str, Any]]:
+    return [
+        {
+            'c_int': i, 'c_float': i / 3, 'c_bool': i % 2 == 0, 'c_str': f'str {i}' if i % 7 != 0 else None,
+            'c_ts': datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=i),
+            'c_json': {'a': i, 'b': [i, str(i)]} if i % 5 != 0 else None,
+            'c_array': np.full((2, 2), i, dtype=np.int64),
+        }
+        for i in range(num_rows)
+    ]
+
+
+def time_insert(rows: list[dict[str, Any]], copy_insert_min_rows: Optional[int], with_index: bool) -> float:
+    """Returns the ingestion rate in rows/s; copy_insert_min_rows=None: use the default setting"""
+    if copy_insert_min_rows is None:
+        os.environ.pop('PIXELTABLE_COPY_INSERT_MIN_ROWS', None)
+    else:
+        os.environ['PIXELTABLE_COPY_INSERT_MIN_ROWS'] = str(copy_insert_min_rows)
+    pxt.drop_table(TBL_NAME, if_not_exists='ignore')
+    t = pxt.create_table(TBL_NAME, {
+        'c_int': pxt.Int, 'c_float': pxt.Float, 'c_bool': pxt.Bool, 'c_str': pxt.String,
+        'c_ts': pxt.Timestamp, 'c_json': pxt.Json, 'c_array': pxt.Array[(2, 2), pxt.Int],  # type: ignore[misc]
+    })
+    if with_index:
+        t.add_computed_column(c_computed=t.c_int * 2)
+        t.add_embedding_index('c_str', string_embed=char_embed)
+    start = time.monotonic()
+    status = t.insert(rows)
+    elapsed = time.monotonic() - start
+    assert status.num_rows == len(rows)
+    pxt.drop_table(TBL_NAME)
+    return len(rows) / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-rows', type=int, default=100_000)
+    parser.add_argument('--num-runs', type=int, default=3)
+    parser.add_argument('--with-index', action='store_true')
+    args = parser.parse_args()
+
+    rows = make_rows(args.num_rows)
+    for name, copy_insert_min_rows in [('INSERT', 0), ('COPY', None)]:
+        rates = [time_insert(rows, copy_insert_min_rows, args.with_index) for _ in range(args.num_runs)]
+        print(f'{name:<6} {args.num_rows:>8} rows  {np.median(rates):>10.0f} rows/s (median of {args.num_runs} runs)')
+
+
+if __name__ == '__main__':
+    main()
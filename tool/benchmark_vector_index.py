@@ -0,0 +1,140 @@
+"""
+Measures recall and latency of embedding index configurations on synthetic vectors.
+
+The vectors are drawn from a mixture of Gaussians (which resembles real embeddings more closely than uniformly
+random vectors) and are produced by a UDF from the string keys of the rows, so that no model is needed. For each
+configuration, the script reports the build time, the size of the index, and for each value of the search parameter
+the recall@k (against the exact nearest neighbors) and the median and p95 query latency.
+
+Example:
+    python tool/benchmark_vector_index.py --num-rows 100000 --dim 768 --configs hnsw:float32 hnsw:float16 hnsw:binary
+    python tool/benchmark_vector_index.py --configs hnsw:float32 ivfpq:float32 --probes 8 16 32
+"""
+import argparse
+import time
+import zlib
+from typing import Any
+
+import numpy as np
+import sqlalchemy as sql
+
+import pixeltable as pxt
+from pixeltable.env import Env
+from pixeltable.func import Batch
+from pixeltable.index import LocalEmbeddingIndex
+
+TBL_NAME = 'vector_index_benchmark'
+NUM_CLUSTERS = 64
+
+
+def create_embed_fn(dim: int, seed: int) -> pxt.Function:
+    centers = np.random.default_rng(seed).standard_normal((NUM_CLUSTERS, dim)).astype(np.float32)
+
+    @pxt.udf(batch_size=256)
+    def synthetic_embed(keys: Batch[str]) -> Batch[pxt.Array[(dim,), pxt.Float]]:  # type: ignore[valid-type]
+        result = []
+        for key in keys:
+            rng = np.random.default_rng(zlib.crc32(key.encode()))
+            v = centers[rng.integers(NUM_CLUSTERS)] + 0.5 * rng.standard_normal(dim).astype(np.float32)
+            result.append(v / np.linalg.norm(v))
+        return result
+
+    return synthetic_embed
+
+
+def exact_neighbors(embed_fn: pxt.Function, keys: list[str], queries: list[str], k: int) -> list[set[str]]:
+    vectors = np.stack(embed_fn.py_fn(keys))
+    query_vectors = np.stack(embed_fn.py_fn(queries))
+    result = []
+    for qv in query_vectors:
+        top_k = np.argpartition(-(vectors @ qv), k)[:k]
+        result.append({keys[i] for i in top_k})
+    return result
+
+
+def index_size(tbl: pxt.Table, idx_name: str) -> int:
+    tbl_version = tbl._tbl_version
+    idx_info = tbl_version.idxs_by_name[idx_name]
+    idx_id = idx_info.id
+    if isinstance(idx_info.idx, LocalEmbeddingIndex):
+        # the in-process index is stored in the index dir
+        index_dir = Env.get().index_dir / f'{tbl_version.id.hex}_{idx_info.val_col.id}'
+        return sum(p.stat().st_size for p in index_dir.rglob('*.npy'))
+    with Env.get().engine.connect() as conn:
+        stmt = sql.text('SELECT pg_relation_size(:name)')
+        return conn.execute(stmt, {'name': tbl_version._store_idx_name(idx_id)}).scalar()
+
+
+def run_config(
+    tbl: pxt.Table, embed_fn: pxt.Function, config: str, search_vals: list[int], queries: list[str],
+    expected: list[set[str]], k: int, args: argparse.Namespace
+) -> None:
+    index_type, precision = config.split(':')
+    index_params: dict[str, Any]
+    if index_type == 'hnsw':
+        index_params = {'m': args.m}
+    elif index_type == 'ivfflat':
+        index_params = {'lists': args.lists}
+    else:
+        index_params = {}
+    start = time.monotonic()
+    tbl.add_embedding_index(
+        'key', idx_name='idx', embedding=embed_fn, metric='cosine', index_type=index_type,
+        index_params=index_params, precision=precision)
+    build_time = time.monotonic() - start
+    size = index_size(tbl, 'idx')
+    print(f'\n{config}: build time {build_time:.1f}s, index size {size / (1 << 20):.1f} MiB')
+
+    search_param = 'ef_search' if index_type == 'hnsw' else 'probes'
+    for val in search_vals:
+        search_params = {search_param: val}
+        if precision == 'binary' or index_type == 'ivfpq':
+            search_params['rerank_factor'] = args.rerank_factor
+        recalls: list[float] = []
+        latencies: list[float] = []
+        for query, expected_keys in zip(queries, expected):
+            sim = tbl.key.similarity(query, **search_params)
+            start = time.monotonic()
+            res = tbl.select(tbl.key).order_by(sim, asc=False).limit(k).collect()
+            latencies.append(time.monotonic() - start)
+            recalls.append(len(expected_keys.intersection(res['key'])) / k)
+        print(
+            f'  {search_param}={val:<5} recall@{k}: {np.mean(recalls):.3f}  '
+            f'latency p50: {np.percentile(latencies, 50) * 1000:.1f}ms p95: {np.percentile(latencies, 95) * 1000:.1f}ms'
+        )
+    tbl.drop_embedding_index(idx_name='idx')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-rows', type=int, default=20_000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--num-queries', type=int, default=50)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument(
+        '--configs', nargs='+', default=['hnsw:float32', 'hnsw:float16', 'hnsw:binary', 'ivfflat:float16'],
+        help='<index type>:<precision> pairs')
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[40, 100, 200])
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--m', type=int, default=16)
+    parser.add_argument('--lists', type=int, default=100)
+    parser.add_argument('--rerank-factor', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    pxt.drop_table(TBL_NAME, if_not_exists='ignore')
+    tbl = pxt.create_table(TBL_NAME, {'key': pxt.String})
+    keys = [f'row {i}' for i in range(args.num_rows)]
+    tbl.insert({'key': key} for key in keys)
+    embed_fn = create_embed_fn(args.dim, args.seed)
+    queries = [f'query {i}' for i in range(args.num_queries)]
+    expected = exact_neighbors(embed_fn, keys, queries, args.k)
+
+    for config in args.configs:
+        search_vals = args.ef_search if config.startswith('hnsw') else args.probes
+        run_config(tbl, embed_fn, config, search_vals, queries, expected, args.k, args)
+    pxt.drop_table(TBL_NAME)
+
+
+if __name__ == '__main__':
+    main()